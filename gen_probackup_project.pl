@@ -175,12 +175,14 @@ sub build_pgprobackup
 	$probackup->AddFiles(
 		"$currpath/src/utils",
 		'configuration.c',
+		'container.c',
 		'file.c',
 		'remote.c',
 		'json.c',
 		'logger.c',
 		'parray.c',
 		'pgut.c',
+		's3.c',
 		'thread.c',
 		'remote.c'
 		);
@@ -148,7 +148,7 @@ do_archive_push(InstanceConfig *instance, char *wal_file_path,
 		elog(ERROR, "getcwd() error");
 
 	/* verify that archive-push --instance parameter is valid */
-	system_id = get_system_identifier(current_dir);
+	system_id = get_system_identifier(current_dir, FIO_DB_HOST);
 
 	if (instance->pgdata == NULL)
 		elog(ERROR, "Cannot read pg_probackup.conf for this instance");
@@ -1371,7 +1371,7 @@ get_wal_file(const char *filename, const char *from_fullpath,
 	 * In non-prefetch mode, do look up '.partial' and '.gz.partial'
 	 * segments.
 	 */
-	if (fio_is_remote(FIO_BACKUP_HOST))
+	if (!fio_is_storage(FIO_BACKUP_HOST) && fio_is_remote(FIO_BACKUP_HOST))
 	{
 		char *errmsg = NULL;
 		/* get file via ssh */
@@ -1520,7 +1520,7 @@ get_wal_file_internal(const char *from_path, const char *to_path, FILE *out,
 	/* open source file for read */
 	if (!is_decompress)
 	{
-		in = fopen(from_path, PG_BINARY_R);
+		in = fio_fopen(from_path, PG_BINARY_R, FIO_BACKUP_HOST);
 		if (in == NULL)
 		{
 			if (errno == ENOENT)
@@ -1540,7 +1540,7 @@ get_wal_file_internal(const char *from_path, const char *to_path, FILE *out,
 #ifdef HAVE_LIBZ
 	else
 	{
-		gz_in = gzopen(from_path, PG_BINARY_R);
+		gz_in = fio_gzopen(from_path, PG_BINARY_R, -1, FIO_BACKUP_HOST);
 		if (gz_in == NULL)
 		{
 			if (errno == ENOENT)
@@ -1565,11 +1565,11 @@ get_wal_file_internal(const char *from_path, const char *to_path, FILE *out,
 #ifdef HAVE_LIBZ
 		if (is_decompress)
 		{
-			read_len = gzread(gz_in, buf, OUT_BUF_SIZE);
+			read_len = fio_gzread(gz_in, buf, OUT_BUF_SIZE);
 
 			if (read_len <= 0)
 			{
-				if (gzeof(gz_in))
+				if (fio_gzeof(gz_in))
 					break;
 				else
 				{
@@ -1612,7 +1612,7 @@ get_wal_file_internal(const char *from_path, const char *to_path, FILE *out,
 cleanup:
 #ifdef HAVE_LIBZ
 	if (gz_in)
-		gzclose(gz_in);
+		fio_gzclose(gz_in);
 #endif
 	if (in)
 		fclose(in);
@@ -73,6 +73,18 @@ static bool backup_in_progress = false;
 /* Is pg_stop_backup() was sent */
 static bool pg_stop_backup_is_sent = false;
 
+/* Is interrupted backup resumed */
+static bool backup_resumed = false;
+/* Files copied by interrupted backup, which may be reused */
+static parray *resume_filelist = NULL;
+/* START LSN, timeline and parent of interrupted backup */
+static XLogRecPtr resume_start_lsn = InvalidXLogRecPtr;
+static TimeLineID resume_tli = 0;
+static time_t resume_parent_backup = INVALID_BACKUP_ID;
+
+/* Destination PGDATA of catchup, files are copied there instead of catalog */
+static const char *catchup_pgdata = NULL;
+
 /*
  * Backup routines
  */
@@ -109,6 +121,25 @@ static bool pg_is_superuser(PGconn *conn);
 static void check_server_version(PGconn *conn, PGNodeInfo *nodeInfo);
 static void confirm_block_size(PGconn *conn, const char *name, int blcksz);
 static void set_cfs_datafiles(parray *files, const char *root, char *relative, size_t i);
+static parray *get_page_delta_chain(pgBackup *prev_backup);
+static void free_page_delta_chain(parray *delta_chain);
+static pgBackup *get_backup_to_resume(parray *backup_list);
+static bool resume_backup_file(backup_files_arg *arguments, pgFile *file,
+							   const char *from_fullpath, const char *to_fullpath);
+static void get_database_path(pgBackup *backup, char *path, size_t len,
+							  const char *subdir);
+static void remove_wal_files(const char *wal_dir);
+static void remove_deleted_files(parray *files, const char *database_path,
+								 const char *external_prefix, parray *external_dirs);
+static void start_wal_streaming(PGconn *backup_conn, const char *wal_dir);
+static XLogRecPtr get_timeline_switchpoint(const char *pgdata, TimeLineID source_tli,
+										   TimeLineID tli);
+static void *catchup_files(void *arg);
+static void catchup_data_file(backup_files_arg *arguments, pgFile *file,
+							  const char *from_fullpath, const char *to_fullpath);
+static size_t catchup_apply_pages(pgFile *file, HeaderMap *hdr_map,
+								  const char *tmp_fullpath, FILE *out,
+								  const char *to_fullpath, datapagemap_t *map);
 
 static void
 backup_stopbackup_callback(bool fatal, void *userdata)
@@ -145,6 +176,7 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 
 	pgBackup   *prev_backup = NULL;
 	parray	   *prev_backup_filelist = NULL;
+	parray	   *delta_chain = NULL;
 	parray	   *backup_list = NULL;
 	parray	   *external_dirs = NULL;
 	parray	   *database_map = NULL;
@@ -251,6 +283,41 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		current.parent_backup = prev_backup->start_time;
 
 		write_backup(&current, true);
+
+		/*
+		 * Delta encoding requires access to previous versions of pages,
+		 * which are kept in parent chain.
+		 */
+		if (page_delta)
+		{
+			if (fio_is_remote(FIO_DB_HOST))
+				elog(WARNING, "Page delta encoding is not supported in remote mode, disable it");
+			else
+				delta_chain = get_page_delta_chain(prev_backup);
+		}
+	}
+
+	/*
+	 * Files copied by interrupted backup can be reused only if they were
+	 * copied against the same parent backup on the same timeline.
+	 */
+	if (resume_filelist &&
+		(current.parent_backup != resume_parent_backup || current.tli != resume_tli))
+	{
+		elog(WARNING, "Parent backup or timeline has changed since backup %s was interrupted, "
+			 "its files cannot be reused", base36enc(current.start_time));
+
+		parray_walk(resume_filelist, pgFileFree);
+		parray_free(resume_filelist);
+		resume_filelist = NULL;
+	}
+	else if (resume_filelist)
+	{
+		elog(INFO, "Resuming backup %s, files copied before interruption: %lu",
+			 base36enc(current.start_time), parray_num(resume_filelist));
+
+		/* Sort the array for binary search */
+		parray_qsort(resume_filelist, pgFileCompareRelPathWithExternal);
 	}
 
 	/*
@@ -310,33 +377,13 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	/* start stream replication */
 	if (stream_wal)
 	{
-		/* How long we should wait for streaming end after pg_stop_backup */
-		stream_stop_timeout = checkpoint_timeout(backup_conn);
-		stream_stop_timeout = stream_stop_timeout + stream_stop_timeout * 0.1;
-
 		join_path_components(dst_backup_path, database_path, PG_XLOG_DIR);
-		fio_mkdir(dst_backup_path, DIR_PERMISSION, FIO_BACKUP_HOST);
-
-		stream_thread_arg.basedir = dst_backup_path;
-
-		/*
-		 * Connect in replication mode to the server.
-		 */
-		stream_thread_arg.conn = pgut_connect_replication(instance_config.conn_opt.pghost,
-														  instance_config.conn_opt.pgport,
-														  instance_config.conn_opt.pgdatabase,
-														  instance_config.conn_opt.pguser);
-		/* sanity */
-		IdentifySystem(&stream_thread_arg);
 
-		/* By default there are some error */
-		stream_thread_arg.ret = 1;
-		/* we must use startpos as start_lsn from start_backup */
-		stream_thread_arg.startpos = current.start_lsn;
-		stream_thread_arg.starttli = current.tli;
+		/* WAL streamed by interrupted backup is useless, streaming starts anew */
+		if (backup_resumed)
+			remove_wal_files(dst_backup_path);
 
-		thread_interrupted = false;
-		pthread_create(&stream_thread, NULL, StreamLog, &stream_thread_arg);
+		start_wal_streaming(backup_conn, dst_backup_path);
 	}
 
 	/* initialize backup list */
@@ -419,6 +466,11 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	 */
 	parray_qsort(backup_files_list, pgFileCompareRelPathWithExternal);
 
+	/* Files deleted from PGDATA since interruption must not stay in backup */
+	if (backup_resumed)
+		remove_deleted_files(backup_files_list, database_path,
+							 external_prefix, external_dirs);
+
 	/* Extract information about files in backup_list parsing their names:*/
 	parse_filelist_filenames(backup_files_list, instance_config.pgdata);
 
@@ -525,6 +577,30 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	/* Init backup page header map */
 	init_header_map(&current);
 
+	/*
+	 * Page headers of files copied by interrupted backup are kept
+	 * in the map, so new headers must be appended to it.
+	 */
+	if (resume_filelist)
+	{
+		struct stat st;
+
+		if (stat(current.hdr_map.path, &st) == 0)
+		{
+			current.hdr_map.fp = fopen(current.hdr_map.path, PG_BINARY_A);
+			if (current.hdr_map.fp == NULL)
+				elog(ERROR, "Cannot open header file \"%s\": %s",
+					 current.hdr_map.path, strerror(errno));
+
+			current.hdr_map.buf = pgut_malloc(LARGE_CHUNK_SIZE);
+			setvbuf(current.hdr_map.fp, current.hdr_map.buf, _IOFBF, LARGE_CHUNK_SIZE);
+			current.hdr_map.offset = st.st_size;
+		}
+		else if (errno != ENOENT)
+			elog(ERROR, "Cannot stat file \"%s\": %s",
+				 current.hdr_map.path, strerror(errno));
+	}
+
 	/* init thread args with own file lists */
 	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
 	threads_args = (backup_files_arg *) palloc(sizeof(backup_files_arg)*num_threads);
@@ -541,10 +617,15 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		arg->files_list = backup_files_list;
 		arg->prev_filelist = prev_backup_filelist;
 		arg->prev_start_lsn = prev_backup_start_lsn;
+		arg->delta_chain = delta_chain;
+		arg->resume_filelist = resume_filelist;
+		arg->resume_start_lsn = resume_start_lsn;
 		arg->conn_arg.conn = NULL;
 		arg->conn_arg.cancel_conn = NULL;
 		arg->hdr_map = &(current.hdr_map);
 		arg->thread_num = i+1;
+		arg->use_pack = pack_small_files;
+		init_pack_file(&(arg->pack), current.root_dir, arg->thread_num);
 		/* By default there are some error */
 		arg->ret = 1;
 	}
@@ -586,6 +667,16 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 		parray_free(prev_backup_filelist);
 	}
 
+	if (delta_chain)
+		free_page_delta_chain(delta_chain);
+
+	if (resume_filelist)
+	{
+		parray_walk(resume_filelist, pgFileFree);
+		parray_free(resume_filelist);
+		resume_filelist = NULL;
+	}
+
 	/* Notify end of backup */
 	pg_stop_backup(&current, backup_conn, nodeInfo);
 
@@ -660,6 +751,7 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 
 			/* Now it is relative to /backup_dir/backups/instance_name/backup_id/database/ */
 			file->rel_path = pgut_strdup(GetRelativePath(wal_full_path, database_path));
+			file->path_hash = pgFileHashPath(file->rel_path);
 
 			file->name = last_dir_separator(file->rel_path);
 
@@ -689,11 +781,21 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 	/* update backup control file to update size info */
 	write_backup(&current, true);
 
+	/* File list is complete, journal is no longer needed */
+	close_backup_filelist_journal(&current, true);
+
+	/* All files are copied, write index of container and close it */
+	if (current.container)
+		container_finish(no_sync);
+
 	/* Sync all copied files unless '--no-sync' flag is used */
 	if (no_sync)
 		elog(WARNING, "Backup files are not synced to disk");
 	else
 	{
+		parray *sync_list = parray_new();
+		parray *sync_roots = parray_new();
+
 		elog(INFO, "Syncing backup files to disk");
 		time(&start_time);
 
@@ -709,6 +811,10 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 			if (file->write_size <= 0)
 				continue;
 
+			/* packed files are synced with their pack file */
+			if (file->pack_num > 0)
+				continue;
+
 			/* construct fullpath */
 			if (file->external_dir_num == 0)
 				join_path_components(to_fullpath, database_path, file->rel_path);
@@ -721,10 +827,26 @@ do_backup_instance(PGconn *backup_conn, PGNodeInfo *nodeInfo, bool no_sync, bool
 				join_path_components(to_fullpath, external_dst, file->rel_path);
 			}
 
-			if (fio_sync(to_fullpath, FIO_BACKUP_HOST) != 0)
-				elog(ERROR, "Cannot sync file \"%s\": %s", to_fullpath, strerror(errno));
+			parray_append(sync_list, pgut_strdup(to_fullpath));
+		}
+
+		/* sync pack files */
+		for (i = 0; i < num_threads; i++)
+		{
+			PackFile   *pack = &(threads_args[i].pack);
+
+			if (pack->offset > 0)
+				parray_append(sync_list, pgut_strdup(pack->path));
 		}
 
+		parray_append(sync_roots, pgut_strdup(current.root_dir));
+		sync_files(sync_list, sync_roots, FIO_BACKUP_HOST);
+
+		parray_walk(sync_list, pfree);
+		parray_free(sync_list);
+		parray_walk(sync_roots, pfree);
+		parray_free(sync_roots);
+
 		time(&end_time);
 		pretty_time_interval(difftime(end_time, start_time),
 							 pretty_time, lengthof(pretty_time));
@@ -857,18 +979,57 @@ do_backup(time_t start_time, pgSetBackupParams *set_backup_params,
 		(pg_strcasecmp(instance_config.external_dir_str, "none") != 0))
 		current.external_dir_str = instance_config.external_dir_str;
 
+	/* Continue interrupted backup instead of taking a new one */
+	if (resume)
+	{
+		parray	   *backup_list = catalog_get_backup_list(instance_name, INVALID_BACKUP_ID);
+		pgBackup   *resume_backup = get_backup_to_resume(backup_list);
+
+		if (resume_backup)
+		{
+			current.start_time = resume_backup->start_time;
+			current.root_dir = pgut_strdup(resume_backup->root_dir);
+			current.database_dir = pgut_strdup(resume_backup->database_dir);
+			init_header_map(&current);
+
+			resume_start_lsn = resume_backup->start_lsn;
+			resume_tli = resume_backup->tli;
+			resume_parent_backup = resume_backup->parent_backup;
+			backup_resumed = true;
+		}
+		else
+			elog(WARNING, "There is no backup to resume, taking a new one");
+
+		parray_walk(backup_list, pgBackupFree);
+		parray_free(backup_list);
+	}
+
 	elog(INFO, "Backup start, pg_probackup version: %s, instance: %s, backup ID: %s, backup mode: %s, "
 			"wal mode: %s, remote: %s, compress-algorithm: %s, compress-level: %i",
-			PROGRAM_VERSION, instance_name, base36enc(start_time), pgBackupGetBackupMode(&current),
+			PROGRAM_VERSION, instance_name, base36enc(current.start_time), pgBackupGetBackupMode(&current),
 			current.stream ? "STREAM" : "ARCHIVE", IsSshProtocol()  ? "true" : "false",
 			deparse_compress_alg(current.compress_alg), current.compress_level);
 
 	/* Create backup directory and BACKUP_CONTROL_FILE */
-	if (pgBackupCreateDir(&current))
+	if (!backup_resumed && pgBackupCreateDir(&current))
 		elog(ERROR, "Cannot create backup directory");
 	if (!lock_backup(&current, true))
 		elog(ERROR, "Cannot lock backup %s directory",
 			 base36enc(current.start_time));
+
+	/* Backup files are written into single-stream container */
+	if (current.container)
+		container_create(current.container, current.root_dir);
+
+	/*
+	 * Get files copied by interrupted backup before the journal is reset.
+	 * Journal must be reset before START LSN of interrupted backup is
+	 * overwritten, because copied files are checked against it.
+	 */
+	if (backup_resumed)
+		resume_filelist = read_backup_filelist_journal(&current);
+	open_backup_filelist_journal(&current);
+
 	write_backup(&current, true);
 
 	/* set the error processing function for the backup process */
@@ -883,7 +1044,7 @@ do_backup(time_t start_time, pgSetBackupParams *set_backup_params,
 	backup_conn = pgdata_basic_setup(instance_config.conn_opt, &nodeInfo);
 
 	if (current.from_replica)
-		elog(INFO, "Backup %s is going to be taken from standby", base36enc(start_time));
+		elog(INFO, "Backup %s is going to be taken from standby", base36enc(current.start_time));
 
 	/* TODO, print PostgreSQL full version */
 	//elog(INFO, "PostgreSQL version: %s", nodeInfo.server_version_str);
@@ -963,7 +1124,14 @@ do_backup(time_t start_time, pgSetBackupParams *set_backup_params,
 	}
 
 	if (!no_validate)
-		pgBackupValidate(&current, NULL);
+	{
+		/* container written to standard output cannot be read back */
+		if (!backup_container_is_available(&current))
+			elog(WARNING, "Backup %s is written to standard output, validation is skipped",
+				 base36enc(current.start_time));
+		else
+			pgBackupValidate(&current, NULL);
+	}
 
 	/* Notify user about backup size */
 	if (current.stream)
@@ -989,151 +1157,515 @@ do_backup(time_t start_time, pgSetBackupParams *set_backup_params,
 }
 
 /*
- * Confirm that this server version is supported
+ * Entry point of pg_probackup CATCHUP subcommand.
+ * Bring existing stopped PostgreSQL instance in 'dest_pgdata' in sync
+ * with running instance in PGDATA without the backup catalog:
+ * changed pages are copied straight into destination data files,
+ * WAL is streamed into destination WAL directory.
  */
-static void
-check_server_version(PGconn *conn, PGNodeInfo *nodeInfo)
+int
+do_catchup(const char *dest_pgdata, bool no_sync)
 {
-	PGresult   *res = NULL;
+	int			i;
+	PGconn	   *backup_conn = NULL;
+	PGNodeInfo	nodeInfo;
+	RedoParams	redo;
+	uint64		system_id_conn;
+	uint64		system_id_source;
+	uint64		system_id_dest;
+	pid_t		pid;
+	XLogRecPtr	sync_lsn;
+	char		label[1024];
+	char		dest_xlog_path[MAXPGPATH];
+	char		from_fullpath[MAXPGPATH];
+	char		to_fullpath[MAXPGPATH];
+	parray	   *source_files = NULL;
+	parray	   *dest_files = NULL;
+	pgFile	   *pg_control = NULL;
 
-	/* confirm server version */
-	nodeInfo->server_version = PQserverVersion(conn);
+	/* arrays with meta info for multi threaded catchup */
+	pthread_t	*threads;
+	backup_files_arg *threads_args;
+	bool		catchup_isok = true;
 
-	if (nodeInfo->server_version == 0)
-		elog(ERROR, "Unknown server version %d", nodeInfo->server_version);
+	/* for fancy reporting */
+	time_t		start_time, end_time;
+	char		pretty_time[20];
 
-	if (nodeInfo->server_version < 100000)
-		sprintf(nodeInfo->server_version_str, "%d.%d",
-				nodeInfo->server_version / 10000,
-				(nodeInfo->server_version / 100) % 100);
-	else
-		sprintf(nodeInfo->server_version_str, "%d",
-				nodeInfo->server_version / 10000);
+	/* Initialize PGInfonode */
+	pgNodeInit(&nodeInfo);
 
-	if (nodeInfo->server_version < 90500)
-		elog(ERROR,
-			 "server version is %s, must be %s or higher",
-			 nodeInfo->server_version_str, "9.5");
+	if (!instance_config.pgdata)
+		elog(ERROR, "required parameter not specified: --source-pgdata");
 
-	if (current.from_replica && nodeInfo->server_version < 90600)
-		elog(ERROR,
-			 "server version is %s, must be %s or higher for backup from replica",
-			 nodeInfo->server_version_str, "9.6");
+	if (!fio_is_remote(FIO_DB_HOST) &&
+		strcmp(instance_config.pgdata, dest_pgdata) == 0)
+		elog(ERROR, "Source and destination data directories must be different");
 
-	if (nodeInfo->pgpro_support)
-		res = pgut_execute(conn, "SELECT pgpro_edition()", 0, NULL);
+	catchup_pgdata = dest_pgdata;
+
+	/* WAL is streamed into destination, there is no archive */
+	stream_wal = true;
+	current.stream = true;
+	current.backup_mode = BACKUP_MODE_DIFF_DELTA;
+	current.start_time = time(NULL);
+
+	StrNCpy(current.program_version, PROGRAM_VERSION,
+			sizeof(current.program_version));
+
+	elog(INFO, "Catchup start, pg_probackup version: %s, source: \"%s\", destination: \"%s\", "
+			"remote: %s", PROGRAM_VERSION, instance_config.pgdata, dest_pgdata,
+			IsSshProtocol() ? "true" : "false");
+
+	/* Destination instance must be stopped */
+	pid = fio_check_postmaster(dest_pgdata, FIO_BACKUP_HOST);
+
+	if (pid == 1)
+		elog(ERROR, "Pid file in destination directory \"%s\" is mangled, "
+			 "cannot determine whether postmaster is running or not", dest_pgdata);
+	else if (pid > 1)
+		elog(ERROR, "Postmaster with pid %u is running in destination directory \"%s\"",
+			 pid, dest_pgdata);
 
 	/*
-	 * Check major version of connected PostgreSQL and major version of
-	 * compiled PostgreSQL.
+	 * setup backup_conn, do some compatibility checks and
+	 * fill basic info about instance
 	 */
-#ifdef PGPRO_VERSION
-	if (!res)
-		/* It seems we connected to PostgreSQL (not Postgres Pro) */
-		elog(ERROR, "%s was built with Postgres Pro %s %s, "
-					"but connection is made with PostgreSQL %s",
-			 PROGRAM_NAME, PG_MAJORVERSION, PGPRO_EDITION, nodeInfo->server_version_str);
-	else
-	{
-		if (strcmp(nodeInfo->server_version_str, PG_MAJORVERSION) != 0 &&
-				 strcmp(PQgetvalue(res, 0, 0), PGPRO_EDITION) != 0)
-			elog(ERROR, "%s was built with Postgres Pro %s %s, "
-						"but connection is made with Postgres Pro %s %s",
-				 PROGRAM_NAME, PG_MAJORVERSION, PGPRO_EDITION,
-				 nodeInfo->server_version_str, PQgetvalue(res, 0, 0));
-	}
+	backup_conn = pgdata_basic_setup(instance_config.conn_opt, &nodeInfo);
+
+	if (current.from_replica && exclusive_backup)
+		elog(ERROR, "Catchup from standby is not supported for PostgreSQL %s",
+			 nodeInfo.server_version_str);
+
+#if PG_VERSION_NUM >= 110000
+	if (!RetrieveWalSegSize(backup_conn))
+		elog(ERROR, "Failed to retrieve wal_segment_size");
+#endif
+	instance_config.xlog_seg_size = get_xlog_seg_size(instance_config.pgdata);
+
+	/* Both data directories must belong to the connected instance */
+	system_id_conn = get_remote_system_identifier(backup_conn);
+	system_id_source = get_system_identifier(instance_config.pgdata, FIO_DB_HOST);
+	system_id_dest = get_system_identifier(dest_pgdata, FIO_BACKUP_HOST);
+
+	if (system_id_source != system_id_conn)
+		elog(ERROR, "Source data directory was initialized with system id " UINT64_FORMAT ", "
+			 "but connected instance system id is " UINT64_FORMAT,
+			 system_id_source, system_id_conn);
+
+	if (system_id_dest != system_id_conn)
+		elog(ERROR, "Destination data directory was initialized with system id " UINT64_FORMAT ", "
+			 "but connected instance system id is " UINT64_FORMAT,
+			 system_id_dest, system_id_conn);
+
+	/*
+	 * Pages of destination are compared with source using their LSN,
+	 * which is reliable only if torn pages can be detected.
+	 */
+	get_redo(dest_pgdata, FIO_BACKUP_HOST, &redo);
+
+	if (redo.checksum_version == 0 || nodeInfo.checksum_version == 0)
+		elog(ERROR, "Catchup requires data_checksums to be enabled "
+			 "in source and destination data directories");
+
+	/* notify start of backup to PostgreSQL server */
+	time2iso(label, lengthof(label), current.start_time);
+	strncat(label, " with pg_probackup catchup", lengthof(label) -
+			strlen(" with pg_probackup catchup"));
+
+	pg_start_backup(label, smooth_checkpoint, &current, &nodeInfo, backup_conn);
+
+	/* Obtain current timeline */
+#if PG_VERSION_NUM >= 90600
+	current.tli = get_current_timeline(backup_conn);
 #else
-	if (res)
-		/* It seems we connected to Postgres Pro (not PostgreSQL) */
-		elog(ERROR, "%s was built with PostgreSQL %s, "
-					"but connection is made with Postgres Pro %s %s",
-			 PROGRAM_NAME, PG_MAJORVERSION,
-			 nodeInfo->server_version_str, PQgetvalue(res, 0, 0));
-	else
+	current.tli = get_current_timeline_from_control(false);
+#endif
+
+	/*
+	 * Pages of destination older than sync LSN are the same as in source,
+	 * unless they were changed in source since then. If destination has
+	 * diverged from source, sync LSN is the point where it happened.
+	 */
+	sync_lsn = redo.lsn;
+
+	if (redo.tli != current.tli)
 	{
-		if (strcmp(nodeInfo->server_version_str, PG_MAJORVERSION) != 0)
-			elog(ERROR, "%s was built with PostgreSQL %s, but connection is made with %s",
-				 PROGRAM_NAME, PG_MAJORVERSION, nodeInfo->server_version_str);
+		XLogRecPtr	switchpoint = get_timeline_switchpoint(instance_config.pgdata,
+														   current.tli, redo.tli);
+
+		if (XLogRecPtrIsInvalid(switchpoint))
+			elog(ERROR, "Destination timeline %u is not found in the history of source timeline %u",
+				 redo.tli, current.tli);
+
+		if (switchpoint < sync_lsn)
+			sync_lsn = switchpoint;
 	}
-#endif
 
-	if (res)
-		PQclear(res);
+	if (sync_lsn > current.start_lsn)
+		elog(ERROR, "Destination redo LSN %X/%X is greater than source START LSN %X/%X. "
+			 "It may indicate that destination is ahead of source.",
+			 (uint32) (sync_lsn >> 32), (uint32) (sync_lsn),
+			 (uint32) (current.start_lsn >> 32), (uint32) (current.start_lsn));
 
-	/* Do exclusive backup only for PostgreSQL 9.5 */
-	exclusive_backup = nodeInfo->server_version < 90600;
-}
+	elog(INFO, "Sync LSN: %X/%X, source START LSN: %X/%X",
+		 (uint32) (sync_lsn >> 32), (uint32) (sync_lsn),
+		 (uint32) (current.start_lsn >> 32), (uint32) (current.start_lsn));
 
-/*
- * Ensure that backup directory was initialized for the same PostgreSQL
- * instance we opened connection to. And that target backup database PGDATA
- * belogns to the same instance.
- * All system identifiers must be equal.
- */
-void
-check_system_identifiers(PGconn *conn, char *pgdata)
-{
-	uint64		system_id_conn;
-	uint64		system_id_pgdata;
+	/* WAL of destination is useless, streaming starts anew */
+	join_path_components(dest_xlog_path, dest_pgdata, PG_XLOG_DIR);
+	remove_wal_files(dest_xlog_path);
+	start_wal_streaming(backup_conn, dest_xlog_path);
 
-	system_id_pgdata = get_system_identifier(pgdata);
-	system_id_conn = get_remote_system_identifier(conn);
+	/* list files with the logical path. omit $PGDATA */
+	source_files = parray_new();
 
-	/* for checkdb check only system_id_pgdata and system_id_conn */
-	if (current.backup_mode == BACKUP_MODE_INVALID)
+	if (fio_is_remote(FIO_DB_HOST))
+		fio_list_dir(source_files, instance_config.pgdata,
+					 true, true, false, false, true, 0);
+	else
+		dir_list_file(source_files, instance_config.pgdata,
+					  true, true, false, false, true, 0, FIO_LOCAL_HOST);
+
+	/* close ssh session in main thread */
+	fio_disconnect();
+
+	if (parray_num(source_files) < 100)
+		elog(ERROR, "PGDATA is almost empty. Either it was concurrently deleted or "
+			"pg_probackup do not possess sufficient permissions to list PGDATA content");
+
+	parray_qsort(source_files, pgFileCompareRelPathWithExternal);
+	parse_filelist_filenames(source_files, instance_config.pgdata);
+
+	/* Remove files of destination, which do not exist in source */
+	dest_files = parray_new();
+	dir_list_file(dest_files, dest_pgdata, true, true, false, false, true, 0,
+				  FIO_BACKUP_HOST);
+	parray_qsort(dest_files, pgFileCompareRelPathWithExternalDesc);
+
+	for (i = 0; i < parray_num(dest_files); i++)
 	{
-		if (system_id_conn != system_id_pgdata)
+		pgFile	   *file = (pgFile *) parray_get(dest_files, i);
+
+		if (parray_bsearch(source_files, file, pgFileCompareRelPathWithExternal) == NULL)
 		{
-			elog(ERROR, "Data directory initialized with system id " UINT64_FORMAT ", "
-						"but connected instance system id is " UINT64_FORMAT,
-				 system_id_pgdata, system_id_conn);
+			join_path_components(to_fullpath, dest_pgdata, file->rel_path);
+
+			fio_delete(file->mode, to_fullpath, FIO_BACKUP_HOST);
+			elog(VERBOSE, "Deleted file \"%s\"", to_fullpath);
 		}
-		return;
 	}
 
-	if (system_id_conn != instance_config.system_identifier)
-		elog(ERROR, "Backup data directory was initialized for system id " UINT64_FORMAT ", "
-					"but connected instance system id is " UINT64_FORMAT,
-			 instance_config.system_identifier, system_id_conn);
+	parray_walk(dest_files, pgFileFree);
+	parray_free(dest_files);
 
-	if (system_id_pgdata != instance_config.system_identifier)
-		elog(ERROR, "Backup data directory was initialized for system id " UINT64_FORMAT ", "
-					"but target backup directory system id is " UINT64_FORMAT,
-			 instance_config.system_identifier, system_id_pgdata);
-}
+	/* Make directories and setup threads at the same time */
+	for (i = 0; i < parray_num(source_files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(source_files, i);
 
-/*
- * Ensure that target backup database is initialized with
- * compatible settings. Currently check BLCKSZ and XLOG_BLCKSZ.
- */
-static void
-confirm_block_size(PGconn *conn, const char *name, int blcksz)
-{
-	PGresult   *res;
-	char	   *endp;
-	int			block_size;
+		if (S_ISDIR(file->mode))
+		{
+			join_path_components(to_fullpath, dest_pgdata, file->rel_path);
 
-	res = pgut_execute(conn, "SELECT pg_catalog.current_setting($1)", 1, &name);
-	if (PQntuples(res) != 1 || PQnfields(res) != 1)
-		elog(ERROR, "cannot get %s: %s", name, PQerrorMessage(conn));
+			elog(VERBOSE, "Create directory '%s'", to_fullpath);
+			fio_mkdir(to_fullpath, DIR_PERMISSION, FIO_BACKUP_HOST);
+		}
 
-	block_size = strtol(PQgetvalue(res, 0, 0), &endp, 10);
-	if ((endp && *endp) || block_size != blcksz)
-		elog(ERROR,
-			 "%s(%d) is not compatible(%d expected)",
-			 name, block_size, blcksz);
+		if (file->external_dir_num == 0 &&
+			strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
+			pg_control = file;
 
-	PQclear(res);
-}
+		/* setup threads */
+		pg_atomic_clear_flag(&file->lock);
+	}
 
-/*
- * Notify start of backup to PostgreSQL server.
- */
-static void
-pg_start_backup(const char *label, bool smooth, pgBackup *backup,
-				PGNodeInfo *nodeInfo, PGconn *conn)
-{
-	PGresult   *res;
+	if (!pg_control)
+		elog(ERROR, "Failed to find file \"%s\" in source filelist.",
+			 XLOG_CONTROL_FILE);
+
+	/* Sort by size for load balancing */
+	parray_qsort(source_files, pgFileCompareSize);
+
+	/* init thread args with own file lists */
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+	threads_args = (backup_files_arg *) palloc0(sizeof(backup_files_arg) * num_threads);
+
+	for (i = 0; i < num_threads; i++)
+	{
+		backup_files_arg *arg = &(threads_args[i]);
+
+		arg->nodeInfo = &nodeInfo;
+		arg->from_root = instance_config.pgdata;
+		arg->to_root = dest_pgdata;
+		arg->files_list = source_files;
+		/* pages older than sync LSN are not copied */
+		arg->prev_start_lsn = sync_lsn;
+		arg->conn_arg.conn = NULL;
+		arg->conn_arg.cancel_conn = NULL;
+		arg->thread_num = i+1;
+		/* By default there are some error */
+		arg->ret = 1;
+	}
+
+	/* Run threads */
+	thread_interrupted = false;
+	elog(INFO, "Start transferring data files");
+	time(&start_time);
+	for (i = 0; i < num_threads; i++)
+	{
+		backup_files_arg *arg = &(threads_args[i]);
+
+		elog(VERBOSE, "Start thread num: %i", i);
+		pthread_create(&threads[i], NULL, catchup_files, arg);
+	}
+
+	/* Wait threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret == 1)
+			catchup_isok = false;
+	}
+
+	time(&end_time);
+	pretty_time_interval(difftime(end_time, start_time),
+						 pretty_time, lengthof(pretty_time));
+	if (catchup_isok)
+		elog(INFO, "Data files are transferred, time elapsed: %s",
+			pretty_time);
+	else
+		elog(ERROR, "Data files transferring failed, time elapsed: %s",
+			pretty_time);
+
+	/*
+	 * pg_control is copied last, so interrupted catchup leaves
+	 * destination with redo LSN, which is still valid for retry.
+	 */
+	join_path_components(from_fullpath, instance_config.pgdata, pg_control->rel_path);
+	join_path_components(to_fullpath, dest_pgdata, pg_control->rel_path);
+	backup_non_data_file(pg_control, NULL, from_fullpath, to_fullpath,
+						 BACKUP_MODE_FULL, 0, false, NULL);
+
+	/* tablespace_map of destination is not valid anymore */
+	join_path_components(to_fullpath, dest_pgdata, PG_TABLESPACE_MAP_FILE);
+	if (fio_unlink(to_fullpath, FIO_BACKUP_HOST) != 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", to_fullpath, strerror(errno));
+
+	/* Notify end of backup, backup_label is written into destination */
+	pg_stop_backup(&current, backup_conn, &nodeInfo);
+
+	/* In case of catchup from replica >= 9.6 we must fix minRecPoint */
+	if (current.from_replica && !exclusive_backup)
+		set_min_recovery_point(pg_control, dest_pgdata, current.stop_lsn);
+
+	/* close ssh session in main thread */
+	fio_disconnect();
+
+	/* Sync all copied files unless '--no-sync' flag is used */
+	if (no_sync)
+		elog(WARNING, "Destination files are not synced to disk");
+	else
+	{
+		parray *sync_list = parray_new();
+		parray *sync_roots = parray_new();
+
+		elog(INFO, "Syncing destination files to disk");
+		time(&start_time);
+
+		for (i = 0; i < parray_num(source_files); i++)
+		{
+			pgFile *file = (pgFile *) parray_get(source_files, i);
+
+			if (S_ISDIR(file->mode))
+				continue;
+
+			if (file->write_size <= 0 && file != pg_control)
+				continue;
+
+			join_path_components(to_fullpath, dest_pgdata, file->rel_path);
+			parray_append(sync_list, pgut_strdup(to_fullpath));
+		}
+
+		if (!exclusive_backup)
+		{
+			join_path_components(to_fullpath, dest_pgdata, PG_BACKUP_LABEL_FILE);
+			parray_append(sync_list, pgut_strdup(to_fullpath));
+		}
+
+		get_sync_roots(sync_roots, dest_pgdata, source_files);
+		sync_files(sync_list, sync_roots, FIO_BACKUP_HOST);
+
+		parray_walk(sync_list, pfree);
+		parray_free(sync_list);
+		parray_walk(sync_roots, pfree);
+		parray_free(sync_roots);
+
+		time(&end_time);
+		pretty_time_interval(difftime(end_time, start_time),
+							 pretty_time, lengthof(pretty_time));
+		elog(INFO, "Destination files are synced, time elapsed: %s", pretty_time);
+	}
+
+	/* Cleanup */
+	pfree(threads);
+	pfree(threads_args);
+
+	parray_walk(source_files, pgFileFree);
+	parray_free(source_files);
+
+	elog(INFO, "Catchup completed, STOP LSN: %X/%X",
+		 (uint32) (current.stop_lsn >> 32), (uint32) (current.stop_lsn));
+
+	return 0;
+}
+
+/*
+ * Confirm that this server version is supported
+ */
+static void
+check_server_version(PGconn *conn, PGNodeInfo *nodeInfo)
+{
+	PGresult   *res = NULL;
+
+	/* confirm server version */
+	nodeInfo->server_version = PQserverVersion(conn);
+
+	if (nodeInfo->server_version == 0)
+		elog(ERROR, "Unknown server version %d", nodeInfo->server_version);
+
+	if (nodeInfo->server_version < 100000)
+		sprintf(nodeInfo->server_version_str, "%d.%d",
+				nodeInfo->server_version / 10000,
+				(nodeInfo->server_version / 100) % 100);
+	else
+		sprintf(nodeInfo->server_version_str, "%d",
+				nodeInfo->server_version / 10000);
+
+	if (nodeInfo->server_version < 90500)
+		elog(ERROR,
+			 "server version is %s, must be %s or higher",
+			 nodeInfo->server_version_str, "9.5");
+
+	if (current.from_replica && nodeInfo->server_version < 90600)
+		elog(ERROR,
+			 "server version is %s, must be %s or higher for backup from replica",
+			 nodeInfo->server_version_str, "9.6");
+
+	if (nodeInfo->pgpro_support)
+		res = pgut_execute(conn, "SELECT pgpro_edition()", 0, NULL);
+
+	/*
+	 * Check major version of connected PostgreSQL and major version of
+	 * compiled PostgreSQL.
+	 */
+#ifdef PGPRO_VERSION
+	if (!res)
+		/* It seems we connected to PostgreSQL (not Postgres Pro) */
+		elog(ERROR, "%s was built with Postgres Pro %s %s, "
+					"but connection is made with PostgreSQL %s",
+			 PROGRAM_NAME, PG_MAJORVERSION, PGPRO_EDITION, nodeInfo->server_version_str);
+	else
+	{
+		if (strcmp(nodeInfo->server_version_str, PG_MAJORVERSION) != 0 &&
+				 strcmp(PQgetvalue(res, 0, 0), PGPRO_EDITION) != 0)
+			elog(ERROR, "%s was built with Postgres Pro %s %s, "
+						"but connection is made with Postgres Pro %s %s",
+				 PROGRAM_NAME, PG_MAJORVERSION, PGPRO_EDITION,
+				 nodeInfo->server_version_str, PQgetvalue(res, 0, 0));
+	}
+#else
+	if (res)
+		/* It seems we connected to Postgres Pro (not PostgreSQL) */
+		elog(ERROR, "%s was built with PostgreSQL %s, "
+					"but connection is made with Postgres Pro %s %s",
+			 PROGRAM_NAME, PG_MAJORVERSION,
+			 nodeInfo->server_version_str, PQgetvalue(res, 0, 0));
+	else
+	{
+		if (strcmp(nodeInfo->server_version_str, PG_MAJORVERSION) != 0)
+			elog(ERROR, "%s was built with PostgreSQL %s, but connection is made with %s",
+				 PROGRAM_NAME, PG_MAJORVERSION, nodeInfo->server_version_str);
+	}
+#endif
+
+	if (res)
+		PQclear(res);
+
+	/* Do exclusive backup only for PostgreSQL 9.5 */
+	exclusive_backup = nodeInfo->server_version < 90600;
+}
+
+/*
+ * Ensure that backup directory was initialized for the same PostgreSQL
+ * instance we opened connection to. And that target backup database PGDATA
+ * belogns to the same instance.
+ * All system identifiers must be equal.
+ */
+void
+check_system_identifiers(PGconn *conn, char *pgdata)
+{
+	uint64		system_id_conn;
+	uint64		system_id_pgdata;
+
+	system_id_pgdata = get_system_identifier(pgdata, FIO_DB_HOST);
+	system_id_conn = get_remote_system_identifier(conn);
+
+	/* for checkdb check only system_id_pgdata and system_id_conn */
+	if (current.backup_mode == BACKUP_MODE_INVALID)
+	{
+		if (system_id_conn != system_id_pgdata)
+		{
+			elog(ERROR, "Data directory initialized with system id " UINT64_FORMAT ", "
+						"but connected instance system id is " UINT64_FORMAT,
+				 system_id_pgdata, system_id_conn);
+		}
+		return;
+	}
+
+	if (system_id_conn != instance_config.system_identifier)
+		elog(ERROR, "Backup data directory was initialized for system id " UINT64_FORMAT ", "
+					"but connected instance system id is " UINT64_FORMAT,
+			 instance_config.system_identifier, system_id_conn);
+
+	if (system_id_pgdata != instance_config.system_identifier)
+		elog(ERROR, "Backup data directory was initialized for system id " UINT64_FORMAT ", "
+					"but target backup directory system id is " UINT64_FORMAT,
+			 instance_config.system_identifier, system_id_pgdata);
+}
+
+/*
+ * Ensure that target backup database is initialized with
+ * compatible settings. Currently check BLCKSZ and XLOG_BLCKSZ.
+ */
+static void
+confirm_block_size(PGconn *conn, const char *name, int blcksz)
+{
+	PGresult   *res;
+	char	   *endp;
+	int			block_size;
+
+	res = pgut_execute(conn, "SELECT pg_catalog.current_setting($1)", 1, &name);
+	if (PQntuples(res) != 1 || PQnfields(res) != 1)
+		elog(ERROR, "cannot get %s: %s", name, PQerrorMessage(conn));
+
+	block_size = strtol(PQgetvalue(res, 0, 0), &endp, 10);
+	if ((endp && *endp) || block_size != blcksz)
+		elog(ERROR,
+			 "%s(%d) is not compatible(%d expected)",
+			 name, block_size, blcksz);
+
+	PQclear(res);
+}
+
+/*
+ * Notify start of backup to PostgreSQL server.
+ */
+static void
+pg_start_backup(const char *label, bool smooth, pgBackup *backup,
+				PGNodeInfo *nodeInfo, PGconn *conn)
+{
+	PGresult   *res;
 	const char *params[2];
 	uint32		lsn_hi;
 	uint32		lsn_lo;
@@ -1398,8 +1930,8 @@ wait_wal_lsn(XLogRecPtr target_lsn, bool is_start_lsn, TimeLineID tli,
 	 */
 	if (in_stream_dir)
 	{
-		pgBackupGetPath2(&current, pg_wal_dir, lengthof(pg_wal_dir),
-						 DATABASE_DIR, PG_XLOG_DIR);
+		get_database_path(&current, pg_wal_dir, lengthof(pg_wal_dir),
+						  PG_XLOG_DIR);
 		join_path_components(wal_segment_path, pg_wal_dir, wal_segment);
 		wal_segment_dir = pg_wal_dir;
 	}
@@ -1773,9 +2305,8 @@ pg_stop_backup(pgBackup *backup, PGconn *pg_startbackup_conn,
 
 			if (stream_wal)
 			{
-				pgBackupGetPath2(backup, stream_xlog_path,
-								 lengthof(stream_xlog_path),
-								 DATABASE_DIR, PG_XLOG_DIR);
+				get_database_path(backup, stream_xlog_path,
+								  lengthof(stream_xlog_path), PG_XLOG_DIR);
 				xlog_path = stream_xlog_path;
 			}
 			else
@@ -1878,7 +2409,7 @@ pg_stop_backup(pgBackup *backup, PGconn *pg_startbackup_conn,
 		if (!exclusive_backup)
 		{
 			Assert(PQnfields(res) >= 4);
-			pgBackupGetPath(backup, path, lengthof(path), DATABASE_DIR);
+			get_database_path(backup, path, lengthof(path), NULL);
 
 			/* Write backup_label */
 			join_path_components(backup_label, path, PG_BACKUP_LABEL_FILE);
@@ -1985,9 +2516,8 @@ pg_stop_backup(pgBackup *backup, PGconn *pg_startbackup_conn,
 			if (stream_thread_arg.ret == 1)
 				elog(ERROR, "WAL streaming failed");
 
-			pgBackupGetPath2(backup, stream_xlog_path,
-							 lengthof(stream_xlog_path),
-							 DATABASE_DIR, PG_XLOG_DIR);
+			get_database_path(backup, stream_xlog_path,
+							  lengthof(stream_xlog_path), PG_XLOG_DIR);
 			xlog_path = stream_xlog_path;
 		}
 		else
@@ -2040,53 +2570,633 @@ checkpoint_timeout(PGconn *backup_conn)
 }
 
 /*
- * Notify end of backup to server when "backup_label" is in the root directory
- * of the DB cluster.
- * Also update backup status to ERROR when the backup is not finished.
+ * Get path to the directory holding copied files of the database,
+ * which is destination PGDATA itself in case of catchup.
  */
 static void
-backup_cleanup(bool fatal, void *userdata)
+get_database_path(pgBackup *backup, char *path, size_t len, const char *subdir)
 {
-	/*
-	 * Update status of backup in BACKUP_CONTROL_FILE to ERROR.
-	 * end_time != 0 means backup finished
-	 */
-	if (current.status == BACKUP_STATUS_RUNNING && current.end_time == 0)
-	{
-		elog(WARNING, "Backup %s is running, setting its status to ERROR",
-			 base36enc(current.start_time));
-		current.end_time = time(NULL);
-		current.status = BACKUP_STATUS_ERROR;
-		write_backup(&current, true);
-	}
+	if (catchup_pgdata && subdir)
+		snprintf(path, len, "%s/%s", catchup_pgdata, subdir);
+	else if (catchup_pgdata)
+		snprintf(path, len, "%s", catchup_pgdata);
+	else
+		pgBackupGetPath2(backup, path, len, DATABASE_DIR, subdir);
 }
 
 /*
- * Take a backup of the PGDATA at a file level.
- * Copy all directories and files listed in backup_files_list.
- * If the file is 'datafile' (regular relation's main fork), read it page by page,
- * verify checksum and copy.
- * In incremental backup mode, copy only files or datafiles' pages changed after
+ * Remove WAL segments and other regular files from WAL directory
+ * before streaming into it.
+ */
+static void
+remove_wal_files(const char *wal_dir)
+{
+	int			i;
+	parray	   *xlog_files_list = parray_new();
+
+	dir_list_file(xlog_files_list, wal_dir, false, true, false, false, true, 0,
+				  FIO_BACKUP_HOST);
+
+	for (i = 0; i < parray_num(xlog_files_list); i++)
+	{
+		char		wal_full_path[MAXPGPATH];
+		pgFile	   *file = (pgFile *) parray_get(xlog_files_list, i);
+
+		if (!S_ISREG(file->mode))
+			continue;
+
+		join_path_components(wal_full_path, wal_dir, file->rel_path);
+
+		if (fio_unlink(wal_full_path, FIO_BACKUP_HOST) != 0)
+			elog(ERROR, "Cannot remove file \"%s\": %s",
+				 wal_full_path, strerror(errno));
+	}
+
+	parray_walk(xlog_files_list, pgFileFree);
+	parray_free(xlog_files_list);
+}
+
+/*
+ * Remove files copied by interrupted backup, which are absent in the
+ * sorted list 'files' of resumed backup. WAL streamed into backup
+ * directory is kept.
+ */
+static void
+remove_deleted_files(parray *files, const char *database_path,
+					 const char *external_prefix, parray *external_dirs)
+{
+	int			i;
+	int			n_external = external_dirs ? parray_num(external_dirs) : 0;
+	parray	   *backup_files = parray_new();
+
+	dir_list_file(backup_files, database_path, false, true, false, false, true, 0,
+				  FIO_BACKUP_HOST);
+
+	for (i = 0; i < n_external; i++)
+	{
+		char		external_dst[MAXPGPATH];
+
+		makeExternalDirPathByNum(external_dst, external_prefix, i+1);
+		dir_list_file(backup_files, external_dst, false, true, false, false, true, i+1,
+					  FIO_BACKUP_HOST);
+	}
+
+	/* Remove contents of directory before the directory itself */
+	parray_qsort(backup_files, pgFileCompareRelPathWithExternalDesc);
+
+	for (i = 0; i < parray_num(backup_files); i++)
+	{
+		char		fullpath[MAXPGPATH];
+		pgFile	   *file = (pgFile *) parray_get(backup_files, i);
+
+		if (parray_bsearch(files, file, pgFileCompareRelPathWithExternal) != NULL)
+			continue;
+
+		if (stream_wal && file->external_dir_num == 0 &&
+			path_is_prefix_of_path(PG_XLOG_DIR, file->rel_path))
+			continue;
+
+		if (file->external_dir_num == 0)
+			join_path_components(fullpath, database_path, file->rel_path);
+		else
+		{
+			char		external_dst[MAXPGPATH];
+
+			makeExternalDirPathByNum(external_dst, external_prefix,
+									 file->external_dir_num);
+			join_path_components(fullpath, external_dst, file->rel_path);
+		}
+
+		fio_delete(file->mode, fullpath, FIO_BACKUP_HOST);
+		elog(VERBOSE, "Deleted file \"%s\"", fullpath);
+	}
+
+	parray_walk(backup_files, pgFileFree);
+	parray_free(backup_files);
+}
+
+/*
+ * Start streaming of WAL into 'wal_dir' from START LSN of current backup.
+ * 'wal_dir' must stay valid until streaming is finished.
+ */
+static void
+start_wal_streaming(PGconn *backup_conn, const char *wal_dir)
+{
+	/* How long we should wait for streaming end after pg_stop_backup */
+	stream_stop_timeout = checkpoint_timeout(backup_conn);
+	stream_stop_timeout = stream_stop_timeout + stream_stop_timeout * 0.1;
+
+	fio_mkdir(wal_dir, DIR_PERMISSION, FIO_BACKUP_HOST);
+
+	stream_thread_arg.basedir = wal_dir;
+
+	/*
+	 * Connect in replication mode to the server.
+	 */
+	stream_thread_arg.conn = pgut_connect_replication(instance_config.conn_opt.pghost,
+													  instance_config.conn_opt.pgport,
+													  instance_config.conn_opt.pgdatabase,
+													  instance_config.conn_opt.pguser);
+	/* sanity */
+	IdentifySystem(&stream_thread_arg);
+
+	/* By default there are some error */
+	stream_thread_arg.ret = 1;
+	/* we must use startpos as start_lsn from start_backup */
+	stream_thread_arg.startpos = current.start_lsn;
+	stream_thread_arg.starttli = current.tli;
+
+	thread_interrupted = false;
+	pthread_create(&stream_thread, NULL, StreamLog, &stream_thread_arg);
+}
+
+/*
+ * Notify end of backup to server when "backup_label" is in the root directory
+ * of the DB cluster.
+ * Also update backup status to ERROR when the backup is not finished.
+ */
+static void
+backup_cleanup(bool fatal, void *userdata)
+{
+	/*
+	 * Update status of backup in BACKUP_CONTROL_FILE to ERROR.
+	 * end_time != 0 means backup finished
+	 */
+	if (current.status == BACKUP_STATUS_RUNNING && current.end_time == 0)
+	{
+		elog(WARNING, "Backup %s is running, setting its status to ERROR",
+			 base36enc(current.start_time));
+		current.end_time = time(NULL);
+		current.status = BACKUP_STATUS_ERROR;
+		write_backup(&current, true);
+	}
+}
+
+/*
+ * Construct the chain of backups holding previous versions of pages:
+ * previous backup and all its parents up to FULL backup.
+ * Every chain member must have page header map and its files loaded.
+ * Return NULL if delta encoding is not possible.
+ */
+static parray *
+get_page_delta_chain(pgBackup *prev_backup)
+{
+	parray	   *delta_chain = parray_new();
+	pgBackup   *backup = prev_backup;
+	int			i;
+
+	while (backup)
+	{
+		if (parse_program_version(backup->program_version) < 20400)
+		{
+			elog(WARNING, "Backup %s has been produced by pg_probackup version %s, "
+						  "which does not support page header map, page delta encoding is disabled",
+				 base36enc(backup->start_time), backup->program_version);
+			parray_free(delta_chain);
+			return NULL;
+		}
+
+		parray_append(delta_chain, backup);
+
+		if (backup->backup_mode == BACKUP_MODE_FULL)
+			break;
+
+		backup = backup->parent_backup_link;
+	}
+
+	/* sanity */
+	if (!backup)
+	{
+		elog(WARNING, "Parent chain of backup %s is broken, page delta encoding is disabled",
+			 base36enc(prev_backup->start_time));
+		parray_free(delta_chain);
+		return NULL;
+	}
+
+	for (i = 0; i < parray_num(delta_chain); i++)
+	{
+		backup = (pgBackup *) parray_get(delta_chain, i);
+
+		backup->files = get_backup_filelist(backup, true);
+		parray_qsort(backup->files, pgFileCompareRelPathWithExternal);
+	}
+
+	elog(INFO, "Changed pages are encoded against parent chain of %lu backups",
+		 parray_num(delta_chain));
+
+	return delta_chain;
+}
+
+static void
+free_page_delta_chain(parray *delta_chain)
+{
+	int			i;
+
+	for (i = 0; i < parray_num(delta_chain); i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(delta_chain, i);
+
+		parray_walk(backup->files, pgFileFree);
+		parray_free(backup->files);
+		backup->files = NULL;
+	}
+
+	parray_free(delta_chain);
+}
+
+/*
+ * Find interrupted backup, which can be resumed.
+ * Only the latest backup of instance can be resumed,
+ * and only if it was taken by the same binary with the same settings.
+ */
+static pgBackup *
+get_backup_to_resume(parray *backup_list)
+{
+	pgBackup   *backup;
+	char		journal_path[MAXPGPATH];
+
+	if (parray_num(backup_list) == 0)
+		return NULL;
+
+	/* backup list is sorted in descending order */
+	backup = (pgBackup *) parray_get(backup_list, 0);
+
+	/*
+	 * Backup killed without a chance to set ERROR status is still RUNNING,
+	 * make sure that the process, which was taking it, is gone.
+	 */
+	if (backup->status != BACKUP_STATUS_ERROR &&
+		!(backup->status == BACKUP_STATUS_RUNNING && lock_backup(backup, false)))
+	{
+		elog(WARNING, "The latest backup %s has status %s, it cannot be resumed",
+			 base36enc(backup->start_time), status2str(backup->status));
+		return NULL;
+	}
+
+	if (backup->backup_mode != current.backup_mode ||
+		backup->stream != current.stream ||
+		backup->compress_alg != current.compress_alg ||
+		backup->compress_level != current.compress_level ||
+		strcmp(backup->program_version, PROGRAM_VERSION) != 0 ||
+		(backup->external_dir_str == NULL) != (current.external_dir_str == NULL) ||
+		(backup->external_dir_str &&
+		 strcmp(backup->external_dir_str, current.external_dir_str) != 0))
+	{
+		elog(WARNING, "Backup %s was taken with different settings, it cannot be resumed",
+			 base36enc(backup->start_time));
+		return NULL;
+	}
+
+	join_path_components(journal_path, backup->root_dir, DATABASE_FILE_JOURNAL);
+
+	if (backup->start_lsn == InvalidXLogRecPtr ||
+		fio_access(journal_path, F_OK, FIO_BACKUP_HOST) != 0)
+	{
+		elog(WARNING, "Backup %s has no journal of copied files, it cannot be resumed",
+			 base36enc(backup->start_time));
+		return NULL;
+	}
+
+	elog(INFO, "Backup %s is going to be resumed", base36enc(backup->start_time));
+
+	return backup;
+}
+
+/*
+ * Decide whether the file copied by interrupted backup can be reused.
+ * Copy must be intact and the source file must not have changed since
+ * it was copied. For data files it means that there are no pages with
+ * LSN greater than START LSN of interrupted backup, this is checked by
+ * DELTA backup of the file into temporary location.
+ * If the copy is reused, its metadata is transferred to file.
+ */
+static bool
+resume_backup_file(backup_files_arg *arguments, pgFile *file,
+				   const char *from_fullpath, const char *to_fullpath)
+{
+	pgFile	  **resume_file_tmp;
+	pgFile	   *resume_file;
+	struct stat st;
+
+	/* pg_control is always copied anew */
+	if (file->external_dir_num == 0 &&
+		strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
+		return false;
+
+	resume_file_tmp = (pgFile **) parray_bsearch(arguments->resume_filelist,
+							file, pgFileCompareRelPathWithExternal);
+	if (!resume_file_tmp)
+		return false;
+
+	resume_file = *resume_file_tmp;
+
+	/* pack files are rewritten by resumed backup */
+	if (resume_file->write_size <= 0 ||
+		resume_file->pack_num > 0 ||
+		resume_file->is_datafile != file->is_datafile ||
+		resume_file->is_cfs != file->is_cfs)
+		return false;
+
+	/* the copy must be intact */
+	if (stat(to_fullpath, &st) != 0 ||
+		st.st_size != resume_file->write_size ||
+		pgFileGetCRC(to_fullpath, true, false) != resume_file->crc)
+		return false;
+
+	if (file->is_datafile && !file->is_cfs)
+	{
+		BackupPageHeader2 *headers;
+		HeaderMap	probe_map;
+		pgFile	   *probe;
+		char		probe_fullpath[MAXPGPATH];
+		bool		changed;
+
+		if (resume_file->n_headers <= 0)
+			return false;
+
+		headers = get_data_file_headers(arguments->hdr_map, resume_file,
+										parse_program_version(PROGRAM_VERSION), false);
+		if (!headers)
+			return false;
+		pg_free(headers);
+
+		/* probe output and its headers are discarded */
+		snprintf(probe_fullpath, MAXPGPATH, "%s.resume", to_fullpath);
+
+		memset(&probe_map, 0, sizeof(HeaderMap));
+		snprintf(probe_map.path, MAXPGPATH, "%s.resume_map", to_fullpath);
+		probe_map.mutex = (pthread_mutex_t)PTHREAD_MUTEX_INITIALIZER;
+
+		probe = pgFileInit(file->rel_path);
+		probe->mode = file->mode;
+		probe->size = file->size;
+		probe->is_datafile = true;
+		probe->segno = file->segno;
+		probe->exists_in_prev = true;
+
+		backup_data_file(&(arguments->conn_arg), probe, from_fullpath, probe_fullpath,
+						 arguments->resume_start_lsn, BACKUP_MODE_DIFF_DELTA,
+						 NONE_COMPRESS, 0,
+						 arguments->nodeInfo->checksum_version,
+						 arguments->nodeInfo->ptrack_version_num,
+						 arguments->nodeInfo->ptrack_schema,
+						 NULL, &probe_map, false);
+
+		changed = probe->write_size != BYTES_INVALID ||
+				  probe->n_blocks != resume_file->n_blocks;
+
+		cleanup_header_map(&probe_map);
+		if (unlink(probe_map.path) != 0 && errno != ENOENT)
+			elog(ERROR, "Cannot remove file \"%s\": %s", probe_map.path, strerror(errno));
+		if (unlink(probe_fullpath) != 0 && errno != ENOENT)
+			elog(ERROR, "Cannot remove file \"%s\": %s", probe_fullpath, strerror(errno));
+		pgFileFree(probe);
+
+		if (changed)
+			return false;
+
+		pg_free(file->pagemap.bitmap);
+		file->pagemap.bitmap = NULL;
+		file->uncompressed_size = resume_file->n_headers * BLCKSZ;
+	}
+	else
+	{
+		if (!EQ_TRADITIONAL_CRC32(fio_get_crc32(from_fullpath, FIO_DB_HOST, false),
+								  resume_file->crc))
+			return false;
+
+		file->uncompressed_size = resume_file->write_size;
+	}
+
+	file->write_size = resume_file->write_size;
+	file->crc = resume_file->crc;
+	file->compress_alg = resume_file->compress_alg;
+	file->n_blocks = resume_file->n_blocks;
+	file->delta_encoded = resume_file->delta_encoded;
+	file->n_headers = resume_file->n_headers;
+	file->hdr_crc = resume_file->hdr_crc;
+	file->hdr_off = resume_file->hdr_off;
+	file->hdr_size = resume_file->hdr_size;
+
+	return true;
+}
+
+/*
+ * Construct source and destination paths of the file
+ * and lookup the file in previous backup.
+ */
+static pgFile *
+backup_file_paths(backup_files_arg *arguments, pgFile *file,
+				  char *from_fullpath, char *to_fullpath)
+{
+	pgFile	   *prev_file = NULL;
+
+	/* construct destination filepath */
+	if (file->external_dir_num == 0)
+	{
+		join_path_components(from_fullpath, arguments->from_root, file->rel_path);
+		join_path_components(to_fullpath, arguments->to_root, file->rel_path);
+	}
+	else
+	{
+		char 	external_dst[MAXPGPATH];
+		char	*external_path = parray_get(arguments->external_dirs,
+											file->external_dir_num - 1);
+
+		makeExternalDirPathByNum(external_dst,
+							 arguments->external_prefix,
+							 file->external_dir_num);
+
+		join_path_components(to_fullpath, external_dst, file->rel_path);
+		join_path_components(from_fullpath, external_path, file->rel_path);
+	}
+
+	/* Check that file exist in previous backup */
+	if (current.backup_mode != BACKUP_MODE_FULL)
+	{
+		pgFile	**prev_file_tmp = NULL;
+		prev_file_tmp = (pgFile **) parray_bsearch(arguments->prev_filelist,
+										file, pgFileCompareRelPathWithExternal);
+		if (prev_file_tmp)
+		{
+			/* File exists in previous backup */
+			file->exists_in_prev = true;
+			prev_file = *prev_file_tmp;
+		}
+	}
+
+	return prev_file;
+}
+
+/*
+ * Claim small files following the i-th file of the list, so that
+ * the thread asks remote agent to send all of them at once and
+ * receives them one after another without waiting for each one.
+ * Claimed files are returned in batch, the i-th file goes first.
+ */
+static int
+prefetch_backup_files(backup_files_arg *arguments, int i, int *batch, int batch_size)
+{
+	int			n_batch = 0;
+	int			j;
+
+	batch[n_batch++] = i;
+
+	for (j = i + 1; j < parray_num(arguments->files_list) && n_batch < batch_size; j++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(arguments->files_list, j);
+
+		if (S_ISDIR(file->mode))
+			continue;
+
+		/* files are sorted by size, so the rest are too large */
+		if (!S_ISREG(file->mode) || file->size > PREFETCH_MAX_FILE_SIZE)
+			break;
+
+		if (!pg_atomic_test_set_flag(&file->lock))
+			continue;
+
+		batch[n_batch++] = j;
+	}
+
+	if (n_batch == 1)
+		return n_batch;
+
+	for (j = 0; j < n_batch; j++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(arguments->files_list, batch[j]);
+		pgFile	   *prev_file;
+		char		from_fullpath[MAXPGPATH];
+		char		to_fullpath[MAXPGPATH];
+
+		if (file->size == 0 || !S_ISREG(file->mode))
+			continue;
+
+		prev_file = backup_file_paths(arguments, file, from_fullpath, to_fullpath);
+
+		prefetch_backup_file(file, prev_file, from_fullpath,
+							 arguments->prev_start_lsn,
+							 current.backup_mode, current.parent_backup,
+							 instance_config.compress_alg,
+							 instance_config.compress_level,
+							 arguments->nodeInfo->checksum_version);
+	}
+
+	return n_batch;
+}
+
+/*
+ * Backup the i-th file of the list, which is claimed by the thread.
+ */
+static void
+backup_file(backup_files_arg *arguments, int i)
+{
+	char		from_fullpath[MAXPGPATH];
+	char		to_fullpath[MAXPGPATH];
+	pgFile	   *file = (pgFile *) parray_get(arguments->files_list, i);
+	pgFile	   *prev_file = NULL;
+
+	/* check for interrupt */
+	if (interrupted || thread_interrupted)
+		elog(ERROR, "interrupted during backup");
+
+	if (progress)
+		elog(INFO, "Progress: (%d/%d). Process file \"%s\"",
+			 i + 1, (int) parray_num(arguments->files_list), file->rel_path);
+
+	/* Handle zero sized files */
+	if (file->size == 0)
+	{
+		file->write_size = 0;
+		return;
+	}
+
+	prev_file = backup_file_paths(arguments, file, from_fullpath, to_fullpath);
+
+	/* Encountered some strange beast */
+	if (!S_ISREG(file->mode))
+		elog(WARNING, "Unexpected type %d of file \"%s\", skipping",
+						file->mode, from_fullpath);
+
+	/* Reuse the file copied by interrupted backup */
+	if (arguments->resume_filelist &&
+		resume_backup_file(arguments, file, from_fullpath, to_fullpath))
+	{
+		elog(VERBOSE, "File \"%s\" is reused from interrupted backup", from_fullpath);
+		append_backup_filelist_journal(file);
+		return;
+	}
+
+	/* backup file */
+	if (file->is_datafile && !file->is_cfs)
+	{
+		backup_data_file(&(arguments->conn_arg), file, from_fullpath, to_fullpath,
+							 arguments->prev_start_lsn,
+							 current.backup_mode,
+							 instance_config.compress_alg,
+							 instance_config.compress_level,
+							 arguments->nodeInfo->checksum_version,
+							 arguments->nodeInfo->ptrack_version_num,
+							 arguments->nodeInfo->ptrack_schema,
+							 arguments->delta_chain,
+							 arguments->hdr_map, false);
+	}
+	else
+	{
+		backup_non_data_file(file, prev_file, from_fullpath, to_fullpath,
+							 current.backup_mode, current.parent_backup, true,
+							 arguments->use_pack ? &(arguments->pack) : NULL);
+	}
+
+	if (file->write_size == FILE_NOT_FOUND)
+		return;
+
+	if (file->write_size == BYTES_INVALID)
+	{
+		elog(VERBOSE, "Skipping the unchanged file: \"%s\"", from_fullpath);
+		return;
+	}
+
+	elog(VERBOSE, "File \"%s\". Copied "INT64_FORMAT " bytes",
+					from_fullpath, file->write_size);
+
+	/* Remember that the file is copied */
+	append_backup_filelist_journal(file);
+}
+
+/*
+ * Take a backup of the PGDATA at a file level.
+ * Copy all directories and files listed in backup_files_list.
+ * If the file is 'datafile' (regular relation's main fork), read it page by page,
+ * verify checksum and copy.
+ * In incremental backup mode, copy only files or datafiles' pages changed after
  * previous backup.
+ * Small files of remote PGDATA are requested in batches of remote window size.
  */
 static void *
 backup_files(void *arg)
 {
 	int			i;
-	char		from_fullpath[MAXPGPATH];
-	char		to_fullpath[MAXPGPATH];
+	int			j;
 	static time_t prev_time;
 
 	backup_files_arg *arguments = (backup_files_arg *) arg;
 	int 		n_backup_files_list = parray_num(arguments->files_list);
+	int			batch_size = 1;
+	int		   *batch;
 
 	prev_time = current.start_time;
 
+	/* files reused from interrupted backup are not transferred */
+	if (fio_is_remote(FIO_DB_HOST) && !arguments->resume_filelist)
+		batch_size = Max(instance_config.remote.window, 1);
+	batch = pgut_newarray(int, batch_size);
+
 	/* backup a file */
 	for (i = 0; i < n_backup_files_list; i++)
 	{
 		pgFile	*file = (pgFile *) parray_get(arguments->files_list, i);
-		pgFile	*prev_file = NULL;
+		int		n_batch = 1;
 
 		/* We have already copied all directories */
 		if (S_ISDIR(file->mode))
@@ -2106,80 +3216,157 @@ backup_files(void *arg)
 			}
 		}
 
+		if (!pg_atomic_test_set_flag(&file->lock))
+			continue;
+
+		batch[0] = i;
+		if (batch_size > 1 && S_ISREG(file->mode) && file->size <= PREFETCH_MAX_FILE_SIZE)
+			n_batch = prefetch_backup_files(arguments, i, batch, batch_size);
+
+		/* files are backed up in the order they were requested */
+		for (j = 0; j < n_batch; j++)
+			backup_file(arguments, batch[j]);
+	}
+
+	pg_free(batch);
+
+	/* close pack file, it is synced by main thread */
+	if (arguments->use_pack)
+		cleanup_pack_file(&(arguments->pack));
+
+	/* ssh connection to longer needed */
+	fio_disconnect();
+
+	/* Close connection */
+	if (arguments->conn_arg.conn)
+		pgut_disconnect(arguments->conn_arg.conn);
+
+	/* Data files transferring is successful */
+	arguments->ret = 0;
+
+	return NULL;
+}
+
+/*
+ * Get LSN at which the history of 'source_tli' timeline of the instance
+ * in 'pgdata' switched off 'tli' timeline.
+ * Return InvalidXLogRecPtr if 'tli' is not found in the history.
+ */
+static XLogRecPtr
+get_timeline_switchpoint(const char *pgdata, TimeLineID source_tli, TimeLineID tli)
+{
+	char		path[MAXPGPATH];
+	char	   *buffer;
+	char	   *line;
+	XLogRecPtr	switchpoint = InvalidXLogRecPtr;
+
+	snprintf(path, lengthof(path), "%s/%08X.history", PG_XLOG_DIR, source_tli);
+
+	buffer = slurpFile(pgdata, path, NULL, true, FIO_DB_HOST);
+	if (buffer == NULL)
+		return InvalidXLogRecPtr;
+
+	for (line = strtok(buffer, "\n"); line != NULL; line = strtok(NULL, "\n"))
+	{
+		TimeLineID	line_tli;
+		uint32		switchpoint_hi;
+		uint32		switchpoint_lo;
+
+		if (sscanf(line, "%u\t%X/%X", &line_tli, &switchpoint_hi, &switchpoint_lo) == 3 &&
+			line_tli == tli)
+		{
+			switchpoint = ((uint64) switchpoint_hi) << 32 | switchpoint_lo;
+			break;
+		}
+	}
+
+	pg_free(buffer);
+
+	return switchpoint;
+}
+
+/*
+ * Bring files of destination PGDATA in sync with source PGDATA.
+ * Non-data files are copied if their size or checksum differs,
+ * data files are updated page by page.
+ * pg_control is skipped, it is copied after all other files.
+ */
+static void *
+catchup_files(void *arg)
+{
+	int			i;
+	char		from_fullpath[MAXPGPATH];
+	char		to_fullpath[MAXPGPATH];
+
+	backup_files_arg *arguments = (backup_files_arg *) arg;
+	int 		n_files_list = parray_num(arguments->files_list);
+
+	for (i = 0; i < n_files_list; i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(arguments->files_list, i);
+		struct stat	st;
+
+		/* We have already created all directories */
+		if (S_ISDIR(file->mode))
+			continue;
+
 		if (!pg_atomic_test_set_flag(&file->lock))
 			continue;
 
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
-			elog(ERROR, "interrupted during backup");
+			elog(ERROR, "interrupted during catchup");
 
 		if (progress)
 			elog(INFO, "Progress: (%d/%d). Process file \"%s\"",
-				 i + 1, n_backup_files_list, file->rel_path);
+				 i + 1, n_files_list, file->rel_path);
 
-		/* Handle zero sized files */
-		if (file->size == 0)
-		{
-			file->write_size = 0;
+		if (file->external_dir_num == 0 &&
+			strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
 			continue;
-		}
-
-		/* construct destination filepath */
-		if (file->external_dir_num == 0)
-		{
-			join_path_components(from_fullpath, arguments->from_root, file->rel_path);
-			join_path_components(to_fullpath, arguments->to_root, file->rel_path);
-		}
-		else
-		{
-			char 	external_dst[MAXPGPATH];
-			char	*external_path = parray_get(arguments->external_dirs,
-												file->external_dir_num - 1);
-
-			makeExternalDirPathByNum(external_dst,
-								 arguments->external_prefix,
-								 file->external_dir_num);
 
-			join_path_components(to_fullpath, external_dst, file->rel_path);
-			join_path_components(from_fullpath, external_path, file->rel_path);
-		}
+		join_path_components(from_fullpath, arguments->from_root, file->rel_path);
+		join_path_components(to_fullpath, arguments->to_root, file->rel_path);
 
 		/* Encountered some strange beast */
 		if (!S_ISREG(file->mode))
+		{
 			elog(WARNING, "Unexpected type %d of file \"%s\", skipping",
-							file->mode, from_fullpath);
+				 file->mode, from_fullpath);
+			continue;
+		}
 
-		/* Check that file exist in previous backup */
-		if (current.backup_mode != BACKUP_MODE_FULL)
+		/* Handle zero sized files */
+		if (file->size == 0)
 		{
-			pgFile	**prev_file_tmp = NULL;
-			prev_file_tmp = (pgFile **) parray_bsearch(arguments->prev_filelist,
-											file, pgFileCompareRelPathWithExternal);
-			if (prev_file_tmp)
-			{
-				/* File exists in previous backup */
-				file->exists_in_prev = true;
-				prev_file = *prev_file_tmp;
-			}
+			FILE	   *out = fio_fopen(to_fullpath, PG_BINARY_W, FIO_BACKUP_HOST);
+
+			if (out == NULL || fio_fclose(out) != 0)
+				elog(ERROR, "Cannot create file \"%s\": %s", to_fullpath,
+					 strerror(errno));
+
+			file->write_size = 0;
+			continue;
 		}
 
-		/* backup file */
 		if (file->is_datafile && !file->is_cfs)
-		{
-			backup_data_file(&(arguments->conn_arg), file, from_fullpath, to_fullpath,
-								 arguments->prev_start_lsn,
-								 current.backup_mode,
-								 instance_config.compress_alg,
-								 instance_config.compress_level,
-								 arguments->nodeInfo->checksum_version,
-								 arguments->nodeInfo->ptrack_version_num,
-								 arguments->nodeInfo->ptrack_schema,
-								 arguments->hdr_map, false);
-		}
+			catchup_data_file(arguments, file, from_fullpath, to_fullpath);
 		else
 		{
-			backup_non_data_file(file, prev_file, from_fullpath, to_fullpath,
-								 current.backup_mode, current.parent_backup, true);
+			/* Skip the file, if destination has the same content */
+			if (fio_stat(to_fullpath, &st, true, FIO_BACKUP_HOST) == 0 &&
+				(size_t) st.st_size == file->size)
+			{
+				file->crc = fio_get_crc32(from_fullpath, FIO_DB_HOST, false);
+
+				if (EQ_TRADITIONAL_CRC32(file->crc,
+										 fio_get_crc32(to_fullpath, FIO_BACKUP_HOST, false)))
+					file->write_size = BYTES_INVALID;
+			}
+
+			if (file->write_size != BYTES_INVALID)
+				backup_non_data_file_internal(from_fullpath, FIO_DB_HOST,
+											  to_fullpath, file, true);
 		}
 
 		if (file->write_size == FILE_NOT_FOUND)
@@ -2208,6 +3395,178 @@ backup_files(void *arg)
 	return NULL;
 }
 
+/*
+ * Update data file of destination PGDATA in place.
+ * Destination page is kept, if it is valid and its LSN is less than
+ * sync LSN, and the source page has not changed since sync LSN.
+ * Otherwise the page is copied from source.
+ *
+ * Pages are copied by backup_data_file() in two passes into temporary
+ * file, which is then applied to the destination file:
+ * - in DELTA mode pages of source changed since sync LSN;
+ * - in PAGE mode destination pages, which cannot be kept and
+ *   were not copied by the first pass.
+ */
+static void
+catchup_data_file(backup_files_arg *arguments, pgFile *file,
+				  const char *from_fullpath, const char *to_fullpath)
+{
+	char		tmp_fullpath[MAXPGPATH];
+	HeaderMap	tmp_map;
+	datapagemap_t *lsn_map = NULL;
+	datapagemap_t copied_map;
+	struct stat	st;
+	bool		dest_exists;
+	FILE	   *out;
+	size_t		write_len = 0;
+
+	snprintf(tmp_fullpath, MAXPGPATH, "%s.catchup", to_fullpath);
+
+	memset(&tmp_map, 0, sizeof(HeaderMap));
+	snprintf(tmp_map.path, MAXPGPATH, "%s.catchup_map", to_fullpath);
+	tmp_map.mutex = (pthread_mutex_t)PTHREAD_MUTEX_INITIALIZER;
+
+	memset(&copied_map, 0, sizeof(datapagemap_t));
+
+	dest_exists = fio_stat(to_fullpath, &st, true, FIO_BACKUP_HOST) == 0 &&
+				  S_ISREG(st.st_mode);
+
+	/*
+	 * Get destination pages, which can be kept.
+	 * Destination file is truncated to the size of source file.
+	 */
+	if (dest_exists)
+		lsn_map = fio_get_lsn_map(to_fullpath, arguments->nodeInfo->checksum_version,
+								  file->size / BLCKSZ, arguments->prev_start_lsn,
+								  file->segno * RELSEG_SIZE, FIO_BACKUP_HOST);
+
+	/* Copy pages of source changed since sync LSN */
+	file->exists_in_prev = dest_exists;
+
+	backup_data_file(&(arguments->conn_arg), file, from_fullpath, tmp_fullpath,
+					 arguments->prev_start_lsn, BACKUP_MODE_DIFF_DELTA,
+					 NONE_COMPRESS, 0,
+					 arguments->nodeInfo->checksum_version,
+					 arguments->nodeInfo->ptrack_version_num,
+					 arguments->nodeInfo->ptrack_schema,
+					 NULL, &tmp_map, false);
+
+	/* File was removed concurrently, WAL replay will remove it too */
+	if (file->write_size == FILE_NOT_FOUND)
+	{
+		cleanup_header_map(&tmp_map);
+		pg_free(lsn_map);
+		return;
+	}
+
+	out = fio_fopen(to_fullpath, dest_exists ? "r+b" : PG_BINARY_W, FIO_BACKUP_HOST);
+	if (out == NULL)
+		elog(ERROR, "Cannot open destination file \"%s\": %s",
+			 to_fullpath, strerror(errno));
+
+	write_len += catchup_apply_pages(file, &tmp_map, tmp_fullpath,
+									 out, to_fullpath, &copied_map);
+
+	/* Copy pages, which cannot be kept in destination */
+	if (dest_exists)
+	{
+		pgFile	   *probe = pgFileInit(file->rel_path);
+		BlockNumber	blknum;
+
+		probe->mode = file->mode;
+		probe->size = file->n_blocks * BLCKSZ;
+		probe->is_datafile = true;
+		probe->segno = file->segno;
+		probe->exists_in_prev = true;
+
+		for (blknum = 0; blknum < file->n_blocks; blknum++)
+		{
+			if (lsn_map && datapagemap_is_set(lsn_map, blknum))
+				continue;
+
+			if (datapagemap_is_set(&copied_map, blknum))
+				continue;
+
+			datapagemap_add(&probe->pagemap, blknum);
+		}
+
+		backup_data_file(&(arguments->conn_arg), probe, from_fullpath, tmp_fullpath,
+						 InvalidXLogRecPtr, BACKUP_MODE_DIFF_PAGE,
+						 NONE_COMPRESS, 0,
+						 arguments->nodeInfo->checksum_version,
+						 arguments->nodeInfo->ptrack_version_num,
+						 arguments->nodeInfo->ptrack_schema,
+						 NULL, &tmp_map, false);
+
+		if (probe->write_size != FILE_NOT_FOUND)
+			write_len += catchup_apply_pages(probe, &tmp_map, tmp_fullpath,
+											 out, to_fullpath, NULL);
+
+		pgFileFree(probe);
+	}
+
+	/* Source file could have been truncated since it was listed */
+	if (fio_fflush(out) != 0 ||
+		fio_ftruncate(out, file->n_blocks * BLCKSZ) != 0)
+		elog(ERROR, "Cannot truncate file \"%s\": %s", to_fullpath, strerror(errno));
+
+	if (fio_fclose(out) != 0)
+		elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath, strerror(errno));
+
+	file->write_size = write_len > 0 ? write_len : BYTES_INVALID;
+
+	pg_free(copied_map.bitmap);
+	pg_free(lsn_map);
+}
+
+/*
+ * Write pages copied by backup_data_file() into temporary file
+ * to their places in destination file 'out'.
+ * Written blocks are added to 'map', if it is not NULL.
+ * Temporary file and its page header map are removed.
+ */
+static size_t
+catchup_apply_pages(pgFile *file, HeaderMap *hdr_map, const char *tmp_fullpath,
+					FILE *out, const char *to_fullpath, datapagemap_t *map)
+{
+	BackupPageHeader2 *headers;
+	FILE	   *in;
+	size_t		write_len = 0;
+
+	/* headers are read back from the page header map */
+	cleanup_header_map(hdr_map);
+
+	if (file->write_size > 0 && file->n_headers > 0)
+	{
+		headers = get_data_file_headers(hdr_map, file,
+										parse_program_version(PROGRAM_VERSION), true);
+
+		in = fopen(tmp_fullpath, PG_BINARY_R);
+		if (in == NULL)
+			elog(ERROR, "Cannot open file \"%s\": %s", tmp_fullpath,
+				 strerror(errno));
+
+		write_len = restore_data_file_internal(in, out, file,
+											   parse_program_version(PROGRAM_VERSION),
+											   tmp_fullpath, to_fullpath, file->n_blocks,
+											   map, NULL, 0, InvalidXLogRecPtr, NULL,
+											   headers, NULL, NULL);
+
+		if (fclose(in) != 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", tmp_fullpath,
+				 strerror(errno));
+
+		pg_free(headers);
+	}
+
+	if (unlink(tmp_fullpath) != 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", tmp_fullpath, strerror(errno));
+	if (unlink(hdr_map->path) != 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", hdr_map->path, strerror(errno));
+
+	return write_len;
+}
+
 /*
  * Extract information about files in backup_list parsing their names:
  * - remove temp tables from the list
@@ -365,12 +365,12 @@ catalog_get_instance_list(void)
 
 	/* open directory and list contents */
 	join_path_components(path, backup_path, BACKUPS_DIR);
-	dir = opendir(path);
+	dir = fio_opendir(path, FIO_BACKUP_HOST);
 	if (dir == NULL)
 		elog(ERROR, "Cannot open directory \"%s\": %s",
 			 path, strerror(errno));
 
-	while (errno = 0, (dent = readdir(dir)) != NULL)
+	while (errno = 0, (dent = fio_readdir(dir)) != NULL)
 	{
 		char		child[MAXPGPATH];
 		struct stat	st;
@@ -383,7 +383,7 @@ catalog_get_instance_list(void)
 
 		join_path_components(child, path, dent->d_name);
 
-		if (lstat(child, &st) == -1)
+		if (fio_stat(child, &st, false, FIO_BACKUP_HOST) == -1)
 			elog(ERROR, "Cannot stat file \"%s\": %s",
 					child, strerror(errno));
 
@@ -403,7 +403,7 @@ catalog_get_instance_list(void)
 		elog(ERROR, "Cannot read directory \"%s\": %s",
 				path, strerror(errno));
 
-	if (closedir(dir))
+	if (fio_closedir(dir))
 		elog(ERROR, "Cannot close directory \"%s\": %s",
 				path, strerror(errno));
 
@@ -477,6 +477,10 @@ catalog_get_backup_list(const char *instance_name, time_t requested_backup_id)
 		/* Initialize page header map */
 		init_header_map(backup);
 
+		/* Data of backup kept in container file is read through its index */
+		if (backup->container && strcmp(backup->container, CONTAINER_STDIO) != 0)
+			container_mount(backup->container, backup->root_dir);
+
 		/* TODO: save encoded backup id */
 		backup->backup_id = backup->start_time;
 		if (requested_backup_id != INVALID_BACKUP_ID
@@ -853,9 +857,15 @@ pgBackupCreateDir(pgBackup *backup)
 	/* block header map */
 	init_header_map(backup);
 
-	/* create directories for actual backup files */
+	/*
+	 * create directories for actual backup files,
+	 * they are not needed if backup files are written into container
+	 */
 	for (i = 0; i < parray_num(subdirs); i++)
 	{
+		if (backup->container)
+			break;
+
 		join_path_components(path, backup->root_dir, parray_get(subdirs, i));
 		fio_mkdir(path, DIR_PERMISSION, FIO_BACKUP_HOST);
 	}
@@ -1638,6 +1648,23 @@ pin_backup(pgBackup	*target_backup, pgSetBackupParams *set_backup_params)
 	return;
 }
 
+/*
+ * Check if data of backup can be read. Container written to standard output
+ * is out of reach until it is unpacked into the backup directory.
+ */
+bool
+backup_container_is_available(pgBackup *backup)
+{
+	char		path[MAXPGPATH];
+
+	if (backup->container == NULL ||
+		strcmp(backup->container, CONTAINER_STDIO) != 0)
+		return true;
+
+	join_path_components(path, backup->root_dir, DATABASE_DIR);
+	return fio_access(path, F_OK, FIO_BACKUP_HOST) == 0;
+}
+
 /*
  * Add note to backup metadata or unset already existing note.
  * It is a job of the caller to make sure that note is not NULL.
@@ -1771,6 +1798,9 @@ pgBackupWriteControl(FILE *out, pgBackup *backup)
 	if (backup->note)
 		fio_fprintf(out, "note = '%s'\n", backup->note);
 
+	if (backup->container)
+		fio_fprintf(out, "container = '%s'\n", backup->container);
+
 	if (backup->content_crc != 0)
 		fio_fprintf(out, "content-crc = %u\n", backup->content_crc);
 
@@ -1791,12 +1821,12 @@ write_backup(pgBackup *backup, bool strict)
 	join_path_components(path, backup->root_dir, BACKUP_CONTROL_FILE);
 	snprintf(path_temp, sizeof(path_temp), "%s.tmp", path);
 
-	fp = fopen(path_temp, PG_BINARY_W);
+	fp = fio_fopen(path_temp, PG_BINARY_W, FIO_BACKUP_HOST);
 	if (fp == NULL)
 		elog(ERROR, "Cannot open control file \"%s\": %s",
 			 path_temp, strerror(errno));
 
-	if (chmod(path_temp, FILE_PERMISSION) == -1)
+	if (fio_chmod(path_temp, FILE_PERMISSION, FIO_BACKUP_HOST) == -1)
 		elog(ERROR, "Cannot change mode of \"%s\": %s", path_temp,
 			 strerror(errno));
 
@@ -1808,7 +1838,8 @@ write_backup(pgBackup *backup, bool strict)
 		elog(ERROR, "Cannot flush control file \"%s\": %s",
 			 path_temp, strerror(errno));
 
-	if (fsync(fileno(fp)) < 0)
+	/* object in storage becomes durable on close */
+	if (!fio_is_storage(FIO_BACKUP_HOST) && fsync(fileno(fp)) < 0)
 		elog(ERROR, "Cannot sync control file \"%s\": %s",
 			 path_temp, strerror(errno));
 
@@ -1816,11 +1847,66 @@ write_backup(pgBackup *backup, bool strict)
 		elog(ERROR, "Cannot close control file \"%s\": %s",
 			 path_temp, strerror(errno));
 
-	if (rename(path_temp, path) < 0)
+	if (fio_rename(path_temp, path, FIO_BACKUP_HOST) < 0)
 		elog(ERROR, "Cannot rename file \"%s\" to \"%s\": %s",
 			 path_temp, path, strerror(errno));
 }
 
+/*
+ * Format the entry of DATABASE_FILE_LIST describing the file.
+ * Line must be at least BLCKSZ bytes long.
+ */
+static void
+print_file_list_line(char *line, pgFile *file)
+{
+	int			len = 0;
+
+	len = sprintf(line, "{\"path\":\"%s\", \"size\":\"" INT64_FORMAT "\", "
+				 "\"mode\":\"%u\", \"is_datafile\":\"%u\", "
+				 "\"is_cfs\":\"%u\", \"crc\":\"%u\", "
+				 "\"compress_alg\":\"%s\", \"external_dir_num\":\"%d\", "
+				 "\"dbOid\":\"%u\"",
+				file->rel_path, file->write_size, file->mode,
+				file->is_datafile ? 1 : 0,
+				file->is_cfs ? 1 : 0,
+				file->crc,
+				deparse_compress_alg(file->compress_alg),
+				file->external_dir_num,
+				file->dbOid);
+
+	if (file->is_datafile)
+		len += sprintf(line+len, ",\"segno\":\"%d\"", file->segno);
+
+	if (file->linked)
+		len += sprintf(line+len, ",\"linked\":\"%s\"", file->linked);
+
+	if (file->n_blocks > 0)
+		len += sprintf(line+len, ",\"n_blocks\":\"%i\"", file->n_blocks);
+
+	if (file->delta_encoded)
+		len += sprintf(line+len, ",\"delta_encoded\":\"1\"");
+
+	if (file->patched)
+		len += sprintf(line+len, ",\"patched\":\"1\",\"dead_size\":\"" INT64_FORMAT "\"",
+					   file->dead_size);
+
+	if (file->n_headers > 0)
+	{
+		len += sprintf(line+len, ",\"n_headers\":\"%i\"", file->n_headers);
+		len += sprintf(line+len, ",\"hdr_crc\":\"%u\"", file->hdr_crc);
+		len += sprintf(line+len, ",\"hdr_off\":\"%li\"", file->hdr_off);
+		len += sprintf(line+len, ",\"hdr_size\":\"%i\"", file->hdr_size);
+	}
+
+	if (file->pack_num > 0)
+	{
+		len += sprintf(line+len, ",\"pack_num\":\"%i\"", file->pack_num);
+		len += sprintf(line+len, ",\"pack_off\":\"%li\"", file->pack_off);
+	}
+
+	sprintf(line+len, "}\n");
+}
+
 /*
  * Output the list of files to backup catalog DATABASE_FILE_LIST
  */
@@ -1841,12 +1927,12 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 	join_path_components(control_path, backup->root_dir, DATABASE_FILE_LIST);
 	snprintf(control_path_temp, sizeof(control_path_temp), "%s.tmp", control_path);
 
-	out = fopen(control_path_temp, PG_BINARY_W);
+	out = fio_fopen(control_path_temp, PG_BINARY_W, FIO_BACKUP_HOST);
 	if (out == NULL)
 		elog(ERROR, "Cannot open file list \"%s\": %s", control_path_temp,
 			 strerror(errno));
 
-	if (chmod(control_path_temp, FILE_PERMISSION) == -1)
+	if (fio_chmod(control_path_temp, FILE_PERMISSION, FIO_BACKUP_HOST) == -1)
 		elog(ERROR, "Cannot change mode of \"%s\": %s", control_path_temp,
 			 strerror(errno));
 
@@ -1859,7 +1945,6 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 	/* print each file in the list */
 	for (i = 0; i < parray_num(files); i++)
 	{
-		int       len = 0;
 		char      line[BLCKSZ];
 		pgFile   *file = (pgFile *) parray_get(files, i);
 
@@ -1889,37 +1974,7 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 			}
 		}
 
-		len = sprintf(line, "{\"path\":\"%s\", \"size\":\"" INT64_FORMAT "\", "
-					 "\"mode\":\"%u\", \"is_datafile\":\"%u\", "
-					 "\"is_cfs\":\"%u\", \"crc\":\"%u\", "
-					 "\"compress_alg\":\"%s\", \"external_dir_num\":\"%d\", "
-					 "\"dbOid\":\"%u\"",
-					file->rel_path, file->write_size, file->mode,
-					file->is_datafile ? 1 : 0,
-					file->is_cfs ? 1 : 0,
-					file->crc,
-					deparse_compress_alg(file->compress_alg),
-					file->external_dir_num,
-					file->dbOid);
-
-		if (file->is_datafile)
-			len += sprintf(line+len, ",\"segno\":\"%d\"", file->segno);
-
-		if (file->linked)
-			len += sprintf(line+len, ",\"linked\":\"%s\"", file->linked);
-
-		if (file->n_blocks > 0)
-			len += sprintf(line+len, ",\"n_blocks\":\"%i\"", file->n_blocks);
-
-		if (file->n_headers > 0)
-		{
-			len += sprintf(line+len, ",\"n_headers\":\"%i\"", file->n_headers);
-			len += sprintf(line+len, ",\"hdr_crc\":\"%u\"", file->hdr_crc);
-			len += sprintf(line+len, ",\"hdr_off\":\"%li\"", file->hdr_off);
-			len += sprintf(line+len, ",\"hdr_size\":\"%i\"", file->hdr_size);
-		}
-
-		sprintf(line+len, "}\n");
+		print_file_list_line(line, file);
 
 		if (sync)
 			COMP_FILE_CRC32(true, backup->content_crc, line, strlen(line));
@@ -1934,7 +1989,7 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 		elog(ERROR, "Cannot flush file list \"%s\": %s",
 			 control_path_temp, strerror(errno));
 
-	if (sync && fsync(fileno(out)) < 0)
+	if (sync && !fio_is_storage(FIO_BACKUP_HOST) && fsync(fileno(out)) < 0)
 		elog(ERROR, "Cannot sync file list \"%s\": %s",
 			 control_path_temp, strerror(errno));
 
@@ -1942,7 +1997,7 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 		elog(ERROR, "Cannot close file list \"%s\": %s",
 			 control_path_temp, strerror(errno));
 
-	if (rename(control_path_temp, control_path) < 0)
+	if (fio_rename(control_path_temp, control_path, FIO_BACKUP_HOST) < 0)
 		elog(ERROR, "Cannot rename file \"%s\" to \"%s\": %s",
 			 control_path_temp, control_path, strerror(errno));
 
@@ -1956,6 +2011,153 @@ write_backup_filelist(pgBackup *backup, parray *files, const char *root,
 	free(buf);
 }
 
+/*
+ * Journal of files, which are already copied into running backup.
+ * Entries are appended as soon as the file is copied, so the journal
+ * survives the interruption of backup and allows to resume it later.
+ */
+static FILE *filelist_journal = NULL;
+static pthread_mutex_t filelist_journal_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+/*
+ * Create empty DATABASE_FILE_JOURNAL for the backup.
+ */
+void
+open_backup_filelist_journal(pgBackup *backup)
+{
+	char		path[MAXPGPATH];
+
+	/*
+	 * Object in storage becomes visible only after it is closed,
+	 * so journal cannot outlive the interrupted backup there.
+	 */
+	if (fio_is_storage(FIO_BACKUP_HOST))
+		return;
+
+	join_path_components(path, backup->root_dir, DATABASE_FILE_JOURNAL);
+
+	filelist_journal = fopen(path, PG_BINARY_W);
+	if (filelist_journal == NULL)
+		elog(ERROR, "Cannot open file list journal \"%s\": %s",
+			 path, strerror(errno));
+
+	if (chmod(path, FILE_PERMISSION) == -1)
+		elog(ERROR, "Cannot change mode of \"%s\": %s", path,
+			 strerror(errno));
+}
+
+/*
+ * Is DATABASE_FILE_JOURNAL of running backup kept.
+ */
+bool
+backup_filelist_journal_is_open(void)
+{
+	return filelist_journal != NULL;
+}
+
+/*
+ * Append entry of copied file to DATABASE_FILE_JOURNAL.
+ * Entry is flushed immediately, so it outlives the killed process.
+ */
+void
+append_backup_filelist_journal(pgFile *file)
+{
+	char		line[BLCKSZ];
+
+	if (!filelist_journal)
+		return;
+
+	print_file_list_line(line, file);
+
+	pthread_lock(&filelist_journal_mutex);
+
+	if (fputs(line, filelist_journal) == EOF ||
+		fflush(filelist_journal) != 0)
+		elog(ERROR, "Cannot write to file list journal: %s", strerror(errno));
+
+	pthread_mutex_unlock(&filelist_journal_mutex);
+}
+
+/*
+ * Close DATABASE_FILE_JOURNAL. Remove it, if the backup is completed.
+ */
+void
+close_backup_filelist_journal(pgBackup *backup, bool remove)
+{
+	char		path[MAXPGPATH];
+
+	if (filelist_journal && fclose(filelist_journal) != 0)
+		elog(ERROR, "Cannot close file list journal: %s", strerror(errno));
+	filelist_journal = NULL;
+
+	if (!remove || fio_is_storage(FIO_BACKUP_HOST))
+		return;
+
+	join_path_components(path, backup->root_dir, DATABASE_FILE_JOURNAL);
+
+	if (unlink(path) != 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", path, strerror(errno));
+}
+
+/*
+ * Read DATABASE_FILE_JOURNAL of interrupted backup.
+ * Partially written last entry is truncated away.
+ * Return NULL if there is no journal.
+ */
+parray *
+read_backup_filelist_journal(pgBackup *backup)
+{
+	char		path[MAXPGPATH];
+	char		buf[BLCKSZ];
+	FILE	   *fp;
+	off_t		valid_len = 0;
+	bool		partial = false;
+
+	if (fio_is_storage(FIO_BACKUP_HOST))
+		return NULL;
+
+	join_path_components(path, backup->root_dir, DATABASE_FILE_JOURNAL);
+
+	fp = fopen(path, PG_BINARY_R);
+	if (fp == NULL)
+	{
+		if (errno == ENOENT)
+			return NULL;
+		elog(ERROR, "Cannot open file list journal \"%s\": %s",
+			 path, strerror(errno));
+	}
+
+	/* find the end of the last complete entry */
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		size_t		len = strlen(buf);
+
+		if (len == 0 || buf[len - 1] != '\n')
+		{
+			partial = true;
+			break;
+		}
+		valid_len += len;
+	}
+
+	if (ferror(fp))
+		elog(ERROR, "Cannot read file list journal \"%s\": %s",
+			 path, strerror(errno));
+
+	fclose(fp);
+
+	if (partial)
+	{
+		elog(WARNING, "Truncating partially written entry of file list journal \"%s\"",
+			 path);
+
+		if (truncate(path, valid_len) != 0)
+			elog(ERROR, "Cannot truncate file \"%s\": %s", path, strerror(errno));
+	}
+
+	return dir_read_file_list(NULL, NULL, path, FIO_BACKUP_HOST, 0);
+}
+
 /*
  * Read BACKUP_CONTROL_FILE and create pgBackup.
  *  - Comment starts with ';'.
@@ -2007,6 +2209,7 @@ readBackupControlFile(const char *path)
 		{'s', 0, "primary-conninfo",	&backup->primary_conninfo, SOURCE_FILE_STRICT},
 		{'s', 0, "external-dirs",		&backup->external_dir_str, SOURCE_FILE_STRICT},
 		{'s', 0, "note",				&backup->note, SOURCE_FILE_STRICT},
+		{'s', 0, "container",			&backup->container, SOURCE_FILE_STRICT},
 		{'u', 0, "content-crc",			&backup->content_crc, SOURCE_FILE_STRICT},
 		{0}
 	};
@@ -2275,7 +2478,9 @@ pgBackupInit(pgBackup *backup)
 	backup->root_dir = NULL;
 	backup->database_dir = NULL;
 	backup->files = NULL;
+	backup->files_index = NULL;
 	backup->note = NULL;
+	backup->container = NULL;
 	backup->content_crc = 0;
 }
 
@@ -2290,6 +2495,8 @@ pgBackupFree(void *backup)
 	pg_free(b->root_dir);
 	pg_free(b->database_dir);
 	pg_free(b->note);
+	pg_free(b->container);
+	pgBackupFreeFilesIndex(b);
 	pg_free(backup);
 }
 
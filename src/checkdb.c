@@ -41,6 +41,16 @@ typedef struct
 	int			thread_num;
 	/* pgdata path */
 	const char	*from_root;
+	/* ledger of the previous incremental checkdb, NULL if there is none */
+	parray	   *ledger;
+	/* ledger being collected by this checkdb run, NULL if not incremental */
+	parray	   *new_ledger;
+	/* number of this incremental checkdb run */
+	uint32		run;
+	/* files modified after this time are not recorded in the ledger */
+	time_t		check_time;
+	/* number of unchanged data files skipped by the thread */
+	int			n_skipped;
 	/*
 	 * Return value from the thread:
 	 * 0 everything is ok
@@ -50,10 +60,13 @@ typedef struct
 	int			ret;
 } check_files_arg;
 
+/* protects new_ledger of incremental checkdb */
+static pthread_mutex_t checkdb_ledger_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 
 typedef struct
 {
-	/* list of indexes to amcheck */
+	/* list of indexes of all databases to amcheck, largest first */
 	parray	   *index_list;
 	/*
 	 * credentials to connect to postgres instance
@@ -62,8 +75,8 @@ typedef struct
 	 */
 	ConnectionOptions conn_opt;
 	/*
-	 * conn and cancel_conn
-	 * to use in threads to connect to databases
+	 * conn and cancel_conn to the database of the index
+	 * being checked, taken from the connection pool
 	 */
 	ConnectionArgs conn_arg;
 	/* number of thread for debugging */
@@ -85,10 +98,34 @@ typedef struct pg_indexEntry
 	bool heapallindexed_is_supported;
 	/* schema where amcheck extension is located */
 	char *amcheck_nspname;
+	/* database of the index and its number in the list of databases */
+	const char *dbname;
+	int db_num;
+	/* size of the index, to check the largest indexes first */
+	int64 size;
+	/* set by amcheck thread when the check of the index is done */
+	bool processed;
+	/* set by amcheck thread if the check of the index failed */
+	bool failed;
 	/* lock for synchronization of parallel threads  */
 	volatile pg_atomic_flag lock;
 } pg_indexEntry;
 
+/*
+ * Connection to a database, idle in the pool of amcheck connections.
+ * Amcheck threads reuse connections between indexes, and no more than
+ * num_threads connections are open at once.
+ */
+typedef struct amcheck_conn
+{
+	const char *dbname;
+	ConnectionArgs conn_arg;
+} amcheck_conn;
+
+static parray *amcheck_idle_conns = NULL;
+static int	amcheck_n_conns = 0;
+static pthread_mutex_t amcheck_conn_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 static void
 pg_indexEntry_free(void *index)
 {
@@ -111,11 +148,18 @@ pg_indexEntry_free(void *index)
 
 
 static void *check_files(void *arg);
+static bool checkdb_file_is_unchanged(check_files_arg *arguments, pgFile *file,
+									  struct stat *st);
+static void checkdb_ledger_add(check_files_arg *arguments, pgFile *file,
+							   struct stat *st);
 static void do_block_validation(char *pgdata, uint32 checksum_version);
 
 static void *check_indexes(void *arg);
-static parray* get_index_list(const char *dbname, bool first_db_with_amcheck,
-							  PGconn *db_conn);
+static parray* get_index_list(const char *dbname, int db_num,
+							  bool first_db_with_amcheck, PGconn *db_conn);
+static void amcheck_conn_acquire(check_indexes_arg *arguments,
+								 const char *dbname);
+static void amcheck_conn_release(check_indexes_arg *arguments);
 static bool amcheck_one_index(check_indexes_arg *arguments,
 				 pg_indexEntry *ind);
 static void do_amcheck(ConnectionOptions conn_opt, PGconn *conn);
@@ -166,6 +210,25 @@ check_files(void *arg)
 			/* check only uncompressed by cfs datafiles */
 			if (file->is_datafile && !file->is_cfs)
 			{
+				struct stat st;
+				bool		has_stat = false;
+
+				/*
+				 * Identity of the file is taken before reading it, so that
+				 * concurrent changes make next run check the file again.
+				 */
+				if (arguments->new_ledger)
+				{
+					has_stat = stat(from_fullpath, &st) == 0;
+
+					if (has_stat && checkdb_file_is_unchanged(arguments, file, &st))
+					{
+						elog(VERBOSE, "Skip unchanged file \"%s\"", from_fullpath);
+						arguments->n_skipped++;
+						continue;
+					}
+				}
+
 				/*
 				 * TODO deep inside check_data_file
 				 * uses global variables to set connections.
@@ -175,6 +238,8 @@ check_files(void *arg)
 									 file, from_fullpath,
 									 arguments->checksum_version))
 					arguments->ret = 2; /* corruption found */
+				else if (has_stat)
+					checkdb_ledger_add(arguments, file, &st);
 			}
 		}
 		else
@@ -192,6 +257,71 @@ check_files(void *arg)
 	return NULL;
 }
 
+/*
+ * Decide whether incremental checkdb can skip the data file.
+ * The file is skipped if its identity matches the ledger entry and
+ * the file does not belong to the slice scanned in full by this run.
+ * Skipped file keeps its ledger entry.
+ */
+static bool
+checkdb_file_is_unchanged(check_files_arg *arguments, pgFile *file,
+						  struct stat *st)
+{
+	checkdb_ledger_entry *entry;
+	checkdb_ledger_entry *new_entry;
+
+	if (!arguments->ledger)
+		return false;
+
+	if (file->path_hash % checkdb_slices == arguments->run % checkdb_slices)
+		return false;
+
+	entry = ledger_find_file(arguments->ledger, file);
+
+	if (!entry ||
+		entry->size != (int64) st->st_size ||
+		entry->mtime != st->st_mtime ||
+		entry->inode != (uint64) st->st_ino)
+		return false;
+
+	new_entry = pgut_new(checkdb_ledger_entry);
+	*new_entry = *entry;
+	new_entry->key.rel_path = pgut_strdup(entry->key.rel_path);
+
+	pthread_lock(&checkdb_ledger_mutex);
+	parray_append(arguments->new_ledger, new_entry);
+	pthread_mutex_unlock(&checkdb_ledger_mutex);
+
+	return true;
+}
+
+/*
+ * Record the data file found valid in the new ledger.
+ * Files modified during the checkdb run are not recorded, because
+ * their mtime cannot tell later changes made within the same second.
+ */
+static void
+checkdb_ledger_add(check_files_arg *arguments, pgFile *file,
+				   struct stat *st)
+{
+	checkdb_ledger_entry *entry;
+
+	if (st->st_mtime >= arguments->check_time)
+		return;
+
+	entry = pgut_new(checkdb_ledger_entry);
+	entry->key.rel_path = pgut_strdup(file->rel_path);
+	entry->key.external_dir_num = 0;
+	entry->size = (int64) st->st_size;
+	entry->mtime = st->st_mtime;
+	entry->inode = (uint64) st->st_ino;
+	entry->checked = arguments->check_time;
+
+	pthread_lock(&checkdb_ledger_mutex);
+	parray_append(arguments->new_ledger, entry);
+	pthread_mutex_unlock(&checkdb_ledger_mutex);
+}
+
 /* collect list of files and run threads to check files in the instance */
 static void
 do_block_validation(char *pgdata, uint32 checksum_version)
@@ -201,7 +331,25 @@ do_block_validation(char *pgdata, uint32 checksum_version)
 	pthread_t	*threads;
 	check_files_arg *threads_args;
 	bool		check_isok = true;
+	bool		check_finished = true;
 	parray *files_list = NULL;
+	/* incremental checkdb */
+	char		ledger_path[MAXPGPATH];
+	parray	   *ledger = NULL;
+	parray	   *new_ledger = NULL;
+	uint32		run = 0;
+	time_t		check_time = time(NULL);
+	int			n_skipped = 0;
+
+	if (checkdb_slices > 0)
+	{
+		join_path_components(ledger_path, backup_instance_path, CHECKDB_LEDGER);
+		ledger = read_checkdb_ledger(ledger_path, &run);
+		new_ledger = parray_new();
+
+		elog(INFO, "Incremental checkdb, run %u, data files of slice %u of %u "
+			 "are checked in full", run, run % checkdb_slices + 1, checkdb_slices);
+	}
 
 	/* initialize file list */
 	files_list = parray_new();
@@ -242,6 +390,11 @@ do_block_validation(char *pgdata, uint32 checksum_version)
 		arg->files_list = files_list;
 		arg->checksum_version = checksum_version;
 		arg->from_root = pgdata;
+		arg->ledger = ledger;
+		arg->new_ledger = new_ledger;
+		arg->run = run;
+		arg->check_time = check_time;
+		arg->n_skipped = 0;
 
 		arg->conn_arg.conn = NULL;
 		arg->conn_arg.cancel_conn = NULL;
@@ -269,6 +422,31 @@ do_block_validation(char *pgdata, uint32 checksum_version)
 		pthread_join(threads[i], NULL);
 		if (threads_args[i].ret > 0)
 			check_isok = false;
+		if (threads_args[i].ret == 1)
+			check_finished = false;
+		n_skipped += threads_args[i].n_skipped;
+	}
+
+	/*
+	 * Corrupted files are not recorded in the ledger, so it is stored
+	 * even if corruption is found. Next run will check them again.
+	 */
+	if (new_ledger)
+	{
+		if (check_finished)
+		{
+			elog(INFO, "%d unchanged data files are skipped", n_skipped);
+			write_checkdb_ledger(ledger_path, new_ledger, run + 1);
+		}
+
+		parray_walk(new_ledger, ledger_entry_free);
+		parray_free(new_ledger);
+	}
+
+	if (ledger)
+	{
+		parray_walk(ledger, ledger_entry_free);
+		parray_free(ledger);
 	}
 
 	/* cleanup */
@@ -309,28 +487,22 @@ check_indexes(void *arg)
 				arguments->thread_num);
 
 		if (progress)
-			elog(INFO, "Thread [%d]. Progress: (%d/%d). Amchecking index '%s.%s'",
-				 arguments->thread_num, i + 1, n_indexes,
-				 ind->namespace, ind->name);
+			elog(INFO, "Thread [%d]. Progress: (%d/%d). Amchecking index '%s.%s' "
+				 "in database '%s'", arguments->thread_num, i + 1, n_indexes,
+				 ind->namespace, ind->name, ind->dbname);
 
-		if (arguments->conn_arg.conn == NULL)
-		{
-
-			arguments->conn_arg.conn = pgut_connect(arguments->conn_opt.pghost,
-												arguments->conn_opt.pgport,
-												arguments->conn_opt.pgdatabase,
-												arguments->conn_opt.pguser);
-			arguments->conn_arg.cancel_conn = PQgetCancel(arguments->conn_arg.conn);
-		}
+		amcheck_conn_acquire(arguments, ind->dbname);
 
 		/* remember that we have a failed check */
 		if (!amcheck_one_index(arguments, ind))
+		{
+			ind->failed = true;
 			arguments->ret = 2; /* corruption found */
-	}
+		}
+		ind->processed = true;
 
-	/* Close connection. */
-	if (arguments->conn_arg.conn)
-		pgut_disconnect(arguments->conn_arg.conn);
+		amcheck_conn_release(arguments);
+	}
 
 	/* Ret values:
 	 * 0 everything is ok
@@ -343,10 +515,102 @@ check_indexes(void *arg)
 	return NULL;
 }
 
+/*
+ * Take a connection to the database from the pool of amcheck connections.
+ * If there is no idle connection to this database, open a new one,
+ * closing the oldest idle connection to another database if there are
+ * num_threads connections open already.
+ */
+static void
+amcheck_conn_acquire(check_indexes_arg *arguments, const char *dbname)
+{
+	amcheck_conn *conn = NULL;
+	amcheck_conn *victim = NULL;
+	int			i;
+
+	pthread_lock(&amcheck_conn_mutex);
+
+	for (i = parray_num(amcheck_idle_conns) - 1; i >= 0; i--)
+	{
+		amcheck_conn *idle = (amcheck_conn *) parray_get(amcheck_idle_conns, i);
+
+		if (strcmp(idle->dbname, dbname) == 0)
+		{
+			conn = (amcheck_conn *) parray_remove(amcheck_idle_conns, i);
+			break;
+		}
+	}
+
+	if (conn == NULL)
+	{
+		if (amcheck_n_conns >= num_threads &&
+			parray_num(amcheck_idle_conns) > 0)
+			victim = (amcheck_conn *) parray_remove(amcheck_idle_conns, 0);
+		else
+			amcheck_n_conns++;
+	}
+
+	pthread_mutex_unlock(&amcheck_conn_mutex);
+
+	arguments->conn_opt.pgdatabase = dbname;
+
+	if (conn)
+	{
+		arguments->conn_arg = conn->conn_arg;
+		pfree(conn);
+		return;
+	}
+
+	if (victim)
+	{
+		pgut_disconnect(victim->conn_arg.conn);
+		pfree(victim);
+	}
+
+	arguments->conn_arg.conn = pgut_connect(arguments->conn_opt.pghost,
+											arguments->conn_opt.pgport,
+											dbname,
+											arguments->conn_opt.pguser);
+	arguments->conn_arg.cancel_conn = PQgetCancel(arguments->conn_arg.conn);
+}
+
+/* Return the connection of the thread to the pool of amcheck connections */
+static void
+amcheck_conn_release(check_indexes_arg *arguments)
+{
+	amcheck_conn *conn = pgut_new(amcheck_conn);
+
+	conn->dbname = arguments->conn_opt.pgdatabase;
+	conn->conn_arg = arguments->conn_arg;
+
+	arguments->conn_arg.conn = NULL;
+	arguments->conn_arg.cancel_conn = NULL;
+
+	pthread_lock(&amcheck_conn_mutex);
+	parray_append(amcheck_idle_conns, conn);
+	pthread_mutex_unlock(&amcheck_conn_mutex);
+}
+
+/* Compare two indexes by size descending, then by database and oid */
+static int
+pg_indexEntry_compare_size_desc(const void *i1, const void *i2)
+{
+	pg_indexEntry *ind1 = *(pg_indexEntry **) i1;
+	pg_indexEntry *ind2 = *(pg_indexEntry **) i2;
+
+	if (ind1->size != ind2->size)
+		return ind1->size > ind2->size ? -1 : 1;
+	if (ind1->db_num != ind2->db_num)
+		return ind1->db_num < ind2->db_num ? -1 : 1;
+	if (ind1->indexrelid != ind2->indexrelid)
+		return ind1->indexrelid < ind2->indexrelid ? -1 : 1;
+	return 0;
+}
+
 /* Get index list for given database */
 static parray*
-get_index_list(const char *dbname, bool first_db_with_amcheck,
-			   PGconn *db_conn)
+get_index_list(const char *dbname, int db_num,
+			   bool first_db_with_amcheck, PGconn *db_conn)
 {
 	PGresult   *res;
 	char *amcheck_nspname = NULL;
@@ -406,7 +670,8 @@ get_index_list(const char *dbname, bool first_db_with_amcheck,
 	if (first_db_with_amcheck)
 	{
 
-		res = pgut_execute(db_conn, "SELECT cls.oid, cls.relname, nmspc.nspname "
+		res = pgut_execute(db_conn, "SELECT cls.oid, cls.relname, nmspc.nspname, "
+									"pg_catalog.pg_relation_size(cls.oid) "
 									"FROM pg_catalog.pg_index idx "
 									"LEFT JOIN pg_catalog.pg_class cls ON idx.indexrelid=cls.oid "
 									"LEFT JOIN pg_catalog.pg_namespace nmspc ON cls.relnamespace=nmspc.oid "
@@ -418,7 +683,8 @@ get_index_list(const char *dbname, bool first_db_with_amcheck,
 	else
 	{
 
-		res = pgut_execute(db_conn, "SELECT cls.oid, cls.relname, nmspc.nspname "
+		res = pgut_execute(db_conn, "SELECT cls.oid, cls.relname, nmspc.nspname, "
+									"pg_catalog.pg_relation_size(cls.oid) "
 									"FROM pg_catalog.pg_index idx "
 									"LEFT JOIN pg_catalog.pg_class cls ON idx.indexrelid=cls.oid "
 									"LEFT JOIN pg_catalog.pg_namespace nmspc ON cls.relnamespace=nmspc.oid "
@@ -451,9 +717,16 @@ get_index_list(const char *dbname, bool first_db_with_amcheck,
 		ind->namespace = pgut_malloc(strlen(namespace) + 1);
 		strcpy(ind->namespace, namespace);	/* enough buffer size guaranteed */
 
+		/* index size */
+		ind->size = atoll(PQgetvalue(res, i, 3));
+
 		ind->heapallindexed_is_supported = heapallindexed_is_supported;
 		ind->amcheck_nspname = pgut_malloc(strlen(amcheck_nspname) + 1);
 		strcpy(ind->amcheck_nspname, amcheck_nspname);
+		ind->dbname = dbname;
+		ind->db_num = db_num;
+		ind->processed = false;
+		ind->failed = false;
 		pg_atomic_clear_flag(&ind->lock);
 
 		if (index_list == NULL)
@@ -508,7 +781,7 @@ amcheck_one_index(check_indexes_arg *arguments,
 	if (PQresultStatus(res) != PGRES_TUPLES_OK)
 	{
 		elog(WARNING, "Thread [%d]. Amcheck failed in database '%s' for index: '%s.%s': %s",
-					   arguments->thread_num, arguments->conn_opt.pgdatabase,
+					   arguments->thread_num, ind->dbname,
 					   ind->namespace, ind->name, PQresultErrorMessage(res));
 
 		pfree(params[0]);
@@ -519,7 +792,7 @@ amcheck_one_index(check_indexes_arg *arguments,
 	else
 		elog(LOG, "Thread [%d]. Amcheck succeeded in database '%s' for index: '%s.%s'",
 				arguments->thread_num,
-				arguments->conn_opt.pgdatabase, ind->namespace, ind->name);
+				ind->dbname, ind->namespace, ind->name);
 
 	pfree(params[0]);
 	pfree(query);
@@ -533,7 +806,8 @@ amcheck_one_index(check_indexes_arg *arguments,
  * Connect to all databases in the cluster
  * and get list of persistent indexes,
  * then run parallel threads to perform bt_index_check()
- * for all indexes from the list.
+ * for all indexes of all databases, the largest indexes first.
+ * Threads share a pool of connections to the databases.
  *
  * If amcheck extension is not installed in the database,
  * skip this database and report it via warning message.
@@ -550,6 +824,10 @@ do_amcheck(ConnectionOptions conn_opt, PGconn *conn)
 	int n_databases = 0;
 	bool first_db_with_amcheck = true;
 	bool db_skipped = false;
+	parray *index_list = parray_new();
+	/* databases whose indexes are amchecked, and which of them failed */
+	bool *db_amchecked;
+	bool *db_failed;
 
 	elog(INFO, "Start amchecking PostgreSQL instance");
 
@@ -565,84 +843,133 @@ do_amcheck(ConnectionOptions conn_opt, PGconn *conn)
 
 	n_databases =  PQntuples(res_db);
 
-	/* For each database check indexes. In parallel. */
+	db_amchecked = pgut_newarray(bool, n_databases);
+	db_failed = pgut_newarray(bool, n_databases);
+
+	/* Collect indexes of all databases into one list */
 	for(i = 0; i < n_databases; i++)
 	{
-		int j;
 		const char 	*dbname;
 		PGconn 		*db_conn = NULL;
-		parray 		*index_list = NULL;
+		parray 		*db_index_list = NULL;
+
+		db_amchecked[i] = false;
+		db_failed[i] = false;
 
 		dbname = PQgetvalue(res_db, i, 0);
 		db_conn = pgut_connect(conn_opt.pghost, conn_opt.pgport,
 								dbname, conn_opt.pguser);
 
-		index_list = get_index_list(dbname, first_db_with_amcheck,
-									db_conn);
+		db_index_list = get_index_list(dbname, i, first_db_with_amcheck,
+									   db_conn);
 
 		/* we don't need this connection anymore */
 		if (db_conn)
 			pgut_disconnect(db_conn);
 
-		if (index_list == NULL)
+		if (db_index_list == NULL)
 		{
 			db_skipped = true;
 			continue;
 		}
 
 		first_db_with_amcheck = false;
+		db_amchecked[i] = true;
 
-		/* init thread args with own index lists */
-		threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
-		threads_args = (check_indexes_arg *) palloc(sizeof(check_indexes_arg)*num_threads);
+		parray_concat(index_list, db_index_list);
+		parray_free(db_index_list);
 
-		for (j = 0; j < num_threads; j++)
-		{
-			check_indexes_arg *arg = &(threads_args[j]);
+		if (interrupted)
+			elog(ERROR, "checkdb --amcheck is interrupted.");
+	}
 
-			arg->index_list = index_list;
-			arg->conn_arg.conn = NULL;
-			arg->conn_arg.cancel_conn = NULL;
+	/* One huge index taken last would leave other threads idle */
+	parray_qsort(index_list, pg_indexEntry_compare_size_desc);
 
-			arg->conn_opt.pghost = conn_opt.pghost;
-			arg->conn_opt.pgport = conn_opt.pgport;
-			arg->conn_opt.pgdatabase = dbname;
-			arg->conn_opt.pguser = conn_opt.pguser;
+	amcheck_idle_conns = parray_new();
+	amcheck_n_conns = 0;
 
-			arg->thread_num = j + 1;
-			/* By default there are some error */
-			arg->ret = 1;
-		}
+	/* init thread args with the common index list */
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+	threads_args = (check_indexes_arg *) palloc(sizeof(check_indexes_arg)*num_threads);
 
-		/* Run threads */
-		for (j = 0; j < num_threads; j++)
-		{
-			check_indexes_arg *arg = &(threads_args[j]);
-			elog(VERBOSE, "Start thread num: %i", j);
-			pthread_create(&threads[j], NULL, check_indexes, arg);
-		}
+	for (i = 0; i < num_threads; i++)
+	{
+		check_indexes_arg *arg = &(threads_args[i]);
 
-		/* Wait threads */
-		for (j = 0; j < num_threads; j++)
-		{
-			pthread_join(threads[j], NULL);
-			if (threads_args[j].ret > 0)
-				check_isok = false;
-		}
+		arg->index_list = index_list;
+		arg->conn_arg.conn = NULL;
+		arg->conn_arg.cancel_conn = NULL;
 
-		if (check_isok)
-			elog(INFO, "Amcheck succeeded for database '%s'", dbname);
-		else
-			elog(WARNING, "Amcheck failed for database '%s'", dbname);
+		arg->conn_opt.pghost = conn_opt.pghost;
+		arg->conn_opt.pgport = conn_opt.pgport;
+		arg->conn_opt.pgdatabase = NULL;
+		arg->conn_opt.pguser = conn_opt.pguser;
+
+		arg->thread_num = i + 1;
+		/* By default there are some error */
+		arg->ret = 1;
+	}
 
-		parray_walk(index_list, pg_indexEntry_free);
-		parray_free(index_list);
+	/* Run threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		check_indexes_arg *arg = &(threads_args[i]);
+		elog(VERBOSE, "Start thread num: %i", i);
+		pthread_create(&threads[i], NULL, check_indexes, arg);
+	}
 
-		if (interrupted)
-			break;
+	/* Wait threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret > 0)
+			check_isok = false;
+	}
+
+	/* Close pooled connections */
+	for (i = 0; i < parray_num(amcheck_idle_conns); i++)
+	{
+		amcheck_conn *idle = (amcheck_conn *) parray_get(amcheck_idle_conns, i);
+
+		pgut_disconnect(idle->conn_arg.conn);
+	}
+	parray_walk(amcheck_idle_conns, pfree);
+	parray_free(amcheck_idle_conns);
+	amcheck_idle_conns = NULL;
+
+	for (i = 0; i < parray_num(index_list); i++)
+	{
+		pg_indexEntry *ind = (pg_indexEntry *) parray_get(index_list, i);
+
+		/* index left unchecked by errored thread is not a success */
+		if (!ind->processed || ind->failed)
+			db_failed[ind->db_num] = true;
+	}
+
+	if (!interrupted)
+	{
+		for (i = 0; i < n_databases; i++)
+		{
+			if (!db_amchecked[i])
+				continue;
+
+			if (db_failed[i])
+				elog(WARNING, "Amcheck failed for database '%s'",
+					 PQgetvalue(res_db, i, 0));
+			else
+				elog(INFO, "Amcheck succeeded for database '%s'",
+					 PQgetvalue(res_db, i, 0));
+		}
 	}
 
 	/* cleanup */
+	parray_walk(index_list, pg_indexEntry_free);
+	parray_free(index_list);
+	pfree(db_amchecked);
+	pfree(db_failed);
+	pfree(threads);
+	pfree(threads_args);
 	PQclear(res_db);
 
 	/* Inform user about amcheck results */
@@ -241,6 +241,11 @@ ConfigOption instance_options[] =
 		&instance_config.remote.ssh_config, SOURCE_CMD, 0,
 		OPTION_REMOTE_GROUP, 0, option_get_value
 	},
+	{
+		'u', 231, "remote-window",
+		&instance_config.remote.window, SOURCE_CMD, 0,
+		OPTION_REMOTE_GROUP, 0, option_get_value
+	},
 	{ 0 }
 };
 
@@ -287,10 +292,10 @@ do_set_config(bool missing_ok)
 	join_path_components(path, backup_instance_path, BACKUP_CATALOG_CONF_FILE);
 	snprintf(path_temp, sizeof(path_temp), "%s.tmp", path);
 
-	if (!missing_ok && !fileExists(path, FIO_LOCAL_HOST))
+	if (!missing_ok && !fileExists(path, FIO_BACKUP_HOST))
 		elog(ERROR, "Configuration file \"%s\" doesn't exist", path);
 
-	fp = fopen(path_temp, "wt");
+	fp = fio_fopen(path_temp, "wt", FIO_BACKUP_HOST);
 	if (fp == NULL)
 		elog(ERROR, "Cannot create configuration file \"%s\": %s",
 			 BACKUP_CATALOG_CONF_FILE, strerror(errno));
@@ -325,12 +330,14 @@ do_set_config(bool missing_ok)
 		pfree(value);
 	}
 
-	fclose(fp);
+	if (fclose(fp) != 0)
+		elog(ERROR, "Cannot write configuration file \"%s\": %s",
+			 path_temp, strerror(errno));
 
-	if (rename(path_temp, path) < 0)
+	if (fio_rename(path_temp, path, FIO_BACKUP_HOST) < 0)
 	{
 		int			errno_temp = errno;
-		unlink(path_temp);
+		fio_unlink(path_temp, FIO_BACKUP_HOST);
 		elog(ERROR, "Cannot rename configuration file \"%s\" to \"%s\": %s",
 			 path_temp, path, strerror(errno_temp));
 	}
@@ -368,6 +375,7 @@ init_config(InstanceConfig *config, const char *instance_name)
 	config->compress_level = COMPRESS_LEVEL_DEFAULT;
 
 	config->remote.proto = (char*)"ssh";
+	config->remote.window = REMOTE_WINDOW_DEFAULT;
 }
 
 /*
@@ -588,6 +596,11 @@ readInstanceConfigFile(const char *instance_name)
 			&instance->remote.ssh_config, SOURCE_CMD, 0,
 			OPTION_REMOTE_GROUP, 0, option_get_value
 		},
+		{
+			'u', 231, "remote-window",
+			&instance->remote.window, SOURCE_CMD, 0,
+			OPTION_REMOTE_GROUP, 0, option_get_value
+		},
 		{ 0 }
 	};
 
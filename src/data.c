@@ -31,9 +31,42 @@ typedef struct DataPage
 	char		data[BLCKSZ];
 } DataPage;
 
+/*
+ * Backups to look up the previous version of a page of delta encoded file in.
+ * Members are ordered from newest to oldest, with FULL backup being the last.
+ * Page headers and descriptors of the file in every backup are obtained lazily.
+ */
+struct PageDeltaChain
+{
+	parray	   *chain;
+	int			start;		/* chain member holding the previous version of pages */
+	pgFile	   *key;		/* file to look up in chain members */
+	bool	   *loaded;
+	pgFile	  **files;
+	BackupPageHeader2 **headers;
+	FILE	  **in;
+};
+
 static bool get_page_header(FILE *in, const char *fullpath, BackupPageHeader* bph,
 							pg_crc32 *crc, bool use_crc32c);
 
+static PageDeltaChain *page_delta_chain_init(parray *chain, pgFile *file);
+static void page_delta_chain_free(PageDeltaChain *delta);
+static void get_base_page(PageDeltaChain *delta, int n, BlockNumber blknum, char *page);
+static void xor_page(char *page, const char *base);
+static void send_non_data_file(const char *from_fullpath, const char *to_fullpath,
+							   FILE *out, pgFile *file, bool missing_ok);
+static void backup_packed_file(const char *from_fullpath, pgFile *file,
+							   PackFile *pack, bool missing_ok);
+static bool validate_restored_page(pgFile *file, char *data, int32 compressed_size,
+								   BlockNumber blknum, XLogRecPtr stop_lsn,
+								   uint32 backup_version, uint32 checksum_version,
+								   const char *fullpath, char *page, bool *decompressed);
+static void set_backup_corrupted(pgBackup *backup, const char *fullpath);
+
+/* serializes status updates of backups found corrupted by restore threads */
+static pthread_mutex_t inline_validation_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 #ifdef HAVE_LIBZ
 /* Implementation of zlib compression method */
 static int32
@@ -522,6 +555,31 @@ compress_and_backup_page(pgFile *file, BlockNumber blknum,
 	return compressed_size;
 }
 
+/*
+ * Check if data file has no changed blocks since previous backup,
+ * according to its pagemap.
+ */
+static bool
+data_file_is_unchanged(pgFile *file, BackupMode backup_mode)
+{
+	return (backup_mode == BACKUP_MODE_DIFF_PAGE ||
+			backup_mode == BACKUP_MODE_DIFF_PTRACK) &&
+		file->pagemap.bitmapsize == PageBitmapIsEmpty &&
+		file->exists_in_prev && !file->pagemap_isabsent;
+}
+
+/*
+ * Check if only blocks of data file marked in its pagemap are to be read.
+ * Otherwise all blocks are read.
+ */
+static bool
+data_file_uses_pagemap(pgFile *file)
+{
+	return !(file->pagemap.bitmapsize == PageBitmapIsEmpty ||
+			 file->pagemap_isabsent || !file->exists_in_prev ||
+			 !file->pagemap.bitmap);
+}
+
 /*
  * Backup data file in the from_root directory to the to_root directory with
  * same relative path. If prev_backup_start_lsn is not NULL, only pages with
@@ -536,7 +594,7 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 				 XLogRecPtr prev_backup_start_lsn, BackupMode backup_mode,
 				 CompressAlg calg, int clevel, uint32 checksum_version,
 				 int ptrack_version_num, const char *ptrack_schema,
-				 HeaderMap *hdr_map, bool is_merge)
+				 parray *delta_chain, HeaderMap *hdr_map, bool is_merge)
 {
 	int         rc;
 	bool        use_pagemap;
@@ -544,6 +602,7 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 	BlockNumber	err_blknum = 0;
 	/* page headers */
 	BackupPageHeader2 *headers = NULL;
+	PageDeltaChain *delta = NULL;
 
 	/* sanity */
 	if (file->size % BLCKSZ != 0)
@@ -561,10 +620,7 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 	 * This way we can correctly handle null-sized files which are
 	 * not tracked by pagemap and thus always marked as unchanged.
 	 */
-	if ((backup_mode == BACKUP_MODE_DIFF_PAGE ||
-		backup_mode == BACKUP_MODE_DIFF_PTRACK) &&
-		file->pagemap.bitmapsize == PageBitmapIsEmpty &&
-		file->exists_in_prev && !file->pagemap_isabsent)
+	if (data_file_is_unchanged(file, backup_mode))
 	{
 		/*
 		 * There are no changed blocks since last backup. We want to make
@@ -589,13 +645,7 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 	 * of data files with missing _ptrack map.
 	 * Such files should be fully copied.
 	 */
-
-	if 	(file->pagemap.bitmapsize == PageBitmapIsEmpty ||
-		 file->pagemap_isabsent || !file->exists_in_prev ||
-		 !file->pagemap.bitmap)
-		use_pagemap = false;
-	else
-		use_pagemap = true;
+	use_pagemap = data_file_uses_pagemap(file);
 
 	/* Remote mode */
 	if (fio_is_remote(FIO_DB_HOST))
@@ -613,13 +663,24 @@ backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 	}
 	else
 	{
+		/*
+		 * Store pages as difference with their previous version,
+		 * which is kept somewhere in parent backup chain.
+		 */
+		if (delta_chain && file->exists_in_prev)
+		{
+			delta = page_delta_chain_init(delta_chain, file);
+			file->delta_encoded = true;
+		}
+
 		/* TODO: stop handling errors internally */
 		rc = send_pages(conn_arg, to_fullpath, from_fullpath, file,
 						/* send prev backup START_LSN */
 						backup_mode == BACKUP_MODE_DIFF_DELTA &&
 						file->exists_in_prev ? prev_backup_start_lsn : InvalidXLogRecPtr,
 						calg, clevel, checksum_version, use_pagemap,
-						&headers, backup_mode, ptrack_version_num, ptrack_schema);
+						&headers, backup_mode, ptrack_version_num, ptrack_schema,
+						delta);
 	}
 
 	/* check for errors */
@@ -683,6 +744,7 @@ cleanup:
 	/* dump page headers */
 	write_page_headers(headers, file, hdr_map, is_merge);
 
+	page_delta_chain_free(delta);
 	pg_free(errmsg);
 	pg_free(file->pagemap.bitmap);
 	pg_free(headers);
@@ -693,12 +755,13 @@ cleanup:
  * We do not apply compression to this file.
  * If file exists in previous backup, then compare checksums
  * and make a decision about copying or skiping the file.
+ * If pack is provided, small files are appended to it.
  */
 void
 backup_non_data_file(pgFile *file, pgFile *prev_file,
 				 const char *from_fullpath, const char *to_fullpath,
 				 BackupMode backup_mode, time_t parent_backup_time,
-				 bool missing_ok)
+				 bool missing_ok, PackFile *pack)
 {
 	/* special treatment for global/pg_control */
 	if (file->external_dir_num == 0 && strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
@@ -725,8 +788,49 @@ backup_non_data_file(pgFile *file, pgFile *prev_file,
 		}
 	}
 
-	backup_non_data_file_internal(from_fullpath, FIO_DB_HOST,
-								  to_fullpath, file, missing_ok);
+	if (pack && file->size < PACK_MAX_FILE_SIZE)
+		backup_packed_file(from_fullpath, file, pack, missing_ok);
+	else
+		backup_non_data_file_internal(from_fullpath, FIO_DB_HOST,
+									  to_fullpath, file, missing_ok);
+}
+
+/*
+ * Ask remote agent to start sending the file, which is going to be copied
+ * next by backup_data_file() or backup_non_data_file() with the same
+ * arguments. Files, which are not going to be sent, are skipped.
+ */
+void
+prefetch_backup_file(pgFile *file, pgFile *prev_file,
+					 const char *from_fullpath,
+					 XLogRecPtr prev_backup_start_lsn, BackupMode backup_mode,
+					 time_t parent_backup_time, CompressAlg calg, int clevel,
+					 uint32 checksum_version)
+{
+	if (file->is_datafile && !file->is_cfs)
+	{
+		if (data_file_is_unchanged(file, backup_mode))
+			return;
+
+		fio_prefetch_pages(from_fullpath, file,
+						   backup_mode == BACKUP_MODE_DIFF_DELTA &&
+						   file->exists_in_prev ? prev_backup_start_lsn : InvalidXLogRecPtr,
+						   calg, clevel, checksum_version,
+						   data_file_uses_pagemap(file));
+	}
+	else
+	{
+		/* pg_control is read by copy_pgcontrol_file() */
+		if (file->external_dir_num == 0 && strcmp(file->rel_path, XLOG_CONTROL_FILE) == 0)
+			return;
+
+		/* file may be skipped after comparing checksums */
+		if (prev_file && file->exists_in_prev &&
+			file->mtime <= parent_backup_time)
+			return;
+
+		fio_prefetch_file(from_fullpath);
+	}
 }
 
 /*
@@ -737,11 +841,13 @@ backup_non_data_file(pgFile *file, pgFile *prev_file,
 size_t
 restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 				  const char *to_fullpath, bool use_bitmap, PageState *checksum_map,
-				  XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers)
+				  XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers,
+				  bool validate)
 {
 	size_t total_write_len = 0;
 	char  *in_buf = pgut_malloc(STDIO_BUFSIZE);
 	int    backup_seq = 0;
+	PageDeltaChain *delta = NULL;
 
 	/*
 	 * FULL -> INCR -> DEST
@@ -766,11 +872,13 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 
 		pgFile **res_file = NULL;
 		pgFile  *tmp_file = NULL;
+		bool     corrupted = false;
 
 		/* page headers */
 		BackupPageHeader2 *headers = NULL;
 
 		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, backup_seq);
+		int         backup_idx = backup_seq;
 
 		if (use_bitmap)
 			backup_seq++;
@@ -778,7 +886,7 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 			backup_seq--;
 
 		/* lookup file in intermediate backup */
-		res_file =  parray_bsearch(backup->files, dest_file, pgFileCompareRelPathWithExternal);
+		res_file =  pgBackupSearchFile(backup, dest_file);
 		tmp_file = (res_file) ? *res_file : NULL;
 
 		/* Destination file is not exists yet at this moment */
@@ -806,7 +914,7 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 		join_path_components(from_root, backup->root_dir, DATABASE_DIR);
 		join_path_components(from_fullpath, from_root, tmp_file->rel_path);
 
-		in = fopen(from_fullpath, PG_BINARY_R);
+		in = fio_fopen(from_fullpath, PG_BINARY_R, FIO_BACKUP_HOST);
 		if (in == NULL)
 			elog(ERROR, "Cannot open backup file \"%s\": %s", from_fullpath,
 				 strerror(errno));
@@ -818,10 +926,38 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 		if (use_headers && tmp_file->n_headers > 0)
 			headers = get_data_file_headers(&(backup->hdr_map), tmp_file,
 											parse_program_version(backup->program_version),
-											true);
+											!validate);
 
 		if (use_headers && !headers && tmp_file->n_headers > 0)
+		{
+			if (validate)
+				set_backup_corrupted(backup, from_fullpath);
 			elog(ERROR, "Failed to get page headers for file \"%s\"", from_fullpath);
+		}
+
+		/*
+		 * Records of files without page headers and of patched files are
+		 * not read in the order they are stored, so such files are
+		 * validated by a separate read before they are restored.
+		 */
+		if (validate && (!headers || tmp_file->patched) &&
+			!validate_file_pages(tmp_file, from_fullpath, backup->stop_lsn,
+								 backup->checksum_version,
+								 parse_program_version(backup->program_version),
+								 &(backup->hdr_map)))
+			set_backup_corrupted(backup, from_fullpath);
+
+		/* previous versions of delta encoded pages are kept in older backups */
+		if (tmp_file->delta_encoded)
+		{
+			if (!headers)
+				elog(ERROR, "Cannot restore delta encoded file \"%s\" without page headers",
+					 from_fullpath);
+
+			if (!delta)
+				delta = page_delta_chain_init(parent_chain, dest_file);
+			delta->start = backup_idx + 1;
+		}
 
 		/*
 		 * Restore the file.
@@ -833,19 +969,24 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 					  parse_program_version(backup->program_version),
 					  from_fullpath, to_fullpath, dest_file->n_blocks,
 					  use_bitmap ? &(dest_file)->pagemap : NULL,
-					  checksum_map, backup->checksum_version,
+					  checksum_map, backup->checksum_version, backup->stop_lsn,
 					  /* shiftmap can be used only if backup state precedes the shift */
 					  backup->stop_lsn <= shift_lsn ? lsn_map : NULL,
-					  headers);
+					  headers, tmp_file->delta_encoded ? delta : NULL,
+					  (validate && headers && !tmp_file->patched) ? &corrupted : NULL);
 
 		if (fclose(in) != 0)
 			elog(ERROR, "Cannot close file \"%s\": %s", from_fullpath,
 				strerror(errno));
 
+		if (corrupted)
+			set_backup_corrupted(backup, from_fullpath);
+
 		pg_free(headers);
 
 //		datapagemap_print_debug(&(dest_file)->pagemap);
 	}
+	page_delta_chain_free(delta);
 	pg_free(in_buf);
 
 	return total_write_len;
@@ -859,18 +1000,33 @@ restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
  * backup. We restoring from newest to oldest and page, once restored, marked in map.
  * When the same page, but in older backup, encountered, we check the map, if it is
  * marked as already restored, then page is skipped.
+ *
+ * If "corrupted" is not NULL, the file is validated inline: every page record
+ * is read, even if it is not written, its page is checked and CRC of the
+ * whole backup file is compared with the file list. If any check fails,
+ * "corrupted" is set. Inline validation requires page headers and records
+ * stored in block order.
  */
 size_t
 restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_version,
 					  const char *from_fullpath, const char *to_fullpath, int nblocks,
 					  datapagemap_t *map, PageState *checksum_map, int checksum_version,
-					  datapagemap_t *lsn_map, BackupPageHeader2 *headers)
+					  XLogRecPtr stop_lsn, datapagemap_t *lsn_map, BackupPageHeader2 *headers,
+					  PageDeltaChain *delta, bool *corrupted)
 {
 	BlockNumber	blknum = 0;
 	int  	n_hdr = -1;
 	size_t	write_len = 0;
 	off_t   cur_pos_out = 0;
 	off_t   cur_pos_in = 0;
+	bool	use_crc32c = backup_version <= 20021 || backup_version >= 20025;
+	pg_crc32 crc = 0;
+	char	validated_page[BLCKSZ];
+
+	Assert(!corrupted || (headers && !file->patched));
+
+	if (corrupted)
+		INIT_FILE_CRC32(use_crc32c, crc);
 
 	/* should not be possible */
 	Assert(!(backup_version >= 20400 && file->n_headers <= 0));
@@ -902,6 +1058,10 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 		uint16     page_crc = 0;
 		XLogRecPtr page_lsn = InvalidXLogRecPtr;
 
+		/* inline validation vars */
+		bool       page_is_read = false;
+		bool       page_is_decompressed = false;
+
 		/* check for interrupt */
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during data file restore");
@@ -916,14 +1076,44 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			blknum = headers[n_hdr].block;
 			page_lsn = headers[n_hdr].lsn;
 			page_crc = headers[n_hdr].checksum;
-			/* calculate payload size by comparing current and next page positions,
-			 * page header is not included */
-			compressed_size = headers[n_hdr+1].pos - headers[n_hdr].pos - sizeof(BackupPageHeader);
+			/* calculate payload size, page header is not included */
+			compressed_size = get_page_record_size(in, file, headers, n_hdr, from_fullpath);
 
 			Assert(compressed_size > 0);
 			Assert(compressed_size <= BLCKSZ);
 
 			read_len = compressed_size + sizeof(BackupPageHeader);
+
+			/*
+			 * Inline validation reads every record, including records
+			 * of pages, which are not going to be written.
+			 */
+			if (corrupted)
+			{
+				if (cur_pos_in != headers[n_hdr].pos)
+				{
+					if (fseek(in, headers[n_hdr].pos, SEEK_SET) != 0)
+						elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+							headers[n_hdr].pos, from_fullpath, strerror(errno));
+
+					cur_pos_in = headers[n_hdr].pos;
+				}
+
+				if (fread(&page, 1, read_len, in) != read_len)
+					elog(ERROR, "Cannot read block %u file \"%s\": %s",
+								blknum, from_fullpath, strerror(errno));
+
+				cur_pos_in += read_len;
+				page_is_read = true;
+
+				COMP_FILE_CRC32(use_crc32c, crc, &page, read_len);
+
+				if (!validate_restored_page(file, page.data, compressed_size, blknum,
+											stop_lsn, backup_version, checksum_version,
+											from_fullpath, validated_page,
+											&page_is_decompressed))
+					*corrupted = true;
+			}
 		}
 		else
 		{
@@ -997,7 +1187,25 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 
 		/* no point in writing redundant data */
 		if (nblocks > 0 && blknum >= nblocks)
+		{
+			/* the rest of records is still read by inline validation */
+			if (page_is_read)
+				continue;
+
+			/*
+			 * Records of patched file are not ordered by block,
+			 * when reading them without page headers, skip the page.
+			 */
+			if (file->patched && !headers)
+			{
+				if (fseek(in, read_len, SEEK_CUR) != 0)
+					elog(ERROR, "Cannot seek block %u of \"%s\": %s",
+						blknum, from_fullpath, strerror(errno));
+				cur_pos_in += read_len;
+				continue;
+			}
 			break;
+		}
 
 		if (compressed_size > BLCKSZ)
 			elog(ERROR, "Size of a blknum %i exceed BLCKSZ: %i", blknum, compressed_size);
@@ -1033,27 +1241,30 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			continue;
 		}
 
-		if (headers &&
-			cur_pos_in != headers[n_hdr].pos)
+		if (!page_is_read)
 		{
-			if (fseek(in, headers[n_hdr].pos, SEEK_SET) != 0)
-				elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
-					headers[n_hdr].pos, from_fullpath, strerror(errno));
+			if (headers &&
+				cur_pos_in != headers[n_hdr].pos)
+			{
+				if (fseek(in, headers[n_hdr].pos, SEEK_SET) != 0)
+					elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+						headers[n_hdr].pos, from_fullpath, strerror(errno));
 
-			cur_pos_in = headers[n_hdr].pos;
-		}
+				cur_pos_in = headers[n_hdr].pos;
+			}
 
-		/* read a page from file */
-		if (headers)
-			len = fread(&page, 1, read_len, in);
-		else
-			len = fread(page.data, 1, read_len, in);
+			/* read a page from file */
+			if (headers)
+				len = fread(&page, 1, read_len, in);
+			else
+				len = fread(page.data, 1, read_len, in);
 
-		if (len != read_len)
-			elog(ERROR, "Cannot read block %u file \"%s\": %s",
-						blknum, from_fullpath, strerror(errno));
+			if (len != read_len)
+				elog(ERROR, "Cannot read block %u file \"%s\": %s",
+							blknum, from_fullpath, strerror(errno));
 
-		cur_pos_in += read_len;
+			cur_pos_in += read_len;
+		}
 
 		/*
 		 * if page size is smaller than BLCKSZ, decompress the page.
@@ -1068,6 +1279,17 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			is_compressed = true;
 		}
 
+		/*
+		 * Page is already decompressed by inline validation. Remote side
+		 * still gets the compressed page, unless it has to be decoded here.
+		 */
+		if (is_compressed && page_is_decompressed &&
+			(delta || !fio_is_remote_file(out)))
+		{
+			memcpy(page.data, validated_page, BLCKSZ);
+			is_compressed = false;
+		}
+
 		/*
 		 * Seek and write the restored page.
 		 * When restoring file from FULL backup, pages are written sequentially,
@@ -1084,6 +1306,35 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			cur_pos_out = write_pos;
 		}
 
+		/*
+		 * Page is stored as XOR with its previous version,
+		 * decode it before writing.
+		 */
+		if (delta)
+		{
+			char		base[BLCKSZ];
+
+			if (is_compressed)
+			{
+				char		decompressed[BLCKSZ];
+				const char *errormsg = NULL;
+				int32		uncompressed_size;
+
+				uncompressed_size = do_decompress(decompressed, BLCKSZ,
+												  page.data, compressed_size,
+												  file->compress_alg, &errormsg);
+				if (uncompressed_size != BLCKSZ)
+					elog(ERROR, "An error occured during decompressing block %u of file \"%s\": %s",
+						 blknum, from_fullpath, errormsg ? errormsg : "invalid page size");
+
+				memcpy(page.data, decompressed, BLCKSZ);
+				is_compressed = false;
+			}
+
+			get_base_page(delta, delta->start, blknum, base);
+			xor_page(page.data, base);
+		}
+
 		/* If page is compressed and restore is in remote mode, send compressed
 		 * page to the remote side.
 		 */
@@ -1111,24 +1362,129 @@ restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_vers
 			datapagemap_add(map, blknum);
 	}
 
+	if (corrupted)
+	{
+		FIN_FILE_CRC32(use_crc32c, crc);
+
+		if (crc != file->crc)
+		{
+			elog(WARNING, "Invalid CRC of backup file \"%s\": %X. Expected %X",
+					from_fullpath, crc, file->crc);
+			*corrupted = true;
+		}
+	}
+
 	elog(VERBOSE, "Copied file \"%s\": %lu bytes", from_fullpath, write_len);
 	return write_len;
 }
 
+/*
+ * Check page record, read by restore with inline validation or by sampled
+ * validation, the same way validate_file_pages() does. Compressed page is
+ * decompressed into "page", in that case "decompressed" is set, so that
+ * restore can write it as is.
+ */
+static bool
+validate_restored_page(pgFile *file, char *data, int32 compressed_size,
+					   BlockNumber blknum, XLogRecPtr stop_lsn,
+					   uint32 backup_version, uint32 checksum_version,
+					   const char *fullpath, char *page, bool *decompressed)
+{
+	char	   *checked_page = data;
+	PageState	page_st;
+	int			rc;
+
+	*decompressed = false;
+
+	if (compressed_size != BLCKSZ
+		|| page_may_be_compressed(data, file->compress_alg, backup_version))
+	{
+		int32		uncompressed_size = 0;
+		const char *errormsg = NULL;
+
+		uncompressed_size = do_decompress(page, BLCKSZ, data, compressed_size,
+										  file->compress_alg, &errormsg);
+		if (uncompressed_size != BLCKSZ)
+		{
+			elog(WARNING, "An error occured during decompressing block %u of file \"%s\": %s",
+				 blknum, fullpath, errormsg ? errormsg : "invalid page size");
+			return false;
+		}
+
+		checked_page = page;
+		*decompressed = true;
+	}
+
+	/*
+	 * Delta encoded page cannot be checked without its previous
+	 * version, only the integrity of stored payload is verified.
+	 */
+	if (file->delta_encoded || skip_block_validation)
+		return true;
+
+	rc = validate_one_page(checked_page, file->segno * RELSEG_SIZE + blknum,
+						   stop_lsn, &page_st, checksum_version);
+
+	switch (rc)
+	{
+		case PAGE_HEADER_IS_INVALID:
+			elog(WARNING, "Page header is looking insane: %s, block %i", file->rel_path, blknum);
+			return false;
+		case PAGE_CHECKSUM_MISMATCH:
+			elog(WARNING, "File: %s blknum %u have wrong checksum: %u", file->rel_path, blknum, page_st.checksum);
+			return false;
+		case PAGE_LSN_FROM_FUTURE:
+			elog(WARNING, "File: %s, block %u, checksum is %s. "
+							"Page is from future: pageLSN %X/%X stopLSN %X/%X",
+						file->rel_path, blknum,
+						checksum_version ? "correct" : "not enabled",
+						(uint32) (page_st.lsn >> 32), (uint32) page_st.lsn,
+						(uint32) (stop_lsn >> 32), (uint32) stop_lsn);
+			break;
+		default:
+			break;
+	}
+
+	return true;
+}
+
+/*
+ * Backup file turned out to be corrupted during restore with inline
+ * validation. Mark the backup as CORRUPT, as validate does, and stop.
+ */
+static void
+set_backup_corrupted(pgBackup *backup, const char *fullpath)
+{
+	pthread_lock(&inline_validation_mutex);
+	if (backup->status != BACKUP_STATUS_CORRUPT)
+		write_backup_status(backup, BACKUP_STATUS_CORRUPT, instance_name, true);
+	pthread_mutex_unlock(&inline_validation_mutex);
+
+	elog(ERROR, "Backup %s is corrupt, validation of file \"%s\" failed",
+		 base36enc(backup->start_time), fullpath);
+}
+
 /*
  * Copy file to backup.
  * We do not apply compression to these files, because
  * it is either small control file or already compressed cfs file.
+ * If "crc" is not NULL, CRC of copied content is calculated into it.
  */
 void
 restore_non_data_file_internal(FILE *in, FILE *out, pgFile *file,
-					  const char *from_fullpath, const char *to_fullpath)
+					  const char *from_fullpath, const char *to_fullpath,
+					  bool use_crc32c, pg_crc32 *crc)
 {
 	size_t     read_len = 0;
 	char      *buf = pgut_malloc(STDIO_BUFSIZE); /* 64kB buffer */
+	/* packed file is followed by other files in the pack */
+	int64      left = file->pack_num > 0 ? file->write_size : -1;
+
+	if (crc)
+		INIT_FILE_CRC32(use_crc32c, *crc);
 
 	/* copy content */
-	for (;;)
+	while (left != 0)
 	{
 		read_len = 0;
 
@@ -1136,7 +1492,7 @@ restore_non_data_file_internal(FILE *in, FILE *out, pgFile *file,
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during nonedata file restore");
 
-		read_len = fread(buf, 1, STDIO_BUFSIZE, in);
+		read_len = fread(buf, 1, left > 0 ? Min(left, STDIO_BUFSIZE) : STDIO_BUFSIZE, in);
 
 		if (ferror(in))
 			elog(ERROR, "Cannot read backup file \"%s\": %s",
@@ -1147,25 +1503,46 @@ restore_non_data_file_internal(FILE *in, FILE *out, pgFile *file,
 			if (fio_fwrite(out, buf, read_len) != read_len)
 				elog(ERROR, "Cannot write to \"%s\": %s", to_fullpath,
 					 strerror(errno));
+
+			if (crc)
+				COMP_FILE_CRC32(use_crc32c, *crc, buf, read_len);
+
+			if (left > 0)
+				left -= read_len;
 		}
 
-		if (feof(in))
+		if (left != 0 && feof(in))
+		{
+			if (left > 0)
+				elog(ERROR, "Unexpected end of pack file \"%s\"", from_fullpath);
 			break;
+		}
 	}
 
 	pg_free(buf);
 
+	if (crc)
+		FIN_FILE_CRC32(use_crc32c, *crc);
+
 	elog(VERBOSE, "Copied file \"%s\": %lu bytes", from_fullpath, file->write_size);
 }
 
+/*
+ * Restore nonedata file from the backup containing its full copy.
+ * Packed files are read via pack, which is kept open between calls.
+ * If "validate" is true, CRC of the backup file is checked while it is copied.
+ */
 size_t
 restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 					  pgFile *dest_file, FILE *out, const char *to_fullpath,
-					  bool already_exists)
+					  bool already_exists, PackFile *pack, bool validate)
 {
 	char		from_root[MAXPGPATH];
 	char		from_fullpath[MAXPGPATH];
 	FILE		*in = NULL;
+	pg_crc32	crc = 0;
+	uint32		backup_version;
+	bool		use_crc32c;
 
 	pgFile		*tmp_file = NULL;
 	pgBackup	*tmp_backup = NULL;
@@ -1191,7 +1568,7 @@ restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 			pgFile	   **res_file = NULL;
 
 			/* lookup file in intermediate backup */
-			res_file =  parray_bsearch(tmp_backup->files, dest_file, pgFileCompareRelPathWithExternal);
+			res_file =  pgBackupSearchFile(tmp_backup, dest_file);
 			tmp_file = (res_file) ? *res_file : NULL;
 
 			/*
@@ -1256,6 +1633,28 @@ restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 					to_fullpath, strerror(errno));
 	}
 
+	/* packed file is read from the pack file of the backup */
+	if (tmp_file->pack_num > 0)
+	{
+		in = open_packed_file(pack, tmp_backup->root_dir, tmp_file);
+		if (in == NULL)
+			elog(ERROR, "Cannot read pack file \"%s\": %s", pack->path,
+				 strerror(errno));
+
+		/* packed files are always checksummed with CRC-32C */
+		restore_non_data_file_internal(in, out, tmp_file, pack->path, to_fullpath,
+									   true, validate ? &crc : NULL);
+
+		if (validate && crc != tmp_file->crc)
+		{
+			elog(WARNING, "Invalid CRC of packed backup file \"%s\" : %X. Expected %X",
+					tmp_file->rel_path, crc, tmp_file->crc);
+			set_backup_corrupted(tmp_backup, pack->path);
+		}
+
+		return tmp_file->write_size;
+	}
+
 	if (tmp_file->external_dir_num == 0)
 		join_path_components(from_root, tmp_backup->root_dir, DATABASE_DIR);
 	else
@@ -1268,7 +1667,7 @@ restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 
 	join_path_components(from_fullpath, from_root, dest_file->rel_path);
 
-	in = fopen(from_fullpath, PG_BINARY_R);
+	in = fio_fopen(from_fullpath, PG_BINARY_R, FIO_BACKUP_HOST);
 	if (in == NULL)
 		elog(ERROR, "Cannot open backup file \"%s\": %s", from_fullpath,
 			 strerror(errno));
@@ -1276,13 +1675,33 @@ restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 	/* disable stdio buffering for nonedata files */
 	setvbuf(in, NULL, _IONBF, BUFSIZ);
 
+	backup_version = parse_program_version(tmp_backup->program_version);
+	use_crc32c = backup_version <= 20021 || backup_version >= 20025;
+
 	/* do actual work */
-	restore_non_data_file_internal(in, out, tmp_file, from_fullpath, to_fullpath);
+	restore_non_data_file_internal(in, out, tmp_file, from_fullpath, to_fullpath,
+								   use_crc32c, validate ? &crc : NULL);
 
 	if (fclose(in) != 0)
 		elog(ERROR, "Cannot close file \"%s\": %s", from_fullpath,
 			strerror(errno));
 
+	if (validate)
+	{
+		/* CRC of pg_control is calculated over its content, see validate.c */
+		if (backup_version >= 20025 &&
+			strcmp(tmp_file->name, "pg_control") == 0 &&
+			!tmp_file->external_dir_num)
+			crc = get_pgcontrol_checksum(from_root);
+
+		if (crc != tmp_file->crc)
+		{
+			elog(WARNING, "Invalid CRC of backup file \"%s\" : %X. Expected %X",
+					from_fullpath, crc, tmp_file->crc);
+			set_backup_corrupted(tmp_backup, from_fullpath);
+		}
+	}
+
 	return tmp_file->write_size;
 }
 
@@ -1298,29 +1717,92 @@ backup_non_data_file_internal(const char *from_fullpath,
 							const char *to_fullpath, pgFile *file,
 							bool missing_ok)
 {
-	FILE       *in = NULL;
 	FILE       *out = NULL;
-	ssize_t     read_len = 0;
-	char	   *buf = NULL;
-
-	INIT_FILE_CRC32(true, file->crc);
-
-	/* reset size summary */
-	file->read_size = 0;
-	file->write_size = 0;
-	file->uncompressed_size = 0;
 
 	/* open backup file for write  */
-	out = fopen(to_fullpath, PG_BINARY_W);
+	out = fio_fopen(to_fullpath, PG_BINARY_W, FIO_BACKUP_HOST);
 	if (out == NULL)
 		elog(ERROR, "Cannot open destination file \"%s\": %s",
 			 to_fullpath, strerror(errno));
 
 	/* update file permission */
-	if (chmod(to_fullpath, file->mode) == -1)
+	if (fio_chmod(to_fullpath, file->mode, FIO_BACKUP_HOST) == -1)
 		elog(ERROR, "Cannot change mode of \"%s\": %s", to_fullpath,
 			 strerror(errno));
 
+	/* disable stdio buffering for local output file to avoid triple buffering */
+	if (!fio_is_remote(FIO_DB_HOST))
+		setvbuf(out, NULL, _IONBF, BUFSIZ);
+
+	send_non_data_file(from_fullpath, to_fullpath, out, file, missing_ok);
+
+	if (fclose(out))
+		elog(ERROR, "Cannot close the file \"%s\": %s", to_fullpath, strerror(errno));
+}
+
+/*
+ * Append small nonedata file to the pack file owned by backup thread.
+ * Compared to backup_non_data_file_internal() there is no need to
+ * create, chmod and sync every file, pack file is synced once.
+ */
+static void
+backup_packed_file(const char *from_fullpath, pgFile *file,
+				   PackFile *pack, bool missing_ok)
+{
+	/* create pack file on first use */
+	if (!pack->fp)
+	{
+		elog(LOG, "Creating pack file \"%s\"", pack->path);
+
+		pack->fp = fio_fopen(pack->path, PG_BINARY_W, FIO_BACKUP_HOST);
+		if (pack->fp == NULL)
+			elog(ERROR, "Cannot open pack file \"%s\": %s",
+				 pack->path, strerror(errno));
+
+		/* enable buffering for pack file */
+		pack->buf = pgut_malloc(LARGE_CHUNK_SIZE);
+		setvbuf(pack->fp, pack->buf, _IOFBF, LARGE_CHUNK_SIZE);
+
+		/* update file permission */
+		if (fio_chmod(pack->path, FILE_PERMISSION, FIO_BACKUP_HOST) == -1)
+			elog(ERROR, "Cannot change mode of \"%s\": %s", pack->path,
+				 strerror(errno));
+
+		pack->offset = 0;
+	}
+
+	send_non_data_file(from_fullpath, pack->path, pack->fp, file, missing_ok);
+
+	if (file->write_size <= 0)
+		return;
+
+	file->pack_num = pack->num;
+	file->pack_off = pack->offset;
+	pack->offset += file->write_size;
+
+	elog(VERBOSE, "Packed file \"%s\" into \"%s\" offset: %li, len: " INT64_FORMAT,
+		 from_fullpath, pack->path, file->pack_off, file->write_size);
+}
+
+/*
+ * Send content of nonedata file into already opened output stream,
+ * computing its CRC and size.
+ */
+static void
+send_non_data_file(const char *from_fullpath, const char *to_fullpath,
+				   FILE *out, pgFile *file, bool missing_ok)
+{
+	FILE       *in = NULL;
+	ssize_t     read_len = 0;
+	char	   *buf = NULL;
+
+	INIT_FILE_CRC32(true, file->crc);
+
+	/* reset size summary */
+	file->read_size = 0;
+	file->write_size = 0;
+	file->uncompressed_size = 0;
+
 	/* backup remote file  */
 	if (fio_is_remote(FIO_DB_HOST))
 	{
@@ -1376,9 +1858,8 @@ backup_non_data_file_internal(const char *from_fullpath,
 				 strerror(errno));
 		}
 
-		/* disable stdio buffering for local input/output files to avoid triple buffering */
+		/* disable stdio buffering for local input file */
 		setvbuf(in, NULL, _IONBF, BUFSIZ);
-		setvbuf(out, NULL, _IONBF, BUFSIZ);
 
 		/* allocate 64kB buffer */
 		buf = pgut_malloc(CHUNK_SIZE);
@@ -1420,9 +1901,6 @@ cleanup:
 	if (in && fclose(in))
 		elog(ERROR, "Cannot close the file \"%s\": %s", from_fullpath, strerror(errno));
 
-	if (out && fclose(out))
-		elog(ERROR, "Cannot close the file \"%s\": %s", to_fullpath, strerror(errno));
-
 	pg_free(buf);
 }
 
@@ -1602,7 +2080,7 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	/* should not be possible */
 	Assert(!(backup_version >= 20400 && file->n_headers <= 0));
 
-	in = fopen(fullpath, PG_BINARY_R);
+	in = fio_fopen(fullpath, PG_BINARY_R, FIO_BACKUP_HOST);
 	if (in == NULL)
 		elog(ERROR, "Cannot open file \"%s\": %s",
 			 fullpath, strerror(errno));
@@ -1640,10 +2118,12 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 				break;
 
 			blknum = headers[n_hdr].block;
-			/* calculate payload size by comparing current and next page positions,
-			 * page header is not included.
-			 */
-			compressed_size = headers[n_hdr+1].pos - headers[n_hdr].pos - sizeof(BackupPageHeader);
+			/* calculate payload size, page header is not included */
+			compressed_size = get_page_record_size(in, file, headers, n_hdr, fullpath);
+
+			/* file is already positioned at the record */
+			if (file->patched)
+				cur_pos_in = headers[n_hdr].pos;
 
 			Assert(compressed_size > 0);
 			Assert(compressed_size <= BLCKSZ);
@@ -1739,10 +2219,19 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 				return false;
 			}
 
+			/*
+			 * Delta encoded page cannot be checked without its previous
+			 * version, only the integrity of stored payload is verified.
+			 */
+			if (file->delta_encoded)
+				continue;
+
 			rc = validate_one_page(page.data,
 				                       file->segno * RELSEG_SIZE + blknum,
 									   stop_lsn, &page_st, checksum_version);
 		}
+		else if (file->delta_encoded)
+			continue;
 		else
 			rc = validate_one_page(compressed_page.data,
 									   file->segno * RELSEG_SIZE + blknum,
@@ -1778,6 +2267,13 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	FIN_FILE_CRC32(use_crc32c, crc);
 	fclose(in);
 
+	/*
+	 * Page records of patched file are read in block order, but its
+	 * CRC is calculated in physical order, including superseded records.
+	 */
+	if (file->patched)
+		crc = pgFileGetCRC(fullpath, use_crc32c, false);
+
 	if (crc != file->crc)
 	{
 		elog(WARNING, "Invalid CRC of backup file \"%s\": %X. Expected %X",
@@ -1790,21 +2286,267 @@ validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 	return is_valid;
 }
 
-/* read local data file and construct map with block checksums */
-PageState*
-get_checksum_map(const char *fullpath, uint32 checksum_version,
-							int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno)
+/*
+ * Validate structure of datafile in backup without decompressing its pages.
+ * Page header map of the file is checked against its CRC, every page record
+ * is checked to be located and sized as the map says, and CRC of the whole
+ * file is calculated in a single sequential pass.
+ * Files without page header map and patched files get file-level CRC check only.
+ */
+bool
+validate_file_structure(pgFile *file, const char *fullpath,
+						uint32 backup_version, HeaderMap *hdr_map)
 {
-	PageState  *checksum_map = NULL;
-	FILE       *in = NULL;
-	BlockNumber blknum = 0;
-	char        read_buffer[BLCKSZ];
-	char        in_buf[STDIO_BUFSIZE];
+	FILE	   *in;
+	char	   *in_buf;
+	pg_crc32	crc;
+	bool		use_crc32c = backup_version <= 20021 || backup_version >= 20025;
+	bool		is_valid = true;
+	BackupPageHeader2 *headers = NULL;
+	int			n_hdr;
 
-	/* open file */
-	in = fopen(fullpath, "r+b");
-	if (!in)
-		elog(ERROR, "Cannot open source file \"%s\": %s", fullpath, strerror(errno));
+	elog(VERBOSE, "Validate structure of file \"%s\"", fullpath);
+
+	if (backup_version >= 20400 && file->n_headers > 0)
+	{
+		headers = get_data_file_headers(hdr_map, file, backup_version, false);
+
+		if (!headers)
+		{
+			elog(WARNING, "Cannot get page headers for file \"%s\"", fullpath);
+			return false;
+		}
+	}
+
+	if (!headers || file->patched)
+	{
+		pg_free(headers);
+		crc = pgFileGetCRC(fullpath, use_crc32c, false);
+
+		if (crc != file->crc)
+		{
+			elog(WARNING, "Invalid CRC of backup file \"%s\": %X. Expected %X",
+					fullpath, crc, file->crc);
+			return false;
+		}
+		return true;
+	}
+
+	/* records of the file are contiguous and follow in block order */
+	if (headers[0].pos != 0 || headers[file->n_headers].pos != file->write_size)
+	{
+		elog(WARNING, "Page header map of file \"%s\" does not match its size "
+			 INT64_FORMAT, fullpath, file->write_size);
+		pg_free(headers);
+		return false;
+	}
+
+	in = fio_fopen(fullpath, PG_BINARY_R, FIO_BACKUP_HOST);
+	if (in == NULL)
+		elog(ERROR, "Cannot open file \"%s\": %s",
+			 fullpath, strerror(errno));
+
+	in_buf = pgut_malloc(STDIO_BUFSIZE);
+	setvbuf(in, in_buf, _IOFBF, STDIO_BUFSIZE);
+
+	INIT_FILE_CRC32(use_crc32c, crc);
+
+	for (n_hdr = 0; n_hdr < file->n_headers; n_hdr++)
+	{
+		DataPage	page;
+		int32		compressed_size;
+		size_t		read_len;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during data file validation");
+
+		compressed_size = headers[n_hdr+1].pos - headers[n_hdr].pos - sizeof(BackupPageHeader);
+
+		if (compressed_size <= 0 || compressed_size > BLCKSZ ||
+			(n_hdr > 0 && headers[n_hdr].block <= headers[n_hdr-1].block))
+		{
+			elog(WARNING, "Page header map of file \"%s\" has invalid record "
+				 "of block %u at offset %u", fullpath, headers[n_hdr].block,
+				 headers[n_hdr].pos);
+			is_valid = false;
+			break;
+		}
+
+		read_len = sizeof(BackupPageHeader) + compressed_size;
+
+		if (fread(&page, 1, read_len, in) != read_len)
+		{
+			elog(WARNING, "Cannot read block %u file \"%s\": %s",
+				 headers[n_hdr].block, fullpath, strerror(errno));
+			is_valid = false;
+			break;
+		}
+
+		COMP_FILE_CRC32(use_crc32c, crc, &page, read_len);
+
+		/* page header, stored in the file, must agree with the map */
+		if (page.bph.block != (BlockNumber) headers[n_hdr].block ||
+			page.bph.compressed_size != compressed_size)
+		{
+			elog(WARNING, "Page record of block %u of file \"%s\" does not match "
+				 "its header: block %u, size %i",
+				 headers[n_hdr].block, fullpath, page.bph.block,
+				 page.bph.compressed_size);
+			is_valid = false;
+		}
+	}
+
+	FIN_FILE_CRC32(use_crc32c, crc);
+	fclose(in);
+	pg_free(in_buf);
+	pg_free(headers);
+
+	if (is_valid && crc != file->crc)
+	{
+		elog(WARNING, "Invalid CRC of backup file \"%s\": %X. Expected %X",
+				fullpath, crc, file->crc);
+		is_valid = false;
+	}
+
+	return is_valid;
+}
+
+/*
+ * Assign page to one of "parts" sampling partitions. Assignment looks random,
+ * but depends only on the seed and the block number, so it is reproducible.
+ */
+static int
+sample_page_partition(uint32 seed, BlockNumber blknum, int parts)
+{
+	uint32		h = seed ^ (blknum * 0x9E3779B1);
+
+	/* murmur3 finalizer */
+	h ^= h >> 16;
+	h *= 0x85EBCA6B;
+	h ^= h >> 13;
+	h *= 0xC2B2AE35;
+	h ^= h >> 16;
+
+	return h % parts;
+}
+
+/*
+ * Validate a sample of pages of datafile in backup.
+ * Pages of the file are split into "parts" partitions, only pages of
+ * partition "part" are read and checked, so that "parts" runs with
+ * subsequent "part" values check every page of the file.
+ * Number of checked pages is returned via "n_checked".
+ */
+bool
+validate_file_pages_sample(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
+						   uint32 checksum_version, uint32 backup_version,
+						   HeaderMap *hdr_map, uint32 seed, int parts, int part,
+						   int *n_checked)
+{
+	FILE	   *in;
+	bool		is_valid = true;
+	BackupPageHeader2 *headers = NULL;
+	int			n_hdr;
+
+	*n_checked = 0;
+
+	elog(VERBOSE, "Validate sample of relation blocks for file \"%s\"", fullpath);
+
+	headers = get_data_file_headers(hdr_map, file, backup_version, false);
+	if (!headers)
+	{
+		elog(WARNING, "Cannot get page headers for file \"%s\"", fullpath);
+		return false;
+	}
+
+	in = fio_fopen(fullpath, PG_BINARY_R, FIO_BACKUP_HOST);
+	if (in == NULL)
+		elog(ERROR, "Cannot open file \"%s\": %s",
+			 fullpath, strerror(errno));
+
+	/* pages are read at random positions */
+	setvbuf(in, NULL, _IONBF, BUFSIZ);
+
+	/* different files get different samples */
+	seed ^= file->path_hash;
+
+	for (n_hdr = 0; n_hdr < file->n_headers; n_hdr++)
+	{
+		DataPage	page;
+		char		decompressed_page[BLCKSZ];
+		bool		is_decompressed;
+		int32		compressed_size;
+		size_t		read_len;
+		BlockNumber	blknum = headers[n_hdr].block;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during data file validation");
+
+		if (sample_page_partition(seed, blknum, parts) != part)
+			continue;
+
+		compressed_size = get_page_record_size(in, file, headers, n_hdr, fullpath);
+
+		if (compressed_size <= 0 || compressed_size > BLCKSZ)
+		{
+			elog(WARNING, "Block %u of file \"%s\" has invalid size: %i",
+				 blknum, fullpath, compressed_size);
+			is_valid = false;
+			break;
+		}
+
+		read_len = sizeof(BackupPageHeader) + compressed_size;
+
+		if (fio_fseek(in, headers[n_hdr].pos) < 0)
+			elog(ERROR, "Cannot seek block %u of \"%s\": %s",
+				 blknum, fullpath, strerror(errno));
+
+		if (fread(&page, 1, read_len, in) != read_len)
+		{
+			elog(WARNING, "Cannot read block %u file \"%s\": %s",
+				 blknum, fullpath, strerror(errno));
+			is_valid = false;
+			break;
+		}
+
+		(*n_checked)++;
+
+		if (page.bph.block != blknum || page.bph.compressed_size != compressed_size)
+		{
+			elog(WARNING, "Page record of block %u of file \"%s\" does not match "
+				 "its header: block %u, size %i",
+				 blknum, fullpath, page.bph.block, page.bph.compressed_size);
+			is_valid = false;
+			continue;
+		}
+
+		if (!validate_restored_page(file, page.data, compressed_size, blknum,
+									stop_lsn, backup_version, checksum_version,
+									fullpath, decompressed_page, &is_decompressed))
+			is_valid = false;
+	}
+
+	fclose(in);
+	pg_free(headers);
+
+	return is_valid;
+}
+
+/* read local data file and construct map with block checksums */
+PageState*
+get_checksum_map(const char *fullpath, uint32 checksum_version,
+							int n_blocks, XLogRecPtr dest_stop_lsn, BlockNumber segmentno)
+{
+	PageState  *checksum_map = NULL;
+	FILE       *in = NULL;
+	BlockNumber blknum = 0;
+	char        read_buffer[BLCKSZ];
+	char        in_buf[STDIO_BUFSIZE];
+
+	/* open file */
+	in = fopen(fullpath, "r+b");
+	if (!in)
+		elog(ERROR, "Cannot open source file \"%s\": %s", fullpath, strerror(errno));
 
 	/* truncate up to blocks */
 	if (ftruncate(fileno(in), n_blocks * BLCKSZ) != 0)
@@ -1973,13 +2715,13 @@ open_local_file_rw(const char *to_fullpath, char **out_buf, uint32 buf_size)
 {
 	FILE *out = NULL;
 	/* open backup file for write  */
-	out = fopen(to_fullpath, PG_BINARY_W);
+	out = fio_fopen(to_fullpath, PG_BINARY_W, FIO_BACKUP_HOST);
 	if (out == NULL)
 		elog(ERROR, "Cannot open backup file \"%s\": %s",
 			 to_fullpath, strerror(errno));
 
 	/* update file permission */
-	if (chmod(to_fullpath, FILE_PERMISSION) == -1)
+	if (fio_chmod(to_fullpath, FILE_PERMISSION, FIO_BACKUP_HOST) == -1)
 		elog(ERROR, "Cannot change mode of \"%s\": %s", to_fullpath,
 			 strerror(errno));
 
@@ -1995,7 +2737,8 @@ int
 send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_fullpath,
 		   pgFile *file, XLogRecPtr prev_backup_start_lsn, CompressAlg calg, int clevel,
 		   uint32 checksum_version, bool use_pagemap, BackupPageHeader2 **headers,
-		   BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema)
+		   BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema,
+		   PageDeltaChain *delta)
 {
 	FILE *in = NULL;
 	FILE *out = NULL;
@@ -2073,6 +2816,15 @@ send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_f
 			(*headers)[hdr_num].lsn = page_st.lsn;
 			(*headers)[hdr_num].checksum = page_st.checksum;
 
+			/* store the page as XOR with its previous version */
+			if (delta)
+			{
+				char	base[BLCKSZ];
+
+				get_base_page(delta, delta->start, blknum, base);
+				xor_page(curr_page, base);
+			}
+
 			compressed_size = compress_and_backup_page(file, blknum, in, out, &(file->crc),
 														rc, curr_page, calg, clevel,
 														from_fullpath, to_fullpath);
@@ -2120,6 +2872,42 @@ send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_f
 	return n_blocks_read;
 }
 
+/*
+ * Get payload size of the page record, described by n-th page header.
+ * Page records are written in block order, so the size is the difference
+ * between positions of the next and current records. Patched file has
+ * records appended by in-place merge, so the size is taken from
+ * BackupPageHeader of the record itself and the file is left positioned
+ * at the start of the record.
+ */
+int32
+get_page_record_size(FILE *in, pgFile *file, BackupPageHeader2 *headers,
+					 int n, const char *fullpath)
+{
+	BackupPageHeader bph;
+
+	if (!file->patched)
+		return headers[n+1].pos - headers[n].pos - sizeof(BackupPageHeader);
+
+	if (fseek(in, headers[n].pos, SEEK_SET) != 0)
+		elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+			 headers[n].pos, fullpath, strerror(errno));
+
+	if (fread(&bph, 1, sizeof(BackupPageHeader), in) != sizeof(BackupPageHeader))
+		elog(ERROR, "Cannot read header of block %u of \"%s\": %s",
+			 headers[n].block, fullpath, strerror(errno));
+
+	if (bph.block != headers[n].block)
+		elog(ERROR, "Page header of block %u of \"%s\" contains invalid block number %u",
+			 headers[n].block, fullpath, bph.block);
+
+	if (fseek(in, headers[n].pos, SEEK_SET) != 0)
+		elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+			 headers[n].pos, fullpath, strerror(errno));
+
+	return bph.compressed_size;
+}
+
 /*
  * Attempt to open header file, read content and return as
  * array of headers.
@@ -2146,7 +2934,7 @@ get_data_file_headers(HeaderMap *hdr_map, pgFile *file, uint32 backup_version, b
 		return NULL;
 
 	/* TODO: consider to make this descriptor thread-specific */
-	in = fopen(hdr_map->path, PG_BINARY_R);
+	in = fio_fopen(hdr_map->path, PG_BINARY_R, FIO_BACKUP_HOST);
 
 	if (!in)
 	{
@@ -2266,7 +3054,7 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 	{
 		elog(LOG, "Creating page header map \"%s\"", map_path);
 
-		hdr_map->fp = fopen(map_path, PG_BINARY_W);
+		hdr_map->fp = fio_fopen(map_path, PG_BINARY_W, FIO_BACKUP_HOST);
 		if (hdr_map->fp == NULL)
 			elog(ERROR, "Cannot open header file \"%s\": %s",
 				 map_path, strerror(errno));
@@ -2276,7 +3064,7 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 		setvbuf(hdr_map->fp, hdr_map->buf, _IOFBF, LARGE_CHUNK_SIZE);
 
 		/* update file permission */
-		if (chmod(map_path, FILE_PERMISSION) == -1)
+		if (fio_chmod(map_path, FILE_PERMISSION, FIO_BACKUP_HOST) == -1)
 			elog(ERROR, "Cannot change mode of \"%s\": %s", map_path,
 				 strerror(errno));
 
@@ -2301,6 +3089,15 @@ write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map,
 	if (fwrite(zheaders, 1, z_len, hdr_map->fp) != z_len)
 		elog(ERROR, "Cannot write to file \"%s\": %s", map_path, strerror(errno));
 
+	/*
+	 * Flush headers of every backed up file, so the file journaled
+	 * as copied can be reused by resumed backup after interruption.
+	 * Without the journal headers are flushed when the map is closed.
+	 */
+	if (!is_merge && backup_filelist_journal_is_open() &&
+		fflush(hdr_map->fp) != 0)
+		elog(ERROR, "Cannot flush file \"%s\": %s", map_path, strerror(errno));
+
 	file->hdr_size = z_len;   /* save the length of compressed headers */
 	hdr_map->offset += z_len; /* update current offset in map */
 
@@ -2331,3 +3128,313 @@ cleanup_header_map(HeaderMap *hdr_map)
 	pg_free(hdr_map->buf);
 	hdr_map->buf = NULL;
 }
+
+/*
+ * Initialize pack file. Pack files are numbered starting with 1,
+ * num is used only for pack file to be written.
+ */
+void
+init_pack_file(PackFile *pack, const char *root, int num)
+{
+	char		name[MAXPGPATH];
+
+	memset(pack, 0, sizeof(PackFile));
+
+	if (num > 0)
+	{
+		snprintf(name, MAXPGPATH, "%s_%d", PACK_FILE, num);
+		join_path_components(pack->path, root, name);
+		pack->num = num;
+	}
+}
+
+void
+cleanup_pack_file(PackFile *pack)
+{
+	/* cleanup descriptor */
+	if (pack->fp && fclose(pack->fp))
+		elog(ERROR, "Cannot close file \"%s\"", pack->path);
+	pack->fp = NULL;
+	pg_free(pack->buf);
+	pack->buf = NULL;
+}
+
+/*
+ * Position pack file at the content of packed file.
+ * Pack file stays open, so consequent packed files of the same backup
+ * are read from the buffer without reopening the pack.
+ * Return NULL and set errno if pack file cannot be read.
+ */
+FILE *
+open_packed_file(PackFile *pack, const char *root, pgFile *file)
+{
+	char		name[MAXPGPATH];
+	char		path[MAXPGPATH];
+
+	snprintf(name, MAXPGPATH, "%s_%d", PACK_FILE, file->pack_num);
+	join_path_components(path, root, name);
+
+	/* switch to another pack */
+	if (pack->fp && strcmp(pack->path, path) != 0)
+		cleanup_pack_file(pack);
+
+	if (!pack->fp)
+	{
+		strncpy(pack->path, path, MAXPGPATH);
+
+		pack->fp = fio_fopen(pack->path, PG_BINARY_R, FIO_BACKUP_HOST);
+		if (pack->fp == NULL)
+			return NULL;
+
+		pack->buf = pgut_malloc(OUT_BUF_SIZE);
+		setvbuf(pack->fp, pack->buf, _IOFBF, OUT_BUF_SIZE);
+	}
+
+	if (fseek(pack->fp, file->pack_off, SEEK_SET) != 0)
+		return NULL;
+
+	return pack->fp;
+}
+
+/*
+ * Compute CRC of packed file.
+ * Return false if pack file is missing or too short.
+ */
+bool
+get_packed_file_crc(PackFile *pack, const char *root, pgFile *file,
+					pg_crc32 *crc)
+{
+	FILE	   *in;
+	char		buf[STDIO_BUFSIZE];
+	int64		left = file->write_size;
+
+	in = open_packed_file(pack, root, file);
+	if (in == NULL)
+	{
+		elog(WARNING, "Cannot read pack file \"%s\": %s",
+			 pack->path, strerror(errno));
+		return false;
+	}
+
+	INIT_FILE_CRC32(true, *crc);
+
+	while (left > 0)
+	{
+		size_t		read_len = fread(buf, 1, Min(left, sizeof(buf)), in);
+
+		if (read_len == 0)
+		{
+			if (ferror(in))
+				elog(WARNING, "Cannot read pack file \"%s\": %s",
+					 pack->path, strerror(errno));
+			else
+				elog(WARNING, "Unexpected end of pack file \"%s\" reading \"%s\"",
+					 pack->path, file->rel_path);
+			return false;
+		}
+
+		COMP_FILE_CRC32(true, *crc, buf, read_len);
+		left -= read_len;
+	}
+
+	FIN_FILE_CRC32(true, *crc);
+
+	return true;
+}
+
+/*
+ * Initialize lookup of previous page versions of the file
+ * in the chain of backups ordered from newest to oldest.
+ */
+static PageDeltaChain *
+page_delta_chain_init(parray *chain, pgFile *file)
+{
+	PageDeltaChain *delta = pgut_new(PageDeltaChain);
+	int			n = parray_num(chain);
+
+	delta->chain = chain;
+	delta->start = 0;
+	delta->key = file;
+	delta->loaded = (bool *) palloc0(n * sizeof(bool));
+	delta->files = (pgFile **) palloc0(n * sizeof(pgFile *));
+	delta->headers = (BackupPageHeader2 **) palloc0(n * sizeof(BackupPageHeader2 *));
+	delta->in = (FILE **) palloc0(n * sizeof(FILE *));
+
+	return delta;
+}
+
+static void
+page_delta_chain_free(PageDeltaChain *delta)
+{
+	int			i;
+
+	if (!delta)
+		return;
+
+	for (i = 0; i < parray_num(delta->chain); i++)
+	{
+		if (delta->in[i] && fclose(delta->in[i]))
+			elog(ERROR, "Cannot close file \"%s\": %s",
+				 delta->files[i]->rel_path, strerror(errno));
+		pg_free(delta->headers[i]);
+	}
+
+	pg_free(delta->loaded);
+	pg_free(delta->files);
+	pg_free(delta->headers);
+	pg_free(delta->in);
+	pg_free(delta);
+}
+
+/* Lookup the file in n-th chain member, open it and get its page headers */
+static pgFile *
+page_delta_chain_get_file(PageDeltaChain *delta, int n)
+{
+	pgBackup   *backup;
+	pgFile	  **res_file;
+	char		from_root[MAXPGPATH];
+	char		fullpath[MAXPGPATH];
+
+	if (delta->loaded[n])
+		return delta->files[n];
+
+	delta->loaded[n] = true;
+	backup = (pgBackup *) parray_get(delta->chain, n);
+
+	res_file = pgBackupSearchFile(backup, delta->key);
+	if (!res_file)
+		return NULL;
+
+	delta->files[n] = *res_file;
+
+	if (delta->files[n]->write_size == BYTES_INVALID ||
+		delta->files[n]->n_headers <= 0)
+		return delta->files[n];
+
+	delta->headers[n] = get_data_file_headers(&(backup->hdr_map), delta->files[n],
+											  parse_program_version(backup->program_version),
+											  true);
+	if (!delta->headers[n])
+		elog(ERROR, "Failed to get page headers for file \"%s\" in backup %s",
+			 delta->files[n]->rel_path, base36enc(backup->start_time));
+
+	join_path_components(from_root, backup->root_dir, DATABASE_DIR);
+	join_path_components(fullpath, from_root, delta->files[n]->rel_path);
+
+	delta->in[n] = fio_fopen(fullpath, PG_BINARY_R, FIO_BACKUP_HOST);
+	if (delta->in[n] == NULL)
+		elog(ERROR, "Cannot open backup file \"%s\": %s", fullpath,
+			 strerror(errno));
+
+	return delta->files[n];
+}
+
+/* Compare block number with block number of page header, used by bsearch */
+static int
+page_header_compare_block(const void *key, const void *elem)
+{
+	BlockNumber blknum = *(const BlockNumber *) key;
+	BlockNumber hdr_blknum = ((const BackupPageHeader2 *) elem)->block;
+
+	if (blknum > hdr_blknum)
+		return 1;
+	else if (blknum < hdr_blknum)
+		return -1;
+	return 0;
+}
+
+/*
+ * Get the version of the block as of n-th member of backup chain.
+ * The block is looked up in n-th backup and, if it did not change there,
+ * in older ones. If the block didn`t exist yet, return zeroed page.
+ */
+static void
+get_base_page(PageDeltaChain *delta, int n, BlockNumber blknum, char *page)
+{
+	for (; n < parray_num(delta->chain); n++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(delta->chain, n);
+		pgFile	   *file = page_delta_chain_get_file(delta, n);
+		BackupPageHeader2 *hdr = NULL;
+		DataPage	buf;
+		size_t		read_len;
+		int32		compressed_size;
+
+		/* File did not exist at this point */
+		if (file == NULL)
+			break;
+
+		/* Block is past the end of the file */
+		if (file->n_blocks != BLOCKNUM_INVALID && blknum >= file->n_blocks)
+			break;
+
+		if (delta->headers[n])
+			hdr = (BackupPageHeader2 *) bsearch(&blknum, delta->headers[n],
+												file->n_headers,
+												sizeof(BackupPageHeader2),
+												page_header_compare_block);
+
+		/* Block was not changed in this backup, look into the older one */
+		if (!hdr)
+		{
+			if (backup->backup_mode == BACKUP_MODE_FULL)
+				break;
+			continue;
+		}
+
+		compressed_size = get_page_record_size(delta->in[n], file, delta->headers[n],
+											   hdr - delta->headers[n], file->rel_path);
+		read_len = compressed_size + sizeof(BackupPageHeader);
+
+		if (compressed_size <= 0 || compressed_size > BLCKSZ)
+			elog(ERROR, "Invalid size %i of block %u in file \"%s\" of backup %s",
+				 compressed_size, blknum, file->rel_path, base36enc(backup->start_time));
+
+		if (fseek(delta->in[n], hdr->pos, SEEK_SET) != 0)
+			elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+				 hdr->pos, file->rel_path, strerror(errno));
+
+		if (fread(&buf, 1, read_len, delta->in[n]) != read_len)
+			elog(ERROR, "Cannot read block %u of \"%s\" in backup %s: %s",
+				 blknum, file->rel_path, base36enc(backup->start_time),
+				 strerror(errno));
+
+		if (compressed_size != BLCKSZ)
+		{
+			const char *errormsg = NULL;
+			int32		uncompressed_size;
+
+			uncompressed_size = do_decompress(page, BLCKSZ, buf.data,
+											  compressed_size, file->compress_alg,
+											  &errormsg);
+			if (uncompressed_size != BLCKSZ)
+				elog(ERROR, "An error occured during decompressing block %u of file \"%s\" in backup %s: %s",
+					 blknum, file->rel_path, base36enc(backup->start_time),
+					 errormsg ? errormsg : "invalid page size");
+		}
+		else
+			memcpy(page, buf.data, BLCKSZ);
+
+		/* The version found is delta encoded itself */
+		if (file->delta_encoded)
+		{
+			char		base[BLCKSZ];
+
+			get_base_page(delta, n + 1, blknum, base);
+			xor_page(page, base);
+		}
+		return;
+	}
+
+	MemSet(page, 0, BLCKSZ);
+}
+
+/* XOR the page with the base page, applying or removing the difference */
+static void
+xor_page(char *page, const char *base)
+{
+	int			i;
+
+	for (i = 0; i < BLCKSZ; i++)
+		page[i] ^= base[i];
+}
@@ -11,23 +11,81 @@
 #include "pg_probackup.h"
 
 #include <dirent.h>
+#include <signal.h>
 #include <time.h>
 #include <unistd.h>
 
+#include "utils/thread.h"
+
 static void delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tli,
 						uint32 xlog_seg_size, bool dry_run);
 static void do_retention_internal(parray *backup_list, parray *to_keep_list,
 									parray *to_purge_list);
-static void do_retention_merge(parray *backup_list, parray *to_keep_list,
-									parray *to_purge_list);
-static void do_retention_purge(parray *to_keep_list, parray *to_purge_list);
+static void plan_retention_merge(parray *to_keep_list, parray *to_purge_list,
+									parray *merge_plan);
+static void plan_retention_purge(parray *to_keep_list, parray *to_purge_list,
+									parray *merge_plan, parray *purge_plan);
+static void print_retention_plan(parray *merge_plan, parray *purge_plan);
+static void do_retention_merge(parray *merge_plan);
+static void do_retention_purge(parray *purge_plan);
 static void do_retention_wal(bool dry_run);
+static void delete_directory_files(const char *root_dir);
+static void reap_backup_trash(const char *trash_dir);
+static void make_trash_path(char *trash_path, const char *trash_dir,
+							const char *backup_id);
+static bool trash_owner_is_alive(const char *host, pid_t pid);
+static void *purge_wal_worker(void *arg);
 
 // TODO: more useful messages for dry run.
 static bool backup_deleted = false;   /* At least one backup was deleted */
 static bool backup_merged = false;    /* At least one merge was enacted */
 static bool wal_deleted = false;      /* At least one WAL segments was deleted */
 
+typedef struct
+{
+	parray	   *files;
+	const char *root_dir;
+
+	/*
+	 * Return value from the thread.
+	 * 0 means there is no error, 1 - there is an error.
+	 */
+	int			ret;
+} delete_files_arg;
+
+/* Merge of incremental chain into its FULL backup, planned by retention */
+typedef struct
+{
+	pgBackup   *keep_backup;	/* final target of the merge */
+	pgBackup   *full_backup;	/* FULL backup of the chain */
+	parray	   *merge_list;		/* chain from keep_backup to full_backup */
+	int64		read_bytes;		/* estimated amount of data to read */
+	int64		write_bytes;	/* estimated amount of data to write */
+	int			order;			/* position of keep_backup in keep list */
+} RetentionMerge;
+
+/* Number of WAL files, removed by a purge thread at once */
+#define WAL_PURGE_BATCH_SIZE	256
+
+typedef struct
+{
+	parray	   *files;			/* WAL files of the timeline */
+	int			n_files;		/* files to purge from the head of the list */
+	TimeLineID	tli;
+	bool		wal_deleted;
+
+	/*
+	 * Return value from the thread.
+	 * 0 means there is no error, 1 - there is an error.
+	 */
+	int			ret;
+} purge_wal_arg;
+
+/* protects the purge position shared by WAL purge threads */
+static pthread_mutex_t purge_wal_mutex = PTHREAD_MUTEX_INITIALIZER;
+static int	purge_wal_next_file = 0;
+static int	purge_wal_n_done = 0;
+
 void
 do_delete(time_t backup_id)
 {
@@ -171,11 +229,38 @@ void do_retention(void)
 	if (retention_is_set && !backup_list_is_empty)
 		do_retention_internal(backup_list, to_keep_list, to_purge_list);
 
-	if (merge_expired && !dry_run && !backup_list_is_empty)
-		do_retention_merge(backup_list, to_keep_list, to_purge_list);
+	/* Plan merges and purges before any of them is done */
+	if ((merge_expired || delete_expired) && !backup_list_is_empty)
+	{
+		parray	   *merge_plan = parray_new();
+		parray	   *purge_plan = parray_new();
+		int			i;
+
+		if (merge_expired)
+			plan_retention_merge(to_keep_list, to_purge_list, merge_plan);
+
+		if (delete_expired)
+			plan_retention_purge(to_keep_list, to_purge_list,
+								 merge_plan, purge_plan);
 
-	if (delete_expired && !dry_run && !backup_list_is_empty)
-		do_retention_purge(to_keep_list, to_purge_list);
+		print_retention_plan(merge_plan, purge_plan);
+
+		if (merge_expired && !dry_run)
+			do_retention_merge(merge_plan);
+
+		if (delete_expired && !dry_run)
+			do_retention_purge(purge_plan);
+
+		for (i = 0; i < parray_num(merge_plan); i++)
+		{
+			RetentionMerge *merge = (RetentionMerge *) parray_get(merge_plan, i);
+
+			parray_free(merge->merge_list);
+		}
+		parray_walk(merge_plan, pfree);
+		parray_free(merge_plan);
+		parray_free(purge_plan);
+	}
 
 	/* TODO: some sort of dry run for delete_wal */
 	if (delete_wal)
@@ -418,12 +503,85 @@ do_retention_internal(parray *backup_list, parray *to_keep_list, parray *to_purg
 	}
 }
 
-/* Merge partially expired incremental chains */
+/* Amount of data kept by the backup */
+static int64
+backup_data_size(pgBackup *backup)
+{
+	return backup->data_bytes == BYTES_INVALID ? 0 : backup->data_bytes;
+}
+
+/* Check if the backup is merged by one of planned merges */
+static bool
+is_merged_by_plan(parray *merge_plan, pgBackup *backup)
+{
+	int			i;
+
+	for (i = 0; i < parray_num(merge_plan); i++)
+	{
+		RetentionMerge *merge = (RetentionMerge *) parray_get(merge_plan, i);
+
+		if (parray_contains(merge->merge_list, backup))
+			return true;
+	}
+
+	return false;
+}
+
+/*
+ * Estimate I/O cost of the merge. Pages of incremental backups are read
+ * and written into FULL backup. FULL backup is rewritten as well, unless
+ * its files can be merged in place.
+ */
 static void
-do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_list)
+estimate_merge_cost(RetentionMerge *merge)
 {
-	int i;
-	int j;
+	int			i;
+
+	merge->read_bytes = 0;
+	merge->write_bytes = 0;
+
+	for (i = 0; i < parray_num(merge->merge_list) - 1; i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(merge->merge_list, i);
+
+		merge->read_bytes += backup_data_size(backup);
+		merge->write_bytes += backup_data_size(backup);
+	}
+
+	if (merge->full_backup->compress_alg != merge->keep_backup->compress_alg ||
+		parse_program_version(merge->full_backup->program_version) !=
+		parse_program_version(merge->keep_backup->program_version))
+	{
+		merge->read_bytes += backup_data_size(merge->full_backup);
+		merge->write_bytes += backup_data_size(merge->full_backup);
+	}
+}
+
+/*
+ * Cheap merges go first, so that most backups are merged early.
+ */
+static int
+retention_merge_compare(const void *a, const void *b)
+{
+	RetentionMerge *merge1 = *(RetentionMerge * const *) a;
+	RetentionMerge *merge2 = *(RetentionMerge * const *) b;
+	int64		cost1 = merge1->read_bytes + merge1->write_bytes;
+	int64		cost2 = merge2->read_bytes + merge2->write_bytes;
+
+	if (cost1 != cost2)
+		return cost1 > cost2 ? 1 : -1;
+
+	return merge1->order - merge2->order;
+}
+
+/*
+ * Plan merges of partially expired incremental chains. Every chain is
+ * merged into its FULL backup in one pass.
+ */
+static void
+plan_retention_merge(parray *to_keep_list, parray *to_purge_list, parray *merge_plan)
+{
+	int			i;
 
 	/* IMPORTANT: we can merge to only those FULL backup, that is NOT
 	 * guarded by retention and final target of such merge must be
@@ -441,19 +599,14 @@ do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_l
 	 * FULL  D
 	 */
 
-	/* Merging happens here */
 	for (i = 0; i < parray_num(to_keep_list); i++)
 	{
-		char		*keep_backup_id = NULL;
 		pgBackup	*full_backup = NULL;
 		parray	    *merge_list = NULL;
+		RetentionMerge *merge;
 
 		pgBackup	*keep_backup = (pgBackup *) parray_get(to_keep_list, i);
 
-		/* keep list may shrink during merge */
-		if (!keep_backup)
-			continue;
-
 		elog(INFO, "Consider backup %s for merge", base36enc(keep_backup->start_time));
 
 		/* Got valid incremental backup, find its FULL ancestor */
@@ -466,10 +619,11 @@ do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_l
 			continue;
 		}
 
-		/* Check that ancestor is in purge_list */
+		/* Check that ancestor is in purge_list and is not merged already */
 		if (!parray_bsearch(to_purge_list,
 							full_backup,
-							pgBackupCompareIdDesc))
+							pgBackupCompareIdDesc) ||
+			is_merged_by_plan(merge_plan, full_backup))
 		{
 			elog(WARNING, "Skip backup %s for merging, "
 				"because his FULL parent is not marked for purge", base36enc(keep_backup->start_time));
@@ -480,12 +634,6 @@ do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_l
 		 * final target for merge, but there could be intermediate incremental
 		 * backups from purge_list.
 		 */
-
-		keep_backup_id = base36enc_dup(keep_backup->start_time);
-		elog(INFO, "Merge incremental chain between full backup %s and backup %s",
-					base36enc(full_backup->start_time), keep_backup_id);
-		pg_free(keep_backup_id);
-
 		merge_list = parray_new();
 
 		/* Form up a merge list */
@@ -495,10 +643,6 @@ do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_l
 			keep_backup = keep_backup->parent_backup_link;
 		}
 
-		/* sanity */
-		if (!merge_list)
-			continue;
-
 		/* sanity */
 		if (parray_num(merge_list) == 0)
 		{
@@ -509,26 +653,6 @@ do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_l
 		/* In the end add FULL backup for easy locking */
 		parray_append(merge_list, full_backup);
 
-		/* Remove FULL backup from purge list */
-		parray_rm(to_purge_list, full_backup, pgBackupCompareId);
-
-		/* Lock merge chain */
-		catalog_lock_backup_list(merge_list, parray_num(merge_list) - 1, 0, true);
-
-		/* Consider this extreme case */
-		//  PAGEa1    PAGEb1   both valid
-		//      \     /
-		//        FULL
-
-		/* Check that FULL backup do not has multiple descendants
-		 * full_backup always point to current full_backup after merge
-		 */
-//		if (is_prolific(backup_list, full_backup))
-//		{
-//			elog(WARNING, "Backup %s has multiple valid descendants. "
-//					"Automatic merge is not possible.", base36enc(full_backup->start_time));
-//		}
-
 		/* Merge list example:
 		 * 0 PAGE3
 		 * 1 PAGE2
@@ -537,35 +661,26 @@ do_retention_merge(parray *backup_list, parray *to_keep_list, parray *to_purge_l
 		 *
 		 * Merge incremental chain from PAGE3 into FULL.
 		 */
-
-		keep_backup = parray_get(merge_list, 0);
-		merge_chain(merge_list, full_backup, keep_backup);
-		backup_merged = true;
-
-		for (j = parray_num(merge_list) - 2; j >= 0; j--)
-		{
-			pgBackup   *tmp_backup = (pgBackup *) parray_get(merge_list, j);
-
-			/* Try to remove merged incremental backup from both keep and purge lists */
-			parray_rm(to_purge_list, tmp_backup, pgBackupCompareId);
-			parray_set(to_keep_list, i, NULL);
-		}
-
-		pgBackupValidate(full_backup, NULL);
-		if (full_backup->status == BACKUP_STATUS_CORRUPT)
-			elog(ERROR, "Merging of backup %s failed", base36enc(full_backup->start_time));
-
-		/* Cleanup */
-		parray_free(merge_list);
+		merge = pgut_new(RetentionMerge);
+		merge->keep_backup = (pgBackup *) parray_get(merge_list, 0);
+		merge->full_backup = full_backup;
+		merge->merge_list = merge_list;
+		merge->order = i;
+		estimate_merge_cost(merge);
+
+		parray_append(merge_plan, merge);
 	}
 
-	elog(INFO, "Retention merging finished");
-
+	parray_qsort(merge_plan, retention_merge_compare);
 }
 
-/* Purge expired backups */
+/*
+ * Plan purge of expired backups. Backups merged by planned merges are not
+ * purged, nor backups having children guarded by retention.
+ */
 static void
-do_retention_purge(parray *to_keep_list, parray *to_purge_list)
+plan_retention_purge(parray *to_keep_list, parray *to_purge_list,
+					 parray *merge_plan, parray *purge_plan)
 {
 	int i;
 	int j;
@@ -584,6 +699,10 @@ do_retention_purge(parray *to_keep_list, parray *to_purge_list)
 
 		pgBackup   *delete_backup = (pgBackup *) parray_get(to_purge_list, j);
 
+		/* FULL and intermediate backups of merged chain are gone after merge */
+		if (is_merged_by_plan(merge_plan, delete_backup))
+			continue;
+
 		elog(LOG, "Consider backup %s for purge",
 						base36enc(delete_backup->start_time));
 
@@ -597,14 +716,14 @@ do_retention_purge(parray *to_keep_list, parray *to_purge_list)
 
 			pgBackup   *keep_backup = (pgBackup *) parray_get(to_keep_list, i);
 
-			/* item could have been nullified in merge */
-			if (!keep_backup)
-				continue;
-
 			/* Full backup cannot be a descendant */
 			if (keep_backup->backup_mode == BACKUP_MODE_FULL)
 				continue;
 
+			/* backup becomes FULL after merge */
+			if (is_merged_by_plan(merge_plan, keep_backup))
+				continue;
+
 			keeped_backup_id = base36enc_dup(keep_backup->start_time);
 
 			elog(LOG, "Check if backup %s is parent of backup %s",
@@ -629,6 +748,111 @@ do_retention_purge(parray *to_keep_list, parray *to_purge_list)
 		if (!purge)
 			continue;
 
+		parray_append(purge_plan, delete_backup);
+	}
+}
+
+/*
+ * Show planned merges and purges with their estimated cost.
+ * The plan is the main output of dry run.
+ */
+static void
+print_retention_plan(parray *merge_plan, parray *purge_plan)
+{
+	int			elevel = dry_run ? INFO : LOG;
+	int64		total_io = 0;
+	int64		total_free = 0;
+	char		read_pretty[20];
+	char		write_pretty[20];
+	char		free_pretty[20];
+	int			i;
+
+	if (parray_num(merge_plan) == 0 && parray_num(purge_plan) == 0)
+		return;
+
+	for (i = 0; i < parray_num(merge_plan); i++)
+	{
+		RetentionMerge *merge = (RetentionMerge *) parray_get(merge_plan, i);
+		char	   *keep_backup_id = base36enc_dup(merge->keep_backup->start_time);
+
+		pretty_size(merge->read_bytes, read_pretty, lengthof(read_pretty));
+		pretty_size(merge->write_bytes, write_pretty, lengthof(write_pretty));
+
+		elog(elevel, "Retention plan: merge %i backups up to %s into FULL backup %s, "
+			 "estimated read: %s, write: %s",
+			 (int) parray_num(merge->merge_list) - 1, keep_backup_id,
+			 base36enc(merge->full_backup->start_time),
+			 read_pretty, write_pretty);
+		pg_free(keep_backup_id);
+
+		total_io += merge->read_bytes + merge->write_bytes;
+	}
+
+	for (i = 0; i < parray_num(purge_plan); i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(purge_plan, i);
+		int64		size = backup_data_size(backup);
+
+		if (backup->stream && backup->wal_bytes != BYTES_INVALID)
+			size += backup->wal_bytes;
+
+		pretty_size(size, free_pretty, lengthof(free_pretty));
+		elog(elevel, "Retention plan: delete backup %s, free: %s",
+			 base36enc(backup->start_time), free_pretty);
+
+		total_free += size;
+	}
+
+	pretty_size(total_io, read_pretty, lengthof(read_pretty));
+	pretty_size(total_free, free_pretty, lengthof(free_pretty));
+	elog(elevel, "Retention plan: %i merges, %i deletions, estimated merge I/O: %s, "
+		 "space to free: %s",
+		 (int) parray_num(merge_plan), (int) parray_num(purge_plan),
+		 read_pretty, free_pretty);
+}
+
+/* Merge partially expired incremental chains as planned */
+static void
+do_retention_merge(parray *merge_plan)
+{
+	int i;
+
+	/* Merging happens here */
+	for (i = 0; i < parray_num(merge_plan); i++)
+	{
+		RetentionMerge *merge = (RetentionMerge *) parray_get(merge_plan, i);
+		char		*keep_backup_id = base36enc_dup(merge->keep_backup->start_time);
+
+		elog(INFO, "Merge incremental chain between full backup %s and backup %s",
+					base36enc(merge->full_backup->start_time), keep_backup_id);
+		pg_free(keep_backup_id);
+
+		/* Lock merge chain */
+		catalog_lock_backup_list(merge->merge_list,
+								 parray_num(merge->merge_list) - 1, 0, true);
+
+		merge_chain(merge->merge_list, merge->full_backup, merge->keep_backup);
+		backup_merged = true;
+
+		pgBackupValidate(merge->full_backup, NULL);
+		if (merge->full_backup->status == BACKUP_STATUS_CORRUPT)
+			elog(ERROR, "Merging of backup %s failed", base36enc(merge->full_backup->start_time));
+	}
+
+	elog(INFO, "Retention merging finished");
+
+}
+
+/* Purge expired backups as planned */
+static void
+do_retention_purge(parray *purge_plan)
+{
+	int j;
+
+	for (j = 0; j < parray_num(purge_plan); j++)
+	{
+		pgBackup   *delete_backup = (pgBackup *) parray_get(purge_plan, j);
+
 		/* Actual purge */
 		if (!lock_backup(delete_backup, false))
 		{
@@ -724,11 +948,9 @@ do_retention_wal(bool dry_run)
 void
 delete_backup_files(pgBackup *backup)
 {
-	size_t		i;
 	char		timestamp[100];
-	parray		*files;
-	size_t		num_files;
-	char		full_path[MAXPGPATH];
+	char		trash_dir[MAXPGPATH];
+	char		trash_path[MAXPGPATH];
 
 	/*
 	 * If the backup was deleted already, there is nothing to do.
@@ -751,34 +973,316 @@ delete_backup_files(pgBackup *backup)
 	 */
 	write_backup_status(backup, BACKUP_STATUS_DELETING, instance_name, false);
 
+	/* data of backup taken with --output is kept in container file */
+	if (backup->container && strcmp(backup->container, CONTAINER_STDIO) != 0)
+	{
+		elog(VERBOSE, "Delete backup container \"%s\"", backup->container);
+
+		if (fio_unlink(backup->container, FIO_LOCAL_HOST) != 0 && errno != ENOENT)
+			elog(ERROR, "Cannot remove backup container \"%s\": %s",
+				 backup->container, strerror(errno));
+	}
+
+	/* Directories cannot be renamed in object storage */
+	if (fio_is_storage(FIO_BACKUP_HOST))
+	{
+		delete_directory_files(backup->root_dir);
+		backup->status = BACKUP_STATUS_DELETED;
+		return;
+	}
+
+	/*
+	 * Move backup directory into the trash of the instance, named after
+	 * the backup, the host and the process, which deletes it. Once renamed,
+	 * backup is gone from the catalog, even if its files are not deleted yet.
+	 */
+	strncpy(trash_dir, backup->root_dir, MAXPGPATH);
+	get_parent_directory(trash_dir);
+	join_path_components(trash_dir, trash_dir, BACKUP_TRASH_DIR);
+
+	if (fio_mkdir(trash_dir, DIR_PERMISSION, FIO_BACKUP_HOST) != 0)
+		elog(ERROR, "Cannot create directory \"%s\": %s",
+			 trash_dir, strerror(errno));
+
+	make_trash_path(trash_path, trash_dir, base36enc(backup->start_time));
+
+	if (fio_rename(backup->root_dir, trash_path, FIO_BACKUP_HOST) != 0)
+		elog(ERROR, "Cannot move backup directory \"%s\" to \"%s\": %s",
+			 backup->root_dir, trash_path, strerror(errno));
+
+	backup->status = BACKUP_STATUS_DELETED;
+
+	delete_directory_files(trash_path);
+
+	/* Finish deletion of backups, interrupted by crash */
+	reap_backup_trash(trash_dir);
+
+	return;
+}
+
+/*
+ * Delete files of the directory in parallel threads.
+ */
+static void *
+delete_files_worker(void *arg)
+{
+	delete_files_arg *arguments = (delete_files_arg *) arg;
+	int			num_files = parray_num(arguments->files);
+	char		full_path[MAXPGPATH];
+	int			i;
+
+	for (i = 0; i < num_files; i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(arguments->files, i);
+
+		if (S_ISDIR(file->mode))
+			continue;
+
+		if (!pg_atomic_test_set_flag(&file->lock))
+			continue;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "interrupted during delete backup");
+
+		join_path_components(full_path, arguments->root_dir, file->rel_path);
+
+		if (progress)
+			elog(INFO, "Progress: (%d/%d). Delete file \"%s\"",
+				 i + 1, num_files, full_path);
+
+		fio_delete(file->mode, full_path, FIO_BACKUP_HOST);
+	}
+
+	/* Data files deleted successfully */
+	arguments->ret = 0;
+
+	return NULL;
+}
+
+/*
+ * Delete the directory with all its content. Files are deleted using
+ * num_threads threads, then directories are deleted leaf node first.
+ */
+static void
+delete_directory_files(const char *root_dir)
+{
+	parray	   *files;
+	pthread_t  *threads;
+	delete_files_arg *threads_args;
+	bool		delete_isok = true;
+	char		full_path[MAXPGPATH];
+	int			i;
+
 	/* list files to be deleted */
 	files = parray_new();
-	dir_list_file(files, backup->root_dir, false, false, true, false, false, 0, FIO_BACKUP_HOST);
+	dir_list_file(files, root_dir, false, false, true, false, false, 0, FIO_BACKUP_HOST);
 
 	/* delete leaf node first */
 	parray_qsort(files, pgFileCompareRelPathWithExternalDesc);
-	num_files = parray_num(files);
-	for (i = 0; i < num_files; i++)
+
+	for (i = 0; i < parray_num(files); i++)
 	{
 		pgFile	   *file = (pgFile *) parray_get(files, i);
 
-		join_path_components(full_path, backup->root_dir, file->rel_path);
+		pg_atomic_clear_flag(&file->lock);
+	}
+
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+	threads_args = (delete_files_arg *) palloc(sizeof(delete_files_arg) * num_threads);
+
+	/* Run threads */
+	thread_interrupted = false;
+	for (i = 0; i < num_threads; i++)
+	{
+		delete_files_arg *arg = &(threads_args[i]);
+
+		arg->files = files;
+		arg->root_dir = root_dir;
+		/* By default there are some error */
+		arg->ret = 1;
+
+		pthread_create(&threads[i], NULL, delete_files_worker, arg);
+	}
+
+	/* Wait threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret == 1)
+			delete_isok = false;
+	}
+	if (!delete_isok)
+		elog(ERROR, "Data files deletion failed");
+
+	pfree(threads);
+	pfree(threads_args);
+
+	/* Directories are empty now */
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+
+		if (!S_ISDIR(file->mode))
+			continue;
 
 		if (interrupted)
 			elog(ERROR, "interrupted during delete backup");
 
-		if (progress)
-			elog(INFO, "Progress: (%zd/%zd). Delete file \"%s\"",
-				 i + 1, num_files, full_path);
-
-		pgFileDelete(file->mode, full_path);
+		join_path_components(full_path, root_dir, file->rel_path);
+		fio_delete(file->mode, full_path, FIO_BACKUP_HOST);
 	}
 
 	parray_walk(files, pgFileFree);
 	parray_free(files);
-	backup->status = BACKUP_STATUS_DELETED;
+}
 
-	return;
+/*
+ * Get the name of the host, the process is running on.
+ */
+static void
+get_host_name(char *host, size_t len)
+{
+#ifndef WIN32
+	if (gethostname(host, len) != 0)
+		elog(ERROR, "Cannot get host name: %s", strerror(errno));
+	host[len - 1] = '\0';
+#else
+	DWORD		size = len;
+
+	if (!GetComputerNameA(host, &size))
+		elog(ERROR, "Cannot get host name: error code %lu", GetLastError());
+#endif
+}
+
+/*
+ * Construct path of the backup in the trash: "backup_id.host.pid".
+ * Backup ID has no dots, host name may have them.
+ */
+static void
+make_trash_path(char *trash_path, const char *trash_dir, const char *backup_id)
+{
+	char		host[MAXPGPATH];
+
+	get_host_name(host, sizeof(host));
+	snprintf(trash_path, MAXPGPATH, "%s/%s.%s.%d",
+			 trash_dir, backup_id, host, getpid());
+}
+
+/*
+ * Check if the process, which moved backup into the trash, still exists.
+ * Catalog may be shared between hosts, and process of another host
+ * cannot be checked, so it is considered alive.
+ */
+static bool
+trash_owner_is_alive(const char *host, pid_t pid)
+{
+	char		my_host[MAXPGPATH];
+
+	get_host_name(my_host, sizeof(my_host));
+	if (strcmp(host, my_host) != 0 || pid == getpid())
+		return true;
+
+#ifndef WIN32
+	return kill(pid, 0) == 0 || errno != ESRCH;
+#else
+	/* kill() of Windows port signals only postgres processes */
+	{
+		HANDLE		proc;
+		DWORD		exit_code;
+		bool		alive;
+
+		proc = OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, FALSE, pid);
+		if (proc == NULL)
+			return GetLastError() != ERROR_INVALID_PARAMETER;
+
+		alive = !GetExitCodeProcess(proc, &exit_code) ||
+			exit_code == STILL_ACTIVE;
+		CloseHandle(proc);
+		return alive;
+	}
+#endif
+}
+
+/*
+ * Delete backups left in the trash by processes of this host,
+ * which do not exist anymore. Backup is claimed by renaming it after
+ * the current process, so that concurrent deletions do not delete
+ * the same backup.
+ */
+static void
+reap_backup_trash(const char *trash_dir)
+{
+	DIR		   *dir;
+	struct dirent *dent;
+	parray	   *leftovers = parray_new();
+	char		old_path[MAXPGPATH];
+	char		new_path[MAXPGPATH];
+	int			i;
+
+	dir = fio_opendir(trash_dir, FIO_BACKUP_HOST);
+	if (dir == NULL)
+	{
+		if (errno == ENOENT)
+		{
+			parray_free(leftovers);
+			return;
+		}
+		elog(ERROR, "Cannot open directory \"%s\": %s", trash_dir, strerror(errno));
+	}
+
+	while ((dent = fio_readdir(dir)))
+	{
+		char	   *host = strchr(dent->d_name, '.');
+		char	   *suffix = strrchr(dent->d_name, '.');
+		char		host_name[MAXPGPATH];
+		pid_t		pid;
+
+		/* skip entries, which are not named after the deleting process */
+		if (host == NULL || host == dent->d_name || suffix == host)
+			continue;
+
+		pid = atoi(suffix + 1);
+		if (pid <= 0)
+			continue;
+
+		strlcpy(host_name, host + 1,
+				Min((size_t) (suffix - host), sizeof(host_name)));
+
+		/* Deletion is in progress */
+		if (trash_owner_is_alive(host_name, pid))
+			continue;
+
+		parray_append(leftovers, pgut_strdup(dent->d_name));
+	}
+	fio_closedir(dir);
+
+	for (i = 0; i < parray_num(leftovers); i++)
+	{
+		char	   *name = (char *) parray_get(leftovers, i);
+		char	   *backup_id = pgut_strdup(name);
+
+		*strchr(backup_id, '.') = '\0';
+
+		join_path_components(old_path, trash_dir, name);
+		make_trash_path(new_path, trash_dir, backup_id);
+
+		/* Backup is claimed by another process */
+		if (fio_rename(old_path, new_path, FIO_BACKUP_HOST) != 0)
+		{
+			if (errno != ENOENT)
+				elog(ERROR, "Cannot rename \"%s\" to \"%s\": %s",
+					 old_path, new_path, strerror(errno));
+		}
+		else
+		{
+			elog(INFO, "Finish deletion of backup %s", backup_id);
+			delete_directory_files(new_path);
+		}
+		pg_free(backup_id);
+	}
+
+	parray_walk(leftovers, pfree);
+	parray_free(leftovers);
 }
 
 /*
@@ -815,7 +1319,11 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 	size_t		wal_size_actual = 0;
 	char		wal_pretty_size[20];
 	bool		purge_all = false;
-
+	int			n_files;
+	int			n_threads;
+	pthread_t  *threads;
+	purge_wal_arg *threads_args;
+	bool		purge_isok = true;
 
 	/* Timeline is completely empty */
 	if (parray_num(tlinfo->xlog_filelist) == 0)
@@ -894,13 +1402,36 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 			tlinfo->tli, wal_pretty_size);
 	}
 
+	/*
+	 * Files of the timeline are sorted by segment number, so files to be
+	 * deleted are the head of the list, up to the first segment to keep.
+	 */
+	if (purge_all)
+		n_files = parray_num(tlinfo->xlog_filelist);
+	else
+	{
+		int			low = 0;
+		int			high = parray_num(tlinfo->xlog_filelist);
+
+		while (low < high)
+		{
+			int			middle = low + (high - low) / 2;
+			xlogFile   *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, middle);
+
+			if (wal_file->segno < OldestToKeepSegNo)
+				low = middle + 1;
+			else
+				high = middle;
+		}
+		n_files = low;
+	}
+
 	/* Calculate the actual size to delete */
-	for (i = 0; i < parray_num(tlinfo->xlog_filelist); i++)
+	for (i = 0; i < n_files; i++)
 	{
 		xlogFile *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, i);
 
-		if (purge_all || wal_file->segno < OldestToKeepSegNo)
-			wal_size_actual += wal_file->file.size;
+		wal_size_actual += wal_file->file.size;
 	}
 
 	/* Report the actual size to delete */
@@ -911,22 +1442,82 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 			tlinfo->tli, wal_pretty_size);
 	}
 
-	if (dry_run)
+	if (dry_run || n_files == 0)
 		return;
 
-	for (i = 0; i < parray_num(tlinfo->xlog_filelist); i++)
+	/* Remove files in batches using num_threads threads */
+	n_threads = Min(num_threads,
+					(n_files + WAL_PURGE_BATCH_SIZE - 1) / WAL_PURGE_BATCH_SIZE);
+
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * n_threads);
+	threads_args = (purge_wal_arg *) palloc(sizeof(purge_wal_arg) * n_threads);
+
+	purge_wal_next_file = 0;
+	purge_wal_n_done = 0;
+
+	/* Run threads */
+	thread_interrupted = false;
+	for (i = 0; i < n_threads; i++)
 	{
-		xlogFile *wal_file = (xlogFile *) parray_get(tlinfo->xlog_filelist, i);
+		purge_wal_arg *arg = &(threads_args[i]);
 
-		if (interrupted)
-			elog(ERROR, "interrupted during WAL archive purge");
+		arg->files = tlinfo->xlog_filelist;
+		arg->n_files = n_files;
+		arg->tli = tlinfo->tli;
+		arg->wal_deleted = false;
+		/* By default there are some error */
+		arg->ret = 1;
 
-		/* Any segment equal or greater than EndSegNo must be kept
-		 * unless it`s a 'purge all' scenario.
-		 */
-		if (purge_all || wal_file->segno < OldestToKeepSegNo)
+		pthread_create(&threads[i], NULL, purge_wal_worker, arg);
+	}
+
+	/* Wait threads */
+	for (i = 0; i < n_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret == 1)
+			purge_isok = false;
+		if (threads_args[i].wal_deleted)
+			wal_deleted = true;
+	}
+
+	pfree(threads);
+	pfree(threads_args);
+
+	if (!purge_isok)
+		elog(ERROR, "WAL archive purge failed");
+}
+
+/*
+ * Remove batches of WAL files from the head of timeline file list.
+ */
+static void *
+purge_wal_worker(void *arg)
+{
+	purge_wal_arg *arguments = (purge_wal_arg *) arg;
+
+	for (;;)
+	{
+		int			first;
+		int			last;
+		int			i;
+
+		pthread_lock(&purge_wal_mutex);
+		first = purge_wal_next_file;
+		last = Min(first + WAL_PURGE_BATCH_SIZE, arguments->n_files);
+		purge_wal_next_file = last;
+		pthread_mutex_unlock(&purge_wal_mutex);
+
+		if (first >= arguments->n_files)
+			break;
+
+		for (i = first; i < last; i++)
 		{
-			char wal_fullpath[MAXPGPATH];
+			xlogFile   *wal_file = (xlogFile *) parray_get(arguments->files, i);
+			char		wal_fullpath[MAXPGPATH];
+
+			if (interrupted || thread_interrupted)
+				elog(ERROR, "interrupted during WAL archive purge");
 
 			join_path_components(wal_fullpath, instance_config.arclog_path, wal_file->file.name);
 
@@ -957,9 +1548,21 @@ delete_walfiles_in_tli(XLogRecPtr keep_lsn, timelineInfo *tlinfo,
 					elog(VERBOSE, "Removed backup history file \"%s\"", wal_fullpath);
 			}
 
-			wal_deleted = true;
+			arguments->wal_deleted = true;
 		}
+
+		pthread_lock(&purge_wal_mutex);
+		purge_wal_n_done += last - first;
+		if (progress)
+			elog(INFO, "Progress: (%d/%d). Purge WAL files on timeline %i",
+				 purge_wal_n_done, arguments->n_files, arguments->tli);
+		pthread_mutex_unlock(&purge_wal_mutex);
 	}
+
+	/* WAL files purged successfully */
+	arguments->ret = 0;
+
+	return NULL;
 }
 
 
@@ -970,7 +1573,7 @@ do_delete_instance(void)
 	parray		*backup_list;
 	int 		i;
 	char		instance_config_path[MAXPGPATH];
-
+	char		trash_dir[MAXPGPATH];
 
 	/* Delete all backups. */
 	backup_list = catalog_get_backup_list(instance_name, INVALID_BACKUP_ID);
@@ -988,24 +1591,47 @@ do_delete_instance(void)
 	parray_free(backup_list);
 
 	/* Delete all wal files. */
-	pgut_rmtree(arclog_path, false, true);
+	if (fio_is_storage(FIO_BACKUP_HOST))
+	{
+		parray	   *files = parray_new();
+
+		dir_list_file(files, arclog_path, false, false, false, false, false, 0, FIO_BACKUP_HOST);
+		parray_qsort(files, pgFileCompareRelPathWithExternalDesc);
+
+		for (i = 0; i < parray_num(files); i++)
+		{
+			pgFile	   *file = (pgFile *) parray_get(files, i);
+			char		full_path[MAXPGPATH];
+
+			join_path_components(full_path, arclog_path, file->rel_path);
+			fio_delete(file->mode, full_path, FIO_BACKUP_HOST);
+		}
+
+		parray_walk(files, pgFileFree);
+		parray_free(files);
+	}
+	else
+		pgut_rmtree(arclog_path, false, true);
 
 	/* Delete backup instance config file */
 	join_path_components(instance_config_path, backup_instance_path, BACKUP_CATALOG_CONF_FILE);
-	if (remove(instance_config_path))
+	if (fio_unlink(instance_config_path, FIO_BACKUP_HOST))
 	{
 		elog(ERROR, "Can't remove \"%s\": %s", instance_config_path,
 			strerror(errno));
 	}
 
-	/* Delete instance root directories */
-	if (rmdir(backup_instance_path) != 0)
-		elog(ERROR, "Can't remove \"%s\": %s", backup_instance_path,
-			strerror(errno));
+	/* Delete the trash, where backups are moved before deletion */
+	if (!fio_is_storage(FIO_BACKUP_HOST))
+	{
+		join_path_components(trash_dir, backup_instance_path, BACKUP_TRASH_DIR);
+		reap_backup_trash(trash_dir);
+		fio_delete(S_IFDIR, trash_dir, FIO_BACKUP_HOST);
+	}
 
-	if (rmdir(arclog_path) != 0)
-		elog(ERROR, "Can't remove \"%s\": %s", arclog_path,
-			strerror(errno));
+	/* Delete instance root directories */
+	fio_delete(S_IFDIR, backup_instance_path, FIO_BACKUP_HOST);
+	fio_delete(S_IFDIR, arclog_path, FIO_BACKUP_HOST);
 
 	elog(INFO, "Instance '%s' successfully deleted", instance_name);
 	return 0;
@@ -22,6 +22,56 @@
 #include <dirent.h>
 
 #include "utils/configuration.h"
+#include "utils/thread.h"
+
+typedef struct
+{
+	parray	   *paths;
+	fio_location location;
+	int			thread_num;
+
+	/*
+	 * Return value from the thread.
+	 * 0 means there is no error, 1 - there is an error.
+	 */
+	int			ret;
+} sync_files_arg;
+
+static void *sync_files_worker(void *arg);
+
+/* State shared by threads of parallel directory listing */
+typedef struct
+{
+	const char *root;
+	parray	   *queue;			/* directories waiting to be listed */
+	int			n_pending;		/* directories queued or being listed */
+	pthread_mutex_t mutex;
+
+	bool		exclude;
+	bool		follow_symlink;
+	bool		backup_logs;
+	bool		skip_hidden;
+	int			external_dir_num;
+	fio_location location;
+} dir_list_state;
+
+typedef struct
+{
+	dir_list_state *state;
+	parray	   *files;			/* files found by this thread */
+
+	/*
+	 * Return value from the thread.
+	 * 0 means there is no error, 1 - there is an error.
+	 */
+	int			ret;
+} dir_list_arg;
+
+static void dir_list_file_parallel(parray *files, pgFile *root_file, const char *root,
+								   bool exclude, bool follow_symlink, bool backup_logs,
+								   bool skip_hidden, int external_dir_num,
+								   fio_location location);
+static void *dir_list_worker(void *arg);
 
 /*
  * The contents of these directories are removed or recreated during server
@@ -127,7 +177,8 @@ static char dir_check_file(pgFile *file, bool backup_logs);
 
 static void dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 								   bool exclude, bool follow_symlink, bool backup_logs,
-								   bool skip_hidden, int external_dir_num, fio_location location);
+								   bool skip_hidden, int external_dir_num, fio_location location,
+								   parray *subdirs);
 static void opt_path_map(ConfigOption *opt, const char *arg,
 						 TablespaceList *list, const char *type);
 
@@ -136,6 +187,32 @@ static TablespaceList tablespace_dirs = {NULL, NULL};
 /* Extra directories mapping */
 static TablespaceList external_remap_list = {NULL, NULL};
 
+/*
+ * Relative paths of files read from the backup catalog. File lists of
+ * backups in the same chain mostly contain the same paths, so every
+ * distinct path is stored only once, in large chunks, and is never freed.
+ */
+#define SHARED_PATHS_CHUNK_SIZE	(64 * 1024)
+
+static char	  **shared_paths = NULL;	/* open addressing hash table */
+static size_t	shared_paths_size = 0;
+static size_t	shared_paths_count = 0;
+static char	   *shared_paths_chunk = NULL;
+static size_t	shared_paths_chunk_free = 0;
+static pthread_mutex_t shared_paths_mutex = PTHREAD_MUTEX_INITIALIZER;
+
+static char *intern_path(const char *path);
+static pgFile *pgFileInitInternal(char *rel_path, bool shared);
+
+struct pgFileIndex
+{
+	pgFile	  **slots;		/* open addressing hash table */
+	size_t		size;		/* number of slots, power of two */
+};
+
+static uint32 pgFileIndexHash(pgFile *file);
+static bool pgFileIndexMatch(pgFile *file, pgFile *key);
+
 /*
  * Create directory, also create parent directories if necessary.
  */
@@ -190,6 +267,32 @@ pgFileNew(const char *path, const char *rel_path, bool follow_symlink,
 
 pgFile *
 pgFileInit(const char *rel_path)
+{
+	char	   *path = pgut_strdup(rel_path);
+
+	canonicalize_path(path);
+
+	return pgFileInitInternal(path, false);
+}
+
+/*
+ * Same as pgFileInit(), but relative path of the file is interned,
+ * so files with the same path, e.g. in file lists of backups of
+ * the same chain, share it. Used for file lists, read from the catalog.
+ */
+pgFile *
+pgFileInitShared(const char *rel_path)
+{
+	char		path[MAXPGPATH];
+
+	strlcpy(path, rel_path, sizeof(path));
+	canonicalize_path(path);
+
+	return pgFileInitInternal(intern_path(path), true);
+}
+
+static pgFile *
+pgFileInitInternal(char *rel_path, bool shared)
 {
 	pgFile	   *file;
 	char	   *file_name = NULL;
@@ -197,8 +300,9 @@ pgFileInit(const char *rel_path)
 	file = (pgFile *) pgut_malloc(sizeof(pgFile));
 	MemSet(file, 0, sizeof(pgFile));
 
-	file->rel_path = pgut_strdup(rel_path);
-	canonicalize_path(file->rel_path);
+	file->rel_path = rel_path;
+	file->rel_path_is_shared = shared;
+	file->path_hash = pgFileHashPath(rel_path);
 
 	/* Get file name from the path */
 	file_name = last_dir_separator(file->rel_path);
@@ -220,6 +324,186 @@ pgFileInit(const char *rel_path)
 	return file;
 }
 
+/* FNV-1a hash of the path */
+uint32
+pgFileHashPath(const char *path)
+{
+	uint32		hash = 2166136261U;
+
+	for (; *path; path++)
+	{
+		hash ^= (unsigned char) *path;
+		hash *= 16777619U;
+	}
+
+	return hash;
+}
+
+/*
+ * Return the shared copy of the path, storing it on the first call.
+ */
+static char *
+intern_path(const char *path)
+{
+	size_t		len = strlen(path) + 1;
+	size_t		i;
+	char	   *result;
+
+	pthread_lock(&shared_paths_mutex);
+
+	/* Keep the hash table at most half full */
+	if ((shared_paths_count + 1) * 2 > shared_paths_size)
+	{
+		size_t		new_size = shared_paths_size > 0 ? shared_paths_size * 2 : 1024;
+		char	  **new_paths = pgut_newarray(char *, new_size);
+
+		MemSet(new_paths, 0, sizeof(char *) * new_size);
+
+		for (i = 0; i < shared_paths_size; i++)
+		{
+			size_t		j;
+
+			if (shared_paths[i] == NULL)
+				continue;
+
+			j = pgFileHashPath(shared_paths[i]) & (new_size - 1);
+			while (new_paths[j] != NULL)
+				j = (j + 1) & (new_size - 1);
+			new_paths[j] = shared_paths[i];
+		}
+
+		pg_free(shared_paths);
+		shared_paths = new_paths;
+		shared_paths_size = new_size;
+	}
+
+	i = pgFileHashPath(path) & (shared_paths_size - 1);
+	while (shared_paths[i] != NULL && strcmp(shared_paths[i], path) != 0)
+		i = (i + 1) & (shared_paths_size - 1);
+
+	if (shared_paths[i] == NULL)
+	{
+		if (len > shared_paths_chunk_free)
+		{
+			shared_paths_chunk_free = Max(len, SHARED_PATHS_CHUNK_SIZE);
+			shared_paths_chunk = pgut_malloc(shared_paths_chunk_free);
+		}
+
+		memcpy(shared_paths_chunk, path, len);
+		shared_paths[i] = shared_paths_chunk;
+		shared_paths_chunk += len;
+		shared_paths_chunk_free -= len;
+		shared_paths_count++;
+	}
+
+	result = shared_paths[i];
+
+	pthread_mutex_unlock(&shared_paths_mutex);
+
+	return result;
+}
+
+/*
+ * Build hash index on backup->files, keyed on external_dir_num and rel_path,
+ * so that files of the backup can be looked up by pgBackupSearchFile()
+ * without string comparisons of binary search. The index refers to
+ * the files themselves, so it stays valid when the list is resorted,
+ * but the list must not be changed otherwise. Once built, the index
+ * is read-only and may be used by many threads.
+ */
+void
+pgBackupIndexFiles(pgBackup *backup)
+{
+	pgFileIndex *index;
+	size_t		n_files = parray_num(backup->files);
+	size_t		i;
+
+	pgBackupFreeFilesIndex(backup);
+
+	index = pgut_new(pgFileIndex);
+
+	/* Keep the hash table at most half full */
+	index->size = 16;
+	while (index->size < n_files * 2)
+		index->size *= 2;
+
+	index->slots = pgut_newarray(pgFile *, index->size);
+	MemSet(index->slots, 0, sizeof(pgFile *) * index->size);
+
+	for (i = 0; i < n_files; i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(backup->files, i);
+		size_t		slot = pgFileIndexHash(file) & (index->size - 1);
+
+		while (index->slots[slot] != NULL)
+			slot = (slot + 1) & (index->size - 1);
+
+		index->slots[slot] = file;
+	}
+
+	backup->files_index = index;
+}
+
+void
+pgBackupFreeFilesIndex(pgBackup *backup)
+{
+	if (backup->files_index == NULL)
+		return;
+
+	pg_free(backup->files_index->slots);
+	pg_free(backup->files_index);
+	backup->files_index = NULL;
+}
+
+/*
+ * Find file with the same rel_path and external_dir_num as key
+ * in backup->files. Use hash index if it is built, and binary search
+ * otherwise, in that case backup->files must be sorted by
+ * pgFileCompareRelPathWithExternal.
+ */
+pgFile **
+pgBackupSearchFile(pgBackup *backup, pgFile *key)
+{
+	pgFileIndex *index = backup->files_index;
+	size_t		slot;
+
+	if (index == NULL)
+		return (pgFile **) parray_bsearch(backup->files, key,
+										  pgFileCompareRelPathWithExternal);
+
+	slot = pgFileIndexHash(key) & (index->size - 1);
+
+	while (index->slots[slot] != NULL)
+	{
+		if (pgFileIndexMatch(index->slots[slot], key))
+			return &index->slots[slot];
+
+		slot = (slot + 1) & (index->size - 1);
+	}
+
+	return NULL;
+}
+
+static uint32
+pgFileIndexHash(pgFile *file)
+{
+	return file->path_hash ^ ((uint32) file->external_dir_num * 0x9E3779B9U);
+}
+
+static bool
+pgFileIndexMatch(pgFile *file, pgFile *key)
+{
+	if (file->path_hash != key->path_hash ||
+		file->external_dir_num != key->external_dir_num)
+		return false;
+
+	/* interned paths are equal only if they are the same string */
+	if (file->rel_path_is_shared && key->rel_path_is_shared)
+		return file->rel_path == key->rel_path;
+
+	return strcmp(file->rel_path, key->rel_path) == 0;
+}
+
 /*
  * Delete file pointed by the pgFile.
  * If the pgFile points directory, the directory must be empty.
@@ -253,7 +537,7 @@ delete_file:
 }
 
 /*
- * Read the local file to compute its CRC.
+ * Read the file in backup catalog to compute its CRC.
  * We cannot make decision about file decompression because
  * user may ask to backup already compressed files and we should be
  * obvious about it.
@@ -266,10 +550,14 @@ pgFileGetCRC(const char *file_path, bool use_crc32c, bool missing_ok)
 	char	   *buf;
 	size_t		len = 0;
 
+	/* file written into container of the backup being taken cannot be read */
+	if (use_crc32c && container_get_crc(file_path, &crc))
+		return crc;
+
 	INIT_FILE_CRC32(use_crc32c, crc);
 
 	/* open file in binary read mode */
-	fp = fopen(file_path, PG_BINARY_R);
+	fp = fio_fopen(file_path, PG_BINARY_R, FIO_BACKUP_HOST);
 	if (fp == NULL)
 	{
 		if (errno == ENOENT)
@@ -394,7 +682,8 @@ pgFileFree(void *file)
 	file_ptr = (pgFile *) file;
 
 	pfree(file_ptr->linked);
-	pfree(file_ptr->rel_path);
+	if (!file_ptr->rel_path_is_shared)
+		pfree(file_ptr->rel_path);
 
 	pfree(file);
 }
@@ -508,12 +797,26 @@ db_map_entry_free(void *entry)
 	free(entry);
 }
 
+/* Free entry of any ledger, all of them start with ledger_key */
+void
+ledger_entry_free(void *entry)
+{
+	ledger_key *e = (ledger_key *) entry;
+
+	free(e->rel_path);
+	free(entry);
+}
+
 /*
  * List files, symbolic links and directories in the directory "root" and add
  * pgFile objects to "files".  We add "root" to "files" if add_root is true.
  *
  * When follow_symlink is true, symbolic link is ignored and only file or
  * directory linked to will be listed.
+ *
+ * Local data directories are listed by num_threads threads. In that case
+ * directories are listed in arbitrary order, so found files are sorted
+ * by path, which keeps every directory ahead of its content.
  */
 void
 dir_list_file(parray *files, const char *root, bool exclude, bool follow_symlink,
@@ -544,8 +847,18 @@ dir_list_file(parray *files, const char *root, bool exclude, bool follow_symlink
 	if (add_root)
 		parray_append(files, file);
 
-	dir_list_file_internal(files, file, root, exclude, follow_symlink,
-						   backup_logs, skip_hidden, external_dir_num, location);
+	/*
+	 * Data directories are listed in parallel. Backup catalog may be kept
+	 * in object storage or container, which cannot be used by many threads.
+	 */
+	if (num_threads > 1 && location != FIO_BACKUP_HOST &&
+		!fio_is_remote_simple(location))
+		dir_list_file_parallel(files, file, root, exclude, follow_symlink,
+							   backup_logs, skip_hidden, external_dir_num, location);
+	else
+		dir_list_file_internal(files, file, root, exclude, follow_symlink,
+							   backup_logs, skip_hidden, external_dir_num, location,
+							   NULL);
 
 	if (!add_root)
 		pgFileFree(file);
@@ -774,11 +1087,15 @@ dir_check_file(pgFile *file, bool backup_logs)
  * List files in parent->path directory.  If "exclude" is true do not add into
  * "files" files from pgdata_exclude_files and directories from
  * pgdata_exclude_dir.
+ *
+ * Subdirectories are listed recursively, unless "subdirs" is not NULL,
+ * then they are only appended to it to be listed by the caller.
  */
 static void
 dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 					   bool exclude, bool follow_symlink, bool backup_logs,
-					   bool skip_hidden, int external_dir_num, fio_location location)
+					   bool skip_hidden, int external_dir_num, fio_location location,
+					   parray *subdirs)
 {
 	DIR			  *dir;
 	struct dirent *dent;
@@ -865,9 +1182,12 @@ dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 		 * If the entry is a directory call dir_list_file_internal()
 		 * recursively.
 		 */
-		if (S_ISDIR(file->mode))
+		if (S_ISDIR(file->mode) && subdirs)
+			parray_append(subdirs, file);
+		else if (S_ISDIR(file->mode))
 			dir_list_file_internal(files, file, child, exclude, follow_symlink,
-								   backup_logs, skip_hidden, external_dir_num, location);
+								   backup_logs, skip_hidden, external_dir_num, location,
+								   NULL);
 	}
 
 	if (errno && errno != ENOENT)
@@ -880,6 +1200,140 @@ dir_list_file_internal(parray *files, pgFile *parent, const char *parent_dir,
 	fio_closedir(dir);
 }
 
+/*
+ * List content of root_file directory by num_threads threads.
+ * Threads take directories from the shared queue and put found
+ * subdirectories back into it, so a thread, that finished small
+ * directory, continues with directories found by others.
+ */
+static void
+dir_list_file_parallel(parray *files, pgFile *root_file, const char *root,
+					   bool exclude, bool follow_symlink, bool backup_logs,
+					   bool skip_hidden, int external_dir_num,
+					   fio_location location)
+{
+	dir_list_state state;
+	pthread_t  *threads;
+	dir_list_arg *threads_args;
+	parray	   *found_files = parray_new();
+	bool		list_isok = true;
+	int			i;
+
+	state.root = root;
+	state.queue = parray_new();
+	state.n_pending = 1;
+	state.mutex = (pthread_mutex_t) PTHREAD_MUTEX_INITIALIZER;
+	state.exclude = exclude;
+	state.follow_symlink = follow_symlink;
+	state.backup_logs = backup_logs;
+	state.skip_hidden = skip_hidden;
+	state.external_dir_num = external_dir_num;
+	state.location = location;
+
+	parray_append(state.queue, root_file);
+
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+	threads_args = (dir_list_arg *) palloc(sizeof(dir_list_arg) * num_threads);
+
+	thread_interrupted = false;
+	for (i = 0; i < num_threads; i++)
+	{
+		dir_list_arg *arg = &(threads_args[i]);
+
+		arg->state = &state;
+		arg->files = parray_new();
+		/* By default there are some error */
+		arg->ret = 1;
+
+		pthread_create(&threads[i], NULL, dir_list_worker, arg);
+	}
+
+	/* Wait threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret == 1)
+			list_isok = false;
+
+		parray_concat(found_files, threads_args[i].files);
+		parray_free(threads_args[i].files);
+	}
+
+	if (!list_isok)
+		elog(ERROR, "Listing of directory \"%s\" failed", root);
+
+	/* parent directory goes before its content */
+	parray_qsort(found_files, pgFileCompareRelPathWithExternal);
+	parray_concat(files, found_files);
+
+	parray_free(found_files);
+	parray_free(state.queue);
+	pfree(threads);
+	pfree(threads_args);
+}
+
+static void *
+dir_list_worker(void *arg)
+{
+	dir_list_arg *arguments = (dir_list_arg *) arg;
+	dir_list_state *state = arguments->state;
+	parray	   *subdirs = parray_new();
+
+	for (;;)
+	{
+		pgFile	   *dir = NULL;
+		char		dir_path[MAXPGPATH];
+		int			i;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during directory listing");
+
+		pthread_lock(&state->mutex);
+		if (parray_num(state->queue) > 0)
+			dir = (pgFile *) parray_remove(state->queue,
+										   parray_num(state->queue) - 1);
+		else if (state->n_pending == 0)
+		{
+			/* all directories are listed */
+			pthread_mutex_unlock(&state->mutex);
+			break;
+		}
+		pthread_mutex_unlock(&state->mutex);
+
+		/* Other threads are still listing, they may find more directories */
+		if (dir == NULL)
+		{
+			pg_usleep(1000L);
+			continue;
+		}
+
+		join_path_components(dir_path, state->root, dir->rel_path);
+
+		dir_list_file_internal(arguments->files, dir, dir_path,
+							   state->exclude, state->follow_symlink,
+							   state->backup_logs, state->skip_hidden,
+							   state->external_dir_num, state->location,
+							   subdirs);
+
+		pthread_lock(&state->mutex);
+		for (i = 0; i < parray_num(subdirs); i++)
+			parray_append(state->queue, parray_get(subdirs, i));
+		state->n_pending += (int) parray_num(subdirs) - 1;
+		pthread_mutex_unlock(&state->mutex);
+
+		/* subdirectories are already in the list of found files */
+		while (parray_num(subdirs) > 0)
+			parray_remove(subdirs, parray_num(subdirs) - 1);
+	}
+
+	parray_free(subdirs);
+
+	/* Directory listing is successful */
+	arguments->ret = 0;
+
+	return NULL;
+}
+
 /*
  * Retrieve tablespace path, either relocated or original depending on whether
  * -T was passed or not.
@@ -1518,10 +1972,15 @@ dir_read_file_list(const char *root, const char *external_prefix,
 					segno,
 					n_blocks,
 					n_headers,
+					delta_encoded,
+					patched,
+					dead_size,
 					dbOid,		/* used for partial restore */
 					hdr_crc,
 					hdr_off,
-					hdr_size;
+					hdr_size,
+					pack_num,
+					pack_off;
 		pgFile	   *file;
 
 		COMP_FILE_CRC32(true, content_crc, buf, strlen(buf));
@@ -1536,7 +1995,7 @@ dir_read_file_list(const char *root, const char *external_prefix,
 		get_control_value(buf, "external_dir_num", NULL, &external_dir_num, false);
 		get_control_value(buf, "dbOid", NULL, &dbOid, false);
 
-		file = pgFileInit(path);
+		file = pgFileInitShared(path);
 		file->write_size = (int64) write_size;
 		file->mode = (mode_t) mode;
 		file->is_datafile = is_datafile ? true : false;
@@ -1562,6 +2021,15 @@ dir_read_file_list(const char *root, const char *external_prefix,
 		if (get_control_value(buf, "n_blocks", NULL, &n_blocks, false))
 			file->n_blocks = (int) n_blocks;
 
+		if (get_control_value(buf, "delta_encoded", NULL, &delta_encoded, false))
+			file->delta_encoded = delta_encoded ? true : false;
+
+		if (get_control_value(buf, "patched", NULL, &patched, false))
+			file->patched = patched ? true : false;
+
+		if (get_control_value(buf, "dead_size", NULL, &dead_size, false))
+			file->dead_size = dead_size;
+
 		if (get_control_value(buf, "n_headers", NULL, &n_headers, false))
 			file->n_headers = (int) n_headers;
 
@@ -1574,6 +2042,12 @@ dir_read_file_list(const char *root, const char *external_prefix,
 		if (get_control_value(buf, "hdr_size", NULL, &hdr_size, false))
 			file->hdr_size = (int) hdr_size;
 
+		if (get_control_value(buf, "pack_num", NULL, &pack_num, false))
+			file->pack_num = (int) pack_num;
+
+		if (get_control_value(buf, "pack_off", NULL, &pack_off, false))
+			file->pack_off = pack_off;
+
 		parray_append(files, file);
 	}
 
@@ -1850,3 +2324,494 @@ read_database_map(pgBackup *backup)
 
 	return database_map;
 }
+
+/*
+ * Compare two ledger entries by their rel_path and external_dir_num.
+ * Entries of every ledger start with ledger_key.
+ */
+static int
+ledger_key_compare(const void *f1, const void *f2)
+{
+	ledger_key *e1 = *(ledger_key **) f1;
+	ledger_key *e2 = *(ledger_key **) f2;
+	int			res;
+
+	res = strcmp(e1->rel_path, e2->rel_path);
+	if (res == 0)
+	{
+		if (e1->external_dir_num > e2->external_dir_num)
+			return 1;
+		else if (e1->external_dir_num < e2->external_dir_num)
+			return -1;
+	}
+	return res;
+}
+
+/*
+ * Read ledger file line by line, entries returned by the 'parse' callback
+ * are sorted for ledger_find_file(). Lines, for which callback returns NULL,
+ * are skipped, it may take something else from them.
+ * Return NULL if there is no ledger file.
+ */
+parray *
+read_ledger(const char *path, ledger_parse_func parse, void *arg)
+{
+	FILE	   *fp;
+	parray	   *ledger;
+	char		buf[BLCKSZ];
+
+	fp = fio_open_stream(path, FIO_BACKUP_HOST);
+	if (fp == NULL)
+	{
+		/* ledger is created by the first run using it */
+		if (errno == ENOENT)
+			return NULL;
+		elog(ERROR, "Cannot open \"%s\": %s", path, strerror(errno));
+	}
+
+	ledger = parray_new();
+
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		void	   *entry = parse(buf, arg);
+
+		if (entry)
+			parray_append(ledger, entry);
+	}
+
+	if (ferror(fp))
+		elog(ERROR, "Failed to read from file: \"%s\"", path);
+
+	fio_close_stream(fp);
+
+	parray_qsort(ledger, ledger_key_compare);
+
+	return ledger;
+}
+
+/*
+ * Atomically replace ledger file: optional header line goes first,
+ * then every entry is printed by the 'print' callback.
+ */
+void
+write_ledger(const char *path, const char *header, parray *ledger,
+			 ledger_print_func print)
+{
+	FILE	   *out;
+	char		path_temp[MAXPGPATH];
+	int			i;
+
+	snprintf(path_temp, sizeof(path_temp), "%s.tmp", path);
+
+	out = fio_fopen(path_temp, PG_BINARY_W, FIO_BACKUP_HOST);
+	if (out == NULL)
+		elog(ERROR, "Cannot open file \"%s\": %s", path_temp, strerror(errno));
+
+	if (header)
+		fio_fprintf(out, "%s\n", header);
+
+	for (i = 0; ledger && i < parray_num(ledger); i++)
+		print(out, parray_get(ledger, i));
+
+	if (fio_fflush(out) || fio_fclose(out))
+	{
+		fio_unlink(path_temp, FIO_BACKUP_HOST);
+		elog(ERROR, "Cannot write file \"%s\": %s", path_temp, strerror(errno));
+	}
+
+	if (fio_rename(path_temp, path, FIO_BACKUP_HOST) < 0)
+		elog(ERROR, "Cannot rename file \"%s\" to \"%s\": %s",
+			 path_temp, path, strerror(errno));
+}
+
+/*
+ * Find ledger entry of the file, return NULL if there is none.
+ */
+void *
+ledger_find_file(parray *ledger, pgFile *file)
+{
+	ledger_key	key;
+	void	  **res;
+
+	key.rel_path = file->rel_path;
+	key.external_dir_num = file->external_dir_num;
+
+	res = (void **) parray_bsearch(ledger, &key, ledger_key_compare);
+
+	return res ? *res : NULL;
+}
+
+static void *
+parse_validation_ledger_line(const char *line, void *arg)
+{
+	char		path[MAXPGPATH];
+	int64		external_dir_num,
+				crc,
+				size,
+				mtime,
+				inode,
+				validated,
+				blocks_checked = 0;
+	ledger_entry *entry;
+
+	/* ledger is only a hint, skip broken lines */
+	if (!get_control_value(line, "path", path, NULL, false) ||
+		!get_control_value(line, "external_dir_num", NULL, &external_dir_num, false) ||
+		!get_control_value(line, "crc", NULL, &crc, false) ||
+		!get_control_value(line, "size", NULL, &size, false) ||
+		!get_control_value(line, "mtime", NULL, &mtime, false) ||
+		!get_control_value(line, "inode", NULL, &inode, false) ||
+		!get_control_value(line, "validated", NULL, &validated, false))
+		return NULL;
+
+	/* without the mode the check is taken for CRC only */
+	get_control_value(line, "blocks", NULL, &blocks_checked, false);
+
+	entry = pgut_new(ledger_entry);
+	entry->key.rel_path = pgut_strdup(path);
+	entry->key.external_dir_num = (int) external_dir_num;
+	entry->crc = (pg_crc32) crc;
+	entry->size = size;
+	entry->mtime = (time_t) mtime;
+	entry->inode = (uint64) inode;
+	entry->validated = (time_t) validated;
+	entry->blocks_checked = blocks_checked != 0;
+
+	return entry;
+}
+
+static void
+print_validation_ledger_entry(FILE *out, void *e)
+{
+	ledger_entry *entry = (ledger_entry *) e;
+
+	fio_fprintf(out, "{\"path\":\"%s\", \"external_dir_num\":\"%d\", "
+				"\"crc\":\"%u\", \"size\":\"" INT64_FORMAT "\", "
+				"\"mtime\":\"" INT64_FORMAT "\", \"inode\":\"" UINT64_FORMAT "\", "
+				"\"validated\":\"" INT64_FORMAT "\", \"blocks\":\"%d\"}\n",
+				entry->key.rel_path, entry->key.external_dir_num, entry->crc,
+				entry->size, (int64) entry->mtime, entry->inode,
+				(int64) entry->validated, entry->blocks_checked ? 1 : 0);
+}
+
+/*
+ * Read validation ledger of the backup.
+ * Return NULL if the backup has no ledger.
+ */
+parray *
+read_validation_ledger(pgBackup *backup)
+{
+	char		ledger_path[MAXPGPATH];
+
+	join_path_components(ledger_path, backup->root_dir, VALIDATION_LEDGER);
+
+	return read_ledger(ledger_path, parse_validation_ledger_line, NULL);
+}
+
+/*
+ * Atomically replace validation ledger of the backup.
+ */
+void
+write_validation_ledger(pgBackup *backup, parray *ledger)
+{
+	char		ledger_path[MAXPGPATH];
+
+	join_path_components(ledger_path, backup->root_dir, VALIDATION_LEDGER);
+
+	write_ledger(ledger_path, NULL, ledger, print_validation_ledger_entry);
+}
+
+/* Take the number of runs from the header line of ledger file */
+static void *
+parse_ledger_run(const char *line, void *arg)
+{
+	int64		run;
+
+	if (get_control_value(line, "run", NULL, &run, false))
+		*(uint32 *) arg = (uint32) run;
+
+	return NULL;
+}
+
+/*
+ * Read the number of sampled validations of the backup done so far.
+ */
+uint32
+read_validation_sample_run(pgBackup *backup)
+{
+	char		path[MAXPGPATH];
+	uint32		run = 0;
+	parray	   *ledger;
+
+	join_path_components(path, backup->root_dir, VALIDATION_SAMPLE);
+
+	ledger = read_ledger(path, parse_ledger_run, &run);
+	if (ledger)
+		parray_free(ledger);
+
+	return run;
+}
+
+/*
+ * Store the number of sampled validations of the backup.
+ */
+void
+write_validation_sample_run(pgBackup *backup, uint32 run)
+{
+	char		path[MAXPGPATH];
+	char		header[64];
+
+	join_path_components(path, backup->root_dir, VALIDATION_SAMPLE);
+	snprintf(header, sizeof(header), "{\"run\":\"%u\"}", run);
+
+	write_ledger(path, header, NULL, NULL);
+}
+
+static void *
+parse_checkdb_ledger_line(const char *line, void *arg)
+{
+	char		path[MAXPGPATH];
+	int64		size,
+				mtime,
+				inode,
+				checked,
+				run;
+	checkdb_ledger_entry *entry;
+
+	/* header line keeps the number of runs */
+	if (get_control_value(line, "run", NULL, &run, false))
+	{
+		*(uint32 *) arg = (uint32) run;
+		return NULL;
+	}
+
+	/* ledger is only a hint, skip broken lines */
+	if (!get_control_value(line, "path", path, NULL, false) ||
+		!get_control_value(line, "size", NULL, &size, false) ||
+		!get_control_value(line, "mtime", NULL, &mtime, false) ||
+		!get_control_value(line, "inode", NULL, &inode, false) ||
+		!get_control_value(line, "checked", NULL, &checked, false))
+		return NULL;
+
+	entry = pgut_new(checkdb_ledger_entry);
+	entry->key.rel_path = pgut_strdup(path);
+	entry->key.external_dir_num = 0;
+	entry->size = size;
+	entry->mtime = (time_t) mtime;
+	entry->inode = (uint64) inode;
+	entry->checked = (time_t) checked;
+
+	return entry;
+}
+
+static void
+print_checkdb_ledger_entry(FILE *out, void *e)
+{
+	checkdb_ledger_entry *entry = (checkdb_ledger_entry *) e;
+
+	fio_fprintf(out, "{\"path\":\"%s\", \"size\":\"" INT64_FORMAT "\", "
+				"\"mtime\":\"" INT64_FORMAT "\", \"inode\":\"" UINT64_FORMAT "\", "
+				"\"checked\":\"" INT64_FORMAT "\"}\n",
+				entry->key.rel_path, entry->size, (int64) entry->mtime,
+				entry->inode, (int64) entry->checked);
+}
+
+/*
+ * Read checkdb ledger and the number of checkdb runs recorded in it.
+ * Return NULL if there is no ledger yet.
+ */
+parray *
+read_checkdb_ledger(const char *ledger_path, uint32 *run)
+{
+	*run = 0;
+
+	return read_ledger(ledger_path, parse_checkdb_ledger_line, run);
+}
+
+/*
+ * Atomically replace checkdb ledger.
+ */
+void
+write_checkdb_ledger(const char *ledger_path, parray *ledger, uint32 run)
+{
+	char		header[64];
+
+	snprintf(header, sizeof(header), "{\"run\":\"%u\"}", run);
+
+	write_ledger(ledger_path, header, ledger, print_checkdb_ledger_entry);
+}
+
+/*
+ * Durably sync the files, listed by their full paths.
+ * With SYNC_METHOD_FSYNC files are fsynced by parallel threads,
+ * with SYNC_METHOD_SYNCFS every filesystem holding the root directories
+ * of the files is synced once.
+ */
+void
+sync_files(parray *paths, parray *roots, fio_location location)
+{
+	pthread_t  *threads;
+	sync_files_arg *threads_args;
+	bool		sync_isok = true;
+	int			i;
+
+	if (parray_num(paths) == 0)
+		return;
+
+	if (sync_method == SYNC_METHOD_SYNCFS)
+	{
+		sync_filesystems(roots, location);
+		return;
+	}
+
+	threads = (pthread_t *) palloc(sizeof(pthread_t) * num_threads);
+	threads_args = (sync_files_arg *) palloc(sizeof(sync_files_arg) * num_threads);
+
+	thread_interrupted = false;
+	for (i = 0; i < num_threads; i++)
+	{
+		sync_files_arg *arg = &(threads_args[i]);
+
+		arg->paths = paths;
+		arg->location = location;
+		arg->thread_num = i;
+		/* By default there are some error */
+		arg->ret = 1;
+
+		pthread_create(&threads[i], NULL, sync_files_worker, arg);
+	}
+
+	/* Wait threads */
+	for (i = 0; i < num_threads; i++)
+	{
+		pthread_join(threads[i], NULL);
+		if (threads_args[i].ret == 1)
+			sync_isok = false;
+	}
+
+	pfree(threads);
+	pfree(threads_args);
+
+	if (!sync_isok)
+		elog(ERROR, "Syncing files failed");
+}
+
+/*
+ * Sync every num_threads-th file of the list, starting with thread_num.
+ * Writeback of all these files is started first, so that the following
+ * fsync calls mostly wait for I/O, which is already in progress.
+ */
+static void *
+sync_files_worker(void *arg)
+{
+	sync_files_arg *arguments = (sync_files_arg *) arg;
+	size_t		n_paths = parray_num(arguments->paths);
+	size_t		i;
+
+	for (i = arguments->thread_num; i < n_paths; i += num_threads)
+	{
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during sync");
+
+		/* missing file is reported by fsync below */
+		fio_sync_file((char *) parray_get(arguments->paths, i),
+					  FIO_SYNC_WRITEBACK, arguments->location);
+	}
+
+	for (i = arguments->thread_num; i < n_paths; i += num_threads)
+	{
+		char	   *path = (char *) parray_get(arguments->paths, i);
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during sync");
+
+		if (fio_sync(path, arguments->location) != 0)
+			elog(ERROR, "Cannot sync file \"%s\": %s", path, strerror(errno));
+	}
+
+	/* ssh connection to longer needed */
+	fio_disconnect();
+
+	/* Files syncing is successful */
+	arguments->ret = 0;
+
+	return NULL;
+}
+
+/*
+ * Sync every filesystem holding the root directories once.
+ * Roots are few, so the filesystems are found without
+ * stat() of every synced file.
+ */
+void
+sync_filesystems(parray *roots, fio_location location)
+{
+	dev_t	   *devices;
+	int			n_devices = 0;
+	size_t		i;
+
+	/* storage is synced by itself, there is no filesystem to sync */
+	if (fio_is_storage(location))
+		return;
+
+	devices = pgut_malloc(sizeof(dev_t) * parray_num(roots));
+
+	for (i = 0; i < parray_num(roots); i++)
+	{
+		char	   *path = (char *) parray_get(roots, i);
+		struct stat	st;
+		int			j;
+
+		if (interrupted)
+			elog(ERROR, "Interrupted during sync");
+
+		if (fio_stat(path, &st, true, location) != 0)
+			elog(ERROR, "Cannot stat directory \"%s\": %s", path, strerror(errno));
+
+		for (j = 0; j < n_devices; j++)
+		{
+			if (devices[j] == st.st_dev)
+				break;
+		}
+
+		if (j < n_devices)
+			continue;
+
+		elog(VERBOSE, "Syncing filesystem containing \"%s\"", path);
+
+		if (fio_sync_file(path, FIO_SYNC_SYNCFS, location) != 0)
+			elog(ERROR, "Cannot sync filesystem containing \"%s\": %s",
+				 path, strerror(errno));
+
+		devices[n_devices++] = st.st_dev;
+	}
+
+	pg_free(devices);
+}
+
+/*
+ * Add root directories of PGDATA files for sync_filesystems():
+ * PGDATA itself and every tablespace linked from it.
+ */
+void
+get_sync_roots(parray *roots, const char *root, parray *files)
+{
+	size_t		i;
+
+	parray_append(roots, pgut_strdup(root));
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+		char		path[MAXPGPATH];
+
+		/* links of pg_tblspc lead to tablespaces */
+		if (file->external_dir_num != 0 || !S_ISDIR(file->mode) ||
+			strncmp(file->rel_path, PG_TBLSPC_DIR "/", strlen(PG_TBLSPC_DIR "/")) != 0 ||
+			strchr(file->rel_path + strlen(PG_TBLSPC_DIR "/"), '/') != NULL)
+			continue;
+
+		join_path_components(path, root, file->rel_path);
+		parray_append(roots, pgut_strdup(path));
+	}
+}
@@ -24,6 +24,7 @@ static void help_del_instance(void);
 static void help_archive_push(void);
 static void help_archive_get(void);
 static void help_checkdb(void);
+static void help_catchup(void);
 
 void
 help_command(char *command)
@@ -58,6 +59,8 @@ help_command(char *command)
 		help_archive_get();
 	else if (strcmp(command, "checkdb") == 0)
 		help_checkdb();
+	else if (strcmp(command, "catchup") == 0)
+		help_catchup();
 	else if (strcmp(command, "--help") == 0
 			 || strcmp(command, "help") == 0
 			 || strcmp(command, "-?") == 0
@@ -80,6 +83,9 @@ help_pg_probackup(void)
 	printf(_("\n  %s version\n"), PROGRAM_NAME);
 
 	printf(_("\n  %s init -B backup-path\n"), PROGRAM_NAME);
+	printf(_("                 [--storage=posix|s3] [--s3-endpoint=url]\n"));
+	printf(_("                 [--s3-bucket=bucket] [--s3-region=region]\n"));
+	printf(_("                 [--s3-upload-threads=num] [--s3-part-size=size]\n"));
 
 	printf(_("\n  %s set-config -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path]\n"));
@@ -120,7 +126,9 @@ help_pg_probackup(void)
 	printf(_("                 [--backup-pg-log] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
 	printf(_("                 [--external-dirs=external-directories-paths]\n"));
-	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--no-sync] [--page-delta] [--resume]\n"));
+	printf(_("                 [--output=path|-] [--pack-small-files]\n"));
+	printf(_("                 [--sync-method=fsync|syncfs]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-filename=log-filename]\n"));
@@ -142,6 +150,9 @@ help_pg_probackup(void)
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n"));
 	printf(_("                 [--ttl=interval] [--expire-time=timestamp] [--note=text]\n"));
+	printf(_("                 [--storage=posix|s3] [--s3-endpoint=url]\n"));
+	printf(_("                 [--s3-bucket=bucket] [--s3-region=region]\n"));
+	printf(_("                 [--s3-upload-threads=num] [--s3-part-size=size]\n"));
 	printf(_("                 [--help]\n"));
 
 
@@ -158,9 +169,12 @@ help_pg_probackup(void)
 	printf(_("                 [--primary-conninfo=primary_conninfo]\n"));
 	printf(_("                 [-S | --primary-slot-name=slotname]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
+	printf(_("                 [--inline-validate]\n"));
 	printf(_("                 [-T OLDDIR=NEWDIR] [--progress]\n"));
 	printf(_("                 [--external-mapping=OLDDIR=NEWDIR]\n"));
-	printf(_("                 [--skip-external-dirs] [--no-sync]\n"));
+	printf(_("                 [--skip-external-dirs] [--no-sync] [--resume]\n"));
+	printf(_("                 [--input=path|-]\n"));
+	printf(_("                 [--sync-method=fsync|syncfs]\n"));
 	printf(_("                 [-I | --incremental-mode=none|checksum|lsn]\n"));
 	printf(_("                 [--db-include | --db-exclude]\n"));
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
@@ -168,21 +182,38 @@ help_pg_probackup(void)
 	printf(_("                 [--ssh-options]\n"));
 	printf(_("                 [--archive-host=hostname]\n"));
 	printf(_("                 [--archive-port=port] [--archive-user=username]\n"));
+	printf(_("                 [--storage=posix|s3] [--s3-endpoint=url]\n"));
+	printf(_("                 [--s3-bucket=bucket] [--s3-region=region]\n"));
+	printf(_("                 [--s3-upload-threads=num] [--s3-part-size=size]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s validate -B backup-path [--instance=instance_name]\n"), PROGRAM_NAME);
 	printf(_("                 [-i backup-id] [--progress] [-j num-threads]\n"));
+	printf(_("                 [--input=path|-]\n"));
 	printf(_("                 [--recovery-target-time=time|--recovery-target-xid=xid\n"));
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
 	printf(_("                 [--recovery-target-timeline=timeline]\n"));
 	printf(_("                 [--recovery-target-name=target-name]\n"));
-	printf(_("                 [--skip-block-validation]\n"));
+	printf(_("                 [--skip-block-validation] [--fast]\n"));
+	printf(_("                 [--revalidate-after=interval]\n"));
+	printf(_("                 [--sample=percent%%|pages]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s checkdb [-B backup-path] [--instance=instance_name]\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path] [--progress] [-j num-threads]\n"));
 	printf(_("                 [--amcheck] [--skip-block-validation]\n"));
-	printf(_("                 [--heapallindexed]\n"));
+	printf(_("                 [--heapallindexed] [--incremental-slices=NUM]\n"));
+	printf(_("                 [--help]\n"));
+
+	printf(_("\n  %s catchup --source-pgdata=path_to_source_pgdata\n"), PROGRAM_NAME);
+	printf(_("                 --destination-pgdata=path_to_destination_pgdata\n"));
+	printf(_("                 [--progress] [-j num-threads] [-C]\n"));
+	printf(_("                 [-S slot-name] [--temp-slot] [--no-sync]\n"));
+	printf(_("                 [--sync-method=fsync|syncfs]\n"));
+	printf(_("                 [--archive-timeout=timeout]\n"));
+	printf(_("                 [--remote-proto] [--remote-host]\n"));
+	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
+	printf(_("                 [--ssh-options]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s show -B backup-path\n"), PROGRAM_NAME);
@@ -202,6 +233,7 @@ help_pg_probackup(void)
 
 	printf(_("\n  %s merge -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 -i backup-id [--progress] [-j num-threads]\n"));
+	printf(_("                 [--in-place]\n"));
 	printf(_("                 [--help]\n"));
 
 	printf(_("\n  %s add-instance -B backup-path -D pgdata-path\n"), PROGRAM_NAME);
@@ -253,8 +285,22 @@ help_pg_probackup(void)
 static void
 help_init(void)
 {
-	printf(_("\n%s init -B backup-path\n\n"), PROGRAM_NAME);
-	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n\n"));
+	printf(_("\n%s init -B backup-path\n"), PROGRAM_NAME);
+	printf(_("                 [--storage=posix|s3] [--s3-endpoint=url]\n"));
+	printf(_("                 [--s3-bucket=bucket] [--s3-region=region]\n"));
+	printf(_("                 [--s3-upload-threads=num] [--s3-part-size=size]\n\n"));
+
+	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
+
+	printf(_("\n  Object storage options:\n"));
+	printf(_("      --storage=storage            where backup catalog is located\n"));
+	printf(_("                                   available options: 'posix', 's3' (default: posix)\n"));
+	printf(_("      --s3-endpoint=url            URL of S3-compatible object storage\n"));
+	printf(_("      --s3-bucket=bucket           bucket to keep backup catalog in\n"));
+	printf(_("      --s3-region=region           region of the bucket (default: us-east-1)\n"));
+	printf(_("      --s3-upload-threads=num      number of parts uploaded in parallel (default: 4)\n"));
+	printf(_("      --s3-part-size=size          size of multipart upload part in MB (default: 8)\n"));
+	printf(_("\n"));
 }
 
 static void
@@ -266,7 +312,9 @@ help_backup(void)
 	printf(_("                 [--backup-pg-log] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
 	printf(_("                 [-E external-directories-paths]\n"));
-	printf(_("                 [--no-sync]\n"));
+	printf(_("                 [--no-sync] [--page-delta] [--resume]\n"));
+	printf(_("                 [--output=path|-] [--pack-small-files]\n"));
+	printf(_("                 [--sync-method=fsync|syncfs]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-filename=log-filename]\n"));
@@ -287,7 +335,10 @@ help_backup(void)
 	printf(_("                 [--remote-proto] [--remote-host]\n"));
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n"));
-	printf(_("                 [--ttl=interval] [--expire-time=timestamp] [--note=text]\n\n"));
+	printf(_("                 [--ttl=interval] [--expire-time=timestamp] [--note=text]\n"));
+	printf(_("                 [--storage=posix|s3] [--s3-endpoint=url]\n"));
+	printf(_("                 [--s3-bucket=bucket] [--s3-region=region]\n"));
+	printf(_("                 [--s3-upload-threads=num] [--s3-part-size=size]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("  -b, --backup-mode=backup-mode    backup mode=FULL|PAGE|DELTA|PTRACK\n"));
@@ -306,8 +357,18 @@ help_backup(void)
 	printf(_("                                   backup some directories not from pgdata \n"));
 	printf(_("                                   (example: --external-dirs=/tmp/dir1:/tmp/dir2)\n"));
 	printf(_("      --no-sync                    do not sync backed up files to disk\n"));
+	printf(_("      --sync-method=method         method of syncing files to disk: fsync or syncfs\n"));
+	printf(_("                                   (default: fsync)\n"));
+	printf(_("      --page-delta                 store changed pages of incremental backup as\n"));
+	printf(_("                                   compressed difference with their previous version\n"));
+	printf(_("      --resume                     resume the latest interrupted backup, reusing\n"));
+	printf(_("                                   files it has already copied\n"));
 	printf(_("      --note=text                  add note to backup\n"));
 	printf(_("                                   (example: --note='backup before app update to v13.1')\n"));
+	printf(_("      --output=path|-              write backup files into single-stream container\n"));
+	printf(_("                                   in file or to standard output\n"));
+	printf(_("      --pack-small-files           store small non-data files in a few pack files\n"));
+	printf(_("                                   instead of separate files\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -377,9 +438,19 @@ help_backup(void)
 	printf(_("      --remote-path=path           path to directory with pg_probackup binary on remote host\n"));
 	printf(_("                                   (default: current binary path)\n"));
 	printf(_("      --remote-user=username       user name for ssh connection (default: current user)\n"));
+	printf(_("      --remote-window=count        number of remote requests in flight (default: 16)\n"));
 	printf(_("      --ssh-options=ssh_options    additional ssh options (default: none)\n"));
 	printf(_("                                   (example: --ssh-options='-c cipher_spec -F configfile')\n"));
 
+	printf(_("\n  Object storage options:\n"));
+	printf(_("      --storage=storage            where backup catalog is located\n"));
+	printf(_("                                   available options: 'posix', 's3' (default: posix)\n"));
+	printf(_("      --s3-endpoint=url            URL of S3-compatible object storage\n"));
+	printf(_("      --s3-bucket=bucket           bucket to keep backup catalog in\n"));
+	printf(_("      --s3-region=region           region of the bucket (default: us-east-1)\n"));
+	printf(_("      --s3-upload-threads=num      number of parts uploaded in parallel (default: 4)\n"));
+	printf(_("      --s3-part-size=size          size of multipart upload part in MB (default: 8)\n"));
+
 	printf(_("\n  Replica options:\n"));
 	printf(_("      --master-user=user_name      user name to connect to master (deprecated)\n"));
 	printf(_("      --master-db=db_name          database to connect to master (deprecated)\n"));
@@ -393,8 +464,11 @@ help_restore(void)
 {
 	printf(_("\n%s restore -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path] [-i backup-id] [-j num-threads]\n"));
-	printf(_("                 [--progress] [--force] [--no-sync]\n"));
+	printf(_("                 [--progress] [--force] [--no-sync] [--resume]\n"));
+	printf(_("                 [--input=path|-]\n"));
+	printf(_("                 [--sync-method=fsync|syncfs]\n"));
 	printf(_("                 [--no-validate] [--skip-block-validation]\n"));
+	printf(_("                 [--inline-validate]\n"));
 	printf(_("                 [-T OLDDIR=NEWDIR]\n"));
 	printf(_("                 [--external-mapping=OLDDIR=NEWDIR]\n"));
 	printf(_("                 [--skip-external-dirs]\n"));
@@ -414,7 +488,10 @@ help_restore(void)
 	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
 	printf(_("                 [--ssh-options]\n"));
 	printf(_("                 [--archive-host=hostname] [--archive-port=port]\n"));
-	printf(_("                 [--archive-user=username]\n\n"));
+	printf(_("                 [--archive-user=username]\n"));
+	printf(_("                 [--storage=posix|s3] [--s3-endpoint=url]\n"));
+	printf(_("                 [--s3-bucket=bucket] [--s3-region=region]\n"));
+	printf(_("                 [--s3-upload-threads=num] [--s3-part-size=size]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("      --instance=instance_name     name of the instance\n"));
@@ -426,8 +503,16 @@ help_restore(void)
 	printf(_("      --progress                   show progress\n"));
 	printf(_("      --force                      ignore invalid status of the restored backup\n"));
 	printf(_("      --no-sync                    do not sync restored files to disk\n"));
+	printf(_("      --sync-method=method         method of syncing files to disk: fsync or syncfs\n"));
+	printf(_("                                   (default: fsync)\n"));
+	printf(_("      --resume                     resume interrupted restore, skipping files\n"));
+	printf(_("                                   it has already restored\n"));
+	printf(_("      --input=path|-               read backup container from file or standard input\n"));
 	printf(_("      --no-validate                disable backup validation during restore\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
+	printf(_("      --inline-validate            validate backup files while restoring them\n"));
+	printf(_("                                   instead of before restore, only restored\n"));
+	printf(_("                                   files are validated, cannot be used with -I\n"));
 
 	printf(_("  -T, --tablespace-mapping=OLDDIR=NEWDIR\n"));
 	printf(_("                                   relocate the tablespace from directory OLDDIR to NEWDIR\n"));
@@ -498,13 +583,24 @@ help_restore(void)
 	printf(_("      --remote-path=path           path to directory with pg_probackup binary on remote host\n"));
 	printf(_("                                   (default: current binary path)\n"));
 	printf(_("      --remote-user=username       user name for ssh connection (default: current user)\n"));
+	printf(_("      --remote-window=count        number of remote requests in flight (default: 16)\n"));
 	printf(_("      --ssh-options=ssh_options    additional ssh options (default: none)\n"));
 	printf(_("                                   (example: --ssh-options='-c cipher_spec -F configfile')\n"));
 
 	printf(_("\n  Remote WAL archive options:\n"));
 	printf(_("      --archive-host=destination   address or hostname for ssh connection to archive host\n"));
 	printf(_("      --archive-port=port          port for ssh connection to archive host (default: 22)\n"));
-	printf(_("      --archive-user=username      user name for ssh connection to archive host (default: PostgreSQL user)\n\n"));
+	printf(_("      --archive-user=username      user name for ssh connection to archive host (default: PostgreSQL user)\n"));
+
+	printf(_("\n  Object storage options:\n"));
+	printf(_("      --storage=storage            where backup catalog is located\n"));
+	printf(_("                                   available options: 'posix', 's3' (default: posix)\n"));
+	printf(_("      --s3-endpoint=url            URL of S3-compatible object storage\n"));
+	printf(_("      --s3-bucket=bucket           bucket to keep backup catalog in\n"));
+	printf(_("      --s3-region=region           region of the bucket (default: us-east-1)\n"));
+	printf(_("      --s3-upload-threads=num      number of parts uploaded in parallel (default: 4)\n"));
+	printf(_("      --s3-part-size=size          size of multipart upload part in MB (default: 8)\n"));
+	printf(_("\n"));
 }
 
 static void
@@ -512,15 +608,19 @@ help_validate(void)
 {
 	printf(_("\n%s validate -B backup-path [--instance=instance_name]\n"), PROGRAM_NAME);
 	printf(_("                 [-i backup-id] [--progress] [-j num-threads]\n"));
+	printf(_("                 [--input=path|-]\n"));
 	printf(_("                 [--recovery-target-time=time|--recovery-target-xid=xid\n"));
 	printf(_("                  |--recovery-target-lsn=lsn [--recovery-target-inclusive=boolean]]\n"));
 	printf(_("                 [--recovery-target-timeline=timeline]\n"));
 	printf(_("                 [--recovery-target-name=target-name]\n"));
-	printf(_("                 [--skip-block-validation]\n\n"));
+	printf(_("                 [--skip-block-validation] [--fast]\n"));
+	printf(_("                 [--revalidate-after=interval]\n"));
+	printf(_("                 [--sample=percent%%|pages]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("      --instance=instance_name     name of the instance\n"));
 	printf(_("  -i, --backup-id=backup-id        backup to validate\n"));
+	printf(_("      --input=path|-               read backup container from file or standard input\n"));
 
 	printf(_("      --progress                   show progress\n"));
 	printf(_("  -j, --threads=NUM                number of parallel threads\n"));
@@ -534,6 +634,12 @@ help_validate(void)
 	printf(_("      --recovery-target-name=target-name\n"));
 	printf(_("                                   the named restore point to which recovery will proceed\n"));
 	printf(_("      --skip-block-validation      set to validate only file-level checksum\n"));
+	printf(_("      --fast                       check page header maps and file-level checksums\n"));
+	printf(_("                                   without decompressing pages\n"));
+	printf(_("      --revalidate-after=interval  do not read files, which were validated within\n"));
+	printf(_("                                   this interval and have not changed since\n"));
+	printf(_("      --sample=percent%%|pages      check only this share or number of pages\n"));
+	printf(_("                                   of each data file, next runs check other pages\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -563,7 +669,7 @@ help_checkdb(void)
 	printf(_("\n%s checkdb [-B backup-path] [--instance=instance_name]\n"), PROGRAM_NAME);
 	printf(_("                 [-D pgdata-path] [-j num-threads] [--progress]\n"));
 	printf(_("                 [--amcheck] [--skip-block-validation]\n"));
-	printf(_("                 [--heapallindexed]\n\n"));
+	printf(_("                 [--heapallindexed] [--incremental-slices=NUM]\n\n"));
 
 	printf(_("  -B, --backup-path=backup-path    location of the backup storage area\n"));
 	printf(_("      --instance=instance_name     name of the instance\n"));
@@ -578,6 +684,9 @@ help_checkdb(void)
 	printf(_("                                   using 'amcheck' or 'amcheck_next' extensions\n"));
 	printf(_("      --heapallindexed             also check that heap is indexed\n"));
 	printf(_("                                   can be used only with '--amcheck' option\n"));
+	printf(_("      --incremental-slices=NUM     check only data files changed since the previous\n"));
+	printf(_("                                   run and one of NUM slices of unchanged files\n"));
+	printf(_("                                   requires '--backup-path' and '--instance' options\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -609,6 +718,71 @@ help_checkdb(void)
 	printf(_("  -W, --password                   force password prompt\n\n"));
 }
 
+static void
+help_catchup(void)
+{
+	printf(_("\n%s catchup --source-pgdata=path_to_source_pgdata\n"), PROGRAM_NAME);
+	printf(_("                 --destination-pgdata=path_to_destination_pgdata\n"));
+	printf(_("                 [--progress] [-j num-threads] [-C]\n"));
+	printf(_("                 [-S slot-name] [--temp-slot] [--no-sync]\n"));
+	printf(_("                 [--sync-method=fsync|syncfs]\n"));
+	printf(_("                 [--archive-timeout=timeout]\n"));
+	printf(_("                 [--remote-proto] [--remote-host]\n"));
+	printf(_("                 [--remote-port] [--remote-path] [--remote-user]\n"));
+	printf(_("                 [--ssh-options]\n\n"));
+
+	printf(_("      --source-pgdata=path_to_source_pgdata\n"));
+	printf(_("                                   location of the database storage area of running instance\n"));
+	printf(_("      --destination-pgdata=path_to_destination_pgdata\n"));
+	printf(_("                                   location of the database storage area of stopped instance,\n"));
+	printf(_("                                   which must be brought in sync with the running one\n"));
+	printf(_("      --progress                   show progress\n"));
+	printf(_("  -j, --threads=NUM                number of parallel threads\n"));
+	printf(_("  -C, --smooth-checkpoint          do smooth checkpoint before catchup\n"));
+	printf(_("  -S, --slot=SLOTNAME              replication slot to use\n"));
+	printf(_("      --temp-slot                  use temporary replication slot\n"));
+	printf(_("      --no-sync                    do not sync copied files to disk\n"));
+	printf(_("      --sync-method=method         method of syncing files to disk: fsync or syncfs\n"));
+	printf(_("                                   (default: fsync)\n"));
+	printf(_("      --archive-timeout=timeout    wait timeout for WAL segment streaming\n"));
+	printf(_("                                   (default: 5min)\n"));
+
+	printf(_("\n  Logging options:\n"));
+	printf(_("      --log-level-console=log-level-console\n"));
+	printf(_("                                   level for console logging (default: info)\n"));
+	printf(_("                                   available options: 'off', 'error', 'warning', 'info', 'log', 'verbose'\n"));
+	printf(_("      --log-level-file=log-level-file\n"));
+	printf(_("                                   level for file logging (default: off)\n"));
+	printf(_("                                   available options: 'off', 'error', 'warning', 'info', 'log', 'verbose'\n"));
+	printf(_("      --log-filename=log-filename\n"));
+	printf(_("                                   filename for file logging (default: 'pg_probackup.log')\n"));
+	printf(_("                                   support strftime format (example: pg_probackup-%%Y-%%m-%%d_%%H%%M%%S.log\n"));
+	printf(_("      --error-log-filename=error-log-filename\n"));
+	printf(_("                                   filename for error logging (default: none)\n"));
+	printf(_("      --log-directory=log-directory\n"));
+	printf(_("                                   directory for file logging\n"));
+
+	printf(_("\n  Connection options:\n"));
+	printf(_("  -U, --pguser=USERNAME            user name to connect as (default: current local user)\n"));
+	printf(_("  -d, --pgdatabase=DBNAME          database to connect (default: username)\n"));
+	printf(_("  -h, --pghost=HOSTNAME            database server host or socket directory(default: 'local socket')\n"));
+	printf(_("  -p, --pgport=PORT                database server port (default: 5432)\n"));
+	printf(_("  -w, --no-password                never prompt for password\n"));
+	printf(_("  -W, --password                   force password prompt\n"));
+
+	printf(_("\n  Remote options:\n"));
+	printf(_("      --remote-proto=protocol      remote protocol to use\n"));
+	printf(_("                                   available options: 'ssh', 'none' (default: ssh)\n"));
+	printf(_("      --remote-host=hostname       remote host address or hostname\n"));
+	printf(_("      --remote-port=port           remote host port (default: 22)\n"));
+	printf(_("      --remote-path=path           path to directory with pg_probackup binary on remote host\n"));
+	printf(_("                                   (default: current binary path)\n"));
+	printf(_("      --remote-user=username       user name for ssh connection (default: current user)\n"));
+	printf(_("      --remote-window=count        number of remote requests in flight (default: 16)\n"));
+	printf(_("      --ssh-options=ssh_options    additional ssh options (default: none)\n"));
+	printf(_("                                   (example: --ssh-options='-c cipher_spec -F configfile')\n\n"));
+}
+
 static void
 help_show(void)
 {
@@ -681,6 +855,7 @@ help_merge(void)
 {
 	printf(_("\n%s merge -B backup-path --instance=instance_name\n"), PROGRAM_NAME);
 	printf(_("                 -i backup-id [-j num-threads] [--progress]\n"));
+	printf(_("                 [--in-place]\n"));
 	printf(_("                 [--log-level-console=log-level-console]\n"));
 	printf(_("                 [--log-level-file=log-level-file]\n"));
 	printf(_("                 [--log-filename=log-filename]\n"));
@@ -695,6 +870,8 @@ help_merge(void)
 
 	printf(_("  -j, --threads=NUM                number of parallel threads\n"));
 	printf(_("      --progress                   show progress\n"));
+	printf(_("      --in-place                   append changed pages to data files of FULL backup\n"));
+	printf(_("                                   instead of rewriting them\n"));
 
 	printf(_("\n  Logging options:\n"));
 	printf(_("      --log-level-console=log-level-console\n"));
@@ -820,6 +997,7 @@ help_set_config(void)
 	printf(_("      --remote-path=path           path to directory with pg_probackup binary on remote host\n"));
 	printf(_("                                   (default: current binary path)\n"));
 	printf(_("      --remote-user=username       user name for ssh connection (default: current user)\n"));
+	printf(_("      --remote-window=count        number of remote requests in flight (default: 16)\n"));
 	printf(_("      --ssh-options=ssh_options    additional ssh options (default: none)\n"));
 	printf(_("                                   (example: --ssh-options='-c cipher_spec -F configfile')\n"));
 
@@ -872,6 +1050,7 @@ help_add_instance(void)
 	printf(_("      --remote-path=path           path to directory with pg_probackup binary on remote host\n"));
 	printf(_("                                   (default: current binary path)\n"));
 	printf(_("      --remote-user=username       user name for ssh connection (default: current user)\n"));
+	printf(_("      --remote-window=count        number of remote requests in flight (default: 16)\n"));
 	printf(_("      --ssh-options=ssh_options    additional ssh options (default: none)\n"));
 	printf(_("                                   (example: --ssh-options='-c cipher_spec -F configfile')\n\n"));
 }
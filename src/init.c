@@ -23,7 +23,10 @@ do_init(void)
 	char		arclog_path_dir[MAXPGPATH];
 	int			results;
 
-	results = pg_check_dir(backup_path);
+	if (fio_is_storage(FIO_BACKUP_HOST))
+		results = dir_is_empty(backup_path, FIO_BACKUP_HOST) ? 0 : 4;
+	else
+		results = pg_check_dir(backup_path);
 	if (results == 4)	/* exists and not empty*/
 		elog(ERROR, "backup catalog already exist and it's not empty");
 	else if (results == -1) /*trouble accessing directory*/
@@ -34,15 +37,21 @@ do_init(void)
 	}
 
 	/* create backup catalog root directory */
-	dir_create_dir(backup_path, DIR_PERMISSION);
+	if (fio_mkdir(backup_path, DIR_PERMISSION, FIO_BACKUP_HOST) < 0)
+		elog(ERROR, "Cannot create directory \"%s\": %s",
+			 backup_path, strerror(errno));
 
 	/* create backup catalog data directory */
 	join_path_components(path, backup_path, BACKUPS_DIR);
-	dir_create_dir(path, DIR_PERMISSION);
+	if (fio_mkdir(path, DIR_PERMISSION, FIO_BACKUP_HOST) < 0)
+		elog(ERROR, "Cannot create directory \"%s\": %s",
+			 path, strerror(errno));
 
 	/* create backup catalog wal directory */
 	join_path_components(arclog_path_dir, backup_path, "wal");
-	dir_create_dir(arclog_path_dir, DIR_PERMISSION);
+	if (fio_mkdir(arclog_path_dir, DIR_PERMISSION, FIO_BACKUP_HOST) < 0)
+		elog(ERROR, "Cannot create directory \"%s\": %s",
+			 arclog_path_dir, strerror(errno));
 
 	elog(INFO, "Backup catalog '%s' successfully inited", backup_path);
 	return 0;
@@ -61,23 +70,23 @@ do_add_instance(InstanceConfig *instance)
 						 "(-D, --pgdata)");
 
 	/* Read system_identifier from PGDATA */
-	instance->system_identifier = get_system_identifier(instance->pgdata);
+	instance->system_identifier = get_system_identifier(instance->pgdata, FIO_DB_HOST);
 	/* Starting from PostgreSQL 11 read WAL segment size from PGDATA */
 	instance->xlog_seg_size = get_xlog_seg_size(instance->pgdata);
 
 	/* Ensure that all root directories already exist */
-	if (access(backup_path, F_OK) != 0)
+	if (fio_access(backup_path, F_OK, FIO_BACKUP_HOST) != 0)
 		elog(ERROR, "Directory does not exist: '%s'", backup_path);
 
 	join_path_components(path, backup_path, BACKUPS_DIR);
-	if (access(path, F_OK) != 0)
+	if (fio_access(path, F_OK, FIO_BACKUP_HOST) != 0)
 		elog(ERROR, "Directory does not exist: '%s'", path);
 
 	join_path_components(arclog_path_dir, backup_path, "wal");
-	if (access(arclog_path_dir, F_OK) != 0)
+	if (fio_access(arclog_path_dir, F_OK, FIO_BACKUP_HOST) != 0)
 		elog(ERROR, "Directory does not exist: '%s'", arclog_path_dir);
 
-	if (stat(instance->backup_instance_path, &st) == 0 && S_ISDIR(st.st_mode))
+	if (fio_stat(instance->backup_instance_path, &st, true, FIO_BACKUP_HOST) == 0 && S_ISDIR(st.st_mode))
 		elog(ERROR, "Instance '%s' backup directory already exists: '%s'",
 			instance->name, instance->backup_instance_path);
 
@@ -86,13 +95,17 @@ do_add_instance(InstanceConfig *instance)
 	 * Existence check is extra paranoid because if we don't have such a
 	 * directory in data dir, we shouldn't have it in wal as well.
 	 */
-	if (stat(instance->arclog_path, &st) == 0 && S_ISDIR(st.st_mode))
+	if (fio_stat(instance->arclog_path, &st, true, FIO_BACKUP_HOST) == 0 && S_ISDIR(st.st_mode))
 		elog(ERROR, "Instance '%s' WAL archive directory already exists: '%s'",
 				instance->name, instance->arclog_path);
 
 	/* Create directory for data files of this specific instance */
-	dir_create_dir(instance->backup_instance_path, DIR_PERMISSION);
-	dir_create_dir(instance->arclog_path, DIR_PERMISSION);
+	if (fio_mkdir(instance->backup_instance_path, DIR_PERMISSION, FIO_BACKUP_HOST) < 0)
+		elog(ERROR, "Cannot create directory \"%s\": %s",
+			 instance->backup_instance_path, strerror(errno));
+	if (fio_mkdir(instance->arclog_path, DIR_PERMISSION, FIO_BACKUP_HOST) < 0)
+		elog(ERROR, "Cannot create directory \"%s\": %s",
+			 instance->arclog_path, strerror(errno));
 
 	/*
 	 * Write initial configuration file.
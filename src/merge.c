@@ -58,6 +58,31 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 				pgFile *tmp_file, const char *full_database_dir,
 				const char *full_external_prefix);
 
+static void
+merge_packed_file(pgBackup *from_backup, pgFile *from_file,
+				  pgFile *tmp_file, const char *to_fullpath_tmp);
+
+static bool
+merge_data_file_copy(parray *parent_chain, pgFile *dest_file, pgFile *tmp_file,
+				const char *to_fullpath, CompressAlg calg, HeaderMap *hdr_map);
+
+static bool
+merge_data_file_patch(parray *parent_chain, pgBackup *full_backup,
+				pgBackup *dest_backup, pgFile *dest_file, pgFile *tmp_file,
+				const char *to_fullpath);
+
+static void merge_journal_append(pgBackup *full_backup, pgFile *file);
+static void merge_journal_replay(pgBackup *full_backup);
+static void merge_journal_remove(pgBackup *full_backup);
+
+/*
+ * Journal of data files of FULL backup patched by in-place merge.
+ * Every entry contains the size of the file before patching, so
+ * failed merge can be rolled back by truncating the files.
+ */
+static FILE *merge_journal = NULL;
+static pthread_mutex_t merge_journal_lock = PTHREAD_MUTEX_INITIALIZER;
+
 /*
  * Implementation of MERGE command.
  *
@@ -516,6 +541,12 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 				backup->program_version,
 				PROGRAM_VERSION);
 		}
+
+		/* Files kept in container cannot be rewritten */
+		if (backup->container)
+			elog(ERROR, "Backup %s is written into container \"%s\", "
+						"merge is not supported",
+				base36enc(backup->start_time), backup->container);
 	}
 
 	/* If destination backup compression algorithm differs from
@@ -559,6 +590,13 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 			"changes introduced in 2.4.0 version, please take a new full backup");
 	}
 
+	/*
+	 * Files of FULL backup may have been patched by failed in-place merge,
+	 * truncate them to their original size.
+	 */
+	if (is_retry)
+		merge_journal_replay(full_backup);
+
 	/*
 	 * Validate or revalidate all members of parent chain
 	 * with sole exception of FULL backup. If it has MERGING status
@@ -595,6 +633,9 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 		backup->files = get_backup_filelist(backup, true);
 		parray_qsort(backup->files, pgFileCompareRelPathWithExternal);
 
+		/* chain members are looked up for every destination file */
+		pgBackupIndexFiles(backup);
+
 		/* Set MERGING status for every member of the chain */
 		if (backup->backup_mode == BACKUP_MODE_FULL)
 		{
@@ -610,6 +651,30 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 			write_backup_status(backup, BACKUP_STATUS_MERGING, instance_name, true);
 	}
 
+	/*
+	 * Delta encoded pages are decoded against previous versions of pages,
+	 * kept in FULL backup. When retrying, FULL backup may already contain
+	 * merged files, so decoding of such pages is not possible.
+	 */
+	if (is_retry)
+	{
+		for (i = parray_num(parent_chain) - 2; i >= 0; i--)
+		{
+			pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+			int			j;
+
+			for (j = 0; j < parray_num(backup->files); j++)
+			{
+				pgFile	   *file = (pgFile *) parray_get(backup->files, j);
+
+				if (file->delta_encoded)
+					elog(ERROR, "Retry of failed merge is not supported for backup %s, "
+						"because it contains delta encoded pages, please take a new full backup",
+						base36enc(backup->start_time));
+			}
+		}
+	}
+
 	/* Construct path to database dir: /backup_dir/instance_name/FULL/database */
 	join_path_components(full_database_dir, full_backup->root_dir, DATABASE_DIR);
 	/* Construct path to external dir: /backup_dir/instance_name/FULL/external */
@@ -635,6 +700,26 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 	if (parse_program_version(dest_backup->program_version) < 20300)
 		use_bitmap = false;
 
+	/*
+	 * When retrying, patched files of FULL backup are read without page
+	 * headers, so superseded records are read too. They precede the newer
+	 * versions of the same blocks, so the file must be restored from
+	 * oldest to newest records, without bitmap.
+	 */
+	if (is_retry && use_bitmap)
+	{
+		for (i = 0; i < parray_num(full_backup->files); i++)
+		{
+			pgFile	   *file = (pgFile *) parray_get(full_backup->files, i);
+
+			if (file->patched)
+			{
+				use_bitmap = false;
+				break;
+			}
+		}
+	}
+
 	/* Setup threads */
 	for (i = 0; i < parray_num(dest_backup->files); i++)
 	{
@@ -710,6 +795,15 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 		elog(ERROR, "Backup files merging failed, time elapsed: %s",
 				pretty_time);
 
+	/* All patched files are synced, journal is not needed anymore */
+	if (merge_journal)
+	{
+		if (fclose(merge_journal) != 0)
+			elog(ERROR, "Cannot close merge journal of backup %s: %s",
+				 base36enc(full_backup->start_time), strerror(errno));
+		merge_journal = NULL;
+	}
+
 	/* If temp header map is open, then close it and make rename */
 	if (full_backup->hdr_map.fp)
 	{
@@ -804,7 +898,7 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 				continue;
 		}
 
-		if (parray_bsearch(dest_backup->files, full_file, pgFileCompareRelPathWithExternalDesc) == NULL)
+		if (pgBackupSearchFile(dest_backup, full_file) == NULL)
 		{
 			char		full_file_path[MAXPGPATH];
 
@@ -824,6 +918,9 @@ merge_chain(parray *parent_chain, pgBackup *full_backup, pgBackup *dest_backup)
 	write_backup(full_backup, true);
 
 merge_delete:
+	/* New file list describes patched files, so journal can be removed */
+	merge_journal_remove(full_backup);
+
 	for (i = parray_num(parent_chain) - 2; i >= 0; i--)
 	{
 		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
@@ -922,6 +1019,7 @@ merge_rename:
 
 		if (backup->files)
 		{
+			pgBackupFreeFilesIndex(backup);
 			parray_walk(backup->files, pgFileFree);
 			parray_free(backup->files);
 		}
@@ -1025,7 +1123,7 @@ merge_files(void *arg)
 				pgBackup   *backup = (pgBackup *) parray_get(arguments->parent_chain, i);
 
 				/* lookup file in intermediate backup */
-				res_file =  parray_bsearch(backup->files, dest_file, pgFileCompareRelPathWithExternal);
+				res_file =  pgBackupSearchFile(backup, dest_file);
 				file = (res_file) ? *res_file : NULL;
 
 				/* Destination file is not exists yet,
@@ -1059,8 +1157,7 @@ merge_files(void *arg)
 		{
 			pgFile	   **res_file = NULL;
 			pgFile	   *file = NULL;
-			res_file = parray_bsearch(arguments->full_backup->files, dest_file,
-										pgFileCompareRelPathWithExternal);
+			res_file = pgBackupSearchFile(arguments->full_backup, dest_file);
 			file = (res_file) ? *res_file : NULL;
 
 			/* If file didn`t changed in any way, then in-place merge is possible */
@@ -1075,6 +1172,10 @@ merge_files(void *arg)
 				tmp_file->crc = file->crc;
 				tmp_file->write_size = file->write_size;
 
+				/* packed file stays in pack file of FULL backup */
+				tmp_file->pack_num = file->pack_num;
+				tmp_file->pack_off = file->pack_off;
+
 				if (dest_file->is_datafile && !dest_file->is_cfs)
 				{
 					tmp_file->n_blocks = file->n_blocks;
@@ -1083,6 +1184,9 @@ merge_files(void *arg)
 
 					tmp_file->n_headers = file->n_headers;
 					tmp_file->hdr_crc = file->hdr_crc;
+
+					tmp_file->patched = file->patched;
+					tmp_file->dead_size = file->dead_size;
 				}
 				else
 					tmp_file->uncompressed_size = tmp_file->write_size;
@@ -1230,6 +1334,32 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	snprintf(to_fullpath_tmp1, MAXPGPATH, "%s_tmp1", to_fullpath);
 	snprintf(to_fullpath_tmp2, MAXPGPATH, "%s_tmp2", to_fullpath);
 
+	/*
+	 * In-place merge appends changed pages to the file of FULL backup.
+	 * Page header map cannot be trusted when retrying.
+	 */
+	if (merge_in_place && use_bitmap && !is_retry &&
+		merge_data_file_patch(parent_chain, full_backup, dest_backup,
+							  dest_file, tmp_file, to_fullpath))
+	{
+		pg_free(buffer);
+		return;
+	}
+
+	/*
+	 * If every page of the file is stored in the chain with the same
+	 * compression algorithm, which destination backup is using, then
+	 * page records can be copied without decompression and recompression.
+	 * Page header map cannot be trusted when retrying.
+	 */
+	if (use_bitmap && !is_retry &&
+		merge_data_file_copy(parent_chain, dest_file, tmp_file, to_fullpath_tmp2,
+							 dest_backup->compress_alg, &(full_backup->hdr_map)))
+	{
+		pg_free(buffer);
+		goto merge_rename;
+	}
+
 	/* open temp file */
 	out = fopen(to_fullpath_tmp1, PG_BINARY_W);
 	if (out == NULL)
@@ -1241,7 +1371,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	tmp_file->size = restore_data_file(parent_chain, dest_file, out, to_fullpath_tmp1,
 									   use_bitmap, NULL, InvalidXLogRecPtr, NULL,
 									   /* when retrying merge header map cannot be trusted */
-									   is_retry ? false : true);
+									   is_retry ? false : true, false);
 	if (fclose(out) != 0)
 		elog(ERROR, "Cannot close file \"%s\": %s",
 			 to_fullpath_tmp1, strerror(errno));
@@ -1260,7 +1390,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 				 InvalidXLogRecPtr, BACKUP_MODE_FULL,
 				 dest_backup->compress_alg, dest_backup->compress_level,
 				 dest_backup->checksum_version, 0, NULL,
-				 &(full_backup->hdr_map), true);
+				 NULL, &(full_backup->hdr_map), true);
 
 	/* drop restored temp file */
 	if (unlink(to_fullpath_tmp1) == -1)
@@ -1282,6 +1412,7 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	if (tmp_file->write_size == 0)
 		return;
 
+merge_rename:
 	/* sync second temp file to disk */
 	if (fio_sync(to_fullpath_tmp2, FIO_BACKUP_HOST) != 0)
 		elog(ERROR, "Cannot sync merge temp file \"%s\": %s",
@@ -1296,6 +1427,647 @@ merge_data_file(parray *parent_chain, pgBackup *full_backup,
 	unlink(to_fullpath_tmp1);
 }
 
+/*
+ * Assemble data file from page records of parent chain members, copying
+ * them byte-for-byte into "to_fullpath". For every block the newest
+ * version in the chain is taken, the same way restore_data_file() does it.
+ * New page headers are written into temp header map of FULL backup.
+ *
+ * Returns false without writing anything into header map, if the file
+ * cannot be assembled this way, e.g. some of its pages were compressed
+ * with different algorithm, are delta encoded or stored by old version
+ * without page headers. In this case the usual restore and backup
+ * path should be used.
+ */
+static bool
+merge_data_file_copy(parray *parent_chain, pgFile *dest_file, pgFile *tmp_file,
+				const char *to_fullpath, CompressAlg calg, HeaderMap *hdr_map)
+{
+	int			i;
+	int			n_chain = parray_num(parent_chain);
+	bool		success = false;
+	FILE	  **in;
+	pgFile	  **files;
+	BackupPageHeader2 **headers;
+	int		   *n_hdr;
+	BackupPageHeader2 *out_headers = NULL;
+	FILE	   *out = NULL;
+	char	   *out_buf = NULL;
+	off_t		cur_pos_out = 0;
+	BlockNumber blknum;
+
+	if (dest_file->n_blocks == BLOCKNUM_INVALID || dest_file->n_blocks == 0)
+		return false;
+
+	in = (FILE **) palloc0(n_chain * sizeof(FILE *));
+	files = (pgFile **) palloc0(n_chain * sizeof(pgFile *));
+	headers = (BackupPageHeader2 **) palloc0(n_chain * sizeof(BackupPageHeader2 *));
+	n_hdr = (int *) palloc0(n_chain * sizeof(int));
+
+	/* Check that every stored version of the file can be copied */
+	for (i = 0; i < n_chain; i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+		pgFile	  **res_file = NULL;
+		pgFile	   *file = NULL;
+		char		from_root[MAXPGPATH];
+		char		from_fullpath[MAXPGPATH];
+
+		res_file = pgBackupSearchFile(backup, dest_file);
+		file = (res_file) ? *res_file : NULL;
+
+		/* Skip the same files as restore_data_file() does */
+		if (file == NULL || file->write_size == BYTES_INVALID ||
+			file->write_size == 0)
+			continue;
+
+		if (parse_program_version(backup->program_version) < 20400 ||
+			file->compress_alg != calg || file->delta_encoded ||
+			file->n_headers <= 0)
+			goto cleanup;
+
+		headers[i] = get_data_file_headers(&(backup->hdr_map), file,
+										   parse_program_version(backup->program_version),
+										   true);
+		if (!headers[i])
+			elog(ERROR, "Failed to get page headers for file \"%s\" in backup %s",
+				 file->rel_path, base36enc(backup->start_time));
+
+		join_path_components(from_root, backup->root_dir, DATABASE_DIR);
+		join_path_components(from_fullpath, from_root, file->rel_path);
+
+		in[i] = fopen(from_fullpath, PG_BINARY_R);
+		if (in[i] == NULL)
+			elog(ERROR, "Cannot open backup file \"%s\": %s", from_fullpath,
+				 strerror(errno));
+
+		files[i] = file;
+	}
+
+	out = fopen(to_fullpath, PG_BINARY_W);
+	if (out == NULL)
+		elog(ERROR, "Cannot open merge target file \"%s\": %s",
+			 to_fullpath, strerror(errno));
+
+	out_buf = pgut_malloc(STDIO_BUFSIZE);
+	setvbuf(out, out_buf, _IOFBF, STDIO_BUFSIZE);
+
+	tmp_file->read_size = 0;
+	tmp_file->write_size = 0;
+	tmp_file->uncompressed_size = 0;
+	INIT_FILE_CRC32(true, tmp_file->crc);
+
+	out_headers = (BackupPageHeader2 *) pgut_malloc((dest_file->n_blocks + 1) *
+													sizeof(BackupPageHeader2));
+
+	for (blknum = 0; blknum < dest_file->n_blocks; blknum++)
+	{
+		BackupPageHeader2 *hdr = NULL;
+		char		page[sizeof(BackupPageHeader) + BLCKSZ];
+		size_t		read_len;
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during merge");
+
+		/* Lookup the newest version of the block, headers are sorted by block */
+		for (i = 0; i < n_chain; i++)
+		{
+			if (!files[i])
+				continue;
+
+			while (n_hdr[i] < files[i]->n_headers &&
+				   headers[i][n_hdr[i]].block < blknum)
+				n_hdr[i]++;
+
+			if (n_hdr[i] < files[i]->n_headers &&
+				headers[i][n_hdr[i]].block == blknum)
+			{
+				hdr = &headers[i][n_hdr[i]];
+				break;
+			}
+		}
+
+		/* Block is missing in the whole chain, let restore deal with it */
+		if (!hdr)
+			goto cleanup;
+
+		read_len = get_page_record_size(in[i], files[i], headers[i], n_hdr[i],
+										files[i]->rel_path) + sizeof(BackupPageHeader);
+
+		if (read_len <= sizeof(BackupPageHeader) ||
+			read_len > sizeof(BackupPageHeader) + BLCKSZ)
+			elog(ERROR, "Invalid size of block %u in file \"%s\": %zu",
+				 blknum, files[i]->rel_path, read_len);
+
+		if (fseek(in[i], hdr->pos, SEEK_SET) != 0)
+			elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+				 hdr->pos, files[i]->rel_path, strerror(errno));
+
+		if (fread(page, 1, read_len, in[i]) != read_len)
+			elog(ERROR, "Cannot read block %u of \"%s\": %s",
+				 blknum, files[i]->rel_path, strerror(errno));
+
+		if (((BackupPageHeader *) page)->block != blknum)
+			elog(ERROR, "Block %u of \"%s\" has invalid block number %u",
+				 blknum, files[i]->rel_path, ((BackupPageHeader *) page)->block);
+
+		out_headers[blknum].block = blknum;
+		out_headers[blknum].pos = cur_pos_out;
+		out_headers[blknum].lsn = hdr->lsn;
+		out_headers[blknum].checksum = hdr->checksum;
+
+		COMP_FILE_CRC32(true, tmp_file->crc, page, read_len);
+
+		if (fwrite(page, 1, read_len, out) != read_len)
+			elog(ERROR, "Cannot write block %u of \"%s\": %s",
+				 blknum, to_fullpath, strerror(errno));
+
+		cur_pos_out += read_len;
+		tmp_file->write_size += read_len;
+		tmp_file->uncompressed_size += BLCKSZ;
+	}
+
+	/* dummy header, used to get the length of the last page */
+	out_headers[dest_file->n_blocks].pos = cur_pos_out;
+
+	if (fclose(out) != 0)
+		elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath, strerror(errno));
+	out = NULL;
+
+	FIN_FILE_CRC32(true, tmp_file->crc);
+
+	tmp_file->n_blocks = dest_file->n_blocks;
+	tmp_file->size = tmp_file->n_blocks * BLCKSZ;
+	tmp_file->read_size = tmp_file->size;
+	tmp_file->compress_alg = calg;
+	tmp_file->n_headers = dest_file->n_blocks;
+
+	write_page_headers(out_headers, tmp_file, hdr_map, true);
+
+	elog(VERBOSE, "Page records of file \"%s\" are copied without recompression",
+		 tmp_file->rel_path);
+
+	success = true;
+
+cleanup:
+	if (out)
+	{
+		fclose(out);
+		if (unlink(to_fullpath) == -1)
+			elog(ERROR, "Cannot remove file \"%s\": %s", to_fullpath,
+				 strerror(errno));
+	}
+
+	for (i = 0; i < n_chain; i++)
+	{
+		if (in[i] && fclose(in[i]))
+			elog(ERROR, "Cannot close file \"%s\": %s",
+				 files[i]->rel_path, strerror(errno));
+		pg_free(headers[i]);
+	}
+
+	pg_free(in);
+	pg_free(files);
+	pg_free(headers);
+	pg_free(n_hdr);
+	pg_free(out_headers);
+	pg_free(out_buf);
+
+	return success;
+}
+
+/*
+ * In-place merge of data file: page records, changed in incremental
+ * backups, are appended to the file of FULL backup and new page headers
+ * point either to the old records or to the appended ones. Merge I/O is
+ * thus proportional to the size of incremental backups.
+ *
+ * The size of the file before patching is saved in merge journal, so
+ * merge failed in the middle can be rolled back.
+ *
+ * Returns false without touching the file, if in-place merge is not
+ * possible or superseded records would take more space than the live
+ * ones, so the file should be rewritten instead.
+ */
+static bool
+merge_data_file_patch(parray *parent_chain, pgBackup *full_backup,
+				pgBackup *dest_backup, pgFile *dest_file, pgFile *tmp_file,
+				const char *to_fullpath)
+{
+	int			i;
+	int			n_chain = parray_num(parent_chain);
+	int			full_idx = n_chain - 1;
+	bool		success = false;
+	pgFile	  **res_file = NULL;
+	pgFile	   *full_file = NULL;
+	FILE	  **in;
+	pgFile	  **files;
+	BackupPageHeader2 **headers;
+	int		   *n_hdr;
+	int		   *src_idx = NULL;
+	BackupPageHeader2 **src_hdr = NULL;
+	BackupPageHeader2 *out_headers = NULL;
+	FILE	   *out = NULL;
+	off_t		cur_pos_out;
+	int64		append_size = 0;
+	int64		dead_size = 0;
+	int			n_appended = 0;
+	pg_crc32	crc;
+	struct stat	st;
+	BlockNumber blknum;
+
+	if (dest_file->n_blocks == BLOCKNUM_INVALID || dest_file->n_blocks == 0)
+		return false;
+
+	res_file = pgBackupSearchFile(full_backup, dest_file);
+	full_file = (res_file) ? *res_file : NULL;
+
+	/* There is nothing to patch */
+	if (full_file == NULL || full_file->write_size <= 0 ||
+		full_file->n_headers <= 0 ||
+		full_file->compress_alg != dest_backup->compress_alg ||
+		parse_program_version(full_backup->program_version) < 20400)
+		return false;
+
+	/* Appended records must follow the last byte, described by file list */
+	if (stat(to_fullpath, &st) == -1)
+		elog(ERROR, "Cannot stat file \"%s\": %s", to_fullpath, strerror(errno));
+
+	if (st.st_size != full_file->write_size)
+		return false;
+
+	in = (FILE **) palloc0(n_chain * sizeof(FILE *));
+	files = (pgFile **) palloc0(n_chain * sizeof(pgFile *));
+	headers = (BackupPageHeader2 **) palloc0(n_chain * sizeof(BackupPageHeader2 *));
+	n_hdr = (int *) palloc0(n_chain * sizeof(int));
+
+	/* Check that every stored version of the file can be appended as is */
+	for (i = 0; i < n_chain; i++)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+		pgFile	   *file = NULL;
+		char		from_root[MAXPGPATH];
+		char		from_fullpath[MAXPGPATH];
+
+		res_file = pgBackupSearchFile(backup, dest_file);
+		file = (res_file) ? *res_file : NULL;
+
+		/* Skip the same files as restore_data_file() does */
+		if (file == NULL || file->write_size == BYTES_INVALID ||
+			file->write_size == 0)
+			continue;
+
+		if (parse_program_version(backup->program_version) < 20400 ||
+			file->compress_alg != full_file->compress_alg ||
+			file->delta_encoded || file->n_headers <= 0)
+			goto cleanup;
+
+		headers[i] = get_data_file_headers(&(backup->hdr_map), file,
+										   parse_program_version(backup->program_version),
+										   true);
+		if (!headers[i])
+			elog(ERROR, "Failed to get page headers for file \"%s\" in backup %s",
+				 file->rel_path, base36enc(backup->start_time));
+
+		join_path_components(from_root, backup->root_dir, DATABASE_DIR);
+		join_path_components(from_fullpath, from_root, file->rel_path);
+
+		in[i] = fopen(from_fullpath, PG_BINARY_R);
+		if (in[i] == NULL)
+			elog(ERROR, "Cannot open backup file \"%s\": %s", from_fullpath,
+				 strerror(errno));
+
+		files[i] = file;
+	}
+
+	/* sanity */
+	if (files[full_idx] != full_file)
+		goto cleanup;
+
+	/*
+	 * Plan the patch: for every block find the newest version in the chain
+	 * and calculate the size of appended and superseded records.
+	 */
+	src_idx = (int *) palloc(dest_file->n_blocks * sizeof(int));
+	src_hdr = (BackupPageHeader2 **) palloc(dest_file->n_blocks * sizeof(BackupPageHeader2 *));
+
+	for (blknum = 0; blknum < dest_file->n_blocks; blknum++)
+	{
+		bool		in_full = false;
+
+		src_idx[blknum] = -1;
+		src_hdr[blknum] = NULL;
+
+		for (i = 0; i < n_chain; i++)
+		{
+			if (!files[i])
+				continue;
+
+			while (n_hdr[i] < files[i]->n_headers &&
+				   headers[i][n_hdr[i]].block < blknum)
+				n_hdr[i]++;
+
+			if (n_hdr[i] < files[i]->n_headers &&
+				headers[i][n_hdr[i]].block == blknum)
+			{
+				if (i == full_idx)
+					in_full = true;
+
+				if (src_idx[blknum] < 0)
+				{
+					src_idx[blknum] = i;
+					src_hdr[blknum] = &headers[i][n_hdr[i]];
+				}
+			}
+		}
+
+		/* Block is missing in the whole chain, let restore deal with it */
+		if (src_idx[blknum] < 0)
+			goto cleanup;
+
+		if (src_idx[blknum] == full_idx)
+			continue;
+
+		n_appended++;
+		append_size += sizeof(BackupPageHeader) +
+			get_page_record_size(in[src_idx[blknum]], files[src_idx[blknum]],
+								 headers[src_idx[blknum]], n_hdr[src_idx[blknum]],
+								 files[src_idx[blknum]]->rel_path);
+
+		/* old version of the block in FULL backup is superseded */
+		if (in_full)
+			dead_size += sizeof(BackupPageHeader) +
+				get_page_record_size(in[full_idx], full_file, headers[full_idx],
+									 n_hdr[full_idx], to_fullpath);
+	}
+
+	/* Blocks of FULL backup past the end of the file are superseded too */
+	for (i = n_hdr[full_idx]; i < full_file->n_headers; i++)
+	{
+		if (headers[full_idx][i].block < dest_file->n_blocks)
+			continue;
+
+		dead_size += sizeof(BackupPageHeader) +
+			get_page_record_size(in[full_idx], full_file, headers[full_idx],
+								 i, to_fullpath);
+	}
+
+	dead_size += full_file->dead_size;
+
+	if (dead_size > full_file->write_size + append_size - dead_size)
+	{
+		elog(VERBOSE, "Superseded page records would take too much space in file \"%s\", "
+			 "rewrite it instead of in-place merge", to_fullpath);
+		goto cleanup;
+	}
+
+	/* Point of no return, the file is going to be changed */
+	merge_journal_append(full_backup, full_file);
+
+	out = fopen(to_fullpath, "r+b");
+	if (out == NULL)
+		elog(ERROR, "Cannot open merge target file \"%s\": %s",
+			 to_fullpath, strerror(errno));
+
+	if (fseek(out, full_file->write_size, SEEK_SET) != 0)
+		elog(ERROR, "Cannot seek to the end of file \"%s\": %s",
+			 to_fullpath, strerror(errno));
+
+	/*
+	 * CRC of the file is calculated in physical order, so it can be
+	 * continued over appended records. Finalization of CRC-32C inverts
+	 * all bits, so do the same to get the intermediate value back.
+	 */
+	crc = full_file->crc;
+	FIN_FILE_CRC32(true, crc);
+
+	out_headers = (BackupPageHeader2 *) pgut_malloc((dest_file->n_blocks + 1) *
+													sizeof(BackupPageHeader2));
+	cur_pos_out = full_file->write_size;
+
+	for (blknum = 0; blknum < dest_file->n_blocks; blknum++)
+	{
+		BackupPageHeader2 *hdr = src_hdr[blknum];
+		char		page[sizeof(BackupPageHeader) + BLCKSZ];
+		size_t		read_len;
+		int			idx = src_idx[blknum];
+
+		if (interrupted || thread_interrupted)
+			elog(ERROR, "Interrupted during merge");
+
+		out_headers[blknum] = *hdr;
+
+		/* The record from FULL backup stays where it is */
+		if (idx == full_idx)
+			continue;
+
+		read_len = get_page_record_size(in[idx], files[idx], headers[idx],
+										hdr - headers[idx], files[idx]->rel_path) +
+			sizeof(BackupPageHeader);
+
+		if (read_len <= sizeof(BackupPageHeader) ||
+			read_len > sizeof(BackupPageHeader) + BLCKSZ)
+			elog(ERROR, "Invalid size of block %u in file \"%s\": %zu",
+				 blknum, files[idx]->rel_path, read_len);
+
+		if (fseek(in[idx], hdr->pos, SEEK_SET) != 0)
+			elog(ERROR, "Cannot seek to offset %u of \"%s\": %s",
+				 hdr->pos, files[idx]->rel_path, strerror(errno));
+
+		if (fread(page, 1, read_len, in[idx]) != read_len)
+			elog(ERROR, "Cannot read block %u of \"%s\": %s",
+				 blknum, files[idx]->rel_path, strerror(errno));
+
+		if (((BackupPageHeader *) page)->block != blknum)
+			elog(ERROR, "Block %u of \"%s\" has invalid block number %u",
+				 blknum, files[idx]->rel_path, ((BackupPageHeader *) page)->block);
+
+		COMP_FILE_CRC32(true, crc, page, read_len);
+
+		if (fwrite(page, 1, read_len, out) != read_len)
+			elog(ERROR, "Cannot write block %u of \"%s\": %s",
+				 blknum, to_fullpath, strerror(errno));
+
+		out_headers[blknum].pos = cur_pos_out;
+		cur_pos_out += read_len;
+	}
+
+	/* dummy header, records are not ordered, so it is kept only for format sake */
+	out_headers[dest_file->n_blocks].pos = cur_pos_out;
+
+	if (fclose(out) != 0)
+		elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath, strerror(errno));
+	out = NULL;
+
+	/* appended records must be durable before new header map is used */
+	if (fio_sync(to_fullpath, FIO_BACKUP_HOST) != 0)
+		elog(ERROR, "Cannot sync merge target file \"%s\": %s",
+			 to_fullpath, strerror(errno));
+
+	FIN_FILE_CRC32(true, crc);
+
+	tmp_file->crc = crc;
+	tmp_file->write_size = cur_pos_out;
+	tmp_file->n_blocks = dest_file->n_blocks;
+	tmp_file->size = tmp_file->n_blocks * BLCKSZ;
+	tmp_file->read_size = tmp_file->size;
+	tmp_file->uncompressed_size = tmp_file->size;
+	tmp_file->compress_alg = full_file->compress_alg;
+	tmp_file->n_headers = dest_file->n_blocks;
+	tmp_file->patched = true;
+	tmp_file->dead_size = dead_size;
+
+	write_page_headers(out_headers, tmp_file, &(full_backup->hdr_map), true);
+
+	elog(VERBOSE, "File \"%s\" is merged in place, %i pages appended",
+		 tmp_file->rel_path, n_appended);
+
+	success = true;
+
+cleanup:
+	for (i = 0; i < n_chain; i++)
+	{
+		if (in[i] && fclose(in[i]))
+			elog(ERROR, "Cannot close file \"%s\": %s",
+				 files[i] ? files[i]->rel_path : dest_file->rel_path,
+				 strerror(errno));
+		pg_free(headers[i]);
+	}
+
+	pg_free(in);
+	pg_free(files);
+	pg_free(headers);
+	pg_free(n_hdr);
+	pg_free(src_idx);
+	pg_free(src_hdr);
+	pg_free(out_headers);
+
+	return success;
+}
+
+/* Save the size of FULL backup file in merge journal before patching it */
+static void
+merge_journal_append(pgBackup *full_backup, pgFile *file)
+{
+	char		path[MAXPGPATH];
+
+	join_path_components(path, full_backup->root_dir, MERGE_JOURNAL);
+
+	pthread_lock(&merge_journal_lock);
+
+	if (!merge_journal)
+	{
+		merge_journal = fopen(path, PG_BINARY_A);
+		if (merge_journal == NULL)
+			elog(ERROR, "Cannot open merge journal \"%s\": %s",
+				 path, strerror(errno));
+	}
+
+	if (fprintf(merge_journal, INT64_FORMAT " %s\n",
+				file->write_size, file->rel_path) < 0 ||
+		fflush(merge_journal) != 0 ||
+		fsync(fileno(merge_journal)) != 0)
+		elog(ERROR, "Cannot write merge journal \"%s\": %s",
+			 path, strerror(errno));
+
+	pthread_mutex_unlock(&merge_journal_lock);
+}
+
+/*
+ * Roll back failed in-place merge: truncate every file, mentioned in
+ * merge journal, to its original size and remove the journal.
+ */
+static void
+merge_journal_replay(pgBackup *full_backup)
+{
+	char		path[MAXPGPATH];
+	char		buf[MAXPGPATH + 32];
+	FILE	   *fp;
+
+	join_path_components(path, full_backup->root_dir, MERGE_JOURNAL);
+
+	fp = fopen(path, PG_BINARY_R);
+	if (fp == NULL)
+	{
+		if (errno == ENOENT)
+			return;
+		elog(ERROR, "Cannot open merge journal \"%s\": %s",
+			 path, strerror(errno));
+	}
+
+	elog(INFO, "Roll back in-place merge of backup %s",
+		 base36enc(full_backup->start_time));
+
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		int64		size;
+		int			n = 0;
+		char		from_root[MAXPGPATH];
+		char		fullpath[MAXPGPATH];
+		char	   *rel_path;
+		size_t		len = strlen(buf);
+		struct stat	st;
+		FILE	   *out;
+
+		/* Incomplete entry, the file was not patched yet */
+		if (len == 0 || buf[len - 1] != '\n')
+			break;
+		buf[len - 1] = '\0';
+
+		if (sscanf(buf, INT64_FORMAT " %n", &size, &n) != 1 || n == 0)
+			elog(ERROR, "Invalid merge journal entry \"%s\" in \"%s\"", buf, path);
+
+		rel_path = buf + n;
+		join_path_components(from_root, full_backup->root_dir, DATABASE_DIR);
+		join_path_components(fullpath, from_root, rel_path);
+
+		if (stat(fullpath, &st) == -1)
+		{
+			if (errno == ENOENT)
+				continue;
+			elog(ERROR, "Cannot stat file \"%s\": %s", fullpath, strerror(errno));
+		}
+
+		if (st.st_size <= size)
+			continue;
+
+		elog(VERBOSE, "Truncate file \"%s\" to " INT64_FORMAT " bytes", fullpath, size);
+
+		out = fopen(fullpath, "r+b");
+		if (out == NULL)
+			elog(ERROR, "Cannot open file \"%s\": %s", fullpath, strerror(errno));
+
+		if (fio_ftruncate(out, size) != 0)
+			elog(ERROR, "Cannot truncate file \"%s\": %s", fullpath, strerror(errno));
+
+		if (fclose(out) != 0)
+			elog(ERROR, "Cannot close file \"%s\": %s", fullpath, strerror(errno));
+
+		if (fio_sync(fullpath, FIO_BACKUP_HOST) != 0)
+			elog(ERROR, "Cannot sync file \"%s\": %s", fullpath, strerror(errno));
+	}
+
+	if (ferror(fp))
+		elog(ERROR, "Cannot read merge journal \"%s\": %s", path, strerror(errno));
+
+	fclose(fp);
+
+	merge_journal_remove(full_backup);
+}
+
+/* Remove merge journal of FULL backup, if any */
+static void
+merge_journal_remove(pgBackup *full_backup)
+{
+	char		path[MAXPGPATH];
+
+	join_path_components(path, full_backup->root_dir, MERGE_JOURNAL);
+
+	if (unlink(path) == -1 && errno != ENOENT)
+		elog(ERROR, "Cannot remove merge journal \"%s\": %s",
+			 path, strerror(errno));
+}
+
 /*
  * For every destionation file lookup the newest file in chain and
  * copy it.
@@ -1339,7 +2111,7 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 		from_backup = (pgBackup *) parray_get(parent_chain, i);
 
 		/* lookup file in intermediate backup */
-		res_file =  parray_bsearch(from_backup->files, dest_file, pgFileCompareRelPathWithExternal);
+		res_file =  pgBackupSearchFile(from_backup, dest_file);
 		from_file = (res_file) ? *res_file : NULL;
 
 		/*
@@ -1365,6 +2137,13 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 	if (!from_file)
 		elog(ERROR, "Failed to locate a full copy of nonedata file \"%s\"", dest_file->rel_path);
 
+	/* unpack packed file into FULL backup directory */
+	if (from_file->pack_num > 0)
+	{
+		merge_packed_file(from_backup, from_file, tmp_file, to_fullpath_tmp);
+		goto merge_rename;
+	}
+
 	/* set path to source file */
 	if (from_file->external_dir_num)
 	{
@@ -1385,8 +2164,9 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 
 	/* Copy file to FULL backup directory into temp file */
 	backup_non_data_file(tmp_file, NULL, from_fullpath,
-						 to_fullpath_tmp, BACKUP_MODE_FULL, 0, false);
+						 to_fullpath_tmp, BACKUP_MODE_FULL, 0, false, NULL);
 
+merge_rename:
 	/* sync temp file to disk */
 	if (fio_sync(to_fullpath_tmp, FIO_BACKUP_HOST) != 0)
 		elog(ERROR, "Cannot sync merge temp file \"%s\": %s",
@@ -1398,3 +2178,45 @@ merge_non_data_file(parray *parent_chain, pgBackup *full_backup,
 				to_fullpath_tmp, to_fullpath, strerror(errno));
 
 }
+
+/*
+ * Copy packed file from the pack file of backup into
+ * regular temp file in FULL backup directory.
+ */
+static void
+merge_packed_file(pgBackup *from_backup, pgFile *from_file,
+				  pgFile *tmp_file, const char *to_fullpath_tmp)
+{
+	PackFile	pack;
+	FILE	   *in;
+	FILE	   *out;
+
+	init_pack_file(&pack, NULL, 0);
+
+	in = open_packed_file(&pack, from_backup->root_dir, from_file);
+	if (in == NULL)
+		elog(ERROR, "Cannot read pack file \"%s\": %s", pack.path,
+			 strerror(errno));
+
+	out = fio_fopen(to_fullpath_tmp, PG_BINARY_W, FIO_BACKUP_HOST);
+	if (out == NULL)
+		elog(ERROR, "Cannot open merge temp file \"%s\": %s",
+			 to_fullpath_tmp, strerror(errno));
+
+	if (fio_chmod(to_fullpath_tmp, tmp_file->mode, FIO_BACKUP_HOST) == -1)
+		elog(ERROR, "Cannot change mode of \"%s\": %s", to_fullpath_tmp,
+			 strerror(errno));
+
+	restore_non_data_file_internal(in, out, from_file, pack.path, to_fullpath_tmp,
+								   false, NULL);
+
+	if (fclose(out) != 0)
+		elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath_tmp,
+			 strerror(errno));
+
+	cleanup_pack_file(&pack);
+
+	tmp_file->crc = from_file->crc;
+	tmp_file->write_size = from_file->write_size;
+	tmp_file->uncompressed_size = from_file->write_size;
+}
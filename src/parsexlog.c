@@ -460,7 +460,7 @@ validate_wal(pgBackup *backup, const char *archivedir,
 	 * If recovery target is provided, ensure that archive files exist in
 	 * archive directory.
 	 */
-	if (dir_is_empty(archivedir, FIO_LOCAL_HOST))
+	if (dir_is_empty(archivedir, FIO_BACKUP_HOST))
 		elog(ERROR, "WAL archive is empty. You cannot restore backup to a recovery target without WAL archive.");
 
 	/*
@@ -981,20 +981,20 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 
 		/* If segment do not exists, but the same
 		 * segment with '.partial' suffix does, use it instead */
-		if (!fileExists(reader_data->xlogpath, FIO_LOCAL_HOST) &&
-			fileExists(partial_file, FIO_LOCAL_HOST))
+		if (!fileExists(reader_data->xlogpath, FIO_BACKUP_HOST) &&
+			fileExists(partial_file, FIO_BACKUP_HOST))
 		{
 			snprintf(reader_data->xlogpath, MAXPGPATH, "%s", partial_file);
 		}
 
-		if (fileExists(reader_data->xlogpath, FIO_LOCAL_HOST))
+		if (fileExists(reader_data->xlogpath, FIO_BACKUP_HOST))
 		{
 			elog(LOG, "Thread [%d]: Opening WAL segment \"%s\"",
 				 reader_data->thread_num, reader_data->xlogpath);
 
 			reader_data->xlogexists = true;
 			reader_data->xlogfile = fio_open(reader_data->xlogpath,
-											 O_RDONLY | PG_BINARY, FIO_LOCAL_HOST);
+											 O_RDONLY | PG_BINARY, FIO_BACKUP_HOST);
 
 			if (reader_data->xlogfile < 0)
 			{
@@ -1006,14 +1006,14 @@ SimpleXLogPageRead(XLogReaderState *xlogreader, XLogRecPtr targetPagePtr,
 		}
 #ifdef HAVE_LIBZ
 		/* Try to open compressed WAL segment */
-		else if (fileExists(reader_data->gz_xlogpath, FIO_LOCAL_HOST))
+		else if (fileExists(reader_data->gz_xlogpath, FIO_BACKUP_HOST))
 		{
 			elog(LOG, "Thread [%d]: Opening compressed WAL segment \"%s\"",
 				 reader_data->thread_num, reader_data->gz_xlogpath);
 
 			reader_data->xlogexists = true;
 			reader_data->gz_xlogfile = fio_gzopen(reader_data->gz_xlogpath,
-													  "rb", -1, FIO_LOCAL_HOST);
+													  "rb", -1, FIO_BACKUP_HOST);
 			if (reader_data->gz_xlogfile == NULL)
 			{
 				elog(WARNING, "Thread [%d]: Could not open compressed WAL segment \"%s\": %s",
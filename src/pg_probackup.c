@@ -17,6 +17,7 @@
 #include <sys/stat.h>
 
 #include "utils/configuration.h"
+#include "utils/s3.h"
 #include "utils/thread.h"
 #include <time.h>
 
@@ -44,7 +45,8 @@ typedef enum ProbackupSubcmd
 	SET_CONFIG_CMD,
 	SET_BACKUP_CMD,
 	SHOW_CONFIG_CMD,
-	CHECKDB_CMD
+	CHECKDB_CMD,
+	CATCHUP_CMD
 } ProbackupSubcmd;
 
 
@@ -72,6 +74,7 @@ pid_t       my_pid = 0;
 __thread int  my_thread_num = 1;
 bool		progress = false;
 bool		no_sync = false;
+SyncMethod	sync_method = SYNC_METHOD_FSYNC;
 #if PG_VERSION_NUM >= 100000
 char	   *replication_slot = NULL;
 #endif
@@ -80,8 +83,12 @@ bool		temp_slot = false;
 /* backup options */
 bool         backup_logs = false;
 bool         smooth_checkpoint;
+bool         page_delta = false;
+bool         resume = false;
+bool         pack_small_files = false;
 char        *remote_agent;
 static char *backup_note = NULL;
+static char *backup_output = NULL;
 /* restore options */
 static char		   *target_time = NULL;
 static char		   *target_xid = NULL;
@@ -94,6 +101,7 @@ static char		   *target_name = NULL;
 static char		   *target_action = NULL;
 
 static char *primary_conninfo = NULL;
+static char *restore_input = NULL;
 
 static pgRecoveryTarget *recovery_target_options = NULL;
 static pgRestoreParams *restore_params = NULL;
@@ -101,6 +109,7 @@ static pgRestoreParams *restore_params = NULL;
 time_t current_time = 0;
 bool restore_as_replica = false;
 bool no_validate = false;
+static bool inline_validate = false;
 IncrRestoreMode incremental_mode = INCR_NONE;
 
 bool skip_block_validation = false;
@@ -114,6 +123,22 @@ static parray *datname_include_list = NULL;
 bool need_amcheck = false;
 bool heapallindexed = false;
 bool amcheck_parent = false;
+uint32 checkdb_slices = 0;
+
+/* validate options */
+int64 revalidate_after = 0;
+bool fast_validation = false;
+int sample_percent = 0;
+int sample_pages = 0;
+
+/* catchup options */
+static char *catchup_source_pgdata = NULL;
+static char *catchup_destination_pgdata = NULL;
+
+/* object storage options */
+static char *storage_type = NULL;
+static S3Config s3_config = {NULL, NULL, NULL, NULL, NULL,
+							 S3_DEFAULT_UPLOAD_THREADS, S3_DEFAULT_PART_SIZE};
 
 /* delete options */
 bool		delete_wal = false;
@@ -122,6 +147,8 @@ bool		merge_expired = false;
 bool		force = false;
 bool		dry_run = false;
 static char *delete_status = NULL;
+/* merge options */
+bool		merge_in_place = false;
 /* compression options */
 bool 		compress_shortcut = false;
 
@@ -155,8 +182,10 @@ static ProbackupSubcmd backup_subcmd = NO_CMD;
 static bool help_opt = false;
 
 static void opt_incr_restore_mode(ConfigOption *opt, const char *arg);
+static void opt_sync_method(ConfigOption *opt, const char *arg);
 static void opt_backup_mode(ConfigOption *opt, const char *arg);
 static void opt_show_format(ConfigOption *opt, const char *arg);
+static void opt_validation_sample(ConfigOption *opt, const char *arg);
 
 static void compress_init(void);
 
@@ -178,6 +207,7 @@ static ConfigOption cmd_options[] =
 	{ 'b', 132, "progress",			&progress,			SOURCE_CMD_STRICT },
 	{ 's', 'i', "backup-id",		&backup_id_string,	SOURCE_CMD_STRICT },
 	{ 'b', 133, "no-sync",			&no_sync,			SOURCE_CMD_STRICT },
+	{ 'f', 169, "sync-method",		opt_sync_method,	SOURCE_CMD_STRICT },
 	/* backup options */
 	{ 'b', 180, "backup-pg-log",	&backup_logs,		SOURCE_CMD_STRICT },
 	{ 'f', 'b', "backup-mode",		opt_backup_mode,	SOURCE_CMD_STRICT },
@@ -187,8 +217,13 @@ static ConfigOption cmd_options[] =
 	{ 'b', 182, "delete-wal",		&delete_wal,		SOURCE_CMD_STRICT },
 	{ 'b', 183, "delete-expired",	&delete_expired,	SOURCE_CMD_STRICT },
 	{ 'b', 184, "merge-expired",	&merge_expired,		SOURCE_CMD_STRICT },
+	{ 'b', 187, "in-place",			&merge_in_place,	SOURCE_CMD_STRICT },
 	{ 'b', 185, "dry-run",			&dry_run,			SOURCE_CMD_STRICT },
 	{ 's', 238, "note",				&backup_note,		SOURCE_CMD_STRICT },
+	{ 'b', 186, "page-delta",		&page_delta,		SOURCE_CMD_STRICT },
+	{ 'b', 188, "resume",			&resume,			SOURCE_CMD_STRICT },
+	{ 's', 161, "output",			&backup_output,		SOURCE_CMD_STRICT },
+	{ 'b', 168, "pack-small-files",	&pack_small_files,	SOURCE_CMD_STRICT },
 	/* restore options */
 	{ 's', 136, "recovery-target-time",	&target_time,	SOURCE_CMD_STRICT },
 	{ 's', 137, "recovery-target-xid",	&target_xid,	SOURCE_CMD_STRICT },
@@ -201,6 +236,7 @@ static ConfigOption cmd_options[] =
 	{ 's', 141, "recovery-target-name",	&target_name,		SOURCE_CMD_STRICT },
 	{ 's', 142, "recovery-target-action", &target_action,	SOURCE_CMD_STRICT },
 	{ 'b', 143, "no-validate",		&no_validate,		SOURCE_CMD_STRICT },
+	{ 'b', 173, "inline-validate",	&inline_validate,	SOURCE_CMD_STRICT },
 	{ 'b', 154, "skip-block-validation", &skip_block_validation,	SOURCE_CMD_STRICT },
 	{ 'b', 156, "skip-external-dirs", &skip_external_dirs,	SOURCE_CMD_STRICT },
 	{ 'f', 158, "db-include", 		opt_datname_include_list, SOURCE_CMD_STRICT },
@@ -209,10 +245,26 @@ static ConfigOption cmd_options[] =
 	{ 's', 160, "primary-conninfo",	&primary_conninfo,	SOURCE_CMD_STRICT },
 	{ 's', 'S', "primary-slot-name",&replication_slot,	SOURCE_CMD_STRICT },
 	{ 'f', 'I', "incremental-mode", opt_incr_restore_mode,	SOURCE_CMD_STRICT },
+	{ 's', 167, "input",			&restore_input,		SOURCE_CMD_STRICT },
 	/* checkdb options */
 	{ 'b', 195, "amcheck",			&need_amcheck,		SOURCE_CMD_STRICT },
 	{ 'b', 196, "heapallindexed",	&heapallindexed,	SOURCE_CMD_STRICT },
 	{ 'b', 197, "parent",			&amcheck_parent,	SOURCE_CMD_STRICT },
+	{ 'u', 177, "incremental-slices", &checkdb_slices,	SOURCE_CMD_STRICT },
+	/* validate options */
+	{ 'I', 174, "revalidate-after", &revalidate_after, SOURCE_CMD_STRICT, SOURCE_DEFAULT, 0, OPTION_UNIT_S, option_get_value},
+	{ 'b', 175, "fast",				&fast_validation,	SOURCE_CMD_STRICT },
+	{ 'f', 176, "sample",			opt_validation_sample,	SOURCE_CMD_STRICT },
+	/* catchup options */
+	{ 's', 189, "source-pgdata",	&catchup_source_pgdata,	SOURCE_CMD_STRICT },
+	{ 's', 190, "destination-pgdata", &catchup_destination_pgdata,	SOURCE_CMD_STRICT },
+	/* object storage options */
+	{ 's', 191, "storage",			&storage_type,		SOURCE_CMD_STRICT },
+	{ 's', 192, "s3-endpoint",		&s3_config.endpoint,	SOURCE_CMD_STRICT },
+	{ 's', 193, "s3-bucket",		&s3_config.bucket,	SOURCE_CMD_STRICT },
+	{ 's', 194, "s3-region",		&s3_config.region,	SOURCE_CMD_STRICT },
+	{ 'i', 198, "s3-upload-threads", &s3_config.upload_threads,	SOURCE_CMD_STRICT },
+	{ 'i', 199, "s3-part-size",		&s3_config.part_size,	SOURCE_CMD_STRICT },
 	/* delete options */
 	{ 'b', 145, "wal",				&delete_wal,		SOURCE_CMD_STRICT },
 	{ 'b', 146, "expired",			&delete_expired,	SOURCE_CMD_STRICT },
@@ -268,7 +320,8 @@ setMyLocation(void)
 	MyLocation = IsSshProtocol()
 		? (backup_subcmd == ARCHIVE_PUSH_CMD || backup_subcmd == ARCHIVE_GET_CMD)
 		   ? FIO_DB_HOST
-		   : (backup_subcmd == BACKUP_CMD || backup_subcmd == RESTORE_CMD || backup_subcmd == ADD_INSTANCE_CMD)
+		   : (backup_subcmd == BACKUP_CMD || backup_subcmd == RESTORE_CMD ||
+			  backup_subcmd == ADD_INSTANCE_CMD || backup_subcmd == CATCHUP_CMD)
 		      ? FIO_BACKUP_HOST
 		      : FIO_LOCAL_HOST
 		: FIO_LOCAL_HOST;
@@ -346,6 +399,8 @@ main(int argc, char *argv[])
 			backup_subcmd = SHOW_CONFIG_CMD;
 		else if (strcmp(argv[1], "checkdb") == 0)
 			backup_subcmd = CHECKDB_CMD;
+		else if (strcmp(argv[1], "catchup") == 0)
+			backup_subcmd = CATCHUP_CMD;
 #ifdef WIN32
 		else if (strcmp(argv[1], "ssh") == 0)
 		    launch_ssh(argv);
@@ -407,7 +462,8 @@ main(int argc, char *argv[])
 		backup_subcmd == DELETE_CMD ||
 		backup_subcmd == MERGE_CMD ||
 		backup_subcmd == SET_CONFIG_CMD ||
-		backup_subcmd == SET_BACKUP_CMD)
+		backup_subcmd == SET_BACKUP_CMD ||
+		backup_subcmd == CATCHUP_CMD)
 	{
 		int			i,
 					len = 0,
@@ -443,7 +499,7 @@ main(int argc, char *argv[])
 	if (help_opt)
 		help_command(command_name);
 
-	/* backup_path is required for all pg_probackup commands except help and checkdb */
+	/* backup_path is required for all pg_probackup commands except help, checkdb and catchup */
 	if (backup_path == NULL)
 	{
 		/*
@@ -451,7 +507,8 @@ main(int argc, char *argv[])
 		 * from environment variable
 		 */
 		backup_path = getenv("BACKUP_PATH");
-		if (backup_path == NULL && backup_subcmd != CHECKDB_CMD)
+		if (backup_path == NULL && backup_subcmd != CHECKDB_CMD &&
+			backup_subcmd != CATCHUP_CMD)
 			elog(ERROR, "required parameter not specified: BACKUP_PATH (-B, --backup-path)");
 	}
 
@@ -470,15 +527,85 @@ main(int argc, char *argv[])
 	if (backup_path && !is_absolute_path(backup_path))
 		elog(ERROR, "-B, --backup-path must be an absolute path");
 
+	/*
+	 * Backup catalog may be located in object storage, then backup_path
+	 * is used as prefix of object keys in the bucket.
+	 */
+	if (storage_type != NULL && strcmp(storage_type, "posix") != 0)
+	{
+		if (strcmp(storage_type, "s3") != 0)
+			elog(ERROR, "Invalid storage \"%s\", expected \"posix\" or \"s3\"",
+				 storage_type);
+
+		if (backup_subcmd == MERGE_CMD || backup_subcmd == CATCHUP_CMD)
+			elog(ERROR, "Command \"%s\" is not supported for backup catalog "
+				 "in object storage", command_name);
+		if (merge_expired)
+			elog(ERROR, "Option --merge-expired is not supported for backup catalog "
+				 "in object storage");
+		if (stream_wal)
+			elog(ERROR, "Option --stream is not supported for backup catalog "
+				 "in object storage");
+		if (resume && backup_subcmd == BACKUP_CMD)
+			elog(ERROR, "Option --resume is not supported for backup catalog "
+				 "in object storage");
+
+		if (backup_output)
+			elog(ERROR, "Option --output is not supported for backup catalog "
+				 "in object storage");
+
+		s3_config.access_key = getenv("AWS_ACCESS_KEY_ID");
+		s3_config.secret_key = getenv("AWS_SECRET_ACCESS_KEY");
+		s3_init(&s3_config);
+	}
+
+	/*
+	 * Backup files may be written into single-stream container,
+	 * either to a file or to standard output.
+	 */
+	if (backup_output)
+	{
+		if (backup_subcmd != BACKUP_CMD)
+			elog(ERROR, "Option --output can be used only with \"backup\" command");
+		if (stream_wal)
+			elog(ERROR, "Option --stream cannot be used together with --output");
+		if (resume)
+			elog(ERROR, "Option --resume cannot be used together with --output");
+		if (pack_small_files)
+			elog(ERROR, "Option --pack-small-files cannot be used together with --output");
+
+		if (strcmp(backup_output, CONTAINER_STDIO) != 0)
+		{
+			canonicalize_path(backup_output);
+			if (!is_absolute_path(backup_output))
+				elog(ERROR, "--output must be an absolute path or \"-\"");
+		}
+	}
+
+	if (restore_input)
+	{
+		if (backup_subcmd != RESTORE_CMD && backup_subcmd != VALIDATE_CMD)
+			elog(ERROR, "Option --input can be used only with \"restore\" "
+				 "and \"validate\" commands");
+
+		if (strcmp(restore_input, CONTAINER_STDIO) != 0)
+		{
+			canonicalize_path(restore_input);
+			if (!is_absolute_path(restore_input))
+				elog(ERROR, "--input must be an absolute path or \"-\"");
+		}
+	}
+
 
 	/*
 	 * Option --instance is required for all commands except
-	 * init, show, checkdb and validate
+	 * init, show, checkdb, catchup and validate
 	 */
 	if (instance_name == NULL)
 	{
 		if (backup_subcmd != INIT_CMD && backup_subcmd != SHOW_CMD &&
-			backup_subcmd != VALIDATE_CMD && backup_subcmd != CHECKDB_CMD)
+			backup_subcmd != VALIDATE_CMD && backup_subcmd != CHECKDB_CMD &&
+			backup_subcmd != CATCHUP_CMD)
 			elog(ERROR, "required parameter not specified: --instance");
 	}
 	else
@@ -587,9 +714,31 @@ main(int argc, char *argv[])
 
 
 	/* Just read environment variables */
-	if (backup_path == NULL && backup_subcmd == CHECKDB_CMD)
+	if (backup_path == NULL &&
+		(backup_subcmd == CHECKDB_CMD || backup_subcmd == CATCHUP_CMD))
 		config_get_opt_env(instance_options);
 
+	/* Catchup does not use backup catalog, so logs must go somewhere else */
+	if (backup_subcmd == CATCHUP_CMD && backup_path == NULL &&
+		instance_config.logger.log_level_file != LOG_OFF &&
+		instance_config.logger.log_directory == NULL)
+		elog(ERROR, "Cannot save catchup logs to a file. "
+			"You must specify --log-directory option when running catchup with "
+			"--log-level-file option enabled.");
+
+	/* Objects cannot be appended, so logs are not stored in the bucket */
+	if (fio_is_storage(FIO_BACKUP_HOST) &&
+		instance_config.logger.log_level_file != LOG_OFF &&
+		instance_config.logger.log_directory == NULL)
+	{
+		if (backup_subcmd == ARCHIVE_GET_CMD || backup_subcmd == ARCHIVE_PUSH_CMD)
+			instance_config.logger.log_level_file = LOG_OFF;
+		else
+			elog(ERROR, "Cannot save logs to a file. "
+				"You must specify --log-directory option when backup catalog is "
+				"located in object storage and --log-level-file option is enabled.");
+	}
+
 	/* Sanity for checkdb, if backup_dir is provided but pgdata and instance are not */
 	if (backup_subcmd == CHECKDB_CMD &&
 		backup_path != NULL &&
@@ -630,6 +779,21 @@ main(int argc, char *argv[])
 			elog(WARNING, "%s: could not find a full path to executable", PROGRAM_NAME);
 	}
 
+	/* Source PGDATA of catchup is accessed as PGDATA of backup */
+	if (backup_subcmd == CATCHUP_CMD)
+	{
+		if (catchup_source_pgdata == NULL)
+			elog(ERROR, "required parameter not specified: --source-pgdata");
+		if (catchup_destination_pgdata == NULL)
+			elog(ERROR, "required parameter not specified: --destination-pgdata");
+
+		instance_config.pgdata = catchup_source_pgdata;
+
+		canonicalize_path(catchup_destination_pgdata);
+		if (!is_absolute_path(catchup_destination_pgdata))
+			elog(ERROR, "--destination-pgdata must be an absolute path");
+	}
+
 	/*
 	 * We have read pgdata path from command line or from configuration file.
 	 * Ensure that pgdata is an absolute path.
@@ -721,6 +885,23 @@ main(int argc, char *argv[])
 		restore_params->partial_restore_type = NONE;
 		restore_params->primary_conninfo = primary_conninfo;
 		restore_params->incremental_mode = incremental_mode;
+		restore_params->resume = resume;
+		restore_params->inline_validate = inline_validate;
+		restore_params->container_input = restore_input;
+
+		if (resume && incremental_mode != INCR_NONE)
+			elog(ERROR, "You cannot specify '--resume' and '--incremental-mode' together");
+
+		if (inline_validate && backup_subcmd != RESTORE_CMD)
+			elog(ERROR, "You cannot specify \"--inline-validate\" flag with the \"%s\" command",
+				command_name);
+
+		if (inline_validate && no_validate)
+			elog(WARNING, "Option '--inline-validate' has no effect with '--no-validate'");
+
+		/* incremental restore does not read every file of the backup */
+		if (inline_validate && !no_validate && incremental_mode != INCR_NONE)
+			elog(ERROR, "You cannot specify '--inline-validate' and '--incremental-mode' together");
 
 		/* handle partial restore parameters */
 		if (datname_exclude_list && datname_include_list)
@@ -773,6 +954,46 @@ main(int argc, char *argv[])
 		elog(ERROR, "You cannot specify \"--no-validate\" option with the \"%s\" command",
 			command_name);
 
+	if (revalidate_after != 0 && backup_subcmd != VALIDATE_CMD)
+		elog(ERROR, "You cannot specify \"--revalidate-after\" option with the \"%s\" command",
+			command_name);
+
+	if (fast_validation && backup_subcmd != VALIDATE_CMD)
+		elog(ERROR, "You cannot specify \"--fast\" option with the \"%s\" command",
+			command_name);
+
+	/* fast check must not let full validation skip files */
+	if (fast_validation && revalidate_after != 0)
+		elog(ERROR, "You cannot specify \"--fast\" and \"--revalidate-after\" options together");
+
+	if (sample_percent > 0 || sample_pages > 0)
+	{
+		if (backup_subcmd != VALIDATE_CMD)
+			elog(ERROR, "You cannot specify \"--sample\" option with the \"%s\" command",
+				command_name);
+
+		if (fast_validation || revalidate_after != 0)
+			elog(ERROR, "You cannot specify \"--sample\" together with \"--fast\" or \"--revalidate-after\"");
+	}
+
+	if (checkdb_slices > 0)
+	{
+		if (backup_subcmd != CHECKDB_CMD)
+			elog(ERROR, "You cannot specify \"--incremental-slices\" option with the \"%s\" command",
+				command_name);
+
+		/* the ledger is kept in the backup catalog */
+		if (backup_path == NULL || instance_name == NULL)
+			elog(ERROR, "Option \"--incremental-slices\" requires --backup-path and --instance options");
+
+		if (skip_block_validation)
+			elog(ERROR, "You cannot specify \"--incremental-slices\" together with \"--skip-block-validation\"");
+	}
+
+	if (revalidate_after < 0)
+		elog(ERROR, "Invalid value of \"--revalidate-after\": " INT64_FORMAT,
+			revalidate_after);
+
 	if (num_threads < 1)
 		num_threads = 1;
 
@@ -803,6 +1024,8 @@ main(int argc, char *argv[])
 				time_t	start_time = time(NULL);
 
 				current.stream = stream_wal;
+				if (backup_output)
+					current.container = pgut_strdup(backup_output);
 
 				/* sanity */
 				if (current.backup_mode == BACKUP_MODE_INVALID)
@@ -821,6 +1044,8 @@ main(int argc, char *argv[])
 				/* sanity */
 				if (datname_exclude_list || datname_include_list)
 					elog(ERROR, "You must specify parameter (-i, --backup-id) for partial validation");
+				if (restore_input)
+					elog(ERROR, "You must specify parameter (-i, --backup-id) to validate backup container");
 
 				return do_validate_all();
 			}
@@ -870,6 +1095,8 @@ main(int argc, char *argv[])
 			do_checkdb(need_amcheck,
 					   instance_config.conn_opt, instance_config.pgdata);
 			break;
+		case CATCHUP_CMD:
+			return do_catchup(catchup_destination_pgdata, no_sync);
 		case NO_CMD:
 			/* Should not happen */
 			elog(ERROR, "Unknown subcommand");
@@ -901,6 +1128,58 @@ opt_incr_restore_mode(ConfigOption *opt, const char *arg)
 	elog(ERROR, "Invalid value for '--incremental-mode' option: '%s'", arg);
 }
 
+static void
+opt_sync_method(ConfigOption *opt, const char *arg)
+{
+	if (pg_strcasecmp(arg, "fsync") == 0)
+	{
+		sync_method = SYNC_METHOD_FSYNC;
+		return;
+	}
+	else if (pg_strcasecmp(arg, "syncfs") == 0)
+	{
+#ifndef FIO_HAVE_SYNCFS
+		elog(ERROR, "Option '--sync-method=syncfs' is not supported on this platform");
+#endif
+		sync_method = SYNC_METHOD_SYNCFS;
+		return;
+	}
+
+	/* Sync method is invalid, so leave with an error */
+	elog(ERROR, "Invalid value for '--sync-method' option: '%s'", arg);
+}
+
+/*
+ * Parse --sample value: percentage of pages, followed by "%",
+ * or number of pages of each data file.
+ */
+static void
+opt_validation_sample(ConfigOption *opt, const char *arg)
+{
+	char		value[32];
+	size_t		len = strlen(arg);
+	int32		n;
+
+	if (len > 0 && len < lengthof(value) && arg[len - 1] == '%')
+	{
+		strncpy(value, arg, len - 1);
+		value[len - 1] = '\0';
+
+		if (!parse_int32(value, &n, 0) || n <= 0 || n > 100)
+			elog(ERROR, "Invalid value for '--sample' option: '%s'", arg);
+
+		sample_percent = n;
+		sample_pages = 0;
+		return;
+	}
+
+	if (!parse_int32(arg, &n, 0) || n <= 0)
+		elog(ERROR, "Invalid value for '--sample' option: '%s'", arg);
+
+	sample_pages = n;
+	sample_percent = 0;
+}
+
 static void
 opt_backup_mode(ConfigOption *opt, const char *arg)
 {
@@ -965,6 +1244,12 @@ compress_init(void)
 		if (instance_config.compress_alg == PGLZ_COMPRESS && num_threads > 1)
 			elog(ERROR, "Multithread backup does not support pglz compression");
 	}
+
+	if (backup_subcmd == BACKUP_CMD && page_delta &&
+		(instance_config.compress_alg == NOT_DEFINED_COMPRESS ||
+		 instance_config.compress_alg == NONE_COMPRESS))
+		elog(ERROR, "Option --page-delta requires compression to be enabled, "
+					"use --compress-algorithm option");
 }
 
 /* Construct array of datnames, provided by user via db-exclude option */
@@ -35,6 +35,7 @@
 #include "utils/parray.h"
 #include "utils/pgut.h"
 #include "utils/file.h"
+#include "utils/container.h"
 
 #include "datapagemap.h"
 #include "utils/thread.h"
@@ -68,12 +69,20 @@ extern const char  *PROGRAM_EMAIL;
 #define BACKUP_CATALOG_CONF_FILE	"pg_probackup.conf"
 #define BACKUP_CATALOG_PID		"backup.pid"
 #define DATABASE_FILE_LIST		"backup_content.control"
+#define DATABASE_FILE_JOURNAL	"backup_content.journal"
 #define PG_BACKUP_LABEL_FILE	"backup_label"
 #define PG_TABLESPACE_MAP_FILE "tablespace_map"
 #define EXTERNAL_DIR			"external_directories/externaldir"
 #define DATABASE_MAP			"database_map"
+#define RESTORE_JOURNAL			"probackup_restore_journal"
 #define HEADER_MAP  			"page_header_map"
 #define HEADER_MAP_TMP  		"page_header_map_tmp"
+#define MERGE_JOURNAL			"merge_journal"
+#define PACK_FILE				"pack"
+#define VALIDATION_LEDGER		"validation_ledger"
+#define VALIDATION_SAMPLE		"validation_sample"
+#define CHECKDB_LEDGER			"checkdb_ledger"
+#define BACKUP_TRASH_DIR		".trash"
 
 /* Timeout defaults */
 #define ARCHIVE_TIMEOUT_DEFAULT		300
@@ -101,6 +110,13 @@ extern const char  *PROGRAM_EMAIL;
 #define LARGE_CHUNK_SIZE (4 * 1024 * 1024)
 #define OUT_BUF_SIZE (512 * 1024)
 
+/* nonedata files smaller than this are appended to pack files */
+#define PACK_MAX_FILE_SIZE (256 * 1024)
+
+/* remote requests in flight by default and size limit of prefetched files */
+#define REMOTE_WINDOW_DEFAULT 16
+#define PREFETCH_MAX_FILE_SIZE (256 * 1024)
+
 /* retry attempts */
 #define PAGE_READ_ATTEMPTS 300
 
@@ -130,6 +146,54 @@ typedef struct db_map_entry
 	char *datname;
 } db_map_entry;
 
+/*
+ * Key of ledger entry. Entries of every ledger start with it, so that
+ * they are read, looked up and freed by the same functions.
+ */
+typedef struct ledger_key
+{
+	char	   *rel_path;
+	int			external_dir_num;
+} ledger_key;
+
+/* Parse line of ledger file, return NULL if it has no entry */
+typedef void *(*ledger_parse_func) (const char *line, void *arg);
+/* Print ledger entry as a line of ledger file */
+typedef void (*ledger_print_func) (FILE *out, void *entry);
+
+/*
+ * Entry of backup validation ledger. File in backup directory is not
+ * read by validate again, until it expires, if it keeps its identity.
+ */
+typedef struct ledger_entry
+{
+	ledger_key	key;
+	pg_crc32	crc;			/* CRC of the file in file list */
+	/* identity of the file in backup directory */
+	int64		size;
+	time_t		mtime;
+	uint64		inode;
+	time_t		validated;		/* time of the last successful check */
+	bool		blocks_checked;	/* pages were checked, not only CRC */
+} ledger_entry;
+
+/* Data file of PGDATA found valid by the previous checkdb run */
+typedef struct checkdb_ledger_entry
+{
+	ledger_key	key;
+	/* identity of the file in PGDATA */
+	int64		size;
+	time_t		mtime;
+	uint64		inode;
+	time_t		checked;		/* time of the check */
+} checkdb_ledger_entry;
+
+typedef enum SyncMethod
+{
+	SYNC_METHOD_FSYNC,	/* fsync every file */
+	SYNC_METHOD_SYNCFS	/* sync every filesystem holding the files */
+} SyncMethod;
+
 typedef enum IncrRestoreMode
 {
 	INCR_NONE,
@@ -185,10 +249,18 @@ do { \
 
 
 /* Information about single file (or dir) in backup */
+/* Hash index on file list, see pgBackupIndexFiles() */
+typedef struct pgFileIndex pgFileIndex;
+
 typedef struct pgFile
 {
+	/*
+	 * Fields are ordered by their size to avoid padding, the struct is
+	 * allocated for every file of every backup in the chain.
+	 */
 	char   *name;			/* file or directory name */
-	mode_t	mode;			/* protection (file type and permission) */
+	char   *rel_path;		/* relative path of the file */
+	char   *linked;			/* path of the linked file */
 	size_t	size;			/* size of the file */
 	time_t  mtime;			/* file st_mtime attribute, can be used only
 								during backup */
@@ -197,35 +269,48 @@ typedef struct pgFile
 	int64	write_size;		/* size of the backed-up file. BYTES_INVALID means
 							   that the file existed but was not backed up
 							   because not modified since last backup. */
+							/* we need int64 here to store '-1' value */
 	size_t	uncompressed_size;	/* size of the backed-up file before compression
 								 * and adding block headers.
 								 */
-							/* we need int64 here to store '-1' value */
+	datapagemap_t	pagemap;			/* bitmap of pages updated since previous backup,
+										   allocated only by backup and may take up to
+										   16kB per file */
+	int64			dead_size;			/* size of superseded page records of patched file */
+	/* Coordinates in header map */
+	off_t    hdr_off;       /* offset in header map */
+	/* Coordinates in pack file */
+	off_t    pack_off;       /* offset in pack file */
+
+	mode_t	mode;			/* protection (file type and permission) */
 	pg_crc32 crc;			/* CRC value of the file, regular file only */
-	char   *rel_path;		/* relative path of the file */
-	char   *linked;			/* path of the linked file */
-	bool	is_datafile;	/* true if the file is PostgreSQL data file */
 	Oid		tblspcOid;		/* tblspcOid extracted from path, if applicable */
 	Oid		dbOid;			/* dbOid extracted from path, if applicable */
 	Oid		relOid;			/* relOid extracted from path, if applicable */
 	ForkName   forkName;	/* forkName extracted from path, if applicable */
 	int		segno;			/* Segment number for ptrack */
 	int		n_blocks;		/* number of blocks in the data file in data directory */
-	bool	is_cfs;			/* Flag to distinguish files compressed by CFS*/
-	bool	is_database;	/* Flag used strictly by ptrack 1.x backup */
 	int		external_dir_num;	/* Number of external directory. 0 if not external */
-	bool	exists_in_prev;		/* Mark files, both data and regular, that exists in previous backup */
 	CompressAlg		compress_alg;		/* compression algorithm applied to the file */
-	volatile 		pg_atomic_flag lock;/* lock for synchronization of parallel threads  */
-	datapagemap_t	pagemap;			/* bitmap of pages updated since previous backup
-										   may take up to 16kB per file */
-	bool			pagemap_isabsent;	/* Used to mark files with unknown state of pagemap,
-										 * i.e. datafiles without _ptrack */
-	/* Coordinates in header map */
 	int      n_headers;		/* number of blocks in the data file in backup */
 	pg_crc32 hdr_crc;		/* CRC value of header file: name_hdr */
-	off_t    hdr_off;       /* offset in header map */
 	int      hdr_size;       /* offset in header map */
+	int      pack_num;       /* number of pack file, 0 if file is not packed */
+	uint32   path_hash;      /* hash of rel_path, used by file list index */
+
+	volatile 		pg_atomic_flag lock;/* lock for synchronization of parallel threads  */
+	bool	is_datafile;	/* true if the file is PostgreSQL data file */
+	bool	is_cfs;			/* Flag to distinguish files compressed by CFS*/
+	bool	is_database;	/* Flag used strictly by ptrack 1.x backup */
+	bool	exists_in_prev;		/* Mark files, both data and regular, that exists in previous backup */
+	bool			pagemap_isabsent;	/* Used to mark files with unknown state of pagemap,
+										 * i.e. datafiles without _ptrack */
+	bool			delta_encoded;		/* pages are stored as XOR with their previous
+										 * version from parent backup chain */
+	bool			patched;			/* page records were appended by in-place merge,
+										 * so they are not stored in block order */
+	bool			rel_path_is_shared;	/* rel_path is interned by pgFileInitShared()
+										 * and must not be freed */
 } pgFile;
 
 typedef struct page_map_entry
@@ -277,7 +362,7 @@ typedef enum ShowFormat
 #define FILE_NOT_FOUND		(-2) /* file disappeared during backup */
 #define BLOCKNUM_INVALID	(-1)
 #define PROGRAM_VERSION	"2.4.3"
-#define AGENT_PROTOCOL_VERSION 20403
+#define AGENT_PROTOCOL_VERSION 20404
 
 
 typedef struct ConnectionOptions
@@ -380,6 +465,19 @@ typedef struct HeaderMap
 
 } HeaderMap;
 
+/* structure used for access to pack file of small nonedata files */
+typedef struct PackFile
+{
+	char  path[MAXPGPATH];
+	FILE  *fp;
+	char  *buf;                /* buffer */
+	int    num;                /* number of pack file, used only for writing */
+	off_t  offset;             /* current position in fp, used only for writing */
+} PackFile;
+
+/* Chain of backups used to encode and decode pages of delta encoded files */
+typedef struct PageDeltaChain PageDeltaChain;
+
 typedef struct pgBackup pgBackup;
 
 /* Information about single backup stored in backup.conf */
@@ -454,7 +552,11 @@ struct pgBackup
 									   backup_path/instance_name/backup_id/database */
 	parray			*files;			/* list of files belonging to this backup
 									 * must be populated explicitly */
+	pgFileIndex		*files_index;	/* hash index on files, built by
+									 * pgBackupIndexFiles() */
 	char			*note;
+	char			*container;		/* file with data of backup taken with --output,
+									 * CONTAINER_STDIO if it was written to stdout */
 
 	pg_crc32         content_crc;
 
@@ -499,6 +601,15 @@ typedef struct pgRestoreParams
 	IncrRestoreMode	incremental_mode;
 	XLogRecPtr shift_lsn;
 
+	/* continue interrupted restore */
+	bool	resume;
+
+	/* validate backup files while restoring them instead of beforehand */
+	bool	inline_validate;
+
+	/* backup container provided with --input */
+	const char *container_input;
+
 	/* options for partial restore */
 	PartialRestoreType partial_restore_type;
 	parray *partial_db_list;
@@ -529,10 +640,15 @@ typedef struct
 	parray	   *prev_filelist;
 	parray	   *external_dirs;
 	XLogRecPtr	prev_start_lsn;
+	parray	   *delta_chain;	/* parent chain for page delta encoding, if any */
+	parray	   *resume_filelist;	/* files copied by interrupted attempt, if any */
+	XLogRecPtr	resume_start_lsn;	/* START LSN of interrupted attempt */
 
 	ConnectionArgs conn_arg;
 	int			thread_num;
 	HeaderMap   *hdr_map;
+	PackFile	pack;			/* pack file of the thread */
+	bool		use_pack;		/* pack small nonedata files */
 
 	/*
 	 * Return value from the thread.
@@ -716,6 +832,7 @@ extern __thread int my_thread_num;
 extern int		num_threads;
 extern bool		stream_wal;
 extern bool		progress;
+extern SyncMethod	sync_method;
 extern bool     is_archive_cmd; /* true for archive-{get,push} */
 #if PG_VERSION_NUM >= 100000
 /* In pre-10 'replication_slot' is defined in receivelog.h */
@@ -725,6 +842,9 @@ extern bool 	temp_slot;
 
 /* backup options */
 extern bool		smooth_checkpoint;
+extern bool		page_delta;
+extern bool		resume;
+extern bool		pack_small_files;
 
 /* remote probackup options */
 extern char* remote_agent;
@@ -737,6 +857,9 @@ extern bool		delete_expired;
 extern bool		merge_expired;
 extern bool		dry_run;
 
+/* merge options */
+extern bool		merge_in_place;
+
 /* compression options */
 extern bool		compress_shortcut;
 
@@ -749,6 +872,13 @@ extern ShowFormat show_format;
 /* checkdb options */
 extern bool heapallindexed;
 extern bool skip_block_validation;
+extern uint32 checkdb_slices;
+
+/* validate options */
+extern int64 revalidate_after;
+extern bool fast_validation;
+extern int	sample_percent;
+extern int	sample_pages;
 
 /* current settings */
 extern pgBackup current;
@@ -763,6 +893,7 @@ extern const char *pgdata_exclude_dir[];
 /* in backup.c */
 extern int do_backup(time_t start_time, pgSetBackupParams *set_backup_params,
 					 bool no_validate, bool no_sync, bool backup_logs);
+extern int do_catchup(const char *dest_pgdata, bool no_sync);
 extern void do_checkdb(bool need_amcheck, ConnectionOptions conn_opt,
 				  char *pgdata);
 extern BackupMode parse_backup_mode(const char *value);
@@ -844,6 +975,7 @@ extern void help_command(char *command);
 
 /* in validate.c */
 extern void pgBackupValidate(pgBackup* backup, pgRestoreParams *params);
+extern bool backup_is_validated(pgBackup *backup);
 extern int do_validate_all(void);
 extern int validate_one_page(Page page, BlockNumber absolute_blkno,
 							 XLogRecPtr stop_lsn, PageState *page_st,
@@ -885,9 +1017,15 @@ extern void do_set_backup(const char *instance_name, time_t backup_id,
 extern void pin_backup(pgBackup	*target_backup,
 							pgSetBackupParams *set_backup_params);
 extern void add_note(pgBackup *target_backup, char *note);
+extern bool backup_container_is_available(pgBackup *backup);
 extern void pgBackupWriteControl(FILE *out, pgBackup *backup);
 extern void write_backup_filelist(pgBackup *backup, parray *files,
 								  const char *root, parray *external_list, bool sync);
+extern void open_backup_filelist_journal(pgBackup *backup);
+extern bool backup_filelist_journal_is_open(void);
+extern void append_backup_filelist_journal(pgFile *file);
+extern void close_backup_filelist_journal(pgBackup *backup, bool remove);
+extern parray *read_backup_filelist_journal(pgBackup *backup);
 
 extern void pgBackupGetPath(const pgBackup *backup, char *path, size_t len,
 							const char *subdir);
@@ -949,6 +1087,19 @@ extern void write_database_map(pgBackup *backup, parray *database_list,
 								   parray *backup_file_list);
 extern void db_map_entry_free(void *map);
 
+extern parray *read_ledger(const char *path, ledger_parse_func parse, void *arg);
+extern void write_ledger(const char *path, const char *header, parray *ledger,
+						 ledger_print_func print);
+extern void *ledger_find_file(parray *ledger, pgFile *file);
+extern void ledger_entry_free(void *entry);
+extern parray *read_validation_ledger(pgBackup *backup);
+extern void write_validation_ledger(pgBackup *backup, parray *ledger);
+extern uint32 read_validation_sample_run(pgBackup *backup);
+extern void write_validation_sample_run(pgBackup *backup, uint32 run);
+extern parray *read_checkdb_ledger(const char *ledger_path, uint32 *run);
+extern void write_checkdb_ledger(const char *ledger_path, parray *ledger,
+								 uint32 run);
+
 extern void print_file_list(FILE *out, const parray *files, const char *root,
 							const char *external_prefix, parray *external_list);
 extern parray *dir_read_file_list(const char *root, const char *external_prefix,
@@ -965,11 +1116,19 @@ extern bool dir_is_empty(const char *path, fio_location location);
 
 extern bool fileExists(const char *path, fio_location location);
 extern size_t pgFileSize(const char *path);
+extern void sync_files(parray *paths, parray *roots, fio_location location);
+extern void sync_filesystems(parray *roots, fio_location location);
+extern void get_sync_roots(parray *roots, const char *root, parray *files);
 
 extern pgFile *pgFileNew(const char *path, const char *rel_path,
 						 bool follow_symlink, int external_dir_num,
 						 fio_location location);
 extern pgFile *pgFileInit(const char *rel_path);
+extern pgFile *pgFileInitShared(const char *rel_path);
+extern uint32 pgFileHashPath(const char *rel_path);
+extern void pgBackupIndexFiles(pgBackup *backup);
+extern void pgBackupFreeFilesIndex(pgBackup *backup);
+extern pgFile **pgBackupSearchFile(pgBackup *backup, pgFile *key);
 extern void pgFileDelete(mode_t mode, const char *full_path);
 extern void fio_pgFileDelete(pgFile *file, const char *full_path);
 
@@ -995,28 +1154,36 @@ extern void backup_data_file(ConnectionArgs* conn_arg, pgFile *file,
 								 XLogRecPtr prev_backup_start_lsn, BackupMode backup_mode,
 								 CompressAlg calg, int clevel, uint32 checksum_version,
 								 int ptrack_version_num, const char *ptrack_schema,
-								 HeaderMap *hdr_map, bool missing_ok);
+								 parray *delta_chain, HeaderMap *hdr_map, bool missing_ok);
 extern void backup_non_data_file(pgFile *file, pgFile *prev_file,
 								 const char *from_fullpath, const char *to_fullpath,
 								 BackupMode backup_mode, time_t parent_backup_time,
-								 bool missing_ok);
+								 bool missing_ok, PackFile *pack);
 extern void backup_non_data_file_internal(const char *from_fullpath,
 										  fio_location from_location,
 										  const char *to_fullpath, pgFile *file,
 										  bool missing_ok);
+extern void prefetch_backup_file(pgFile *file, pgFile *prev_file,
+								 const char *from_fullpath,
+								 XLogRecPtr prev_backup_start_lsn, BackupMode backup_mode,
+								 time_t parent_backup_time, CompressAlg calg, int clevel,
+								 uint32 checksum_version);
 
 extern size_t restore_data_file(parray *parent_chain, pgFile *dest_file, FILE *out,
 								const char *to_fullpath, bool use_bitmap, PageState *checksum_map,
-								XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers);
+								XLogRecPtr shift_lsn, datapagemap_t *lsn_map, bool use_headers,
+								bool validate);
 extern size_t restore_data_file_internal(FILE *in, FILE *out, pgFile *file, uint32 backup_version,
 										 const char *from_fullpath, const char *to_fullpath, int nblocks,
 										 datapagemap_t *map, PageState *checksum_map, int checksum_version,
-										 datapagemap_t *lsn_map, BackupPageHeader2 *headers);
+										 XLogRecPtr stop_lsn, datapagemap_t *lsn_map, BackupPageHeader2 *headers,
+										 PageDeltaChain *delta, bool *corrupted);
 extern size_t restore_non_data_file(parray *parent_chain, pgBackup *dest_backup,
 									pgFile *dest_file, FILE *out, const char *to_fullpath,
-									bool already_exists);
+									bool already_exists, PackFile *pack, bool validate);
 extern void restore_non_data_file_internal(FILE *in, FILE *out, pgFile *file,
-										   const char *from_fullpath, const char *to_fullpath);
+										   const char *from_fullpath, const char *to_fullpath,
+										   bool use_crc32c, pg_crc32 *crc);
 extern bool create_empty_file(fio_location from_location, const char *to_root,
 							  fio_location to_location, pgFile *file);
 
@@ -1028,11 +1195,25 @@ extern pid_t check_postmaster(const char *pgdata);
 
 extern bool validate_file_pages(pgFile *file, const char *fullpath, XLogRecPtr stop_lsn,
 							    uint32 checksum_version, uint32 backup_version, HeaderMap *hdr_map);
+extern bool validate_file_structure(pgFile *file, const char *fullpath,
+									uint32 backup_version, HeaderMap *hdr_map);
+extern bool validate_file_pages_sample(pgFile *file, const char *fullpath,
+									   XLogRecPtr stop_lsn,
+									   uint32 checksum_version, uint32 backup_version,
+									   HeaderMap *hdr_map, uint32 seed, int parts, int part,
+									   int *n_checked);
 
 extern BackupPageHeader2* get_data_file_headers(HeaderMap *hdr_map, pgFile *file, uint32 backup_version, bool strict);
+extern int32 get_page_record_size(FILE *in, pgFile *file, BackupPageHeader2 *headers,
+								  int n, const char *fullpath);
 extern void write_page_headers(BackupPageHeader2 *headers, pgFile *file, HeaderMap *hdr_map, bool is_merge);
 extern void init_header_map(pgBackup *backup);
 extern void cleanup_header_map(HeaderMap *hdr_map);
+extern void init_pack_file(PackFile *pack, const char *root, int num);
+extern void cleanup_pack_file(PackFile *pack);
+extern FILE *open_packed_file(PackFile *pack, const char *root, pgFile *file);
+extern bool get_packed_file_crc(PackFile *pack, const char *root, pgFile *file,
+								pg_crc32 *crc);
 /* parsexlog.c */
 extern bool extractPageMap(const char *archivedir, uint32 wal_seg_size,
 						   XLogRecPtr startpoint, TimeLineID start_tli,
@@ -1063,12 +1244,12 @@ extern XLogRecPtr get_next_record_lsn(const char *archivedir, XLogSegNo	segno, T
 extern TimeLineID get_current_timeline(PGconn *conn);
 extern TimeLineID get_current_timeline_from_control(bool safe);
 extern XLogRecPtr get_checkpoint_location(PGconn *conn);
-extern uint64 get_system_identifier(const char *pgdata_path);
+extern uint64 get_system_identifier(const char *pgdata_path, fio_location location);
 extern uint64 get_remote_system_identifier(PGconn *conn);
 extern uint32 get_data_checksum_version(bool safe);
 extern pg_crc32c get_pgcontrol_checksum(const char *pgdata_path);
 extern uint32 get_xlog_seg_size(char *pgdata_path);
-extern void get_redo(const char *pgdata_path, RedoParams *redo);
+extern void get_redo(const char *pgdata_path, fio_location location, RedoParams *redo);
 extern void set_min_recovery_point(pgFile *file, const char *backup_path,
 								   XLogRecPtr stop_backup_lsn);
 extern void copy_pgcontrol_file(const char *from_fullpath, fio_location from_location,
@@ -1120,7 +1301,8 @@ extern FILE* open_local_file_rw(const char *to_fullpath, char **out_buf, uint32
 extern int send_pages(ConnectionArgs* conn_arg, const char *to_fullpath, const char *from_fullpath,
 					  pgFile *file, XLogRecPtr prev_backup_start_lsn, CompressAlg calg, int clevel,
 					  uint32 checksum_version, bool use_pagemap, BackupPageHeader2 **headers,
-					  BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema);
+					  BackupMode backup_mode, int ptrack_version_num, const char *ptrack_schema,
+					  PageDeltaChain *delta);
 
 /* FIO */
 extern void fio_delete(mode_t mode, const char *fullpath, fio_location location);
@@ -1132,6 +1314,10 @@ extern int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pg
 extern int fio_send_file_gz(const char *from_fullpath, const char *to_fullpath, FILE* out, char **errormsg);
 extern int fio_send_file(const char *from_fullpath, const char *to_fullpath, FILE* out,
 														pgFile *file, char **errormsg);
+extern void fio_prefetch_pages(const char *from_fullpath, pgFile *file,
+							   XLogRecPtr horizonLsn, int calg, int clevel,
+							   uint32 checksum_version, bool use_pagemap);
+extern void fio_prefetch_file(const char *from_fullpath);
 
 extern void fio_list_dir(parray *files, const char *root, bool exclude, bool follow_symlink,
 						 bool add_root, bool backup_logs, bool skip_hidden, int external_dir_num);
@@ -1161,6 +1347,7 @@ extern int32 fio_decompress(void* dst, void const* src, size_t size, int compres
 /* Check if specified location is local for current node */
 extern bool fio_is_remote(fio_location location);
 extern bool fio_is_remote_simple(fio_location location);
+extern bool fio_is_storage(fio_location location);
 
 extern void get_header_errormsg(Page page, char **errormsg);
 extern void get_checksum_errormsg(Page page, char **errormsg,
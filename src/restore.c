@@ -17,6 +17,11 @@
 
 #include "utils/thread.h"
 
+/* number of files synced and journaled together by restore thread */
+#define RESTORE_SYNC_BATCH	64
+/* seconds between journal checkpoints, when filesystems are synced */
+#define RESTORE_SYNCFS_INTERVAL	60
+
 typedef struct
 {
 	parray	   *pgdata_files;
@@ -31,6 +36,14 @@ typedef struct
 	bool        use_bitmap;
 	IncrRestoreMode        incremental_mode;
 	XLogRecPtr  shift_lsn;    /* used only in LSN incremental_mode */
+	parray	   *restored_files;	/* files restored before interruption */
+	bool		no_sync;
+	bool		inline_validate;	/* validate files while restoring them */
+	PackFile	pack;			/* pack file being read */
+	parray	   *sync_roots;		/* roots of filesystems to be synced */
+	/* files to be synced and journaled */
+	parray	   *batch_files;
+	parray	   *batch_paths;
 
 	/*
 	 * Return value from the thread.
@@ -53,6 +66,21 @@ static void restore_chain(pgBackup *dest_backup, parray *parent_chain,
 static void check_incremental_compatibility(const char *pgdata, uint64 system_identifier,
 											IncrRestoreMode incremental_mode);
 
+static parray *read_restore_journal(const char *pgdata_path, pgBackup *dest_backup);
+static void open_restore_journal(const char *pgdata_path, pgBackup *dest_backup,
+								 parray *restored_files);
+static void append_restore_journal(parray *files, parray *paths,
+								   const char *pgdata_path);
+static void sync_restored_files(restore_files_arg *arguments,
+								parray *files, parray *paths);
+static void remove_restore_journal(const char *pgdata_path);
+static bool restore_syncfs_checkpoint(void);
+static void unpacked_container_cleanup(bool fatal, void *userdata);
+
+/* time of the last sync of filesystems by restore threads */
+static time_t restore_syncfs_time = 0;
+static pthread_mutex_t restore_syncfs_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 /*
  * Iterate over backup list to find all ancestors of the broken parent_backup
  * and update their status to BACKUP_STATUS_ORPHAN
@@ -117,6 +145,7 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 	bool        pgdata_is_empty = true;
 	bool        tblspaces_are_empty = true;
 	XLogRecPtr  shift_lsn = InvalidXLogRecPtr;
+	bool		container_unpacked = false;
 
 	if (params->is_restore)
 	{
@@ -126,8 +155,17 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 		/* Check if restore destination empty */
 		if (!dir_is_empty(instance_config.pgdata, FIO_DB_HOST))
 		{
+			char		journal_path[MAXPGPATH];
+
+			join_path_components(journal_path, instance_config.pgdata, RESTORE_JOURNAL);
+
+			/* Interrupted restore has left its journal in destination directory */
+			if (params->resume &&
+				fio_access(journal_path, F_OK, FIO_DB_HOST) == 0)
+				elog(INFO, "Resuming interrupted restore into nonempty directory: \"%s\"",
+					 instance_config.pgdata);
 			/* Check that remote system is NOT running and systemd id is the same as ours */
-			if (params->incremental_mode != INCR_NONE)
+			else if (params->incremental_mode != INCR_NONE)
 			{
 				elog(INFO, "Running incremental restore into nonempty directory: \"%s\"",
 					 instance_config.pgdata);
@@ -143,6 +181,11 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 			/* if destination directory is empty, then incremental restore may be disabled */
 			pgdata_is_empty = false;
 		}
+		else if (params->resume)
+		{
+			elog(INFO, "Destination directory is empty, there is no restore to resume");
+			params->resume = false;
+		}
 	}
 
 	if (instance_name == NULL)
@@ -340,7 +383,9 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 	 */
 	if (params->is_restore)
 	{
-		check_tablespace_mapping(dest_backup, params->incremental_mode != INCR_NONE, &tblspaces_are_empty);
+		check_tablespace_mapping(dest_backup,
+								 params->incremental_mode != INCR_NONE || params->resume,
+								 &tblspaces_are_empty);
 
 		if (params->incremental_mode != INCR_NONE && pgdata_is_empty && tblspaces_are_empty)
 		{
@@ -351,7 +396,8 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 
 		/* no point in checking external directories if their restore is not requested */
 		if (!params->skip_external_dirs)
-			check_external_dir_mapping(dest_backup, params->incremental_mode != INCR_NONE);
+			check_external_dir_mapping(dest_backup,
+									   params->incremental_mode != INCR_NONE || params->resume);
 	}
 
 	/* At this point we are sure that parent chain is whole
@@ -371,6 +417,41 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 		tmp_backup = tmp_backup->parent_backup_link;
 	}
 
+	/*
+	 * Container of destination backup may be provided with --input option.
+	 * Container file is read in place, while container read from a pipe
+	 * is unpacked into the backup directory and removed afterwards.
+	 */
+	if (params->container_input)
+	{
+		struct stat st;
+
+		if (dest_backup->container == NULL)
+			elog(ERROR, "Backup %s is not written into container, "
+				 "option --input cannot be used",
+				 base36enc(dest_backup->start_time));
+
+		if (strcmp(params->container_input, CONTAINER_STDIO) != 0 &&
+			stat(params->container_input, &st) == 0 && S_ISREG(st.st_mode))
+			container_mount(params->container_input, dest_backup->root_dir);
+		else
+		{
+			pgut_atexit_push(unpacked_container_cleanup, dest_backup->root_dir);
+			container_unpack(params->container_input, dest_backup->root_dir);
+			container_unpacked = true;
+		}
+	}
+
+	for (i = 0; i < parray_num(parent_chain); i++)
+	{
+		tmp_backup = (pgBackup *) parray_get(parent_chain, i);
+
+		if (!backup_container_is_available(tmp_backup))
+			elog(ERROR, "Backup %s is written to standard output, "
+				 "its container must be provided with --input option",
+				 base36enc(tmp_backup->start_time));
+	}
+
 	/*
 	 * Determine the shift-LSN
 	 * Consider the example A:
@@ -409,7 +490,7 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 	{
 		RedoParams redo;
 		parray	  *timelines = NULL;
-		get_redo(instance_config.pgdata, &redo);
+		get_redo(instance_config.pgdata, FIO_DB_HOST, &redo);
 
 		if (redo.checksum_version == 0)
 			elog(ERROR, "Incremental restore in 'lsn' mode require "
@@ -483,8 +564,22 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 		params->shift_lsn = shift_lsn;
 	}
 
+	/*
+	 * Restore with inline validation checks backup files while restoring
+	 * them, only WAL is validated beforehand. Files of the chain, which
+	 * are not restored, are not validated.
+	 */
+	if (params->is_restore && !params->no_validate && params->inline_validate)
+	{
+		elog(INFO, "Restored files of backup %s will be validated during restore",
+			 base36enc(dest_backup->start_time));
+
+		validate_wal(dest_backup, arclog_path, rt->target_time,
+					 rt->target_xid, rt->target_lsn,
+					 dest_backup->tli, instance_config.xlog_seg_size);
+	}
 	/* for validation or restore with enabled validation */
-	if (!params->is_restore || !params->no_validate)
+	else if (!params->is_restore || !params->no_validate)
 	{
 		if (dest_backup->backup_mode != BACKUP_MODE_FULL)
 			elog(INFO, "Validating parents for backup %s", base36enc(dest_backup->start_time));
@@ -514,11 +609,12 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 			pgBackupValidate(tmp_backup, params);
 
 			/* After pgBackupValidate() only following backup
-			 * states are possible: ERROR, RUNNING, CORRUPT and OK.
+			 * states are possible: ERROR, RUNNING, CORRUPT and OK,
+			 * and DONE after sampled validation.
 			 * Validate WAL only for OK, because there is no point
 			 * in WAL validation for corrupted, errored or running backups.
 			 */
-			if (tmp_backup->status != BACKUP_STATUS_OK)
+			if (!backup_is_validated(tmp_backup))
 			{
 				corrupted_backup = tmp_backup;
 				break;
@@ -555,6 +651,8 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 	{
 		if (params->no_validate)
 			elog(WARNING, "Backup %s is used without validation.", base36enc(dest_backup->start_time));
+		else if (params->inline_validate)
+			elog(INFO, "Backup %s WAL is valid.", base36enc(dest_backup->start_time));
 		else
 			elog(INFO, "Backup %s is valid.", base36enc(dest_backup->start_time));
 	}
@@ -606,11 +704,20 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 
 		/* Create recovery.conf with given recovery target parameters */
 		create_recovery_conf(target_backup_id, rt, dest_backup, params);
+
+		/* Restore is complete, journal is no longer needed */
+		remove_restore_journal(instance_config.pgdata);
 	}
 
 	/* ssh connection to longer needed */
 	fio_disconnect();
 
+	if (container_unpacked)
+	{
+		pgut_atexit_pop(unpacked_container_cleanup, dest_backup->root_dir);
+		container_remove_unpacked(dest_backup->root_dir);
+	}
+
 	elog(INFO, "%s of backup %s completed.",
 		 action, base36enc(dest_backup->start_time));
 
@@ -622,6 +729,13 @@ do_restore_or_validate(time_t target_backup_id, pgRecoveryTarget *rt,
 	return 0;
 }
 
+/* Remove files of backup container unpacked for restore or validate */
+static void
+unpacked_container_cleanup(bool fatal, void *userdata)
+{
+	container_remove_unpacked((const char *) userdata);
+}
+
 /*
  * Restore backup chain.
  */
@@ -640,6 +754,8 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	restore_files_arg *threads_args;
 	bool		restore_isok = true;
 	bool        use_bitmap = true;
+	parray	   *restored_files = NULL;
+	parray	   *sync_roots = parray_new();
 
 	/* fancy reporting */
 	char		pretty_dest_bytes[20];
@@ -697,6 +813,9 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		 * using bsearch.
 		 */
 		parray_qsort(backup->files, pgFileCompareRelPathWithExternal);
+
+		/* chain members are looked up for every destination file */
+		pgBackupIndexFiles(backup);
 	}
 
 	/* If dest backup version is older than 2.4.0, then bitmap optimization
@@ -727,7 +846,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	 */
 	create_data_directories(dest_files, instance_config.pgdata,
 							dest_backup->root_dir, true,
-							params->incremental_mode != INCR_NONE,
+							params->incremental_mode != INCR_NONE || params->resume,
 							FIO_DB_HOST);
 
 	/*
@@ -829,7 +948,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 			pgFile	   *file = (pgFile *) parray_get(pgdata_files, i);
 
 			/* if file does not exists in destination list, then we can safely unlink it */
-			if (parray_bsearch(dest_backup->files, file, pgFileCompareRelPathWithExternal) == NULL)
+			if (pgBackupSearchFile(dest_backup, file) == NULL)
 			{
 				char		fullpath[MAXPGPATH];
 
@@ -853,6 +972,25 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		elog(INFO, "Redundant files are removed, time elapsed: %s", pretty_time);
 	}
 
+	/* Get files restored before interruption and start the journal */
+	if (params->resume)
+	{
+		restored_files = read_restore_journal(pgdata_path, dest_backup);
+
+		elog(INFO, "Files restored before interruption: %lu",
+			 parray_num(restored_files));
+
+		/* Sort the array for binary search */
+		parray_qsort(restored_files, pgFileCompareRelPathWithExternal);
+	}
+	open_restore_journal(pgdata_path, dest_backup, restored_files);
+
+	/* Filesystems holding restored files are synced by their roots */
+	get_sync_roots(sync_roots, pgdata_path, dest_files);
+	for (i = 0; external_dirs && i < parray_num(external_dirs); i++)
+		parray_append(sync_roots, pgut_strdup(parray_get(external_dirs, i)));
+	time(&restore_syncfs_time);
+
 	/*
 	 * Close ssh connection belonging to the main thread
 	 * to avoid the possibility of been killed for idleness
@@ -888,6 +1026,13 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		arg->use_bitmap = use_bitmap;
 		arg->incremental_mode = params->incremental_mode;
 		arg->shift_lsn = params->shift_lsn;
+		arg->restored_files = restored_files;
+		arg->no_sync = no_sync;
+		arg->inline_validate = params->inline_validate && !params->no_validate;
+		init_pack_file(&(arg->pack), NULL, 0);
+		arg->sync_roots = sync_roots;
+		arg->batch_files = parray_new();
+		arg->batch_paths = parray_new();
 		threads_args[i].restored_bytes = 0;
 		/* By default there are some error */
 		threads_args[i].ret = 1;
@@ -923,8 +1068,28 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 			pretty_total_bytes, pretty_dest_bytes);
 	}
 	else
+	{
+		/*
+		 * Inline validation marks corrupted backup as CORRUPT,
+		 * orphanize its descendants, as validation does.
+		 */
+		if (params->inline_validate)
+		{
+			for (i = parray_num(parent_chain) - 1; i >= 0; i--)
+			{
+				pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
+
+				if (backup->status == BACKUP_STATUS_CORRUPT)
+				{
+					set_orphan_status(parent_chain, backup);
+					break;
+				}
+			}
+		}
+
 		elog(ERROR, "Backup files restoring failed. Transfered bytes: %s, time elapsed: %s",
 			pretty_total_bytes, pretty_time);
+	}
 
 	/* Close page header maps */
 	for (i = parray_num(parent_chain) - 1; i >= 0; i--)
@@ -933,51 +1098,43 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 		cleanup_header_map(&(backup->hdr_map));
 	}
 
+	if (restored_files)
+	{
+		parray_walk(restored_files, pgFileFree);
+		parray_free(restored_files);
+	}
+
+	/*
+	 * With fsync restored files are synced to disk by restore threads
+	 * in batches, before they are journaled. With syncfs files left
+	 * unjournaled by the threads are journaled after single sync of
+	 * every filesystem.
+	 */
 	if (no_sync)
 		elog(WARNING, "Restored files are not synced to disk");
-	else
+	else if (sync_method == SYNC_METHOD_SYNCFS)
 	{
 		elog(INFO, "Syncing restored files to disk");
-		time(&start_time);
+		sync_filesystems(sync_roots, FIO_DB_HOST);
 
-		for (i = 0; i < parray_num(dest_files); i++)
+		for (i = 0; i < num_threads; i++)
 		{
-			char		to_fullpath[MAXPGPATH];
-			pgFile	   *dest_file = (pgFile *) parray_get(dest_files, i);
-
-			if (S_ISDIR(dest_file->mode))
-				continue;
+			restore_files_arg *arg = &(threads_args[i]);
 
-			/* skip external files if ordered to do so */
-			if (dest_file->external_dir_num > 0 &&
-				params->skip_external_dirs)
-				continue;
-
-			/* construct fullpath */
-			if (dest_file->external_dir_num == 0)
-			{
-				if (strcmp(PG_TABLESPACE_MAP_FILE, dest_file->rel_path) == 0)
-					continue;
-				if (strcmp(DATABASE_MAP, dest_file->rel_path) == 0)
-					continue;
-				join_path_components(to_fullpath, pgdata_path, dest_file->rel_path);
-			}
-			else
-			{
-				char *external_path = parray_get(external_dirs, dest_file->external_dir_num - 1);
-				join_path_components(to_fullpath, external_path, dest_file->rel_path);
-			}
-
-			/* TODO: write test for case: file to be synced is missing */
-			if (fio_sync(to_fullpath, FIO_DB_HOST) != 0)
-				elog(ERROR, "Failed to sync file \"%s\": %s", to_fullpath, strerror(errno));
+			if (parray_num(arg->batch_paths) > 0)
+				append_restore_journal(arg->batch_files, arg->batch_paths,
+									   pgdata_path);
 		}
+	}
 
-		time(&end_time);
-		pretty_time_interval(difftime(end_time, start_time),
-							 pretty_time, lengthof(pretty_time));
-		elog(INFO, "Restored backup files are synced, time elapsed: %s", pretty_time);
+	for (i = 0; i < num_threads; i++)
+	{
+		parray_walk(threads_args[i].batch_paths, pfree);
+		parray_free(threads_args[i].batch_paths);
+		parray_free(threads_args[i].batch_files);
 	}
+	parray_walk(sync_roots, pfree);
+	parray_free(sync_roots);
 
 	/* cleanup */
 	pfree(threads);
@@ -996,6 +1153,7 @@ restore_chain(pgBackup *dest_backup, parray *parent_chain,
 	{
 		pgBackup   *backup = (pgBackup *) parray_get(parent_chain, i);
 
+		pgBackupFreeFilesIndex(backup);
 		parray_walk(backup->files, pgFileFree);
 		parray_free(backup->files);
 	}
@@ -1053,6 +1211,11 @@ restore_files(void *arg)
 				create_empty_file(FIO_BACKUP_HOST,
 					  arguments->to_root, FIO_DB_HOST, dest_file);
 
+				/* empty file is synced, but not journaled */
+				join_path_components(to_fullpath, arguments->to_root, dest_file->rel_path);
+				parray_append(arguments->batch_files, NULL);
+				parray_append(arguments->batch_paths, pgut_strdup(to_fullpath));
+
 				elog(VERBOSE, "Skip file due to partial restore: \"%s\"",
 						dest_file->rel_path);
 				continue;
@@ -1089,6 +1252,26 @@ restore_files(void *arg)
 			join_path_components(to_fullpath, external_path, dest_file->rel_path);
 		}
 
+		/* Skip the file restored before interruption */
+		if (arguments->restored_files)
+		{
+			pgFile	  **restored_file;
+			struct stat st;
+
+			restored_file = (pgFile **) parray_bsearch(arguments->restored_files,
+										dest_file, pgFileCompareRelPathWithExternal);
+
+			if (restored_file &&
+				(*restored_file)->crc == dest_file->crc &&
+				fio_stat(to_fullpath, &st, false, FIO_DB_HOST) == 0 &&
+				st.st_size == (*restored_file)->size)
+			{
+				elog(VERBOSE, "Skip file restored before interruption: \"%s\"",
+					 to_fullpath);
+				continue;
+			}
+		}
+
 		if (arguments->incremental_mode != INCR_NONE &&
 			parray_bsearch(arguments->pgdata_files, dest_file, pgFileCompareRelPathWithExternalDesc))
 		{
@@ -1161,7 +1344,8 @@ restore_files(void *arg)
 			arguments->restored_bytes += restore_data_file(arguments->parent_chain,
 														   dest_file, out, to_fullpath,
 														   arguments->use_bitmap, checksum_map,
-														   arguments->shift_lsn, lsn_map, true);
+														   arguments->shift_lsn, lsn_map, true,
+														   arguments->inline_validate);
 		}
 		else
 		{
@@ -1171,7 +1355,8 @@ restore_files(void *arg)
 			/* Destination file is nonedata file */
 			arguments->restored_bytes += restore_non_data_file(arguments->parent_chain,
 										arguments->dest_backup, dest_file, out, to_fullpath,
-										already_exists);
+										already_exists, &(arguments->pack),
+										arguments->inline_validate);
 		}
 
 done:
@@ -1180,6 +1365,17 @@ done:
 			elog(ERROR, "Cannot close file \"%s\": %s", to_fullpath,
 				 strerror(errno));
 
+		/* start writeback early, file is synced and journaled in batch */
+		if (!arguments->no_sync)
+			fio_sync_file(to_fullpath, FIO_SYNC_WRITEBACK, FIO_DB_HOST);
+
+		parray_append(arguments->batch_files, dest_file);
+		parray_append(arguments->batch_paths, pgut_strdup(to_fullpath));
+
+		if (parray_num(arguments->batch_paths) >= RESTORE_SYNC_BATCH)
+			sync_restored_files(arguments, arguments->batch_files,
+								arguments->batch_paths);
+
 		/* free pagemap used for restore optimization */
 		pg_free(dest_file->pagemap.bitmap);
 
@@ -1190,7 +1386,13 @@ done:
 		pg_free(checksum_map);
 	}
 
+	/* with syncfs the rest of files is synced and journaled by main thread */
+	if (arguments->no_sync || sync_method != SYNC_METHOD_SYNCFS)
+		sync_restored_files(arguments, arguments->batch_files,
+							arguments->batch_paths);
+
 	free(out_buf);
+	cleanup_pack_file(&(arguments->pack));
 
 	/* ssh connection to longer needed */
 	fio_disconnect();
@@ -1201,6 +1403,231 @@ done:
 	return NULL;
 }
 
+/*
+ * Read RESTORE_JOURNAL left in PGDATA by interrupted restore.
+ * Journal must belong to the same backup. Partially written
+ * last entry is ignored.
+ */
+static parray *
+read_restore_journal(const char *pgdata_path, pgBackup *dest_backup)
+{
+	FILE	   *fp;
+	char		path[MAXPGPATH];
+	char		buf[MAXPGPATH * 2];
+	parray	   *files = parray_new();
+	bool		header_is_read = false;
+
+	join_path_components(path, pgdata_path, RESTORE_JOURNAL);
+
+	fp = fio_open_stream(path, FIO_DB_HOST);
+	if (fp == NULL)
+		elog(ERROR, "Cannot open restore journal \"%s\": %s", path, strerror(errno));
+
+	while (fgets(buf, lengthof(buf), fp))
+	{
+		char		rel_path[MAXPGPATH];
+		char		backup_id[20];
+		uint32		crc;
+		int64		size;
+		int			external_dir_num;
+		pgFile	   *file;
+
+		/* partially written entry */
+		if (buf[strlen(buf) - 1] != '\n')
+			break;
+
+		if (!header_is_read)
+		{
+			if (sscanf(buf, "backup-id %19s", backup_id) != 1)
+				elog(ERROR, "Invalid header of restore journal \"%s\"", path);
+
+			if (strcmp(backup_id, base36enc(dest_backup->start_time)) != 0)
+				elog(ERROR, "Restore journal \"%s\" belongs to backup %s, "
+					 "restore of backup %s cannot be resumed",
+					 path, backup_id, base36enc(dest_backup->start_time));
+
+			header_is_read = true;
+			continue;
+		}
+
+		if (sscanf(buf, "%u " INT64_FORMAT " %d %[^\n]",
+				   &crc, &size, &external_dir_num, rel_path) != 4)
+			elog(ERROR, "Invalid entry in restore journal \"%s\": %s", path, buf);
+
+		file = pgFileInit(rel_path);
+		file->crc = crc;
+		file->size = size;
+		file->external_dir_num = external_dir_num;
+
+		parray_append(files, file);
+	}
+
+	if (ferror(fp))
+		elog(ERROR, "Failed to read from file: \"%s\"", path);
+
+	fio_close_stream(fp);
+
+	return files;
+}
+
+/*
+ * Create RESTORE_JOURNAL in PGDATA. Entries of files restored before
+ * interruption are carried over.
+ */
+static void
+open_restore_journal(const char *pgdata_path, pgBackup *dest_backup,
+					 parray *restored_files)
+{
+	FILE	   *out;
+	char		path[MAXPGPATH];
+	int			i;
+
+	join_path_components(path, pgdata_path, RESTORE_JOURNAL);
+
+	out = fio_fopen(path, PG_BINARY_W, FIO_DB_HOST);
+	if (out == NULL)
+		elog(ERROR, "Cannot open restore journal \"%s\": %s", path, strerror(errno));
+
+	fio_fprintf(out, "backup-id %s\n", base36enc(dest_backup->start_time));
+
+	for (i = 0; restored_files && i < parray_num(restored_files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(restored_files, i);
+
+		fio_fprintf(out, "%u " INT64_FORMAT " %d %s\n",
+					file->crc, (int64) file->size, file->external_dir_num,
+					file->rel_path);
+	}
+
+	if (fio_fflush(out) != 0 ||
+		fio_fclose(out) != 0)
+		elog(ERROR, "Cannot write restore journal \"%s\": %s", path, strerror(errno));
+}
+
+/*
+ * Append entries of restored files to RESTORE_JOURNAL.
+ * Entry keeps CRC of the file in backup and size of restored file.
+ * Files without pgFile are not journaled.
+ * Journal is reopened every time, because in remote mode every
+ * thread has its own connection to the agent.
+ */
+static void
+append_restore_journal(parray *files, parray *paths, const char *pgdata_path)
+{
+	FILE	   *out;
+	char		path[MAXPGPATH];
+	int			i;
+
+	join_path_components(path, pgdata_path, RESTORE_JOURNAL);
+
+	out = fio_fopen(path, "a", FIO_DB_HOST);
+	if (out == NULL)
+		elog(ERROR, "Cannot open restore journal \"%s\": %s", path, strerror(errno));
+
+	for (i = 0; i < parray_num(files); i++)
+	{
+		pgFile	   *file = (pgFile *) parray_get(files, i);
+		char	   *to_fullpath = (char *) parray_get(paths, i);
+		struct stat st;
+
+		if (!file)
+			continue;
+
+		if (fio_stat(to_fullpath, &st, false, FIO_DB_HOST) != 0)
+			elog(ERROR, "Cannot stat file \"%s\": %s", to_fullpath, strerror(errno));
+
+		fio_fprintf(out, "%u " INT64_FORMAT " %d %s\n",
+					file->crc, (int64) st.st_size, file->external_dir_num,
+					file->rel_path);
+	}
+
+	if (fio_fflush(out) != 0 ||
+		fio_fclose(out) != 0)
+		elog(ERROR, "Cannot write restore journal \"%s\": %s", path, strerror(errno));
+}
+
+/*
+ * Sync the batch of files written by restore thread and journal them.
+ * The file must reach the disk before it is journaled, otherwise
+ * resumed restore may skip the lost file. Writeback of every file
+ * is started as soon as it is written, so syncing the batch mostly
+ * waits for I/O which is already in progress.
+ *
+ * Syncing of the whole filesystem is too expensive to be done for
+ * every batch, so with syncfs files are accumulated and journaled
+ * only at rare checkpoints.
+ */
+static void
+sync_restored_files(restore_files_arg *arguments, parray *files, parray *paths)
+{
+	int			i;
+
+	if (parray_num(paths) == 0)
+		return;
+
+	if (!arguments->no_sync && sync_method == SYNC_METHOD_SYNCFS)
+	{
+		if (!restore_syncfs_checkpoint())
+			return;
+
+		sync_filesystems(arguments->sync_roots, FIO_DB_HOST);
+	}
+	else if (!arguments->no_sync)
+	{
+		for (i = 0; i < parray_num(paths); i++)
+		{
+			char	   *to_fullpath = (char *) parray_get(paths, i);
+
+			if (fio_sync(to_fullpath, FIO_DB_HOST) != 0)
+				elog(ERROR, "Failed to sync file \"%s\": %s", to_fullpath, strerror(errno));
+		}
+	}
+
+	append_restore_journal(files, paths, arguments->to_root);
+
+	/* empty the batch */
+	while (parray_num(paths) > 0)
+	{
+		pfree(parray_remove(paths, parray_num(paths) - 1));
+		parray_remove(files, parray_num(files) - 1);
+	}
+}
+
+/*
+ * Check if RESTORE_SYNCFS_INTERVAL has passed since the last sync
+ * of filesystems. Only one thread gets the checkpoint in the interval.
+ */
+static bool
+restore_syncfs_checkpoint(void)
+{
+	bool		result = false;
+	time_t		now = time(NULL);
+
+	pthread_lock(&restore_syncfs_mutex);
+	if (now - restore_syncfs_time >= RESTORE_SYNCFS_INTERVAL)
+	{
+		restore_syncfs_time = now;
+		result = true;
+	}
+	pthread_mutex_unlock(&restore_syncfs_mutex);
+
+	return result;
+}
+
+/*
+ * Remove RESTORE_JOURNAL after restore is completed.
+ */
+static void
+remove_restore_journal(const char *pgdata_path)
+{
+	char		path[MAXPGPATH];
+
+	join_path_components(path, pgdata_path, RESTORE_JOURNAL);
+
+	if (fio_unlink(path, FIO_DB_HOST) != 0 && errno != ENOENT)
+		elog(ERROR, "Cannot remove file \"%s\": %s", path, strerror(errno));
+}
+
 /*
  * Create recovery.conf (probackup_recovery.conf in case of PG12)
  * with given recovery target parameters
@@ -1535,7 +1962,7 @@ read_timeline_history(const char *arclog_path, TimeLineID targetTLI, bool strict
 	/* Timeline 1 does not have a history file */
 	if (targetTLI != 1)
 	{
-		fd = fopen(path, "rt");
+		fd = fio_fopen(path, "rt", FIO_BACKUP_HOST);
 		if (fd == NULL)
 		{
 			if (errno != ENOENT)
@@ -1979,7 +2406,7 @@ check_incremental_compatibility(const char *pgdata, uint64 system_identifier,
 	 * choose a backup suitable for lsn based incremental restore.
 	 */
 
-	system_id_pgdata = get_system_identifier(pgdata);
+	system_id_pgdata = get_system_identifier(pgdata, FIO_DB_HOST);
 
 	if (system_id_pgdata != instance_config.system_identifier)
 	{
@@ -434,6 +434,10 @@ print_backup_json_object(PQExpBuffer buf, pgBackup *backup)
 		json_add_value(buf, "note", backup->note,
 					json_level, true);
 
+	if (backup->container)
+		json_add_value(buf, "container", backup->container,
+					json_level, true);
+
 	if (backup->content_crc != 0)
 	{
 		json_add_key(buf, "content-crc", json_level);
@@ -249,14 +249,14 @@ get_checkpoint_location(PGconn *conn)
 }
 
 uint64
-get_system_identifier(const char *pgdata_path)
+get_system_identifier(const char *pgdata_path, fio_location location)
 {
 	ControlFileData ControlFile;
 	char	   *buffer;
 	size_t		size;
 
 	/* First fetch file... */
-	buffer = slurpFile(pgdata_path, XLOG_CONTROL_FILE, &size, false, FIO_DB_HOST);
+	buffer = slurpFile(pgdata_path, XLOG_CONTROL_FILE, &size, false, location);
 	if (buffer == NULL)
 		return 0;
 	digestControlFile(&ControlFile, buffer, size);
@@ -352,14 +352,14 @@ get_pgcontrol_checksum(const char *pgdata_path)
 }
 
 void
-get_redo(const char *pgdata_path, RedoParams *redo)
+get_redo(const char *pgdata_path, fio_location location, RedoParams *redo)
 {
 	ControlFileData ControlFile;
 	char	   *buffer;
 	size_t		size;
 
 	/* First fetch file... */
-	buffer = slurpFile(pgdata_path, XLOG_CONTROL_FILE, &size, false, FIO_DB_HOST);
+	buffer = slurpFile(pgdata_path, XLOG_CONTROL_FILE, &size, false, location);
 
 	digestControlFile(&ControlFile, buffer, size);
 	pg_free(buffer);
@@ -419,7 +419,7 @@ set_min_recovery_point(pgFile *file, const char *backup_path,
 
 	/* overwrite pg_control */
 	snprintf(fullpath, sizeof(fullpath), "%s/%s", backup_path, XLOG_CONTROL_FILE);
-	writeControlFile(&ControlFile, fullpath, FIO_LOCAL_HOST);
+	writeControlFile(&ControlFile, fullpath, FIO_BACKUP_HOST);
 
 	/* Update pg_control checksum in backup_list */
 	file->crc = ControlFile.crc;
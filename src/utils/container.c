@@ -0,0 +1,1247 @@
+/*-------------------------------------------------------------------------
+ *
+ * container.c: single-stream backup container.
+ *
+ * Backup taken with --output option does not create a file per relation
+ * segment in the backup directory. Instead, backup threads append content
+ * of files to a single stream, which can be a regular file or standard
+ * output. Content is written in chunks, so chunks of files copied by
+ * different threads are interleaved. Metadata of the backup
+ * (backup.control, backup_content.control) stays in the backup catalog,
+ * only content of DATABASE_DIR, external directories and page header map
+ * is placed into container.
+ *
+ * Container layout:
+ *
+ *	ContainerHeader
+ *	ContainerRecord [payload]		(MEMBER, DATA, CLOSE, RENAME, UNLINK)
+ *	...
+ *	ContainerRecord index			(INDEX)
+ *	ContainerTrailer
+ *
+ * Container can be read sequentially and unpacked into the backup
+ * directory, which is the only option for a pipe. Container stored in
+ * a regular file is read in place: trailer points to the index with
+ * the list of chunks of each member, so any member can be read by
+ * seeking, as it is done by validate and restore.
+ *
+ * Members are accessed via stdio FILE streams (see fopencookie(3)), so
+ * the code reading and writing backup files with fread()/fwrite() works
+ * unchanged.
+ *
+ * Copyright (c) 2020, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "pg_probackup.h"
+
+#include <fcntl.h>
+#include <unistd.h>
+
+#include "container.h"
+#include "thread.h"
+
+#define CONTAINER_MAGIC		"PGPBCONT"
+#define CONTAINER_MAGIC_LEN	8
+#define CONTAINER_VERSION	1
+/* Maximum size of data chunk, member streams buffer data up to this size */
+#define CONTAINER_CHUNK_SIZE	(1024 * 1024)
+
+typedef enum ContainerRecordType
+{
+	CONTAINER_MEMBER = 1,		/* new member, payload is its path */
+	CONTAINER_DATA,				/* payload is content of member */
+	CONTAINER_CLOSE,			/* member is written completely */
+	CONTAINER_RENAME,			/* payload is new path of member */
+	CONTAINER_UNLINK,			/* member is removed */
+	CONTAINER_INDEX				/* payload is index of members */
+} ContainerRecordType;
+
+typedef struct ContainerHeader
+{
+	char		magic[CONTAINER_MAGIC_LEN];
+	uint32		version;
+	uint32		padding;
+} ContainerHeader;
+
+typedef struct ContainerRecord
+{
+	uint32		type;
+	uint32		member;			/* member id */
+	uint64		offset;			/* offset of data in member */
+	uint64		size;			/* size of payload */
+} ContainerRecord;
+
+typedef struct ContainerTrailer
+{
+	uint64		index_offset;	/* offset of CONTAINER_INDEX record */
+	char		magic[CONTAINER_MAGIC_LEN];
+} ContainerTrailer;
+
+/* Entry of index, followed by path of member and array of its chunks */
+typedef struct ContainerIndexEntry
+{
+	uint64		size;
+	uint32		path_len;
+	uint32		nchunks;
+	pg_crc32c	crc;
+	uint32		padding;
+} ContainerIndexEntry;
+
+typedef struct ContainerChunk
+{
+	uint64		data_offset;	/* offset of data in container */
+	uint64		offset;			/* offset of data in member */
+	uint64		size;
+} ContainerChunk;
+
+typedef struct ContainerMember
+{
+	uint32		id;
+	char	   *path;			/* relative to backup directory */
+	uint64		size;
+	pg_crc32c	crc;			/* CRC-32C of content */
+	bool		removed;
+	ContainerChunk *chunks;
+	uint32		nchunks;
+	uint32		maxchunks;
+} ContainerMember;
+
+typedef struct Container
+{
+	char	   *path;			/* container file or CONTAINER_STDIO */
+	char	   *root;			/* backup directory */
+	FILE	   *out;			/* output stream, if container is written */
+	uint64		offset;			/* size of written part of container */
+	int			fd;				/* container file, if container is read */
+	bool		loaded;			/* are members known */
+	parray	   *members;
+	pthread_mutex_t lock;
+} Container;
+
+/* Stream of container member */
+typedef struct ContainerStream
+{
+	Container  *container;
+	ContainerMember *member;
+	bool		write;
+	uint64		pos;
+	uint32		chunk;			/* chunk read last time */
+	char	   *buf;			/* data not yet appended to container */
+	size_t		buf_len;
+	size_t		buf_size;
+} ContainerStream;
+
+/* Paths, relative to backup directory, whose content is kept in container */
+static const char *container_paths[] =
+{
+	DATABASE_DIR,
+	"external_directories",		/* parent directory of EXTERNAL_DIR */
+	HEADER_MAP,
+	HEADER_MAP_TMP,
+	NULL
+};
+
+/* Container of the backup being taken */
+static Container *writer = NULL;
+/* Containers of backups in catalog */
+static parray *mounts = NULL;
+static pthread_mutex_t mounts_lock = PTHREAD_MUTEX_INITIALIZER;
+
+static ssize_t container_stream_read(void *cookie, char *buf, size_t size);
+static ssize_t container_stream_write(void *cookie, const char *buf, size_t size);
+static int	container_stream_seek(void *cookie, off64_t *offset, int whence);
+static int	container_stream_close(void *cookie);
+
+static const cookie_io_functions_t container_stream_funcs = {
+	container_stream_read,
+	container_stream_write,
+	container_stream_seek,
+	container_stream_close
+};
+
+static Container *
+container_new(const char *path, const char *root)
+{
+	Container  *c = pgut_new(Container);
+
+	memset(c, 0, sizeof(Container));
+	c->path = pgut_strdup(path);
+	c->root = pgut_strdup(root);
+	c->fd = -1;
+	c->members = parray_new();
+	pthread_mutex_init(&c->lock, NULL);
+
+	return c;
+}
+
+static void
+container_member_free(void *member)
+{
+	ContainerMember *m = (ContainerMember *) member;
+
+	pg_free(m->path);
+	pg_free(m->chunks);
+	pg_free(m);
+}
+
+static void
+container_free(Container *c)
+{
+	if (c->fd >= 0)
+		close(c->fd);
+	parray_walk(c->members, container_member_free);
+	parray_free(c->members);
+	pthread_mutex_destroy(&c->lock);
+	pg_free(c->path);
+	pg_free(c->root);
+	pg_free(c);
+}
+
+/* Compare members by path and by id in descending order */
+static int
+container_member_compare(const void *a, const void *b)
+{
+	ContainerMember *ma = *(ContainerMember **) a;
+	ContainerMember *mb = *(ContainerMember **) b;
+	int			res = strcmp(ma->path, mb->path);
+
+	if (res != 0)
+		return res;
+	return (ma->id < mb->id) ? 1 : (ma->id > mb->id) ? -1 : 0;
+}
+
+static int
+container_member_compare_path(const void *a, const void *b)
+{
+	return strcmp((*(ContainerMember **) a)->path,
+				  (*(ContainerMember **) b)->path);
+}
+
+/* Check if content of path relative to backup directory is in container */
+static bool
+container_path_is_member(const char *rel)
+{
+	int			i;
+
+	if (is_absolute_path(rel) || path_contains_parent_reference(rel))
+		return false;
+
+	for (i = 0; container_paths[i]; i++)
+	{
+		size_t		len = strlen(container_paths[i]);
+
+		if (strncmp(rel, container_paths[i], len) == 0 &&
+			(rel[len] == '\0' || rel[len] == '/'))
+			return true;
+	}
+	return false;
+}
+
+/* Get path relative to backup directory, if content of the file is in container */
+static const char *
+container_relative_path(Container *c, const char *path)
+{
+	size_t		len = strlen(c->root);
+
+	if (strncmp(path, c->root, len) != 0 || path[len] != '/' ||
+		!container_path_is_member(path + len + 1))
+		return NULL;
+
+	return path + len + 1;
+}
+
+/*
+ * Find container keeping content of the file. Path of the file relative
+ * to backup directory is returned in rel.
+ */
+static Container *
+container_find(const char *path, const char **rel)
+{
+	Container  *c = NULL;
+	int			i;
+
+	if (writer && (*rel = container_relative_path(writer, path)) != NULL)
+		return writer;
+
+	if (mounts == NULL)
+		return NULL;
+
+	pthread_lock(&mounts_lock);
+	for (i = 0; i < parray_num(mounts); i++)
+	{
+		Container  *mount = (Container *) parray_get(mounts, i);
+
+		if ((*rel = container_relative_path(mount, path)) != NULL)
+		{
+			c = mount;
+			break;
+		}
+	}
+	pthread_mutex_unlock(&mounts_lock);
+
+	return c;
+}
+
+/*
+ * Find live member. Must be called with container lock held,
+ * if container is being written.
+ */
+static ContainerMember *
+container_find_member(Container *c, const char *rel)
+{
+	int			i;
+
+	if (c != writer)
+	{
+		ContainerMember key;
+		ContainerMember *keyp = &key;
+		ContainerMember **m;
+
+		key.path = (char *) rel;
+		m = (ContainerMember **) parray_bsearch(c->members, &keyp,
+												container_member_compare_path);
+		return m ? *m : NULL;
+	}
+
+	/* the latest member with this path supersedes all previous ones */
+	for (i = parray_num(c->members) - 1; i >= 0; i--)
+	{
+		ContainerMember *m = (ContainerMember *) parray_get(c->members, i);
+
+		if (strcmp(m->path, rel) == 0)
+			return m->removed ? NULL : m;
+	}
+	return NULL;
+}
+
+/* Remove all members with the path, except the given one */
+static void
+container_remove_path(Container *c, const char *rel, ContainerMember *keep)
+{
+	int			i;
+
+	for (i = 0; i < parray_num(c->members); i++)
+	{
+		ContainerMember *m = (ContainerMember *) parray_get(c->members, i);
+
+		if (m != keep && strcmp(m->path, rel) == 0)
+			m->removed = true;
+	}
+}
+
+static bool
+container_has_dir(Container *c, const char *rel)
+{
+	size_t		len = strlen(rel);
+	int			i;
+
+	/* top-level directories always exist */
+	for (i = 0; container_paths[i]; i++)
+	{
+		if (strcmp(rel, container_paths[i]) == 0)
+			return strcmp(rel, HEADER_MAP) != 0 && strcmp(rel, HEADER_MAP_TMP) != 0;
+	}
+
+	for (i = 0; i < parray_num(c->members); i++)
+	{
+		ContainerMember *m = (ContainerMember *) parray_get(c->members, i);
+
+		if (!m->removed && strncmp(m->path, rel, len) == 0 && m->path[len] == '/')
+			return true;
+	}
+	return false;
+}
+
+/* Append data to container, must be called with container lock held */
+static void
+container_write(Container *c, const void *data, size_t size)
+{
+	if (size > 0 && fwrite(data, 1, size, c->out) != size)
+		elog(ERROR, "Cannot write backup container \"%s\": %s",
+			 c->path, strerror(errno));
+	c->offset += size;
+}
+
+/*
+ * Append record with payload to container. Returns offset of payload.
+ * Must be called with container lock held.
+ */
+static uint64
+container_write_record(Container *c, ContainerRecordType type, uint32 member,
+					   uint64 offset, const void *data, uint64 size)
+{
+	ContainerRecord rec;
+	uint64		data_offset;
+
+	rec.type = type;
+	rec.member = member;
+	rec.offset = offset;
+	rec.size = size;
+
+	container_write(c, &rec, sizeof(rec));
+	data_offset = c->offset;
+	container_write(c, data, size);
+
+	return data_offset;
+}
+
+/* Read the exact amount of bytes from container file at offset */
+static bool
+container_pread(Container *c, void *buf, size_t size, uint64 offset)
+{
+	size_t		done = 0;
+
+	while (done < size)
+	{
+		ssize_t		rc = pread(c->fd, (char *) buf + done, size - done,
+							   offset + done);
+
+		if (rc < 0 && errno == EINTR)
+			continue;
+		if (rc <= 0)
+		{
+			if (rc == 0)
+				errno = EIO;
+			return false;
+		}
+		done += rc;
+	}
+	return true;
+}
+
+/*
+ * Read index of container file. Loading is delayed until the first access
+ * to container, so it is not an error to have container of backup missing
+ * unless data of the backup is requested.
+ */
+static void
+container_load(Container *c)
+{
+	ContainerTrailer trailer;
+	ContainerRecord rec;
+	struct stat st;
+	uint64		file_size;
+	char	   *index;
+	char	   *ptr;
+	char	   *end;
+
+	pthread_lock(&c->lock);
+	if (c->loaded)
+	{
+		pthread_mutex_unlock(&c->lock);
+		return;
+	}
+
+	c->fd = open(c->path, O_RDONLY | PG_BINARY, 0);
+	if (c->fd < 0 || fstat(c->fd, &st) < 0)
+		elog(ERROR, "Cannot open backup container \"%s\": %s",
+			 c->path, strerror(errno));
+	file_size = st.st_size;
+
+	if (file_size < sizeof(ContainerHeader) + sizeof(rec) + sizeof(trailer) ||
+		!container_pread(c, &trailer, sizeof(trailer), file_size - sizeof(trailer)) ||
+		memcmp(trailer.magic, CONTAINER_MAGIC, CONTAINER_MAGIC_LEN) != 0 ||
+		trailer.index_offset + sizeof(rec) > file_size - sizeof(trailer) ||
+		!container_pread(c, &rec, sizeof(rec), trailer.index_offset) ||
+		rec.type != CONTAINER_INDEX ||
+		rec.size != file_size - sizeof(trailer) - sizeof(rec) - trailer.index_offset)
+		elog(ERROR, "Backup container \"%s\" is incomplete or corrupted", c->path);
+
+	index = pgut_malloc(Max(rec.size, 1));
+	if (!container_pread(c, index, rec.size, trailer.index_offset + sizeof(rec)))
+		elog(ERROR, "Cannot read index of backup container \"%s\": %s",
+			 c->path, strerror(errno));
+
+	for (ptr = index, end = index + rec.size; ptr < end;)
+	{
+		ContainerIndexEntry entry;
+		ContainerMember *m;
+		size_t		chunks_len;
+
+		if ((size_t) (end - ptr) < sizeof(entry))
+			elog(ERROR, "Index of backup container \"%s\" is corrupted", c->path);
+		memcpy(&entry, ptr, sizeof(entry));
+		ptr += sizeof(entry);
+
+		chunks_len = (size_t) entry.nchunks * sizeof(ContainerChunk);
+		if ((size_t) (end - ptr) < entry.path_len + chunks_len)
+			elog(ERROR, "Index of backup container \"%s\" is corrupted", c->path);
+
+		m = pgut_new(ContainerMember);
+		memset(m, 0, sizeof(ContainerMember));
+		m->id = parray_num(c->members);
+		m->path = pgut_malloc(entry.path_len + 1);
+		memcpy(m->path, ptr, entry.path_len);
+		m->path[entry.path_len] = '\0';
+		ptr += entry.path_len;
+
+		m->chunks = pgut_malloc(chunks_len);
+		memcpy(m->chunks, ptr, chunks_len);
+		ptr += chunks_len;
+		m->nchunks = m->maxchunks = entry.nchunks;
+		m->size = entry.size;
+		m->crc = entry.crc;
+
+		parray_append(c->members, m);
+	}
+	pg_free(index);
+
+	parray_qsort(c->members, container_member_compare_path);
+	c->loaded = true;
+
+	pthread_mutex_unlock(&c->lock);
+}
+
+/*
+ * Start writing container of the backup located in root directory.
+ * Container is written to standard output, if path is CONTAINER_STDIO.
+ */
+void
+container_create(const char *path, const char *root)
+{
+	ContainerHeader header;
+	Container  *c = container_new(path, root);
+
+	Assert(writer == NULL);
+
+	if (strcmp(path, CONTAINER_STDIO) == 0)
+		c->out = stdout;
+	else
+	{
+		/* never overwrite container of another backup */
+		int			fd = open(path, O_CREAT | O_EXCL | O_WRONLY | PG_BINARY,
+							  FILE_PERMISSION);
+
+		if (fd < 0 || (c->out = fdopen(fd, PG_BINARY_W)) == NULL)
+			elog(ERROR, "Cannot create backup container \"%s\": %s",
+				 path, strerror(errno));
+	}
+	setvbuf(c->out, NULL, _IOFBF, CONTAINER_CHUNK_SIZE);
+
+	memcpy(header.magic, CONTAINER_MAGIC, CONTAINER_MAGIC_LEN);
+	header.version = CONTAINER_VERSION;
+	header.padding = 0;
+	container_write(c, &header, sizeof(header));
+
+	c->loaded = true;
+	writer = c;
+
+	elog(LOG, "Backup files are written into container \"%s\"", path);
+}
+
+/*
+ * Write index of members and close container of the backup being taken.
+ * Container file is mounted afterwards, so the backup can be validated.
+ */
+void
+container_finish(bool no_sync)
+{
+	Container  *c = writer;
+	ContainerTrailer trailer;
+	char	   *index;
+	size_t		index_len = 0;
+	size_t		pos = 0;
+	const char *prev_path = NULL;
+	int			i;
+
+	Assert(c != NULL);
+
+	/* the latest member with the same path goes first */
+	parray_qsort(c->members, container_member_compare);
+
+	for (i = 0; i < parray_num(c->members); i++)
+	{
+		ContainerMember *m = (ContainerMember *) parray_get(c->members, i);
+
+		if (prev_path && strcmp(prev_path, m->path) == 0)
+			m->removed = true;
+		prev_path = m->path;
+
+		if (!m->removed)
+			index_len += sizeof(ContainerIndexEntry) + strlen(m->path) +
+				m->nchunks * sizeof(ContainerChunk);
+	}
+
+	index = pgut_malloc(Max(index_len, 1));
+	for (i = 0; i < parray_num(c->members); i++)
+	{
+		ContainerMember *m = (ContainerMember *) parray_get(c->members, i);
+		ContainerIndexEntry entry;
+
+		if (m->removed)
+			continue;
+
+		entry.size = m->size;
+		entry.path_len = strlen(m->path);
+		entry.nchunks = m->nchunks;
+		entry.crc = m->crc;
+		FIN_CRC32C(entry.crc);
+		entry.padding = 0;
+
+		memcpy(index + pos, &entry, sizeof(entry));
+		pos += sizeof(entry);
+		memcpy(index + pos, m->path, entry.path_len);
+		pos += entry.path_len;
+		memcpy(index + pos, m->chunks, m->nchunks * sizeof(ContainerChunk));
+		pos += m->nchunks * sizeof(ContainerChunk);
+	}
+
+	trailer.index_offset = c->offset;
+	memcpy(trailer.magic, CONTAINER_MAGIC, CONTAINER_MAGIC_LEN);
+
+	container_write_record(c, CONTAINER_INDEX, 0, 0, index, index_len);
+	container_write(c, &trailer, sizeof(trailer));
+	pg_free(index);
+
+	if (fflush(c->out) != 0 ||
+		(c->out != stdout && !no_sync && fsync(fileno(c->out)) != 0) ||
+		(c->out != stdout && fclose(c->out) != 0))
+		elog(ERROR, "Cannot write backup container \"%s\": %s",
+			 c->path, strerror(errno));
+
+	elog(LOG, "Backup container \"%s\" is written, size: " UINT64_FORMAT,
+		 c->path, c->offset);
+
+	writer = NULL;
+	if (strcmp(c->path, CONTAINER_STDIO) != 0)
+		container_mount(c->path, c->root);
+	container_free(c);
+}
+
+/*
+ * Register container file keeping data of the backup located in root
+ * directory. Container replaces previously registered one for this backup.
+ */
+void
+container_mount(const char *path, const char *root)
+{
+	int			i;
+
+	pthread_lock(&mounts_lock);
+	if (mounts == NULL)
+		mounts = parray_new();
+
+	for (i = 0; i < parray_num(mounts); i++)
+	{
+		Container  *c = (Container *) parray_get(mounts, i);
+
+		if (strcmp(c->root, root) == 0)
+		{
+			if (strcmp(c->path, path) == 0)
+			{
+				pthread_mutex_unlock(&mounts_lock);
+				return;
+			}
+			parray_remove(mounts, i);
+			container_free(c);
+			break;
+		}
+	}
+	parray_append(mounts, container_new(path, root));
+
+	pthread_mutex_unlock(&mounts_lock);
+}
+
+static bool
+container_fread(FILE *in, void *buf, size_t size)
+{
+	return fread(buf, 1, size, in) == size;
+}
+
+static char *
+container_read_path(FILE *in, ContainerRecord *rec, const char *path)
+{
+	char	   *rel;
+
+	if (rec->size == 0 || rec->size >= MAXPGPATH)
+		elog(ERROR, "Backup container \"%s\" is corrupted", path);
+
+	rel = pgut_malloc(rec->size + 1);
+	if (!container_fread(in, rel, rec->size))
+		elog(ERROR, "Unexpected end of backup container \"%s\"", path);
+	rel[rec->size] = '\0';
+
+	if (!container_path_is_member(rel))
+		elog(ERROR, "Backup container \"%s\" contains invalid path \"%s\"",
+			 path, rel);
+	return rel;
+}
+
+static void
+container_make_parent(const char *path)
+{
+	char		dir[MAXPGPATH];
+
+	strlcpy(dir, path, MAXPGPATH);
+	get_parent_directory(dir);
+
+	if (pg_mkdir_p(dir, DIR_PERMISSION) != 0 && errno != EEXIST)
+		elog(ERROR, "Cannot create directory \"%s\": %s", dir, strerror(errno));
+}
+
+/*
+ * Read container sequentially and write its members into the backup
+ * directory. Container is read from standard input, if path is
+ * CONTAINER_STDIO.
+ */
+void
+container_unpack(const char *path, const char *root)
+{
+	FILE	   *in;
+	ContainerHeader header;
+	ContainerRecord rec;
+	char	  **paths = NULL;
+	int		   *fds = NULL;
+	uint32		nmembers = 0;
+	uint32		maxmembers = 0;
+	char	   *buf = pgut_malloc(CONTAINER_CHUNK_SIZE);
+	char		to_path[MAXPGPATH];
+	char		new_path[MAXPGPATH];
+	bool		done = false;
+	uint32		i;
+
+	if (strcmp(path, CONTAINER_STDIO) == 0)
+		in = stdin;
+	else if ((in = fopen(path, PG_BINARY_R)) == NULL)
+		elog(ERROR, "Cannot open backup container \"%s\": %s",
+			 path, strerror(errno));
+
+	elog(INFO, "Unpacking backup container \"%s\" into \"%s\"", path, root);
+
+	if (!container_fread(in, &header, sizeof(header)) ||
+		memcmp(header.magic, CONTAINER_MAGIC, CONTAINER_MAGIC_LEN) != 0)
+		elog(ERROR, "\"%s\" is not a backup container", path);
+	if (header.version != CONTAINER_VERSION)
+		elog(ERROR, "Unsupported version %u of backup container \"%s\"",
+			 header.version, path);
+
+	while (!done)
+	{
+		if (interrupted)
+			elog(ERROR, "Interrupted during unpacking of backup container");
+
+		if (!container_fread(in, &rec, sizeof(rec)))
+			elog(ERROR, "Unexpected end of backup container \"%s\"", path);
+
+		if (rec.type != CONTAINER_MEMBER && rec.type != CONTAINER_INDEX &&
+			rec.member >= nmembers)
+			elog(ERROR, "Backup container \"%s\" is corrupted", path);
+
+		switch (rec.type)
+		{
+			case CONTAINER_MEMBER:
+				if (rec.member != nmembers)
+					elog(ERROR, "Backup container \"%s\" is corrupted", path);
+
+				if (nmembers == maxmembers)
+				{
+					maxmembers = Max(maxmembers * 2, 1024);
+					paths = pgut_realloc(paths, maxmembers * sizeof(char *));
+					fds = pgut_realloc(fds, maxmembers * sizeof(int));
+				}
+
+				paths[nmembers] = container_read_path(in, &rec, path);
+				join_path_components(to_path, root, paths[nmembers]);
+				container_make_parent(to_path);
+
+				fds[nmembers] = open(to_path, O_CREAT | O_TRUNC | O_WRONLY | PG_BINARY,
+									 FILE_PERMISSION);
+				if (fds[nmembers] < 0)
+					elog(ERROR, "Cannot open file \"%s\": %s",
+						 to_path, strerror(errno));
+				nmembers++;
+				break;
+
+			case CONTAINER_DATA:
+				{
+					uint64		offset = rec.offset;
+					uint64		left = rec.size;
+
+					if (fds[rec.member] < 0)
+						elog(ERROR, "Backup container \"%s\" is corrupted", path);
+
+					while (left > 0)
+					{
+						size_t		len = Min(left, CONTAINER_CHUNK_SIZE);
+						size_t		written = 0;
+
+						if (!container_fread(in, buf, len))
+							elog(ERROR, "Unexpected end of backup container \"%s\"", path);
+
+						while (written < len)
+						{
+							ssize_t		rc = pwrite(fds[rec.member], buf + written,
+													len - written, offset + written);
+
+							if (rc < 0 && errno == EINTR)
+								continue;
+							if (rc <= 0)
+								elog(ERROR, "Cannot write file \"%s/%s\": %s",
+									 root, paths[rec.member], strerror(errno));
+							written += rc;
+						}
+						offset += len;
+						left -= len;
+					}
+				}
+				break;
+
+			case CONTAINER_CLOSE:
+				if (fds[rec.member] >= 0 && close(fds[rec.member]) != 0)
+					elog(ERROR, "Cannot close file \"%s/%s\": %s",
+						 root, paths[rec.member], strerror(errno));
+				fds[rec.member] = -1;
+				break;
+
+			case CONTAINER_RENAME:
+				{
+					char	   *rel = container_read_path(in, &rec, path);
+
+					join_path_components(to_path, root, paths[rec.member]);
+					join_path_components(new_path, root, rel);
+					container_make_parent(new_path);
+					if (rename(to_path, new_path) != 0)
+						elog(ERROR, "Cannot rename file \"%s\" to \"%s\": %s",
+							 to_path, new_path, strerror(errno));
+
+					pg_free(paths[rec.member]);
+					paths[rec.member] = rel;
+				}
+				break;
+
+			case CONTAINER_UNLINK:
+				join_path_components(to_path, root, paths[rec.member]);
+				if (unlink(to_path) != 0 && errno != ENOENT)
+					elog(ERROR, "Cannot remove file \"%s\": %s",
+						 to_path, strerror(errno));
+				break;
+
+			case CONTAINER_INDEX:
+				/* index is useless for sequential reading */
+				done = true;
+				break;
+
+			default:
+				elog(ERROR, "Backup container \"%s\" is corrupted", path);
+		}
+	}
+
+	for (i = 0; i < nmembers; i++)
+	{
+		if (fds[i] >= 0)
+			close(fds[i]);
+		pg_free(paths[i]);
+	}
+	pg_free(paths);
+	pg_free(fds);
+	pg_free(buf);
+
+	if (in != stdin)
+		fclose(in);
+
+	elog(INFO, "Backup container \"%s\" is unpacked, %u files", path, nmembers);
+}
+
+/* Remove files of backup unpacked by container_unpack() */
+void
+container_remove_unpacked(const char *root)
+{
+	char		path[MAXPGPATH];
+	struct stat st;
+	int			i;
+
+	for (i = 0; container_paths[i]; i++)
+	{
+		join_path_components(path, root, container_paths[i]);
+
+		if (lstat(path, &st) != 0)
+			continue;
+
+		if (S_ISDIR(st.st_mode))
+			pgut_rmtree(path, true, false);
+		else if (unlink(path) != 0)
+			elog(WARNING, "Cannot remove file \"%s\": %s", path, strerror(errno));
+	}
+}
+
+/* Check if content of the file is kept in container */
+bool
+container_owns(const char *path)
+{
+	const char *rel;
+
+	return container_find(path, &rel) != NULL;
+}
+
+/*
+ * Open stream of container member. Container of the backup being taken
+ * is write only, and every file is written anew. Mounted containers are
+ * read only.
+ */
+FILE *
+container_fopen(const char *path, const char *mode)
+{
+	const char *rel;
+	Container  *c = container_find(path, &rel);
+	ContainerStream *s;
+	ContainerMember *m;
+	bool		write = (mode[0] == 'w');
+	FILE	   *fp;
+
+	if (c == NULL)
+	{
+		errno = ENOENT;
+		return NULL;
+	}
+	if ((mode[0] != 'r' && mode[0] != 'w') || strchr(mode, '+') != NULL)
+	{
+		errno = ENOTSUP;
+		return NULL;
+	}
+	if (write != (c == writer))
+	{
+		errno = write ? EROFS : ENOTSUP;
+		return NULL;
+	}
+
+	if (write)
+	{
+		m = pgut_new(ContainerMember);
+		memset(m, 0, sizeof(ContainerMember));
+		m->path = pgut_strdup(rel);
+		INIT_CRC32C(m->crc);
+
+		pthread_lock(&c->lock);
+		m->id = parray_num(c->members);
+		parray_append(c->members, m);
+		container_write_record(c, CONTAINER_MEMBER, m->id, 0, rel, strlen(rel));
+		pthread_mutex_unlock(&c->lock);
+	}
+	else
+	{
+		container_load(c);
+		m = container_find_member(c, rel);
+		if (m == NULL)
+		{
+			errno = ENOENT;
+			return NULL;
+		}
+	}
+
+	s = pgut_new(ContainerStream);
+	memset(s, 0, sizeof(ContainerStream));
+	s->container = c;
+	s->member = m;
+	s->write = write;
+
+	fp = fopencookie(s, write ? "w" : "r", container_stream_funcs);
+	if (fp == NULL)
+		pg_free(s);
+
+	return fp;
+}
+
+/* Append buffered data of member to container */
+static void
+container_stream_flush(ContainerStream *s)
+{
+	Container  *c = s->container;
+	ContainerMember *m = s->member;
+	ContainerChunk *chunk;
+
+	if (s->buf_len == 0)
+		return;
+
+	if (m->nchunks == m->maxchunks)
+	{
+		m->maxchunks = Max(m->maxchunks * 2, 4);
+		m->chunks = pgut_realloc(m->chunks, m->maxchunks * sizeof(ContainerChunk));
+	}
+	chunk = &m->chunks[m->nchunks];
+
+	pthread_lock(&c->lock);
+	chunk->data_offset = container_write_record(c, CONTAINER_DATA, m->id,
+												m->size, s->buf, s->buf_len);
+	pthread_mutex_unlock(&c->lock);
+
+	chunk->offset = m->size;
+	chunk->size = s->buf_len;
+	m->nchunks++;
+	m->size += s->buf_len;
+	s->buf_len = 0;
+}
+
+static ssize_t
+container_stream_write(void *cookie, const char *buf, size_t size)
+{
+	ContainerStream *s = (ContainerStream *) cookie;
+	size_t		done = 0;
+
+	while (done < size)
+	{
+		size_t		len;
+
+		if (s->buf_len == CONTAINER_CHUNK_SIZE)
+			container_stream_flush(s);
+
+		len = Min(size - done, CONTAINER_CHUNK_SIZE - s->buf_len);
+		if (s->buf_len + len > s->buf_size)
+		{
+			/* most of files are small, so buffer grows on demand */
+			s->buf_size = Min(Max(s->buf_size * 2, s->buf_len + len),
+							  CONTAINER_CHUNK_SIZE);
+			s->buf = pgut_realloc(s->buf, s->buf_size);
+		}
+		memcpy(s->buf + s->buf_len, buf + done, len);
+		s->buf_len += len;
+		done += len;
+	}
+
+	COMP_CRC32C(s->member->crc, buf, size);
+	s->pos += size;
+
+	return size;
+}
+
+static ssize_t
+container_stream_read(void *cookie, char *buf, size_t size)
+{
+	ContainerStream *s = (ContainerStream *) cookie;
+	ContainerMember *m = s->member;
+	size_t		done = 0;
+
+	while (done < size && s->pos < m->size)
+	{
+		ContainerChunk *chunk = &m->chunks[s->chunk];
+		uint64		skip;
+		size_t		len;
+
+		/* chunks are ordered by offset in member */
+		if (s->pos < chunk->offset || s->pos >= chunk->offset + chunk->size)
+		{
+			uint32		low = 0;
+			uint32		high = m->nchunks;
+
+			while (high - low > 1)
+			{
+				uint32		mid = (low + high) / 2;
+
+				if (m->chunks[mid].offset <= s->pos)
+					low = mid;
+				else
+					high = mid;
+			}
+			s->chunk = low;
+			chunk = &m->chunks[low];
+		}
+
+		skip = s->pos - chunk->offset;
+		len = Min(size - done, chunk->size - skip);
+		if (!container_pread(s->container, buf + done, len,
+							 chunk->data_offset + skip))
+			return done > 0 ? done : -1;
+
+		done += len;
+		s->pos += len;
+	}
+
+	return done;
+}
+
+static int
+container_stream_seek(void *cookie, off64_t *offset, int whence)
+{
+	ContainerStream *s = (ContainerStream *) cookie;
+	off64_t		pos;
+
+	switch (whence)
+	{
+		case SEEK_SET:
+			pos = *offset;
+			break;
+		case SEEK_CUR:
+			pos = s->pos + *offset;
+			break;
+		case SEEK_END:
+			pos = (s->write ? s->pos : s->member->size) + *offset;
+			break;
+		default:
+			errno = EINVAL;
+			return -1;
+	}
+
+	if (pos < 0)
+	{
+		errno = EINVAL;
+		return -1;
+	}
+	/* member is written sequentially */
+	if (s->write && pos != s->pos)
+	{
+		errno = ESPIPE;
+		return -1;
+	}
+
+	s->pos = pos;
+	*offset = pos;
+	return 0;
+}
+
+static int
+container_stream_close(void *cookie)
+{
+	ContainerStream *s = (ContainerStream *) cookie;
+	Container  *c = s->container;
+
+	if (s->write)
+	{
+		container_stream_flush(s);
+
+		pthread_lock(&c->lock);
+		container_write_record(c, CONTAINER_CLOSE, s->member->id, 0, NULL, 0);
+		pthread_mutex_unlock(&c->lock);
+	}
+
+	pg_free(s->buf);
+	pg_free(s);
+	return 0;
+}
+
+/* Get information about container member */
+int
+container_stat(const char *path, struct stat *st)
+{
+	const char *rel;
+	Container  *c = container_find(path, &rel);
+	ContainerMember *m;
+	int			rc = 0;
+
+	if (c == NULL)
+	{
+		errno = ENOENT;
+		return -1;
+	}
+	if (c != writer)
+		container_load(c);
+
+	memset(st, 0, sizeof(struct stat));
+
+	pthread_lock(&c->lock);
+	m = container_find_member(c, rel);
+	if (m)
+	{
+		st->st_mode = S_IFREG | FILE_PERMISSION;
+		st->st_size = m->size;
+	}
+	else if (container_has_dir(c, rel))
+		st->st_mode = S_IFDIR | DIR_PERMISSION;
+	else
+	{
+		errno = ENOENT;
+		rc = -1;
+	}
+	pthread_mutex_unlock(&c->lock);
+
+	return rc;
+}
+
+/* Rename member of container of the backup being taken */
+int
+container_rename(const char *old_path, const char *new_path)
+{
+	const char *old_rel;
+	const char *new_rel;
+	Container  *c = container_find(old_path, &old_rel);
+	ContainerMember *m;
+
+	if (c == NULL || container_find(new_path, &new_rel) != c)
+	{
+		errno = EXDEV;
+		return -1;
+	}
+	if (c != writer)
+	{
+		errno = EROFS;
+		return -1;
+	}
+
+	pthread_lock(&c->lock);
+	m = container_find_member(c, old_rel);
+	if (m == NULL)
+	{
+		pthread_mutex_unlock(&c->lock);
+		errno = ENOENT;
+		return -1;
+	}
+
+	container_remove_path(c, old_rel, m);
+	container_remove_path(c, new_rel, m);
+	pg_free(m->path);
+	m->path = pgut_strdup(new_rel);
+	container_write_record(c, CONTAINER_RENAME, m->id, 0, new_rel, strlen(new_rel));
+	pthread_mutex_unlock(&c->lock);
+
+	return 0;
+}
+
+/* Remove member of container of the backup being taken */
+int
+container_unlink(const char *path)
+{
+	const char *rel;
+	Container  *c = container_find(path, &rel);
+	ContainerMember *m;
+
+	if (c == NULL)
+	{
+		errno = ENOENT;
+		return -1;
+	}
+	if (c != writer)
+	{
+		errno = EROFS;
+		return -1;
+	}
+
+	pthread_lock(&c->lock);
+	m = container_find_member(c, rel);
+	if (m == NULL)
+	{
+		pthread_mutex_unlock(&c->lock);
+		errno = ENOENT;
+		return -1;
+	}
+
+	container_remove_path(c, rel, NULL);
+	container_write_record(c, CONTAINER_UNLINK, m->id, 0, NULL, 0);
+	pthread_mutex_unlock(&c->lock);
+
+	return 0;
+}
+
+/*
+ * Get CRC-32C of member written into container of the backup being taken.
+ * Container may be written to a pipe, so it cannot be read back.
+ */
+bool
+container_get_crc(const char *path, pg_crc32c *crc)
+{
+	const char *rel;
+	ContainerMember *m;
+
+	if (writer == NULL || container_find(path, &rel) != writer)
+		return false;
+
+	pthread_lock(&writer->lock);
+	m = container_find_member(writer, rel);
+	if (m)
+	{
+		*crc = m->crc;
+		FIN_CRC32C(*crc);
+	}
+	pthread_mutex_unlock(&writer->lock);
+
+	return m != NULL;
+}
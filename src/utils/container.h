@@ -0,0 +1,34 @@
+/*-------------------------------------------------------------------------
+ *
+ * container.h: single-stream backup container.
+ *
+ * Copyright (c) 2020, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#ifndef PROBACKUP_CONTAINER_H
+#define PROBACKUP_CONTAINER_H
+
+#include <stdio.h>
+#include <sys/stat.h>
+
+#include "port/pg_crc32c.h"
+
+/* Container path denoting standard output or standard input */
+#define CONTAINER_STDIO		"-"
+
+extern void container_create(const char *path, const char *root);
+extern void container_finish(bool no_sync);
+extern void container_mount(const char *path, const char *root);
+extern void container_unpack(const char *path, const char *root);
+extern void container_remove_unpacked(const char *root);
+
+extern bool container_owns(const char *path);
+extern FILE *container_fopen(const char *path, const char *mode);
+extern int	container_stat(const char *path, struct stat *st);
+extern int	container_rename(const char *old_path, const char *new_path);
+extern int	container_unlink(const char *path);
+extern bool container_get_crc(const char *path, pg_crc32c *crc);
+
+#endif   /* PROBACKUP_CONTAINER_H */
@@ -4,6 +4,8 @@
 
 #include "pg_probackup.h"
 #include "file.h"
+#include "container.h"
+#include "s3.h"
 #include "storage/checksum.h"
 
 #define PRINTF_BUF_SIZE  1024
@@ -17,6 +19,25 @@ static __thread int fio_stderr = 0;
 
 fio_location MyLocation;
 
+/*
+ * Files of object storage and backup container opened by fio_open().
+ * Descriptor is index in these arrays marked by FIO_STORAGE_MARKER.
+ */
+static FILE *fio_storage_files[FIO_FDMAX];
+static char *fio_storage_paths[FIO_FDMAX];
+static pthread_mutex_t fio_storage_lock = PTHREAD_MUTEX_INITIALIZER;
+
+/* Directory of object storage, pointer is marked by the lowest bit */
+typedef struct fioStorageDir
+{
+	parray	   *names;
+	size_t		pos;
+	struct dirent entry;
+} fioStorageDir;
+
+#define FIO_STORAGE_DIR_MARKER 1
+#define fio_is_storage_dir(dir) (((size_t)(dir) & FIO_STORAGE_DIR_MARKER) != 0)
+
 typedef struct
 {
 	BlockNumber nblocks;
@@ -40,6 +61,7 @@ typedef struct
 	bool exclusive_backup;
 	bool skip_hidden;
 	int  external_dir_num;
+	int  threads;
 } fio_list_dir_request;
 
 typedef struct
@@ -119,6 +141,14 @@ static bool fio_is_remote_fd(int fd)
 	return (fd & FIO_PIPE_MARKER) != 0;
 }
 
+/* Check if file descriptor belongs to object storage */
+static bool fio_is_storage_fd(int fd)
+{
+	return fd >= 0 && (fd & FIO_STORAGE_MARKER) != 0;
+}
+
+#define fio_storage_file(fd) (fio_storage_files[(fd) & ~FIO_STORAGE_MARKER])
+
 #ifdef WIN32
 
 #undef stat
@@ -176,6 +206,18 @@ static int remove_file_or_dir(char const* path)
 #define remove_file_or_dir(path) remove(path)
 #endif
 
+/* Check if specified location is backup catalog in object storage */
+bool fio_is_storage(fio_location location)
+{
+	return location == FIO_BACKUP_HOST && s3_enabled();
+}
+
+/* Check if content of the file in backup catalog is kept in backup container */
+static bool fio_is_container(char const* path, fio_location location)
+{
+	return location == FIO_BACKUP_HOST && container_owns(path);
+}
+
 /* Check if specified location is local for current node */
 bool fio_is_remote(fio_location location)
 {
@@ -239,10 +281,297 @@ static ssize_t fio_write_all(int fd, void const* buf, size_t size)
 	return offs;
 }
 
+/*
+ * Request to the agent, reply to which is not received yet.
+ *
+ * The agent replies in the order of requests, so requests in flight are
+ * queued and replies to them are received before the reply to any
+ * synchronous request. Replies to prefetched transfers are buffered in
+ * memory until they are taken by fio_send_file() or fio_send_pages().
+ */
+typedef struct fio_inflight
+{
+	fio_operations cop;
+	unsigned	handle;		/* descriptor for FIO_OPEN, tag for FIO_SYNC */
+	char	   *path;		/* path of opened file for error reporting */
+	char	   *req;		/* request of prefetched transfer */
+	size_t		req_size;
+	char	   *reply;		/* buffered reply to prefetched transfer */
+	size_t		reply_size;
+	size_t		reply_pos;
+} fio_inflight;
+
+static __thread parray *fio_inflight_queue = NULL;
+static __thread parray *fio_prefetched = NULL;
+/* Buffered reply being read by fio_read_reply() */
+static __thread fio_inflight *fio_reply = NULL;
+static __thread unsigned fio_sync_tag = 0;
+
+/* Get number of requests allowed to be in flight */
+static int
+fio_window(void)
+{
+	return Max(instance_config.remote.window, 1);
+}
+
+static void
+fio_inflight_free(fio_inflight *req)
+{
+	pg_free(req->path);
+	pg_free(req->req);
+	pg_free(req->reply);
+	pg_free(req);
+}
+
+/* Receive reply to FIO_OPEN or FIO_SYNC sent without waiting for it */
+static void
+fio_complete(fio_inflight *req)
+{
+	fio_header hdr;
+
+	IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+
+	if (hdr.cop != req->cop || hdr.handle != req->handle)
+		elog(ERROR, "Remote agent returned message of unexpected type: %i", hdr.cop);
+
+	/* writeback is only a hint, so its failure is ignored */
+	if (req->cop == FIO_OPEN && hdr.arg != 0)
+		elog(ERROR, "Cannot open remote file \"%s\": %s",
+			 req->path, strerror(hdr.arg));
+}
+
+/* Receive the whole reply to prefetched transfer into memory */
+static void
+fio_buffer_reply(fio_inflight *req)
+{
+	size_t		alloc_size = CHUNK_SIZE;
+	fio_header	hdr;
+
+	req->reply = pgut_malloc(alloc_size);
+	req->reply_size = 0;
+
+	do
+	{
+		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+
+		if (hdr.cop != FIO_PAGE && hdr.cop != FIO_ERROR &&
+			hdr.cop != FIO_SEND_FILE_EOF && hdr.cop != FIO_SEND_FILE_CORRUPTION)
+			elog(ERROR, "Remote agent returned message of unexpected type: %i", hdr.cop);
+
+		/* EOF of FIO_SEND_FILE has no payload, whatever its size says */
+		if (req->cop == FIO_SEND_FILE && hdr.cop == FIO_SEND_FILE_EOF)
+			hdr.size = 0;
+
+		while (req->reply_size + sizeof(hdr) + hdr.size > alloc_size)
+		{
+			alloc_size *= 2;
+			req->reply = pgut_realloc(req->reply, alloc_size);
+		}
+
+		memcpy(req->reply + req->reply_size, &hdr, sizeof(hdr));
+		req->reply_size += sizeof(hdr);
+
+		if (hdr.size > 0)
+			IO_CHECK(fio_read_all(fio_stdin, req->reply + req->reply_size, hdr.size), hdr.size);
+		req->reply_size += hdr.size;
+	} while (hdr.cop == FIO_PAGE);
+}
+
+/*
+ * Receive reply to the oldest request in flight.
+ * Reply to prefetched transfer is kept in memory, unless it is discarded.
+ */
+static void
+fio_receive_oldest(bool discard)
+{
+	fio_inflight *req = (fio_inflight *) parray_remove(fio_inflight_queue, 0);
+
+	if (req->req == NULL)
+	{
+		fio_complete(req);
+		fio_inflight_free(req);
+		return;
+	}
+
+	fio_buffer_reply(req);
+
+	if (discard)
+		fio_inflight_free(req);
+	else
+		parray_append(fio_prefetched, req);
+}
+
+/*
+ * Receive replies to all requests in flight,
+ * so that the reply to next request can be read from the pipe.
+ */
+static void
+fio_drain(void)
+{
+	while (fio_inflight_queue && parray_num(fio_inflight_queue) > 0)
+		fio_receive_oldest(false);
+}
+
+/* Free requests in flight and prefetched replies */
+static void
+fio_forget_inflight(void)
+{
+	if (fio_inflight_queue == NULL)
+		return;
+
+	parray_walk(fio_inflight_queue, (void (*)(void *)) fio_inflight_free);
+	parray_free(fio_inflight_queue);
+	parray_walk(fio_prefetched, (void (*)(void *)) fio_inflight_free);
+	parray_free(fio_prefetched);
+	fio_inflight_queue = NULL;
+	fio_prefetched = NULL;
+}
+
+/*
+ * Register request, which is going to be sent without waiting for reply.
+ * If the window is full, reply to the oldest request is received first.
+ */
+static fio_inflight *
+fio_inflight_push(fio_operations cop, unsigned handle, char const* path)
+{
+	fio_inflight *req;
+
+	if (fio_inflight_queue == NULL)
+	{
+		fio_inflight_queue = parray_new();
+		fio_prefetched = parray_new();
+	}
+
+	while (parray_num(fio_inflight_queue) >= fio_window())
+		fio_receive_oldest(false);
+
+	req = pgut_new(fio_inflight);
+	memset(req, 0, sizeof(fio_inflight));
+	req->cop = cop;
+	req->handle = handle;
+	if (path)
+		req->path = pgut_strdup(path);
+
+	parray_append(fio_inflight_queue, req);
+
+	return req;
+}
+
+/* Send request of transfer without waiting for reply */
+static void
+fio_prefetch(char *req, size_t req_size)
+{
+	fio_inflight *pf = fio_inflight_push(((fio_header *) req)->cop, 0, NULL);
+
+	pf->req = req;
+	pf->req_size = req_size;
+
+	IO_CHECK(fio_write_all(fio_stdout, req, req_size), req_size);
+}
+
+static bool
+fio_same_request(fio_inflight *pf, char const* req, size_t req_size)
+{
+	return pf->req != NULL && pf->req_size == req_size &&
+		memcmp(pf->req, req, req_size) == 0;
+}
+
+/*
+ * Find prefetched transfer with the same request. Its reply is then read
+ * by fio_read_reply() either from memory or from the pipe.
+ * Return false, if the request is not prefetched and should be sent.
+ */
+static bool
+fio_take_prefetched(char const* req, size_t req_size)
+{
+	int			i;
+
+	if (fio_inflight_queue == NULL)
+		return false;
+
+	for (i = 0; i < parray_num(fio_prefetched); i++)
+	{
+		if (fio_same_request(parray_get(fio_prefetched, i), req, req_size))
+		{
+			fio_reply = (fio_inflight *) parray_remove(fio_prefetched, i);
+			return true;
+		}
+	}
+
+	for (i = 0; i < parray_num(fio_inflight_queue); i++)
+	{
+		if (fio_same_request(parray_get(fio_inflight_queue, i), req, req_size))
+		{
+			/* replies to preceding requests are in the pipe first */
+			while (i-- > 0)
+				fio_receive_oldest(false);
+
+			fio_inflight_free(parray_remove(fio_inflight_queue, 0));
+			return true;
+		}
+	}
+
+	return false;
+}
+
+/* Read reply to the transfer, either buffered or from the pipe */
+static void
+fio_read_reply(void* buf, size_t size)
+{
+	if (fio_reply == NULL)
+	{
+		IO_CHECK(fio_read_all(fio_stdin, buf, size), size);
+		return;
+	}
+
+	if (fio_reply->reply_pos + size > fio_reply->reply_size)
+		elog(ERROR, "Buffered reply of remote agent is truncated");
+
+	memcpy(buf, fio_reply->reply + fio_reply->reply_pos, size);
+	fio_reply->reply_pos += size;
+}
+
+/*
+ * Skip the rest of reply to FIO_SEND_FILE, which is not needed anymore,
+ * so that replies to the following requests can be received.
+ */
+static void
+fio_skip_send_file_reply(void)
+{
+	fio_header	hdr;
+	char	   *buf = pgut_malloc(CHUNK_SIZE);
+
+	do
+	{
+		fio_read_reply(&hdr, sizeof(hdr));
+
+		if (hdr.cop == FIO_SEND_FILE_EOF)
+			break;
+
+		Assert(hdr.size <= CHUNK_SIZE);
+		if (hdr.size > 0)
+			fio_read_reply(buf, hdr.size);
+	} while (hdr.cop != FIO_ERROR);
+
+	pg_free(buf);
+}
+
+/* Free buffered reply to the transfer, if any */
+static void
+fio_release_reply(void)
+{
+	if (fio_reply)
+		fio_inflight_free(fio_reply);
+	fio_reply = NULL;
+}
+
 /* Get version of remote agent */
 int fio_get_agent_version(void)
 {
 	fio_header hdr;
+
+	fio_drain();
+
 	hdr.cop = FIO_AGENT_VERSION;
 	hdr.size = 0;
 
@@ -256,9 +585,20 @@ int fio_get_agent_version(void)
 FILE* fio_open_stream(char const* path, fio_location location)
 {
 	FILE* f;
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		f = container_fopen(path, "r");
+	}
+	else if (fio_is_storage(location))
+	{
+		f = s3_fopen(path, "r", false);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
+
+		fio_drain();
+
 		hdr.cop = FIO_LOAD;
 		hdr.size = strlen(path) + 1;
 
@@ -307,7 +647,20 @@ int fio_close_stream(FILE* f)
 DIR* fio_opendir(char const* path, fio_location location)
 {
 	DIR* dir;
-	if (fio_is_remote(location))
+	if (fio_is_storage(location))
+	{
+		fioStorageDir *sdir;
+		parray *names = s3_list_dir(path);
+
+		if (names == NULL)
+			return NULL;
+
+		sdir = pgut_new(fioStorageDir);
+		memset(sdir, 0, sizeof(fioStorageDir));
+		sdir->names = names;
+		dir = (DIR*)((size_t)sdir + FIO_STORAGE_DIR_MARKER);
+	}
+	else if (fio_is_remote(location))
 	{
 		int i;
 		fio_header hdr;
@@ -319,6 +672,8 @@ DIR* fio_opendir(char const* path, fio_location location)
 			elog(ERROR, "Descriptor pool for remote files is exhausted, "
 					"probably too many remote directories are opened");
 		}
+		fio_drain();
+
 		hdr.cop = FIO_OPENDIR;
 		hdr.handle = i;
 		hdr.size = strlen(path) + 1;
@@ -352,6 +707,8 @@ struct dirent* fio_readdir(DIR *dir)
 		fio_header hdr;
 		static __thread struct dirent entry;
 
+		fio_drain();
+
 		hdr.cop = FIO_READDIR;
 		hdr.handle = (size_t)dir - 1;
 		hdr.size = 0;
@@ -366,6 +723,17 @@ struct dirent* fio_readdir(DIR *dir)
 
 		return hdr.size ? &entry : NULL;
 	}
+	else if (fio_is_storage_dir(dir))
+	{
+		fioStorageDir *sdir = (fioStorageDir*)((size_t)dir - FIO_STORAGE_DIR_MARKER);
+
+		if (sdir->pos >= parray_num(sdir->names))
+			return NULL;
+
+		strncpy(sdir->entry.d_name, (char *) parray_get(sdir->names, sdir->pos++),
+				sizeof(sdir->entry.d_name) - 1);
+		return &sdir->entry;
+	}
 	else
 	{
 		return readdir(dir);
@@ -386,17 +754,73 @@ int fio_closedir(DIR *dir)
 		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 		return 0;
 	}
+	else if (fio_is_storage_dir(dir))
+	{
+		fioStorageDir *sdir = (fioStorageDir*)((size_t)dir - FIO_STORAGE_DIR_MARKER);
+
+		parray_walk(sdir->names, pfree);
+		parray_free(sdir->names);
+		pfree(sdir);
+		return 0;
+	}
 	else
 	{
 		return closedir(dir);
 	}
 }
 
+/* Get descriptor for file of object storage or backup container */
+static int fio_storage_fd(FILE* f, char const* path)
+{
+	int i;
+
+	if (f == NULL)
+		return -1;
+
+	pthread_lock(&fio_storage_lock);
+	for (i = 0; i < FIO_FDMAX && fio_storage_files[i] != NULL; i++);
+	if (i == FIO_FDMAX)
+	{
+		pthread_mutex_unlock(&fio_storage_lock);
+		fclose(f);
+		elog(ERROR, "Descriptor pool for object storage files is exhausted, "
+				"probably too many files are opened");
+	}
+	fio_storage_files[i] = f;
+	fio_storage_paths[i] = pgut_strdup(path);
+	pthread_mutex_unlock(&fio_storage_lock);
+
+	return i | FIO_STORAGE_MARKER;
+}
+
 /* Open file */
 int fio_open(char const* path, int mode, fio_location location)
 {
 	int fd;
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		/* members of container are either read or written anew */
+		fd = fio_storage_fd(container_fopen(path, (mode & O_ACCMODE) == O_RDONLY ? "r" : "w"),
+							path);
+	}
+	else if (fio_is_storage(location))
+	{
+		FILE *f;
+
+		/* objects can be either read or written as a whole */
+		if ((mode & O_ACCMODE) == O_RDONLY)
+			f = s3_fopen(path, "r", false);
+		else if (mode & O_CREAT)
+			f = s3_fopen(path, "w", (mode & O_EXCL) != 0);
+		else
+		{
+			errno = ENOTSUP;
+			return -1;
+		}
+
+		fd = fio_storage_fd(f, path);
+	}
+	else if (fio_is_remote(location))
 	{
 		int i;
 		fio_header hdr;
@@ -417,6 +841,23 @@ int fio_open(char const* path, int mode, fio_location location)
 //		elog(INFO, "MODE: %i", hdr.arg);
 		fio_fdset |= 1 << i;
 
+		/*
+		 * Files of PGDATA are created without waiting for confirmation,
+		 * failure to create them is reported when the reply is received.
+		 */
+		if (location == FIO_DB_HOST && (mode & O_CREAT) && !(mode & O_EXCL) &&
+			fio_window() > 1)
+		{
+			fio_inflight_push(FIO_OPEN, i, path);
+
+			IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+			IO_CHECK(fio_write_all(fio_stdout, path, hdr.size), hdr.size);
+
+			return i | FIO_PIPE_MARKER;
+		}
+
+		fio_drain();
+
 		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 		IO_CHECK(fio_write_all(fio_stdout, path, hdr.size), hdr.size);
 
@@ -445,6 +886,12 @@ fio_disconnect(void)
 	if (fio_stdin)
 	{
 		fio_header hdr;
+
+		/* check replies to requests in flight, prefetched data is not needed */
+		while (fio_inflight_queue && parray_num(fio_inflight_queue) > 0)
+			fio_receive_oldest(true);
+		fio_forget_inflight();
+
 		hdr.cop = FIO_DISCONNECT;
 		hdr.size = 0;
 		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
@@ -463,7 +910,15 @@ FILE* fio_fopen(char const* path, char const* mode, fio_location location)
 {
 	FILE	   *f = NULL;
 
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		f = container_fopen(path, mode);
+	}
+	else if (fio_is_storage(location))
+	{
+		f = s3_fopen(path, mode, false);
+	}
+	else if (fio_is_remote(location))
 	{
 		int flags = 0;
 		int fd;
@@ -541,7 +996,8 @@ int fio_fflush(FILE* f)
 /* Sync file to the disk (does nothing for remote file) */
 int fio_flush(int fd)
 {
-	return fio_is_remote_fd(fd) ? 0 : fsync(fd);
+	/* objects are durable once they are closed */
+	return fio_is_remote_fd(fd) || fio_is_storage_fd(fd) ? 0 : fsync(fd);
 }
 
 /* Close output stream */
@@ -569,6 +1025,20 @@ int fio_close(int fd)
 
 		return 0;
 	}
+	else if (fio_is_storage_fd(fd))
+	{
+		FILE *f;
+		int i = fd & ~FIO_STORAGE_MARKER;
+
+		pthread_lock(&fio_storage_lock);
+		f = fio_storage_files[i];
+		fio_storage_files[i] = NULL;
+		pfree(fio_storage_paths[i]);
+		fio_storage_paths[i] = NULL;
+		pthread_mutex_unlock(&fio_storage_lock);
+
+		return fclose(f);
+	}
 	else
 	{
 		return close(fd);
@@ -599,6 +1069,11 @@ int fio_truncate(int fd, off_t size)
 
 		return 0;
 	}
+	else if (fio_is_storage_fd(fd))
+	{
+		errno = ENOTSUP;
+		return -1;
+	}
 	else
 	{
 		return ftruncate(fd, size);
@@ -616,6 +1091,8 @@ int fio_pread(FILE* f, void* buf, off_t offs)
 		int fd = fio_fileno(f);
 		fio_header hdr;
 
+		fio_drain();
+
 		hdr.cop = FIO_PREAD;
 		hdr.handle = fd & ~FIO_PIPE_MARKER;
 		hdr.size = 0;
@@ -668,6 +1145,10 @@ int fio_seek(int fd, off_t offs)
 
 		return 0;
 	}
+	else if (fio_is_storage_fd(fd))
+	{
+		return fseeko(fio_storage_file(fd), offs, SEEK_SET) == 0 ? offs : -1;
+	}
 	else
 	{
 		return lseek(fd, offs, SEEK_SET);
@@ -698,6 +1179,12 @@ ssize_t fio_write(int fd, void const* buf, size_t size)
 
 		return size;
 	}
+	else if (fio_is_storage_fd(fd))
+	{
+		FILE *f = fio_storage_file(fd);
+
+		return fwrite(buf, 1, size, f) == size ? size : -1;
+	}
 	else
 	{
 		return write(fd, buf, size);
@@ -780,6 +1267,8 @@ ssize_t fio_read(int fd, void* buf, size_t size)
 	{
 		fio_header hdr;
 
+		fio_drain();
+
 		hdr.cop = FIO_READ;
 		hdr.handle = fd & ~FIO_PIPE_MARKER;
 		hdr.size = 0;
@@ -793,6 +1282,13 @@ ssize_t fio_read(int fd, void* buf, size_t size)
 
 		return hdr.size;
 	}
+	else if (fio_is_storage_fd(fd))
+	{
+		FILE *f = fio_storage_file(fd);
+		size_t rc = fread(buf, 1, size, f);
+
+		return rc == 0 && ferror(f) ? -1 : rc;
+	}
 	else
 	{
 		return read(fd, buf, size);
@@ -802,11 +1298,21 @@ ssize_t fio_read(int fd, void* buf, size_t size)
 /* Get information about file */
 int fio_stat(char const* path, struct stat* st, bool follow_symlink, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		return container_stat(path, st);
+	}
+	else if (fio_is_storage(location))
+	{
+		return s3_stat(path, st);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(path) + 1;
 
+		fio_drain();
+
 		hdr.cop = FIO_STAT;
 		hdr.handle = -1;
 		hdr.arg = follow_symlink;
@@ -835,10 +1341,25 @@ int fio_stat(char const* path, struct stat* st, bool follow_symlink, fio_locatio
 /* Check presence of the file */
 int fio_access(char const* path, int mode, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		struct stat st;
+
+		return container_stat(path, &st);
+	}
+	else if (fio_is_storage(location))
+	{
+		struct stat st;
+
+		return s3_stat(path, &st);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(path) + 1;
+
+		fio_drain();
+
 		hdr.cop = FIO_ACCESS;
 		hdr.handle = -1;
 		hdr.size = path_len;
@@ -866,7 +1387,12 @@ int fio_access(char const* path, int mode, fio_location location)
 /* Create symbolic link */
 int fio_symlink(char const* target, char const* link_path, bool overwrite, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_storage(location))
+	{
+		errno = ENOTSUP;
+		return -1;
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t target_len = strlen(target) + 1;
@@ -907,7 +1433,15 @@ static void fio_symlink_impl(int out, char *buf, bool overwrite)
 /* Rename file */
 int fio_rename(char const* old_path, char const* new_path, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(old_path, location))
+	{
+		return container_rename(old_path, new_path);
+	}
+	else if (fio_is_storage(location))
+	{
+		return s3_rename(old_path, new_path);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t old_path_len = strlen(old_path) + 1;
@@ -930,16 +1464,88 @@ int fio_rename(char const* old_path, char const* new_path, fio_location location
 	}
 }
 
+/* Sync file or filesystem containing it using specified method */
+static int fio_sync_file_impl(char const* path, fio_sync_method method)
+{
+	int fd;
+	int rc = 0;
+	int save_errno;
+
+	fd = open(path, (method == FIO_SYNC_FSYNC ? O_WRONLY : O_RDONLY) | PG_BINARY, FILE_PERMISSIONS);
+	if (fd < 0)
+		return -1;
+
+	switch (method)
+	{
+		case FIO_SYNC_FSYNC:
+			rc = fsync(fd);
+			break;
+		case FIO_SYNC_WRITEBACK:
+#ifdef HAVE_SYNC_FILE_RANGE
+			/* it is only a hint, so failure is ignored */
+			(void) sync_file_range(fd, 0, 0, SYNC_FILE_RANGE_WRITE);
+#endif
+			break;
+		case FIO_SYNC_SYNCFS:
+#ifdef FIO_HAVE_SYNCFS
+			rc = syncfs(fd);
+#else
+			rc = fsync(fd);
+#endif
+			break;
+	}
+
+	save_errno = errno;
+	close(fd);
+	errno = save_errno;
+
+	return rc;
+}
+
 /* Sync file to disk */
 int fio_sync(char const* path, fio_location location)
 {
-	if (fio_is_remote(location))
+	return fio_sync_file(path, FIO_SYNC_FSYNC, location);
+}
+
+/*
+ * Sync file to disk, start writeback of its data or
+ * sync the whole filesystem containing it.
+ */
+int fio_sync_file(char const* path, fio_sync_method method, fio_location location)
+{
+	if (fio_is_container(path, location))
+	{
+		/* container is synced as a whole when it is finished */
+		return 0;
+	}
+	else if (fio_is_storage(location))
+	{
+		/* objects are durable once they are closed */
+		return 0;
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(path) + 1;
 		hdr.cop = FIO_SYNC;
 		hdr.handle = -1;
 		hdr.size = path_len;
+		hdr.arg = method;
+
+		/* writeback is only a hint, so reply to it is not waited for */
+		if (method == FIO_SYNC_WRITEBACK && fio_window() > 1)
+		{
+			hdr.handle = ++fio_sync_tag;
+			fio_inflight_push(FIO_SYNC, hdr.handle, NULL);
+
+			IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
+			IO_CHECK(fio_write_all(fio_stdout, path, path_len), path_len);
+
+			return 0;
+		}
+
+		fio_drain();
 
 		IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 		IO_CHECK(fio_write_all(fio_stdout, path, path_len), path_len);
@@ -954,32 +1560,82 @@ int fio_sync(char const* path, fio_location location)
 		return 0;
 	}
 	else
+		return fio_sync_file_impl(path, method);
+}
+
+/*
+ * Get crc32 of object in backup catalog, see pgFileGetCRC() and
+ * pgFileGetCRCgz(). Missing object is not an error.
+ */
+static pg_crc32
+fio_storage_get_crc32(const char *file_path, bool decompress)
+{
+	pg_crc32	crc;
+	char	   *buf = pgut_malloc(STDIO_BUFSIZE);
+
+	INIT_FILE_CRC32(true, crc);
+
+#ifdef HAVE_LIBZ
+	if (decompress)
 	{
-		int fd;
+		gzFile	gz = fio_gzopen(file_path, PG_BINARY_R, Z_DEFAULT_COMPRESSION,
+								FIO_BACKUP_HOST);
+		int		len;
 
-		fd = open(path, O_WRONLY | PG_BINARY, FILE_PERMISSIONS);
-		if (fd < 0)
-			return -1;
+		if (gz == NULL && errno != ENOENT)
+			elog(ERROR, "Cannot open compressed file \"%s\": %s",
+				 file_path, strerror(errno));
 
-		if (fsync(fd) < 0)
+		while (gz && (len = fio_gzread(gz, buf, STDIO_BUFSIZE)) != 0)
 		{
-			close(fd);
-			return -1;
+			if (len < 0)
+				elog(ERROR, "Cannot read compressed file \"%s\"", file_path);
+			COMP_FILE_CRC32(true, crc, buf, len);
 		}
-		close(fd);
 
-		return 0;
+		if (gz)
+			fio_gzclose(gz);
 	}
+	else
+#endif
+	{
+		FILE   *fp = s3_fopen(file_path, PG_BINARY_R, false);
+		size_t	len;
+
+		if (fp == NULL && errno != ENOENT)
+			elog(ERROR, "Cannot open file \"%s\": %s", file_path, strerror(errno));
+
+		while (fp && (len = fread(buf, 1, STDIO_BUFSIZE, fp)) != 0)
+			COMP_FILE_CRC32(true, crc, buf, len);
+
+		if (fp && ferror(fp))
+			elog(ERROR, "Cannot read \"%s\": %s", file_path, strerror(errno));
+
+		if (fp)
+			fclose(fp);
+	}
+
+	FIN_FILE_CRC32(true, crc);
+	pg_free(buf);
+
+	return crc;
 }
 
 /* Get crc32 of file */
 pg_crc32 fio_get_crc32(const char *file_path, fio_location location, bool decompress)
 {
-	if (fio_is_remote(location))
+	if (fio_is_storage(location))
+	{
+		return fio_storage_get_crc32(file_path, decompress);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(file_path) + 1;
 		pg_crc32 crc = 0;
+
+		fio_drain();
+
 		hdr.cop = FIO_GET_CRC32;
 		hdr.handle = -1;
 		hdr.size = path_len;
@@ -1006,7 +1662,15 @@ pg_crc32 fio_get_crc32(const char *file_path, fio_location location, bool decomp
 /* Remove file */
 int fio_unlink(char const* path, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		return container_unlink(path);
+	}
+	else if (fio_is_storage(location))
+	{
+		return s3_unlink(path);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(path) + 1;
@@ -1029,10 +1693,22 @@ int fio_unlink(char const* path, fio_location location)
 /* Create directory */
 int fio_mkdir(char const* path, int mode, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		/* directories of container are implied by paths of its members */
+		return 0;
+	}
+	else if (fio_is_storage(location))
+	{
+		return s3_mkdir(path);
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(path) + 1;
+
+		fio_drain();
+
 		hdr.cop = FIO_MKDIR;
 		hdr.handle = -1;
 		hdr.size = path_len;
@@ -1055,7 +1731,17 @@ int fio_mkdir(char const* path, int mode, fio_location location)
 /* Change file mode */
 int fio_chmod(char const* path, int mode, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(path, location))
+	{
+		/* members of container have no permissions */
+		return 0;
+	}
+	else if (fio_is_storage(location))
+	{
+		/* objects have no permissions */
+		return 0;
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header hdr;
 		size_t path_len = strlen(path) + 1;
@@ -1097,7 +1783,8 @@ gzFile
 fio_gzopen(char const* path, char const* mode, int level, fio_location location)
 {
 	int rc;
-	if (fio_is_remote(location))
+	/* objects are (de)compressed here and transferred by fio_read/fio_write */
+	if (fio_is_storage(location) || fio_is_remote(location))
 	{
 		fioGZFile* gz = (fioGZFile*) pgut_malloc(sizeof(fioGZFile));
 		memset(&gz->strm, 0, sizeof(gz->strm));
@@ -1347,7 +2034,31 @@ const char* fio_gzerror(gzFile f, int *errnum)
 
 z_off_t fio_gzseek(gzFile f, z_off_t offset, int whence)
 {
-	Assert(!((size_t)f & FIO_GZ_REMOTE_MARKER));
+	if ((size_t)f & FIO_GZ_REMOTE_MARKER)
+	{
+		fioGZFile* gz = (fioGZFile*)((size_t)f - FIO_GZ_REMOTE_MARKER);
+		char buf[XLOG_BLCKSZ];
+
+		Assert(!gz->compress && whence == SEEK_SET);
+
+		/* Stream can only be decompressed from the start */
+		if (offset < gz->strm.total_out)
+		{
+			if (fio_seek(gz->fd, 0) < 0 || inflateReset(&gz->strm) != Z_OK)
+				return -1;
+			gz->strm.avail_in = 0;
+			gz->eof = false;
+		}
+
+		while (gz->strm.total_out < offset)
+		{
+			int rc = fio_gzread(f, buf, Min(sizeof(buf), offset - gz->strm.total_out));
+
+			if (rc <= 0)
+				return -1;
+		}
+		return offset;
+	}
 	return gzseek(f, offset, whence);
 }
 
@@ -1384,34 +2095,19 @@ static void fio_load_file(int out, char const* path)
 }
 
 /*
- * Return number of actually(!) readed blocks, attempts or
- * half-readed block are not counted.
- * Return values in case of error:
- *  FILE_MISSING
- *  OPEN_FAILED
- *  READ_ERROR
- *  PAGE_CORRUPTION
- *  WRITE_FAILED
- *
- * If none of the above, this function return number of blocks
- * readed by remote agent.
- *
- * In case of DELTA mode horizonLsn must be a valid lsn,
- * otherwise it should be set to InvalidXLogRecPtr.
+ * Compose request of fio_send_pages(). Unused fields of the request are
+ * zeroed, so that identical requests can be compared byte by byte.
  */
-int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *file,
-				   XLogRecPtr horizonLsn, int calg, int clevel, uint32 checksum_version,
-				   bool use_pagemap, BlockNumber* err_blknum, char **errormsg,
-				   BackupPageHeader2 **headers)
+static char *
+fio_send_pages_request(const char *from_fullpath, pgFile *file,
+					   XLogRecPtr horizonLsn, int calg, int clevel, uint32 checksum_version,
+					   bool use_pagemap, size_t *req_size)
 {
-	FILE *out = NULL;
-	char *out_buf = NULL;
+	char	   *buf;
 	struct {
 		fio_header hdr;
 		fio_send_request arg;
 	} req;
-	BlockNumber	n_blocks_read = 0;
-	BlockNumber blknum = 0;
 
 	/* send message with header
 
@@ -1421,6 +2117,7 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 	--------------------------------------------------------------
 	*/
 
+	memset(&req, 0, sizeof(req));
 	req.hdr.cop = FIO_SEND_PAGES;
 
 	if (use_pagemap)
@@ -1447,32 +2144,86 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 	req.arg.clevel = clevel;
 	req.arg.path_len = strlen(from_fullpath) + 1;
 
-	file->compress_alg = calg; /* TODO: wtf? why here? */
+	*req_size = sizeof(req) + req.arg.path_len + req.arg.bitmapsize;
+	buf = pgut_malloc(*req_size);
 
-//<-----
-//	datapagemap_iterator_t *iter;
-//	BlockNumber blkno;
-//	iter = datapagemap_iterate(pagemap);
-//	while (datapagemap_next(iter, &blkno))
-//		elog(INFO, "block %u", blkno);
-//	pg_free(iter);
-//<-----
+	/* header, file path and pagemap if any */
+	memcpy(buf, &req, sizeof(req));
+	memcpy(buf + sizeof(req), from_fullpath, req.arg.path_len);
+	if (use_pagemap)
+		memcpy(buf + sizeof(req) + req.arg.path_len,
+			   (*file).pagemap.bitmap, (*file).pagemap.bitmapsize);
 
-	/* send header */
-	IO_CHECK(fio_write_all(fio_stdout, &req, sizeof(req)), sizeof(req));
+	return buf;
+}
 
-	/* send file path */
-	IO_CHECK(fio_write_all(fio_stdout, from_fullpath, req.arg.path_len), req.arg.path_len);
+/*
+ * Ask the agent to send pages of data file, which are received later by
+ * fio_send_pages() with the same arguments. This way transfers of several
+ * files are not separated by round trips to the remote host.
+ */
+void
+fio_prefetch_pages(const char *from_fullpath, pgFile *file,
+				   XLogRecPtr horizonLsn, int calg, int clevel,
+				   uint32 checksum_version, bool use_pagemap)
+{
+	size_t		req_size;
 
-	/* send pagemap if any */
-	if (use_pagemap)
-		IO_CHECK(fio_write_all(fio_stdout, (*file).pagemap.bitmap, (*file).pagemap.bitmapsize), (*file).pagemap.bitmapsize);
+	if (fio_window() <= 1)
+		return;
+
+	fio_prefetch(fio_send_pages_request(from_fullpath, file, horizonLsn, calg, clevel,
+										checksum_version, use_pagemap, &req_size),
+				 req_size);
+}
+
+/*
+ * Return number of actually(!) readed blocks, attempts or
+ * half-readed block are not counted.
+ * Return values in case of error:
+ *  FILE_MISSING
+ *  OPEN_FAILED
+ *  READ_ERROR
+ *  PAGE_CORRUPTION
+ *  WRITE_FAILED
+ *
+ * If none of the above, this function return number of blocks
+ * readed by remote agent.
+ *
+ * In case of DELTA mode horizonLsn must be a valid lsn,
+ * otherwise it should be set to InvalidXLogRecPtr.
+ */
+int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *file,
+				   XLogRecPtr horizonLsn, int calg, int clevel, uint32 checksum_version,
+				   bool use_pagemap, BlockNumber* err_blknum, char **errormsg,
+				   BackupPageHeader2 **headers)
+{
+	FILE *out = NULL;
+	char *out_buf = NULL;
+	char *req;
+	size_t req_size;
+	int rc;
+	BlockNumber	n_blocks_read = 0;
+	BlockNumber blknum = 0;
+
+	req = fio_send_pages_request(from_fullpath, file, horizonLsn, calg, clevel,
+								 checksum_version, use_pagemap, &req_size);
+
+	file->compress_alg = calg; /* TODO: wtf? why here? */
+
+	/* send request, unless it is already prefetched */
+	if (!fio_take_prefetched(req, req_size))
+	{
+		fio_drain();
+		IO_CHECK(fio_write_all(fio_stdout, req, req_size), req_size);
+	}
+	pg_free(req);
 
 	while (true)
 	{
 		fio_header hdr;
 		char buf[BLCKSZ + sizeof(BackupPageHeader)];
-		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+		fio_read_reply(&hdr, sizeof(hdr));
 
 		if (interrupted)
 			elog(ERROR, "Interrupted during page reading");
@@ -1482,12 +2233,13 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 			/* FILE_MISSING, OPEN_FAILED and READ_FAILED */
 			if (hdr.size > 0)
 			{
-				IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+				fio_read_reply(buf, hdr.size);
 				*errormsg = pgut_malloc(hdr.size);
 				snprintf(*errormsg, hdr.size, "%s", buf);
 			}
 
-			return hdr.arg;
+			rc = hdr.arg;
+			goto cleanup;
 		}
 		else if (hdr.cop == FIO_SEND_FILE_CORRUPTION)
 		{
@@ -1495,11 +2247,12 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 
 			if (hdr.size > 0)
 			{
-				IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+				fio_read_reply(buf, hdr.size);
 				*errormsg = pgut_malloc(hdr.size);
 				snprintf(*errormsg, hdr.size, "%s", buf);
 			}
-			return PAGE_CORRUPTION;
+			rc = PAGE_CORRUPTION;
+			goto cleanup;
 		}
 		else if (hdr.cop == FIO_SEND_FILE_EOF)
 		{
@@ -1510,7 +2263,7 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 			if (hdr.size > 0)
 			{
 				*headers = pgut_malloc(hdr.size);
-				IO_CHECK(fio_read_all(fio_stdin, *headers, hdr.size), hdr.size);
+				fio_read_reply(*headers, hdr.size);
 				file->n_headers = (hdr.size / sizeof(BackupPageHeader2)) -1;
 			}
 
@@ -1521,7 +2274,7 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 			blknum = hdr.arg;
 
 			Assert(hdr.size <= sizeof(buf));
-			IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+			fio_read_reply(buf, hdr.size);
 
 			COMP_FILE_CRC32(true, file->crc, buf, hdr.size);
 
@@ -1533,7 +2286,8 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 			{
 				fio_fclose(out);
 				*err_blknum = blknum;
-				return WRITE_FAILED;
+				rc = WRITE_FAILED;
+				goto cleanup;
 			}
 			file->write_size += hdr.size;
 			file->uncompressed_size += BLCKSZ;
@@ -1546,7 +2300,11 @@ int fio_send_pages(const char *to_fullpath, const char *from_fullpath, pgFile *f
 		fclose(out);
 	pg_free(out_buf);
 
-	return n_blocks_read;
+	rc = n_blocks_read;
+
+cleanup:
+	fio_release_reply();
+	return rc;
 }
 
 /* TODO: read file using large buffer
@@ -1838,6 +2596,7 @@ int fio_send_file_gz(const char *from_fullpath, const char *to_fullpath, FILE* o
 	size_t path_len = strlen(from_fullpath) + 1;
 	/* decompressor */
 	z_stream *strm = NULL;
+	bool replied = false; /* whole reply is received */
 
 	hdr.cop = FIO_SEND_FILE;
 	hdr.size = path_len;
@@ -1845,6 +2604,8 @@ int fio_send_file_gz(const char *from_fullpath, const char *to_fullpath, FILE* o
 //	elog(VERBOSE, "Thread [%d]: Attempting to open remote compressed WAL file '%s'",
 //			thread_num, from_fullpath);
 
+	fio_drain();
+
 	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
 	IO_CHECK(fio_write_all(fio_stdout, from_fullpath, path_len), path_len);
 
@@ -1855,10 +2616,12 @@ int fio_send_file_gz(const char *from_fullpath, const char *to_fullpath, FILE* o
 
 		if (hdr.cop == FIO_SEND_FILE_EOF)
 		{
+			replied = true;
 			break;
 		}
 		else if (hdr.cop == FIO_ERROR)
 		{
+			replied = true;
 			/* handle error, reported by the agent */
 			if (hdr.size > 0)
 			{
@@ -1964,8 +2727,12 @@ int fio_send_file_gz(const char *from_fullpath, const char *to_fullpath, FILE* o
 	}
 
 cleanup:
+	/* receive the rest of data, or pending data in pipe would be taken for reply */
+	if (!replied)
+		fio_skip_send_file_reply();
+
 	if (exit_code < OPEN_FAILED)
-		fio_disconnect(); /* discard possible pending data in pipe */
+		fio_disconnect();
 
 	if (strm)
 	{
@@ -1978,6 +2745,45 @@ cleanup:
 	return exit_code;
 }
 
+/*
+ * Compose request of fio_send_file(). Unused fields of the request are
+ * zeroed, so that identical requests can be compared byte by byte.
+ */
+static char *
+fio_send_file_request(const char *from_fullpath, size_t *req_size)
+{
+	fio_header	hdr;
+	size_t		path_len = strlen(from_fullpath) + 1;
+	char	   *buf;
+
+	memset(&hdr, 0, sizeof(hdr));
+	hdr.cop = FIO_SEND_FILE;
+	hdr.size = path_len;
+
+	*req_size = sizeof(hdr) + path_len;
+	buf = pgut_malloc(*req_size);
+	memcpy(buf, &hdr, sizeof(hdr));
+	memcpy(buf + sizeof(hdr), from_fullpath, path_len);
+
+	return buf;
+}
+
+/*
+ * Ask the agent to send the file, which is received later by fio_send_file()
+ * with the same path. This way transfers of several small files are not
+ * separated by round trips to the remote host.
+ */
+void
+fio_prefetch_file(const char *from_fullpath)
+{
+	size_t		req_size;
+
+	if (fio_window() <= 1)
+		return;
+
+	fio_prefetch(fio_send_file_request(from_fullpath, &req_size), req_size);
+}
+
 /* Receive chunks of data and write them to destination file.
  * Return codes:
  *   SEND_OK       (0)
@@ -1994,22 +2800,27 @@ int fio_send_file(const char *from_fullpath, const char *to_fullpath, FILE* out,
 {
 	fio_header hdr;
 	int exit_code = SEND_OK;
-	size_t path_len = strlen(from_fullpath) + 1;
+	char *req;
+	size_t req_size;
 	char *buf = pgut_malloc(CHUNK_SIZE);    /* buffer */
 
-	hdr.cop = FIO_SEND_FILE;
-	hdr.size = path_len;
-
 //	elog(VERBOSE, "Thread [%d]: Attempting to open remote WAL file '%s'",
 //			thread_num, from_fullpath);
 
-	IO_CHECK(fio_write_all(fio_stdout, &hdr, sizeof(hdr)), sizeof(hdr));
-	IO_CHECK(fio_write_all(fio_stdout, from_fullpath, path_len), path_len);
+	req = fio_send_file_request(from_fullpath, &req_size);
+
+	/* send request, unless it is already prefetched */
+	if (!fio_take_prefetched(req, req_size))
+	{
+		fio_drain();
+		IO_CHECK(fio_write_all(fio_stdout, req, req_size), req_size);
+	}
+	pg_free(req);
 
 	for (;;)
 	{
 		/* receive data */
-		IO_CHECK(fio_read_all(fio_stdin, &hdr, sizeof(hdr)), sizeof(hdr));
+		fio_read_reply(&hdr, sizeof(hdr));
 
 		if (hdr.cop == FIO_SEND_FILE_EOF)
 		{
@@ -2020,7 +2831,7 @@ int fio_send_file(const char *from_fullpath, const char *to_fullpath, FILE* out,
 			/* handle error, reported by the agent */
 			if (hdr.size > 0)
 			{
-				IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+				fio_read_reply(buf, hdr.size);
 				*errormsg = pgut_malloc(hdr.size);
 				snprintf(*errormsg, hdr.size, "%s", buf);
 			}
@@ -2030,12 +2841,14 @@ int fio_send_file(const char *from_fullpath, const char *to_fullpath, FILE* out,
 		else if (hdr.cop == FIO_PAGE)
 		{
 			Assert(hdr.size <= CHUNK_SIZE);
-			IO_CHECK(fio_read_all(fio_stdin, buf, hdr.size), hdr.size);
+			fio_read_reply(buf, hdr.size);
 
 			/* We have received a chunk of data data, lets write it out */
 			if (fwrite(buf, 1, hdr.size, out) != hdr.size)
 			{
 				exit_code = WRITE_FAILED;
+				/* pending data in pipe would be taken for the next reply */
+				fio_skip_send_file_reply();
 				break;
 			}
 
@@ -2052,9 +2865,15 @@ int fio_send_file(const char *from_fullpath, const char *to_fullpath, FILE* out,
 		}
 	}
 
-	if (exit_code < OPEN_FAILED)
-		fio_disconnect(); /* discard possible pending data in pipe */
+	/*
+	 * Close the session, unless reply is buffered. Replies to requests
+	 * in flight are received by fio_disconnect(), so failure to open
+	 * a file is still reported.
+	 */
+	if (exit_code < OPEN_FAILED && fio_reply == NULL)
+		fio_disconnect();
 
+	fio_release_reply();
 	pg_free(buf);
 	return exit_code;
 }
@@ -2150,6 +2969,7 @@ static void fio_send_file_impl(int out, char const* path)
 
 	/* we are done, send eof */
 	hdr.cop = FIO_SEND_FILE_EOF;
+	hdr.size = 0;
 	IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
 
 cleanup:
@@ -2178,6 +2998,9 @@ void fio_list_dir(parray *files, const char *root, bool exclude,
 	req.exclusive_backup = exclusive_backup;
 	req.skip_hidden = skip_hidden;
 	req.external_dir_num = external_dir_num;
+	req.threads = num_threads;
+
+	fio_drain();
 
 	hdr.cop = FIO_LIST_DIR;
 	hdr.size = sizeof(req);
@@ -2269,6 +3092,8 @@ static void fio_list_dir_impl(int out, char* buf)
 	 */
 	instance_config.logger.log_level_console = ERROR;
 	exclusive_backup = req->exclusive_backup;
+	/* list the directory by as many threads as the main process uses */
+	num_threads = req->threads;
 
 	dir_list_file(file_files, req->path, req->exclude, req->follow_symlink,
 				  req->add_root, req->backup_logs, req->skip_hidden,
@@ -2335,6 +3160,8 @@ fio_get_checksum_map(const char *fullpath, uint32 checksum_version, int n_blocks
 		req_hdr.stop_lsn = dest_stop_lsn;
 		req_hdr.checksumVersion = checksum_version;
 
+		fio_drain();
+
 		hdr.cop = FIO_GET_CHECKSUM_MAP;
 		hdr.size = sizeof(req_hdr) + path_len;
 
@@ -2399,6 +3226,8 @@ fio_get_lsn_map(const char *fullpath, uint32 checksum_version,
 		req_hdr.shift_lsn = shift_lsn;
 		req_hdr.checksumVersion = checksum_version;
 
+		fio_drain();
+
 		hdr.cop = FIO_GET_LSN_MAP;
 		hdr.size = sizeof(req_hdr) + path_len;
 
@@ -2465,6 +3294,8 @@ pid_t fio_check_postmaster(const char *pgdata, fio_location location)
 	{
 		fio_header hdr;
 
+		fio_drain();
+
 		hdr.cop = FIO_CHECK_POSTMASTER;
 		hdr.size = strlen(pgdata) + 1;
 
@@ -2499,7 +3330,18 @@ static void fio_check_postmaster_impl(int out, char *buf)
 void
 fio_delete(mode_t mode, const char *fullpath, fio_location location)
 {
-	if (fio_is_remote(location))
+	if (fio_is_container(fullpath, location))
+	{
+		if (!S_ISDIR(mode) && container_unlink(fullpath) != 0 && errno != ENOENT)
+			elog(ERROR, "Cannot remove file \"%s\": %s", fullpath, strerror(errno));
+	}
+	else if (fio_is_storage(location))
+	{
+		if ((S_ISDIR(mode) ? s3_rmdir(fullpath) : s3_unlink(fullpath)) != 0)
+			elog(ERROR, "Cannot remove %s \"%s\": %s",
+				 S_ISDIR(mode) ? "directory" : "file", fullpath, strerror(errno));
+	}
+	else if (fio_is_remote(location))
 	{
 		fio_header  hdr;
 
@@ -2539,7 +3381,6 @@ void fio_communicate(int in, int out)
 	fio_header hdr;
 	struct stat st;
 	int rc;
-	int tmp_fd;
 	pg_crc32 crc;
 
 #ifdef WIN32
@@ -2592,12 +3433,19 @@ void fio_communicate(int in, int out)
 			IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
 			break;
 		  case FIO_CLOSE: /* Close file */
+			/* failure to open the file is already reported */
+			if (fd[hdr.handle] < 0)
+				break;
 			SYS_CHECK(close(fd[hdr.handle]));
 			break;
 		  case FIO_WRITE: /* Write to the current position in file */
+			if (fd[hdr.handle] < 0)
+				break;
 			IO_CHECK(fio_write_all(fd[hdr.handle], buf, hdr.size), hdr.size);
 			break;
 		  case FIO_WRITE_COMPRESSED: /* Write to the current position in file */
+			if (fd[hdr.handle] < 0)
+				break;
 			IO_CHECK(fio_write_compressed_impl(fd[hdr.handle], buf, hdr.size, hdr.arg), BLCKSZ);
 			break;
 		  case FIO_READ: /* Read from the current position in file */
@@ -2655,9 +3503,13 @@ void fio_communicate(int in, int out)
 			SYS_CHECK(chmod(buf, hdr.arg));
 			break;
 		  case FIO_SEEK:   /* Set current position in file */
+			if (fd[hdr.handle] < 0)
+				break;
 			SYS_CHECK(lseek(fd[hdr.handle], hdr.arg, SEEK_SET));
 			break;
 		  case FIO_TRUNCATE: /* Truncate file */
+			if (fd[hdr.handle] < 0)
+				break;
 			SYS_CHECK(ftruncate(fd[hdr.handle], hdr.arg));
 			break;
 		  case FIO_LIST_DIR:
@@ -2671,18 +3523,8 @@ void fio_communicate(int in, int out)
 			fio_send_file_impl(out, buf);
 			break;
 		  case FIO_SYNC:
-			/* open file and fsync it */
-			tmp_fd = open(buf, O_WRONLY | PG_BINARY, FILE_PERMISSIONS);
-			if (tmp_fd < 0)
-				hdr.arg = errno;
-			else
-			{
-				if (fsync(tmp_fd) == 0)
-					hdr.arg = 0;
-				else
-					hdr.arg = errno;
-			}
-			close(tmp_fd);
+			/* open file and sync it using requested method */
+			hdr.arg = fio_sync_file_impl(buf, hdr.arg) == 0 ? 0 : errno;
 
 			IO_CHECK(fio_write_all(out, &hdr, sizeof(hdr)), sizeof(hdr));
 			break;
@@ -64,8 +64,22 @@ typedef enum
 	FIO_REMOTE_HOST  /* date is located at remote host */
 } fio_location;
 
+/* Methods of fio_sync_file() */
+typedef enum
+{
+	FIO_SYNC_FSYNC,     /* fsync the file */
+	FIO_SYNC_WRITEBACK, /* start writeback of file data, do not wait for it */
+	FIO_SYNC_SYNCFS     /* sync the whole filesystem containing the file */
+} fio_sync_method;
+
+/* syncfs() is checked by configure only since PostgreSQL 14 */
+#if defined(HAVE_SYNCFS) || defined(__linux__)
+#define FIO_HAVE_SYNCFS
+#endif
+
 #define FIO_FDMAX 64
 #define FIO_PIPE_MARKER 0x40000000
+#define FIO_STORAGE_MARKER 0x20000000
 
 #define SYS_CHECK(cmd) do if ((cmd) < 0) { fprintf(stderr, "%s:%d: (%s) %s\n", __FILE__, __LINE__, #cmd, strerror(errno)); exit(EXIT_FAILURE); } while (0)
 #define IO_CHECK(cmd, size) do { int _rc = (cmd); if (_rc != (size)) fio_error(_rc, size, __FILE__, __LINE__); } while (0)
@@ -112,6 +126,7 @@ extern int     fio_truncate(int fd, off_t size);
 extern int     fio_close(int fd);
 extern void    fio_disconnect(void);
 extern int     fio_sync(char const* path, fio_location location);
+extern int     fio_sync_file(char const* path, fio_sync_method method, fio_location location);
 extern pg_crc32 fio_get_crc32(const char *file_path, fio_location location, bool decompress);
 
 extern int     fio_rename(char const* old_path, char const* new_path, fio_location location);
@@ -242,8 +242,9 @@ bool launch_agent(void)
 				(agent_version / 100) % 100,
 				agent_version % 100);
 
-		elog(ERROR, "Remote agent version %s does not match local program version %s",
-			agent_version_str, PROGRAM_VERSION);
+		elog(ERROR, "Remote agent version %s does not match local program version %s "
+			 "(protocol version %d)",
+			agent_version_str, PROGRAM_VERSION, AGENT_PROTOCOL_VERSION);
 	}
 
 	return true;
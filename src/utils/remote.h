@@ -19,6 +19,7 @@ typedef struct RemoteConfig
 	char* user;
 	char *ssh_config;
 	char *ssh_options;
+	uint32 window;	/* number of remote requests allowed to be in flight */
 } RemoteConfig;
 
 #endif
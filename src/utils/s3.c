@@ -0,0 +1,1686 @@
+/*-------------------------------------------------------------------------
+ *
+ * s3.c: S3-compatible object storage for backup catalog.
+ *
+ * Files of backup catalog are stored as objects, keyed by their catalog
+ * path without leading slash. Directories are represented by empty
+ * marker objects with trailing slash in the key, so empty directories
+ * created by 'init' and 'add-instance' are visible.
+ *
+ * Files are accessed via stdio FILE streams (see fopencookie(3)), so
+ * the code reading and writing backup files with fread()/fwrite() works
+ * unchanged:
+ *  - reading is done by ranged GET requests with read-ahead;
+ *  - writing is buffered in memory; small objects are uploaded by single
+ *    PUT request on close, large objects are uploaded in parts by the
+ *    pool of upload threads. Number of parts in flight is limited, so
+ *    memory consumption is bounded by part size multiplied by twice the
+ *    number of upload threads, no matter how many files are written.
+ *
+ * Requests are signed with AWS Signature Version 4 and sent in path-style
+ * addressing, which is supported by AWS S3 and its local stand-ins such
+ * as MinIO.
+ *
+ * Copyright (c) 2020, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#include "postgres_fe.h"
+#include "pqexpbuffer.h"
+
+#include "s3.h"
+#include "logger.h"
+#include "pgut.h"
+#include "thread.h"
+
+#ifdef WITH_S3
+
+#include <curl/curl.h>
+#include <openssl/hmac.h>
+#include <openssl/sha.h>
+
+/* How many times failed request is repeated */
+#define S3_MAX_RETRIES		3
+/* Minimal size of ranged GET request */
+#define S3_READ_AHEAD		(1024 * 1024)
+/* Initial size of write buffer, it grows up to part size */
+#define S3_WRITE_BUFSIZE	(64 * 1024)
+#define S3_UNSIGNED_PAYLOAD	"UNSIGNED-PAYLOAD"
+#define S3_FILE_MODE		(S_IFREG | 0600)
+#define S3_DIR_MODE			(S_IFDIR | 0700)
+/* Maximum number of headers covered by request signature */
+#define S3_MAX_SIGNED_HEADERS	16
+
+typedef struct S3Request
+{
+	const char *method;
+	const char *key;			/* object key, NULL for bucket requests */
+	const char *query;			/* canonical query string or NULL */
+	const char *body;
+	size_t		body_len;
+	struct curl_slist *headers;	/* additional headers, x-amz-* ones are signed */
+
+	/* response */
+	long		status;
+	char	   *data;			/* response body */
+	size_t		data_len;
+	size_t		data_size;
+	char	   *out;			/* if set, response body is stored here */
+	size_t		out_size;
+	char		etag[128];
+	curl_off_t	content_length;
+	time_t		mtime;
+} S3Request;
+
+typedef struct S3File
+{
+	char	   *key;
+	bool		write;
+	bool		exclusive;		/* fail if object already exists */
+	off_t		pos;
+
+	/* reading */
+	off_t		size;
+	char	   *rbuf;
+	size_t		rbuf_size;
+	off_t		rbuf_off;
+	size_t		rbuf_len;
+
+	/* writing */
+	char	   *wbuf;
+	size_t		wbuf_size;
+	size_t		wbuf_len;
+	char	   *upload_id;		/* multipart upload, NULL if not started */
+	int			nparts;
+	char	  **etags;			/* etags of uploaded parts */
+	int			etags_size;
+	int			pending;		/* parts queued or being uploaded */
+	bool		failed;
+} S3File;
+
+/* Part of multipart upload, queued for upload thread */
+typedef struct S3Part
+{
+	S3File	   *file;
+	int			number;
+	char	   *data;
+	size_t		len;
+	struct S3Part *next;
+} S3Part;
+
+/* Header of canonical request, name is lower-cased */
+typedef struct S3SignedHeader
+{
+	char	   *name;
+	const char *value;
+} S3SignedHeader;
+
+/* Entry of directory listing, saved to answer following stat() calls */
+typedef struct S3ListEntry
+{
+	char	   *name;
+	bool		is_dir;
+	off_t		size;
+	time_t		mtime;
+} S3ListEntry;
+
+static S3Config s3_config;
+static bool s3_is_enabled = false;
+static char *s3_url = NULL;		/* endpoint without trailing slash */
+static char *s3_host = NULL;	/* host[:port] of endpoint */
+static size_t s3_part_size;
+
+/* Curl handle of the thread, is reused to keep connection alive */
+static pthread_key_t s3_curl_key;
+
+/* Pool of upload threads */
+static pthread_mutex_t s3_pool_lock = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t s3_pool_queued = PTHREAD_COND_INITIALIZER;
+static pthread_cond_t s3_pool_uploaded = PTHREAD_COND_INITIALIZER;
+static S3Part *s3_queue_head = NULL;
+static S3Part *s3_queue_tail = NULL;
+static int	s3_inflight = 0;
+static int	s3_max_inflight = 0;
+static bool s3_workers_started = false;
+
+/* Last directory listing of the thread */
+static __thread char *s3_list_cache_key = NULL;
+static __thread parray *s3_list_cache = NULL;
+
+static ssize_t s3_cookie_read(void *cookie, char *buf, size_t size);
+static ssize_t s3_cookie_write(void *cookie, const char *buf, size_t size);
+static int	s3_cookie_seek(void *cookie, off64_t *offset, int whence);
+static int	s3_cookie_close(void *cookie);
+
+static const cookie_io_functions_t s3_cookie_funcs = {
+	s3_cookie_read,
+	s3_cookie_write,
+	s3_cookie_seek,
+	s3_cookie_close
+};
+
+/*
+ * Initialize object storage. Must be called from the main thread before
+ * any other thread is started.
+ */
+void
+s3_init(S3Config *config)
+{
+	const char *host;
+	size_t		len;
+
+	if (!config->endpoint)
+		elog(ERROR, "Object storage endpoint is not specified, use --s3-endpoint option");
+	if (!config->bucket)
+		elog(ERROR, "Object storage bucket is not specified, use --s3-bucket option");
+	if (!config->access_key || !config->secret_key)
+		elog(ERROR, "Object storage credentials are not specified, set AWS_ACCESS_KEY_ID "
+			 "and AWS_SECRET_ACCESS_KEY environment variables");
+	if (config->upload_threads < 1)
+		elog(ERROR, "--s3-upload-threads must be greater than 0");
+	if (config->part_size < 5)
+		elog(ERROR, "--s3-part-size must be at least 5 MB");
+
+	s3_config = *config;
+	if (!s3_config.region)
+		s3_config.region = "us-east-1";
+
+	host = strstr(config->endpoint, "://");
+	if (host == NULL)
+		elog(ERROR, "Invalid object storage endpoint \"%s\", expected http[s]://host[:port]",
+			 config->endpoint);
+	host += 3;
+
+	s3_url = pgut_strdup(config->endpoint);
+	len = strlen(s3_url);
+	while (len > 0 && s3_url[len - 1] == '/')
+		s3_url[--len] = '\0';
+
+	s3_host = pgut_strdup(host);
+	len = strcspn(s3_host, "/");
+	s3_host[len] = '\0';
+
+	s3_part_size = (size_t) s3_config.part_size * 1024 * 1024;
+	s3_max_inflight = s3_config.upload_threads * 2;
+
+	if (curl_global_init(CURL_GLOBAL_DEFAULT) != 0)
+		elog(ERROR, "Cannot initialize libcurl");
+
+	if (pthread_key_create(&s3_curl_key, (void (*)(void *)) curl_easy_cleanup) != 0)
+		elog(ERROR, "Cannot create thread key: %s", strerror(errno));
+
+	s3_is_enabled = true;
+
+	elog(LOG, "Backup catalog is stored in bucket \"%s\" of \"%s\"",
+		 s3_config.bucket, s3_url);
+}
+
+bool
+s3_enabled(void)
+{
+	return s3_is_enabled;
+}
+
+/*
+ * Convert catalog path to object key: strip leading and trailing slashes,
+ * add trailing slash for directories.
+ */
+static char *
+s3_key(const char *path, bool is_dir)
+{
+	char	   *key;
+	size_t		len;
+
+	while (*path == '/')
+		path++;
+
+	key = pgut_malloc(strlen(path) + 2);
+	strcpy(key, path);
+
+	len = strlen(key);
+	while (len > 0 && key[len - 1] == '/')
+		key[--len] = '\0';
+
+	if (is_dir && len > 0)
+		strcat(key, "/");
+
+	return key;
+}
+
+/*
+ * Percent-encode string as required by Signature Version 4.
+ */
+static char *
+s3_uri_encode(const char *src, bool encode_slash)
+{
+	static const char hex[] = "0123456789ABCDEF";
+	char	   *dst = pgut_malloc(strlen(src) * 3 + 1);
+	char	   *p = dst;
+
+	for (; *src; src++)
+	{
+		unsigned char c = (unsigned char) *src;
+
+		if (isalnum(c) || c == '-' || c == '_' || c == '.' || c == '~' ||
+			(c == '/' && !encode_slash))
+			*p++ = c;
+		else
+		{
+			*p++ = '%';
+			*p++ = hex[c >> 4];
+			*p++ = hex[c & 0xF];
+		}
+	}
+	*p = '\0';
+
+	return dst;
+}
+
+static void
+s3_hex(const unsigned char *src, size_t len, char *dst)
+{
+	static const char hex[] = "0123456789abcdef";
+	size_t		i;
+
+	for (i = 0; i < len; i++)
+	{
+		dst[i * 2] = hex[src[i] >> 4];
+		dst[i * 2 + 1] = hex[src[i] & 0xF];
+	}
+	dst[len * 2] = '\0';
+}
+
+static void
+s3_hmac(const unsigned char *key, size_t key_len, const char *data,
+		unsigned char *digest)
+{
+	unsigned char result[EVP_MAX_MD_SIZE];
+	unsigned int result_len = 0;
+
+	/* key and digest may point to the same buffer */
+	HMAC(EVP_sha256(), key, (int) key_len, (const unsigned char *) data,
+		 strlen(data), result, &result_len);
+	memcpy(digest, result, SHA256_DIGEST_LENGTH);
+}
+
+static int
+s3_signed_header_compare(const void *h1, const void *h2)
+{
+	return strcmp(((const S3SignedHeader *) h1)->name,
+				  ((const S3SignedHeader *) h2)->name);
+}
+
+static void
+s3_add_signed_header(S3SignedHeader *headers, int *n_headers,
+					 const char *name, size_t name_len, const char *value)
+{
+	size_t		i;
+
+	if (*n_headers >= S3_MAX_SIGNED_HEADERS)
+		elog(ERROR, "Too many headers in S3 request");
+
+	headers[*n_headers].name = pgut_malloc(name_len + 1);
+	for (i = 0; i < name_len; i++)
+		headers[*n_headers].name[i] = pg_tolower((unsigned char) name[i]);
+	headers[*n_headers].name[name_len] = '\0';
+
+	/* leading whitespace is not a part of canonical value */
+	while (*value == ' ' || *value == '\t')
+		value++;
+	headers[*n_headers].value = value;
+	(*n_headers)++;
+}
+
+/*
+ * Build Authorization header for the request according to
+ * AWS Signature Version 4. Payload is not signed. Every x-amz-* header
+ * of the request must be signed, otherwise the request is rejected.
+ */
+static void
+s3_sign(const char *method, const char *uri, const char *query,
+		struct curl_slist *req_headers, const char *amz_date,
+		char *auth, size_t auth_len)
+{
+	char		date[9];
+	char		scope[256];
+	char		secret[512];
+	char		hash_hex[SHA256_DIGEST_LENGTH * 2 + 1];
+	char		signature[SHA256_DIGEST_LENGTH * 2 + 1];
+	unsigned char hash[SHA256_DIGEST_LENGTH];
+	unsigned char key[SHA256_DIGEST_LENGTH];
+	char	   *string_to_sign;
+	S3SignedHeader headers[S3_MAX_SIGNED_HEADERS];
+	int			n_headers = 0;
+	struct curl_slist *h;
+	PQExpBufferData canonical;
+	PQExpBufferData signed_headers;
+	int			i;
+
+	strncpy(date, amz_date, 8);
+	date[8] = '\0';
+
+	s3_add_signed_header(headers, &n_headers, "host", 4, s3_host);
+	s3_add_signed_header(headers, &n_headers, "x-amz-content-sha256", 20,
+						 S3_UNSIGNED_PAYLOAD);
+	s3_add_signed_header(headers, &n_headers, "x-amz-date", 10, amz_date);
+	for (h = req_headers; h; h = h->next)
+	{
+		const char *colon = strchr(h->data, ':');
+
+		if (colon && pg_strncasecmp(h->data, "x-amz-", 6) == 0)
+			s3_add_signed_header(headers, &n_headers, h->data,
+								 colon - h->data, colon + 1);
+	}
+	qsort(headers, n_headers, sizeof(S3SignedHeader), s3_signed_header_compare);
+
+	initPQExpBuffer(&canonical);
+	initPQExpBuffer(&signed_headers);
+	appendPQExpBuffer(&canonical, "%s\n%s\n%s\n",
+					  method, uri, query ? query : "");
+	for (i = 0; i < n_headers; i++)
+	{
+		appendPQExpBuffer(&canonical, "%s:%s\n",
+						  headers[i].name, headers[i].value);
+		appendPQExpBuffer(&signed_headers, "%s%s",
+						  i > 0 ? ";" : "", headers[i].name);
+		pg_free(headers[i].name);
+	}
+	appendPQExpBuffer(&canonical, "\n%s\n%s",
+					  signed_headers.data, S3_UNSIGNED_PAYLOAD);
+	if (PQExpBufferBroken(&canonical) || PQExpBufferBroken(&signed_headers))
+		elog(ERROR, "Out of memory");
+
+	SHA256((const unsigned char *) canonical.data, canonical.len, hash);
+	s3_hex(hash, SHA256_DIGEST_LENGTH, hash_hex);
+
+	snprintf(scope, sizeof(scope), "%s/%s/s3/aws4_request",
+			 date, s3_config.region);
+	string_to_sign = psprintf("AWS4-HMAC-SHA256\n%s\n%s\n%s",
+							  amz_date, scope, hash_hex);
+
+	/* derive signing key */
+	snprintf(secret, sizeof(secret), "AWS4%s", s3_config.secret_key);
+	s3_hmac((unsigned char *) secret, strlen(secret), date, key);
+	s3_hmac(key, SHA256_DIGEST_LENGTH, s3_config.region, key);
+	s3_hmac(key, SHA256_DIGEST_LENGTH, "s3", key);
+	s3_hmac(key, SHA256_DIGEST_LENGTH, "aws4_request", key);
+
+	s3_hmac(key, SHA256_DIGEST_LENGTH, string_to_sign, hash);
+	s3_hex(hash, SHA256_DIGEST_LENGTH, signature);
+
+	snprintf(auth, auth_len,
+			 "Authorization: AWS4-HMAC-SHA256 Credential=%s/%s, "
+			 "SignedHeaders=%s, Signature=%s",
+			 s3_config.access_key, scope, signed_headers.data, signature);
+
+	termPQExpBuffer(&canonical);
+	termPQExpBuffer(&signed_headers);
+	pfree(string_to_sign);
+}
+
+static size_t
+s3_write_callback(char *ptr, size_t size, size_t nmemb, void *userdata)
+{
+	S3Request  *req = (S3Request *) userdata;
+	size_t		len = size * nmemb;
+
+	if (req->out)
+	{
+		size_t		n = Min(len, req->out_size - req->data_len);
+
+		memcpy(req->out + req->data_len, ptr, n);
+		req->data_len += n;
+		return len;
+	}
+
+	if (req->data_len + len + 1 > req->data_size)
+	{
+		req->data_size = Max(req->data_size * 2, req->data_len + len + 1);
+		req->data = pgut_realloc(req->data, req->data_size);
+	}
+	memcpy(req->data + req->data_len, ptr, len);
+	req->data_len += len;
+	req->data[req->data_len] = '\0';
+
+	return len;
+}
+
+static size_t
+s3_header_callback(char *buffer, size_t size, size_t nitems, void *userdata)
+{
+	S3Request  *req = (S3Request *) userdata;
+	size_t		len = size * nitems;
+
+	if (len > 5 && pg_strncasecmp(buffer, "ETag:", 5) == 0)
+	{
+		char	   *p = buffer + 5;
+		size_t		n = len - 5;
+
+		while (n > 0 && (*p == ' ' || *p == '\t'))
+		{
+			p++;
+			n--;
+		}
+		while (n > 0 && (p[n - 1] == '\r' || p[n - 1] == '\n' || p[n - 1] == ' '))
+			n--;
+
+		n = Min(n, sizeof(req->etag) - 1);
+		memcpy(req->etag, p, n);
+		req->etag[n] = '\0';
+	}
+
+	return len;
+}
+
+static CURL *
+s3_get_curl(void)
+{
+	CURL	   *curl = pthread_getspecific(s3_curl_key);
+
+	if (curl == NULL)
+	{
+		curl = curl_easy_init();
+		if (curl == NULL)
+			elog(ERROR, "Cannot initialize libcurl handle");
+		pthread_setspecific(s3_curl_key, curl);
+	}
+	else
+		curl_easy_reset(curl);
+
+	return curl;
+}
+
+/*
+ * Send request to object storage. Requests failed due to network errors
+ * or server errors are repeated. Return false if request cannot be sent,
+ * otherwise HTTP status of response is stored in req->status.
+ */
+static bool
+s3_perform(S3Request *req)
+{
+	char	   *encoded_key = NULL;
+	char	   *uri;
+	char	   *url;
+	int			attempt;
+	bool		sent = false;
+
+	if (req->key)
+	{
+		encoded_key = s3_uri_encode(req->key, false);
+		uri = psprintf("/%s/%s", s3_config.bucket, encoded_key);
+	}
+	else
+		uri = psprintf("/%s", s3_config.bucket);
+
+	url = psprintf("%s%s%s%s", s3_url, uri, req->query ? "?" : "",
+				   req->query ? req->query : "");
+
+	for (attempt = 0; attempt < S3_MAX_RETRIES; attempt++)
+	{
+		CURL	   *curl = s3_get_curl();
+		CURLcode	rc;
+		struct curl_slist *headers = NULL;
+		struct curl_slist *h;
+		char		amz_date[32];
+		char		header[1024];
+		char		auth[1024];
+		time_t		now = time(NULL);
+		struct tm	tm;
+		long		filetime = -1;
+
+		if (attempt > 0)
+			sleep(1 << attempt);
+
+		req->status = 0;
+		req->data_len = 0;
+		req->etag[0] = '\0';
+		req->content_length = -1;
+		req->mtime = 0;
+
+		gmtime_r(&now, &tm);
+		strftime(amz_date, sizeof(amz_date), "%Y%m%dT%H%M%SZ", &tm);
+
+		s3_sign(req->method, uri, req->query, req->headers, amz_date,
+				auth, sizeof(auth));
+
+		headers = curl_slist_append(headers, auth);
+		snprintf(header, sizeof(header), "x-amz-date: %s", amz_date);
+		headers = curl_slist_append(headers, header);
+		headers = curl_slist_append(headers,
+									"x-amz-content-sha256: " S3_UNSIGNED_PAYLOAD);
+		/* do not wait for "100 Continue" */
+		headers = curl_slist_append(headers, "Expect:");
+		for (h = req->headers; h; h = h->next)
+			headers = curl_slist_append(headers, h->data);
+
+		curl_easy_setopt(curl, CURLOPT_URL, url);
+		curl_easy_setopt(curl, CURLOPT_HTTPHEADER, headers);
+		curl_easy_setopt(curl, CURLOPT_NOSIGNAL, 1L);
+		curl_easy_setopt(curl, CURLOPT_FILETIME, 1L);
+		curl_easy_setopt(curl, CURLOPT_WRITEFUNCTION, s3_write_callback);
+		curl_easy_setopt(curl, CURLOPT_WRITEDATA, req);
+		curl_easy_setopt(curl, CURLOPT_HEADERFUNCTION, s3_header_callback);
+		curl_easy_setopt(curl, CURLOPT_HEADERDATA, req);
+
+		if (strcmp(req->method, "HEAD") == 0)
+			curl_easy_setopt(curl, CURLOPT_NOBODY, 1L);
+		else if (strcmp(req->method, "GET") == 0)
+			curl_easy_setopt(curl, CURLOPT_HTTPGET, 1L);
+		else
+		{
+			curl_easy_setopt(curl, CURLOPT_CUSTOMREQUEST, req->method);
+			if (strcmp(req->method, "DELETE") != 0)
+			{
+				curl_easy_setopt(curl, CURLOPT_POSTFIELDS, req->body ? req->body : "");
+				curl_easy_setopt(curl, CURLOPT_POSTFIELDSIZE_LARGE,
+								 (curl_off_t) req->body_len);
+			}
+		}
+
+		rc = curl_easy_perform(curl);
+		curl_slist_free_all(headers);
+
+		if (rc != CURLE_OK)
+		{
+			elog(WARNING, "Request %s \"%s\" failed: %s",
+				 req->method, url, curl_easy_strerror(rc));
+			continue;
+		}
+
+		curl_easy_getinfo(curl, CURLINFO_RESPONSE_CODE, &req->status);
+		curl_easy_getinfo(curl, CURLINFO_CONTENT_LENGTH_DOWNLOAD_T, &req->content_length);
+		curl_easy_getinfo(curl, CURLINFO_FILETIME, &filetime);
+		if (filetime >= 0)
+			req->mtime = (time_t) filetime;
+
+		sent = true;
+
+		/* server errors and throttling are worth to retry */
+		if (req->status >= 500)
+		{
+			elog(WARNING, "Request %s \"%s\" failed with HTTP status %ld",
+				 req->method, url, req->status);
+			continue;
+		}
+		break;
+	}
+
+	if (encoded_key)
+		pfree(encoded_key);
+	pfree(uri);
+	pfree(url);
+
+	return sent;
+}
+
+static void
+s3_request_free(S3Request *req)
+{
+	if (req->data)
+		pfree(req->data);
+	if (req->headers)
+		curl_slist_free_all(req->headers);
+}
+
+/* Set errno according to HTTP status of failed request */
+static void
+s3_set_errno(S3Request *req)
+{
+	if (req->status == 404)
+		errno = ENOENT;
+	else if (req->status == 403)
+		errno = EACCES;
+	else if (req->status == 412)
+		errno = EEXIST;
+	else
+		errno = EIO;
+}
+
+/*
+ * Some requests, like CopyObject and CompleteMultipartUpload, may fail
+ * with "200 OK" status and error in the response body.
+ */
+static bool
+s3_response_ok(S3Request *req)
+{
+	if (req->status < 200 || req->status >= 300)
+		return false;
+	return req->data == NULL || strstr(req->data, "<Error>") == NULL;
+}
+
+/*
+ * Return decoded content of the first XML element 'tag' found in 'xml',
+ * or NULL. Position after the element is stored in 'next'.
+ */
+static char *
+s3_xml_value(const char *xml, const char *tag, const char **next)
+{
+	char		open_tag[64];
+	char		close_tag[64];
+	const char *start;
+	const char *end;
+	char	   *value;
+	char	   *p;
+
+	snprintf(open_tag, sizeof(open_tag), "<%s>", tag);
+	snprintf(close_tag, sizeof(close_tag), "</%s>", tag);
+
+	if (xml == NULL || (start = strstr(xml, open_tag)) == NULL)
+		return NULL;
+	start += strlen(open_tag);
+	if ((end = strstr(start, close_tag)) == NULL)
+		return NULL;
+
+	if (next)
+		*next = end + strlen(close_tag);
+
+	value = pgut_malloc(end - start + 1);
+	for (p = value; start < end; start++)
+	{
+		static const struct
+		{
+			const char *entity;
+			char		c;
+		}			entities[] = {
+			{"&amp;", '&'}, {"&lt;", '<'}, {"&gt;", '>'},
+			{"&quot;", '"'}, {"&apos;", '\''}
+		};
+		int			i;
+
+		for (i = 0; i < lengthof(entities); i++)
+		{
+			size_t		len = strlen(entities[i].entity);
+
+			if (strncmp(start, entities[i].entity, len) == 0)
+			{
+				*p++ = entities[i].c;
+				start += len - 1;
+				break;
+			}
+		}
+		if (i == lengthof(entities))
+			*p++ = *start;
+	}
+	*p = '\0';
+
+	return value;
+}
+
+/* Parse ISO 8601 timestamp of object listing */
+static time_t
+s3_parse_time(const char *str)
+{
+	struct tm	tm;
+
+	memset(&tm, 0, sizeof(tm));
+	if (sscanf(str, "%d-%d-%dT%d:%d:%d", &tm.tm_year, &tm.tm_mon, &tm.tm_mday,
+			   &tm.tm_hour, &tm.tm_min, &tm.tm_sec) != 6)
+		return 0;
+	tm.tm_year -= 1900;
+	tm.tm_mon -= 1;
+
+	return timegm(&tm);
+}
+
+static void
+s3_list_free(parray *entries)
+{
+	int			i;
+
+	for (i = 0; i < parray_num(entries); i++)
+	{
+		S3ListEntry *entry = (S3ListEntry *) parray_get(entries, i);
+
+		pfree(entry->name);
+		pfree(entry);
+	}
+	parray_free(entries);
+}
+
+static void
+s3_list_cache_reset(void)
+{
+	if (s3_list_cache)
+	{
+		s3_list_free(s3_list_cache);
+		s3_list_cache = NULL;
+	}
+	if (s3_list_cache_key)
+	{
+		pfree(s3_list_cache_key);
+		s3_list_cache_key = NULL;
+	}
+}
+
+static int
+s3_list_entry_compare(const void *a, const void *b)
+{
+	return strcmp((*(S3ListEntry * const *) a)->name,
+				  (*(S3ListEntry * const *) b)->name);
+}
+
+/*
+ * Look for the object in the last directory listing of the thread.
+ */
+static bool
+s3_list_cache_lookup(const char *key, struct stat *st)
+{
+	const char *name = last_dir_separator(key);
+	S3ListEntry probe;
+	S3ListEntry **entry;
+
+	if (s3_list_cache == NULL || name == NULL ||
+		strlen(s3_list_cache_key) != name - key + 1 ||
+		strncmp(s3_list_cache_key, key, name - key + 1) != 0)
+		return false;
+
+	probe.name = (char *) name + 1;
+	entry = (S3ListEntry **) parray_bsearch(s3_list_cache, &probe,
+											s3_list_entry_compare);
+	if (entry == NULL)
+		return false;
+
+	memset(st, 0, sizeof(struct stat));
+	st->st_mode = (*entry)->is_dir ? S3_DIR_MODE : S3_FILE_MODE;
+	st->st_size = (*entry)->size;
+	st->st_mtime = (*entry)->mtime;
+
+	return true;
+}
+
+/*
+ * List objects with specified prefix, up to 'max_keys' entries if it is
+ * positive. Keys and common prefixes are returned relative to 'prefix'.
+ * Return NULL on error.
+ */
+static parray *
+s3_list(const char *prefix, int max_keys)
+{
+	parray	   *entries = parray_new();
+	char	   *token = NULL;
+	char	   *encoded_prefix = s3_uri_encode(prefix, true);
+	size_t		prefix_len = strlen(prefix);
+
+	do
+	{
+		S3Request	req;
+		const char *p;
+		char	   *value;
+		char	   *truncated;
+		char	   *encoded_token = token ? s3_uri_encode(token, true) : NULL;
+		char	   *query;
+		char		max_keys_str[32] = "";
+
+		if (max_keys > 0)
+			snprintf(max_keys_str, sizeof(max_keys_str), "&max-keys=%d", max_keys);
+
+		/* query parameters must be sorted by name */
+		query = psprintf("%s%s%sdelimiter=%%2F&list-type=2%s&prefix=%s",
+						 token ? "continuation-token=" : "",
+						 token ? encoded_token : "",
+						 token ? "&" : "",
+						 max_keys_str, encoded_prefix);
+
+		memset(&req, 0, sizeof(req));
+		req.method = "GET";
+		req.query = query;
+
+		if (!s3_perform(&req) || !s3_response_ok(&req))
+		{
+			s3_set_errno(&req);
+			s3_request_free(&req);
+			pfree(query);
+			s3_list_free(entries);
+			return NULL;
+		}
+
+		/* objects */
+		p = req.data;
+		while ((value = s3_xml_value(p, "Contents", &p)) != NULL)
+		{
+			char	   *key = s3_xml_value(value, "Key", NULL);
+			char	   *size = s3_xml_value(value, "Size", NULL);
+			char	   *mtime = s3_xml_value(value, "LastModified", NULL);
+
+			if (key && strlen(key) >= prefix_len)
+			{
+				S3ListEntry *entry = pgut_new(S3ListEntry);
+
+				entry->name = pgut_strdup(key + prefix_len);
+				entry->is_dir = false;
+				entry->size = size ? atoll(size) : 0;
+				entry->mtime = mtime ? s3_parse_time(mtime) : 0;
+				parray_append(entries, entry);
+			}
+
+			if (key)
+				pfree(key);
+			if (size)
+				pfree(size);
+			if (mtime)
+				pfree(mtime);
+			pfree(value);
+		}
+
+		/* subdirectories */
+		p = req.data;
+		while ((value = s3_xml_value(p, "CommonPrefixes", &p)) != NULL)
+		{
+			char	   *subdir = s3_xml_value(value, "Prefix", NULL);
+
+			if (subdir && strlen(subdir) > prefix_len)
+			{
+				S3ListEntry *entry = pgut_new(S3ListEntry);
+				size_t		len;
+
+				entry->name = pgut_strdup(subdir + prefix_len);
+				len = strlen(entry->name);
+				if (len > 0 && entry->name[len - 1] == '/')
+					entry->name[len - 1] = '\0';
+				entry->is_dir = true;
+				entry->size = 0;
+				entry->mtime = 0;
+				parray_append(entries, entry);
+			}
+
+			if (subdir)
+				pfree(subdir);
+			pfree(value);
+		}
+
+		if (token)
+		{
+			pfree(token);
+			pfree(encoded_token);
+		}
+		token = NULL;
+
+		truncated = s3_xml_value(req.data, "IsTruncated", NULL);
+		if (truncated && strcmp(truncated, "true") == 0 && max_keys <= 0)
+			token = s3_xml_value(req.data, "NextContinuationToken", NULL);
+		if (truncated)
+			pfree(truncated);
+
+		s3_request_free(&req);
+		pfree(query);
+	} while (token);
+
+	pfree(encoded_prefix);
+
+	return entries;
+}
+
+/*
+ * Get object metadata. Objects, which are not found, are considered
+ * directories if there are objects with their key as prefix.
+ */
+int
+s3_stat(const char *path, struct stat *st)
+{
+	S3Request	req;
+	char	   *key = s3_key(path, false);
+	char	   *prefix;
+	parray	   *entries;
+	bool		is_dir;
+
+	if (key[0] == '\0')
+	{
+		/* bucket itself */
+		pfree(key);
+		memset(st, 0, sizeof(struct stat));
+		st->st_mode = S3_DIR_MODE;
+		return 0;
+	}
+
+	if (s3_list_cache_lookup(key, st))
+	{
+		pfree(key);
+		return 0;
+	}
+
+	memset(&req, 0, sizeof(req));
+	req.method = "HEAD";
+	req.key = key;
+
+	if (!s3_perform(&req))
+	{
+		s3_set_errno(&req);
+		pfree(key);
+		return -1;
+	}
+
+	if (req.status == 200)
+	{
+		memset(st, 0, sizeof(struct stat));
+		st->st_mode = S3_FILE_MODE;
+		st->st_size = req.content_length > 0 ? req.content_length : 0;
+		st->st_mtime = req.mtime;
+		s3_request_free(&req);
+		pfree(key);
+		return 0;
+	}
+
+	if (req.status != 404)
+	{
+		s3_set_errno(&req);
+		s3_request_free(&req);
+		pfree(key);
+		return -1;
+	}
+	s3_request_free(&req);
+
+	prefix = s3_key(path, true);
+	entries = s3_list(prefix, 1);
+	pfree(prefix);
+	pfree(key);
+
+	if (entries == NULL)
+		return -1;
+
+	is_dir = parray_num(entries) > 0;
+	s3_list_free(entries);
+
+	if (!is_dir)
+	{
+		errno = ENOENT;
+		return -1;
+	}
+
+	memset(st, 0, sizeof(struct stat));
+	st->st_mode = S3_DIR_MODE;
+	return 0;
+}
+
+/*
+ * Return names of files and subdirectories of the directory.
+ * Stat information of the entries is kept until next listing,
+ * so subsequent s3_stat() calls do not issue requests.
+ */
+parray *
+s3_list_dir(const char *path)
+{
+	char	   *prefix = s3_key(path, true);
+	parray	   *entries = s3_list(prefix, 0);
+	parray	   *names;
+	bool		exists = false;
+	int			i;
+
+	if (entries == NULL)
+	{
+		pfree(prefix);
+		return NULL;
+	}
+
+	names = parray_new();
+	for (i = 0; i < parray_num(entries); i++)
+	{
+		S3ListEntry *entry = (S3ListEntry *) parray_get(entries, i);
+
+		/* directory marker */
+		if (entry->name[0] == '\0')
+		{
+			exists = true;
+			pfree(entry->name);
+			pfree(entry);
+			parray_remove(entries, i--);
+			continue;
+		}
+
+		exists = true;
+		parray_append(names, pgut_strdup(entry->name));
+	}
+
+	if (!exists && prefix[0] != '\0')
+	{
+		parray_free(names);
+		parray_free(entries);
+		pfree(prefix);
+		errno = ENOENT;
+		return NULL;
+	}
+
+	s3_list_cache_reset();
+	parray_qsort(entries, s3_list_entry_compare);
+	s3_list_cache = entries;
+	s3_list_cache_key = prefix;
+
+	return names;
+}
+
+static int
+s3_delete_object(const char *key)
+{
+	S3Request	req;
+
+	s3_list_cache_reset();
+
+	memset(&req, 0, sizeof(req));
+	req.method = "DELETE";
+	req.key = key;
+
+	if (!s3_perform(&req) || (req.status != 204 && req.status != 200 &&
+							  req.status != 404))
+	{
+		s3_set_errno(&req);
+		s3_request_free(&req);
+		return -1;
+	}
+
+	s3_request_free(&req);
+	return 0;
+}
+
+int
+s3_unlink(const char *path)
+{
+	char	   *key = s3_key(path, false);
+	int			rc = s3_delete_object(key);
+
+	pfree(key);
+	return rc;
+}
+
+int
+s3_rmdir(const char *path)
+{
+	char	   *key = s3_key(path, true);
+	int			rc = s3_delete_object(key);
+
+	pfree(key);
+	return rc;
+}
+
+/* Create directory marker */
+int
+s3_mkdir(const char *path)
+{
+	S3Request	req;
+	char	   *key = s3_key(path, true);
+
+	if (key[0] == '\0')
+	{
+		pfree(key);
+		return 0;
+	}
+
+	memset(&req, 0, sizeof(req));
+	req.method = "PUT";
+	req.key = key;
+
+	if (!s3_perform(&req) || !s3_response_ok(&req))
+	{
+		s3_set_errno(&req);
+		s3_request_free(&req);
+		pfree(key);
+		return -1;
+	}
+
+	s3_request_free(&req);
+	pfree(key);
+	return 0;
+}
+
+/*
+ * There is no rename in object storage, so object is copied on server side
+ * and then removed. Unlike rename(2), it is not atomic.
+ */
+int
+s3_rename(const char *old_path, const char *new_path)
+{
+	S3Request	req;
+	char	   *old_key = s3_key(old_path, false);
+	char	   *new_key = s3_key(new_path, false);
+	char	   *encoded = s3_uri_encode(old_key, false);
+	char	   *header;
+	int			rc = 0;
+
+	s3_list_cache_reset();
+
+	memset(&req, 0, sizeof(req));
+	req.method = "PUT";
+	req.key = new_key;
+	header = psprintf("x-amz-copy-source: /%s/%s", s3_config.bucket, encoded);
+	req.headers = curl_slist_append(NULL, header);
+
+	if (!s3_perform(&req) || !s3_response_ok(&req))
+	{
+		s3_set_errno(&req);
+		rc = -1;
+	}
+	else
+		rc = s3_delete_object(old_key);
+
+	s3_request_free(&req);
+	pfree(header);
+	pfree(encoded);
+	pfree(old_key);
+	pfree(new_key);
+
+	return rc;
+}
+
+/*
+ * Open object as stdio stream. Modes "r" and "w" are supported.
+ * If 'exclusive' is true, opening for write fails with EEXIST if object
+ * exists, and the object is created only if it was not created concurrently.
+ */
+FILE *
+s3_fopen(const char *path, const char *mode, bool exclusive)
+{
+	S3File	   *file;
+	FILE	   *fp;
+	struct stat st;
+
+	if (strchr(mode, 'a') || strchr(mode, '+') ||
+		(mode[0] != 'r' && mode[0] != 'w'))
+	{
+		errno = ENOTSUP;
+		return NULL;
+	}
+
+	file = pgut_new(S3File);
+	memset(file, 0, sizeof(S3File));
+	file->key = s3_key(path, false);
+	file->write = mode[0] == 'w';
+	file->exclusive = exclusive;
+
+	if (!file->write || exclusive)
+	{
+		int			rc = s3_stat(path, &st);
+
+		if (file->write && rc == 0)
+		{
+			pfree(file->key);
+			pfree(file);
+			errno = EEXIST;
+			return NULL;
+		}
+		if (!file->write && (rc != 0 || S_ISDIR(st.st_mode)))
+		{
+			if (rc == 0)
+				errno = EISDIR;
+			pfree(file->key);
+			pfree(file);
+			return NULL;
+		}
+		if (!file->write)
+			file->size = st.st_size;
+	}
+
+	fp = fopencookie(file, file->write ? "w" : "r", s3_cookie_funcs);
+	if (fp == NULL)
+	{
+		pfree(file->key);
+		pfree(file);
+	}
+
+	return fp;
+}
+
+static ssize_t
+s3_cookie_read(void *cookie, char *buf, size_t size)
+{
+	S3File	   *file = (S3File *) cookie;
+	size_t		done = 0;
+
+	while (done < size && file->pos < file->size)
+	{
+		size_t		n;
+
+		if (file->pos < file->rbuf_off ||
+			file->pos >= file->rbuf_off + (off_t) file->rbuf_len)
+		{
+			S3Request	req;
+			char		range[64];
+			size_t		len = Max(size - done, S3_READ_AHEAD);
+
+			len = Min(len, (size_t) (file->size - file->pos));
+			if (len > file->rbuf_size)
+			{
+				file->rbuf = pgut_realloc(file->rbuf, len);
+				file->rbuf_size = len;
+			}
+
+			memset(&req, 0, sizeof(req));
+			req.method = "GET";
+			req.key = file->key;
+			req.out = file->rbuf;
+			req.out_size = len;
+			snprintf(range, sizeof(range), "Range: bytes=" INT64_FORMAT "-" INT64_FORMAT,
+					 (int64) file->pos, (int64) (file->pos + len - 1));
+			req.headers = curl_slist_append(NULL, range);
+
+			if (!s3_perform(&req) ||
+				(req.status != 206 && req.status != 200) || req.data_len == 0)
+			{
+				s3_set_errno(&req);
+				s3_request_free(&req);
+				return done > 0 ? done : -1;
+			}
+			s3_request_free(&req);
+
+			/* whole object is sent if range is not supported */
+			file->rbuf_off = req.status == 200 ? 0 : file->pos;
+			file->rbuf_len = req.data_len;
+		}
+
+		n = Min(size - done, file->rbuf_off + file->rbuf_len - file->pos);
+		memcpy(buf + done, file->rbuf + (file->pos - file->rbuf_off), n);
+		done += n;
+		file->pos += n;
+	}
+
+	return done;
+}
+
+/* Start upload threads on the first multipart upload */
+static void *s3_upload_worker(void *arg);
+
+static void
+s3_start_workers(void)
+{
+	int			i;
+
+	for (i = 0; i < s3_config.upload_threads; i++)
+	{
+		pthread_t	thread;
+
+		if (pthread_create(&thread, NULL, s3_upload_worker, NULL) != 0)
+			elog(ERROR, "Cannot create upload thread: %s", strerror(errno));
+		pthread_detach(thread);
+	}
+	s3_workers_started = true;
+}
+
+/*
+ * Hand over filled write buffer to upload threads. Wait if too many parts
+ * are in flight already.
+ */
+static bool
+s3_queue_part(S3File *file)
+{
+	S3Part	   *part;
+
+	if (file->upload_id == NULL)
+	{
+		S3Request	req;
+
+		memset(&req, 0, sizeof(req));
+		req.method = "POST";
+		req.key = file->key;
+		req.query = "uploads=";
+
+		if (!s3_perform(&req) || !s3_response_ok(&req) ||
+			(file->upload_id = s3_xml_value(req.data, "UploadId", NULL)) == NULL)
+		{
+			elog(WARNING, "Cannot start multipart upload of \"%s\", HTTP status %ld",
+				 file->key, req.status);
+			s3_set_errno(&req);
+			s3_request_free(&req);
+			file->failed = true;
+			return false;
+		}
+		s3_request_free(&req);
+	}
+
+	part = pgut_new(S3Part);
+	part->file = file;
+	part->data = file->wbuf;
+	part->len = file->wbuf_len;
+	part->next = NULL;
+
+	file->wbuf = NULL;
+	file->wbuf_len = 0;
+	file->wbuf_size = 0;
+
+	pthread_lock(&s3_pool_lock);
+
+	if (!s3_workers_started)
+		s3_start_workers();
+
+	while (s3_inflight >= s3_max_inflight)
+		pthread_cond_wait(&s3_pool_uploaded, &s3_pool_lock);
+
+	part->number = ++file->nparts;
+	if (file->nparts > file->etags_size)
+	{
+		file->etags_size = Max(file->etags_size * 2, 16);
+		file->etags = pgut_realloc(file->etags, file->etags_size * sizeof(char *));
+	}
+	file->etags[part->number - 1] = NULL;
+	file->pending++;
+	s3_inflight++;
+
+	if (s3_queue_tail)
+		s3_queue_tail->next = part;
+	else
+		s3_queue_head = part;
+	s3_queue_tail = part;
+
+	pthread_cond_signal(&s3_pool_queued);
+	pthread_mutex_unlock(&s3_pool_lock);
+
+	return true;
+}
+
+static void *
+s3_upload_worker(void *arg)
+{
+	for (;;)
+	{
+		S3Part	   *part;
+		S3Request	req;
+		char	   *query;
+		char	   *upload_id;
+		bool		ok;
+
+		pthread_lock(&s3_pool_lock);
+		while (s3_queue_head == NULL)
+			pthread_cond_wait(&s3_pool_queued, &s3_pool_lock);
+
+		part = s3_queue_head;
+		s3_queue_head = part->next;
+		if (s3_queue_head == NULL)
+			s3_queue_tail = NULL;
+		pthread_mutex_unlock(&s3_pool_lock);
+
+		upload_id = s3_uri_encode(part->file->upload_id, true);
+		query = psprintf("partNumber=%d&uploadId=%s", part->number, upload_id);
+
+		memset(&req, 0, sizeof(req));
+		req.method = "PUT";
+		req.key = part->file->key;
+		req.query = query;
+		req.body = part->data;
+		req.body_len = part->len;
+
+		ok = s3_perform(&req) && s3_response_ok(&req) && req.etag[0] != '\0';
+		if (!ok)
+			elog(WARNING, "Cannot upload part %d of \"%s\", HTTP status %ld",
+				 part->number, part->file->key, req.status);
+
+		pthread_lock(&s3_pool_lock);
+		if (ok)
+			part->file->etags[part->number - 1] = pgut_strdup(req.etag);
+		else
+			part->file->failed = true;
+		part->file->pending--;
+		s3_inflight--;
+		pthread_cond_broadcast(&s3_pool_uploaded);
+		pthread_mutex_unlock(&s3_pool_lock);
+
+		s3_request_free(&req);
+		pfree(query);
+		pfree(upload_id);
+		pfree(part->data);
+		pfree(part);
+	}
+
+	return NULL;
+}
+
+static ssize_t
+s3_cookie_write(void *cookie, const char *buf, size_t size)
+{
+	S3File	   *file = (S3File *) cookie;
+	size_t		done = 0;
+
+	if (file->failed)
+	{
+		errno = EIO;
+		return -1;
+	}
+
+	while (done < size)
+	{
+		size_t		n;
+
+		if (file->wbuf_len == s3_part_size && !s3_queue_part(file))
+			return -1;
+
+		if (file->wbuf_len == file->wbuf_size)
+		{
+			/* once object has grown past the first part, allocate whole parts */
+			file->wbuf_size = file->nparts > 0 ? s3_part_size :
+				Min(Max(file->wbuf_size * 2, S3_WRITE_BUFSIZE), s3_part_size);
+			file->wbuf = pgut_realloc(file->wbuf, file->wbuf_size);
+		}
+
+		n = Min(size - done, file->wbuf_size - file->wbuf_len);
+		memcpy(file->wbuf + file->wbuf_len, buf + done, n);
+		file->wbuf_len += n;
+		done += n;
+	}
+
+	file->pos += size;
+	return size;
+}
+
+static int
+s3_cookie_seek(void *cookie, off64_t *offset, int whence)
+{
+	S3File	   *file = (S3File *) cookie;
+	off_t		pos;
+
+	switch (whence)
+	{
+		case SEEK_SET:
+			pos = *offset;
+			break;
+		case SEEK_CUR:
+			pos = file->pos + *offset;
+			break;
+		case SEEK_END:
+			pos = (file->write ? file->pos : file->size) + *offset;
+			break;
+		default:
+			errno = EINVAL;
+			return -1;
+	}
+
+	/* objects are written sequentially */
+	if (pos < 0 || (file->write && pos != file->pos))
+	{
+		errno = file->write ? ESPIPE : EINVAL;
+		return -1;
+	}
+
+	file->pos = pos;
+	*offset = pos;
+	return 0;
+}
+
+/* Put object by single request */
+static bool
+s3_put_object(S3File *file)
+{
+	S3Request	req;
+	bool		ok;
+
+	memset(&req, 0, sizeof(req));
+	req.method = "PUT";
+	req.key = file->key;
+	req.body = file->wbuf;
+	req.body_len = file->wbuf_len;
+	if (file->exclusive)
+		req.headers = curl_slist_append(NULL, "If-None-Match: *");
+
+	ok = s3_perform(&req) && s3_response_ok(&req);
+	if (!ok)
+		s3_set_errno(&req);
+
+	s3_request_free(&req);
+	return ok;
+}
+
+/* Wait for all parts to be uploaded and complete multipart upload */
+static bool
+s3_complete_upload(S3File *file)
+{
+	S3Request	req;
+	char	   *body;
+	size_t		body_len = 0;
+	char	   *upload_id;
+	char	   *query;
+	bool		ok;
+	int			i;
+
+	if (file->wbuf_len > 0)
+		s3_queue_part(file);
+
+	pthread_lock(&s3_pool_lock);
+	while (file->pending > 0)
+		pthread_cond_wait(&s3_pool_uploaded, &s3_pool_lock);
+	pthread_mutex_unlock(&s3_pool_lock);
+
+	upload_id = s3_uri_encode(file->upload_id, true);
+	query = psprintf("uploadId=%s", upload_id);
+
+	memset(&req, 0, sizeof(req));
+	req.key = file->key;
+	req.query = query;
+
+	if (file->failed)
+	{
+		/* abort upload, so its parts do not occupy space */
+		req.method = "DELETE";
+		s3_perform(&req);
+		s3_request_free(&req);
+		pfree(query);
+		pfree(upload_id);
+		errno = EIO;
+		return false;
+	}
+
+	body = pgut_malloc(file->nparts * (sizeof(((S3Request *) 0)->etag) + 64) + 64);
+	body_len += sprintf(body + body_len, "<CompleteMultipartUpload>");
+	for (i = 0; i < file->nparts; i++)
+		body_len += sprintf(body + body_len,
+							"<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>",
+							i + 1, file->etags[i]);
+	body_len += sprintf(body + body_len, "</CompleteMultipartUpload>");
+
+	req.method = "POST";
+	req.body = body;
+	req.body_len = body_len;
+	if (file->exclusive)
+		req.headers = curl_slist_append(NULL, "If-None-Match: *");
+
+	ok = s3_perform(&req) && s3_response_ok(&req);
+	if (!ok)
+	{
+		elog(WARNING, "Cannot complete multipart upload of \"%s\", HTTP status %ld",
+			 file->key, req.status);
+		s3_set_errno(&req);
+	}
+
+	s3_request_free(&req);
+	pfree(body);
+	pfree(query);
+	pfree(upload_id);
+
+	return ok;
+}
+
+static int
+s3_cookie_close(void *cookie)
+{
+	S3File	   *file = (S3File *) cookie;
+	bool		ok = true;
+	int			i;
+
+	if (file->write)
+	{
+		if (file->upload_id == NULL && !file->failed)
+			ok = s3_put_object(file);
+		else
+			ok = s3_complete_upload(file);
+
+		s3_list_cache_reset();
+	}
+
+	if (file->rbuf)
+		pfree(file->rbuf);
+	if (file->wbuf)
+		pfree(file->wbuf);
+	if (file->upload_id)
+		pfree(file->upload_id);
+	for (i = 0; i < file->nparts; i++)
+	{
+		if (file->etags[i])
+			pfree(file->etags[i]);
+	}
+	if (file->etags)
+		pfree(file->etags);
+	pfree(file->key);
+	pfree(file);
+
+	return ok ? 0 : -1;
+}
+
+#else							/* !WITH_S3 */
+
+void
+s3_init(S3Config *config)
+{
+	elog(ERROR, "This build of pg_probackup does not support object storage, "
+		 "rebuild it with USE_S3=1");
+}
+
+bool
+s3_enabled(void)
+{
+	return false;
+}
+
+FILE *
+s3_fopen(const char *path, const char *mode, bool exclusive)
+{
+	errno = ENOTSUP;
+	return NULL;
+}
+
+int
+s3_stat(const char *path, struct stat *st)
+{
+	errno = ENOTSUP;
+	return -1;
+}
+
+int
+s3_unlink(const char *path)
+{
+	errno = ENOTSUP;
+	return -1;
+}
+
+int
+s3_rename(const char *old_path, const char *new_path)
+{
+	errno = ENOTSUP;
+	return -1;
+}
+
+int
+s3_mkdir(const char *path)
+{
+	errno = ENOTSUP;
+	return -1;
+}
+
+int
+s3_rmdir(const char *path)
+{
+	errno = ENOTSUP;
+	return -1;
+}
+
+parray *
+s3_list_dir(const char *path)
+{
+	errno = ENOTSUP;
+	return NULL;
+}
+
+#endif							/* WITH_S3 */
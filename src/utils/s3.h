@@ -0,0 +1,45 @@
+/*-------------------------------------------------------------------------
+ *
+ * s3.h: S3-compatible object storage for backup catalog.
+ *
+ * Copyright (c) 2020, Postgres Professional
+ *
+ *-------------------------------------------------------------------------
+ */
+
+#ifndef PROBACKUP_S3_H
+#define PROBACKUP_S3_H
+
+#include <stdio.h>
+#include <sys/stat.h>
+
+#include "parray.h"
+
+/* Default size of part of multipart upload, in megabytes */
+#define S3_DEFAULT_PART_SIZE	8
+/* Default number of parts uploaded in parallel */
+#define S3_DEFAULT_UPLOAD_THREADS	4
+
+typedef struct S3Config
+{
+	char	   *endpoint;		/* http[s]://host[:port] */
+	char	   *bucket;
+	char	   *region;
+	char	   *access_key;
+	char	   *secret_key;
+	int			upload_threads;	/* number of parts uploaded in parallel */
+	int			part_size;		/* size of multipart upload part, in MB */
+} S3Config;
+
+extern void s3_init(S3Config *config);
+extern bool s3_enabled(void);
+
+extern FILE *s3_fopen(const char *path, const char *mode, bool exclusive);
+extern int	s3_stat(const char *path, struct stat *st);
+extern int	s3_unlink(const char *path);
+extern int	s3_rename(const char *old_path, const char *new_path);
+extern int	s3_mkdir(const char *path);
+extern int	s3_rmdir(const char *path);
+extern parray *s3_list_dir(const char *path);
+
+#endif   /* PROBACKUP_S3_H */
@@ -12,15 +12,23 @@
 
 #include <sys/stat.h>
 #include <dirent.h>
+#ifndef WIN32
+#include <sys/wait.h>
+#endif
 
 #include "utils/thread.h"
 
 static void *pgBackupValidateFiles(void *arg);
 static void do_validate_instance(void);
+static bool init_instance_validation(const char *name);
+static void validate_instances_parallel(parray *instances, int n_workers);
 
 static bool corrupted_backup_found = false;
 static bool skipped_due_to_lock = false;
 
+/* protects the ledger being built by validation threads */
+static pthread_mutex_t ledger_mutex = PTHREAD_MUTEX_INITIALIZER;
+
 typedef struct
 {
 	const char *base_path;
@@ -33,6 +41,21 @@ typedef struct
 	parray		*dbOid_exclude_list;
 	const char	*external_prefix;
 	HeaderMap   *hdr_map;
+	const char	*root_dir;
+	PackFile	pack;		/* pack file being read */
+
+	/* validation ledger, used if --revalidate-after is set */
+	parray		*ledger;		/* ledger of the previous validation */
+	parray		*new_ledger;	/* ledger being built, shared by threads */
+	time_t		validation_time;
+	int			n_skipped;		/* files skipped due to the ledger */
+
+	/* page sampling, used if --sample is set */
+	uint32		sample_seed;
+	uint32		sample_run;		/* number of previous sampled validations */
+	int64		n_sampled;		/* pages checked */
+	int64		n_pages;		/* pages of sampled files */
+	double		n_covered;		/* pages checked by the current sweep */
 
 	/*
 	 * Return value from the thread.
@@ -57,6 +80,14 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	pthread_t  *threads;
 	validate_files_arg *threads_args;
 	int			i;
+	parray	   *ledger = NULL;
+	parray	   *new_ledger = NULL;
+	int			n_skipped = 0;
+	bool		sampling = sample_percent > 0 || sample_pages > 0;
+	uint32		sample_run = 0;
+	int64		n_sampled = 0;
+	int64		n_pages = 0;
+	double		n_covered = 0;
 //	parray		*dbOid_exclude_list = NULL;
 
 	/* Check backup program version */
@@ -131,6 +162,20 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 //		dbOid_exclude_list = get_dbOid_exclude_list(backup, files, params->partial_db_list,
 //														params->partial_restore_type);
 
+	/*
+	 * With --revalidate-after files, which were successfully validated
+	 * not long ago and have not changed since, are not read again.
+	 */
+	if (revalidate_after > 0)
+	{
+		ledger = read_validation_ledger(backup);
+		new_ledger = parray_new();
+	}
+
+	/* every sampled validation checks the next part of pages */
+	if (sampling)
+		sample_run = read_validation_sample_run(backup);
+
 	/* setup threads */
 	for (i = 0; i < parray_num(files); i++)
 	{
@@ -158,6 +203,17 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 		arg->backup_version = parse_program_version(backup->program_version);
 		arg->external_prefix = external_prefix;
 		arg->hdr_map = &(backup->hdr_map);
+		arg->root_dir = backup->root_dir;
+		init_pack_file(&(arg->pack), NULL, 0);
+		arg->ledger = ledger;
+		arg->new_ledger = new_ledger;
+		arg->validation_time = current_time;
+		arg->n_skipped = 0;
+		arg->sample_seed = (uint32) backup->start_time;
+		arg->sample_run = sample_run;
+		arg->n_sampled = 0;
+		arg->n_pages = 0;
+		arg->n_covered = 0;
 //		arg->dbOid_exclude_list = dbOid_exclude_list;
 		/* By default there are some error */
 		threads_args[i].ret = 1;
@@ -175,6 +231,10 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 			corrupted = true;
 		if (arg->ret == 1)
 			validation_isok = false;
+		n_skipped += arg->n_skipped;
+		n_sampled += arg->n_sampled;
+		n_pages += arg->n_pages;
+		n_covered += arg->n_covered;
 	}
 	if (!validation_isok)
 		elog(ERROR, "Data files validation failed");
@@ -182,11 +242,52 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	pfree(threads);
 	pfree(threads_args);
 
+	/* only successfully validated files get into the ledger */
+	if (new_ledger)
+	{
+		if (n_skipped > 0)
+			elog(INFO, "Backup %s: %i files are not read, they were validated recently",
+				 base36enc(backup->start_time), n_skipped);
+
+		write_validation_ledger(backup, new_ledger);
+
+		parray_walk(new_ledger, ledger_entry_free);
+		parray_free(new_ledger);
+	}
+
+	if (ledger)
+	{
+		parray_walk(ledger, ledger_entry_free);
+		parray_free(ledger);
+	}
+
+	if (sampling)
+	{
+		elog(INFO, "Backup %s: " INT64_FORMAT " of " INT64_FORMAT " data file pages are sampled, "
+			 "current sweep has covered %.f%% of pages",
+			 base36enc(backup->start_time), n_sampled, n_pages,
+			 n_pages > 0 ? n_covered * 100 / n_pages : 100);
+
+		write_validation_sample_run(backup, sample_run + 1);
+	}
+
 	/* cleanup */
 	parray_walk(files, pgFileFree);
 	parray_free(files);
 	cleanup_header_map(&(backup->hdr_map));
 
+	/*
+	 * Sampled validation checks only a part of pages, it can find
+	 * corruption, but it cannot prove that backup is valid.
+	 */
+	if (sampling && !corrupted)
+	{
+		elog(INFO, "Backup %s: no corruption is found in sampled pages, "
+			 "its status %s is kept",
+			 base36enc(backup->start_time), status2str(backup->status));
+		return;
+	}
+
 	/* Update backup status */
 	if (corrupted)
 		backup->status = BACKUP_STATUS_CORRUPT;
@@ -222,6 +323,99 @@ pgBackupValidate(pgBackup *backup, pgRestoreParams *params)
 	}
 }
 
+/*
+ * Has backup passed validation of its files.
+ * Sampled validation keeps DONE status of backup, if it finds no corruption.
+ */
+bool
+backup_is_validated(pgBackup *backup)
+{
+	if (backup->status == BACKUP_STATUS_OK)
+		return true;
+
+	return backup->status == BACKUP_STATUS_DONE &&
+		   (sample_percent > 0 || sample_pages > 0);
+}
+
+/*
+ * Look up backup file in the ledger of the previous validation.
+ * Return its entry, if the file has kept its identity since it was
+ * validated, the entry has not expired yet and the file was checked
+ * at least as thoroughly as it is going to be checked now, otherwise
+ * return NULL.
+ */
+static ledger_entry *
+ledger_lookup_fresh(validate_files_arg *arguments, pgFile *file, struct stat *st)
+{
+	ledger_entry *entry;
+	int64		expire_after = revalidate_after;
+
+	if (!arguments->ledger)
+		return NULL;
+
+	entry = ledger_find_file(arguments->ledger, file);
+	if (!entry)
+		return NULL;
+
+	if (entry->crc != file->crc ||
+		entry->size != st->st_size ||
+		entry->mtime != st->st_mtime ||
+		entry->inode != (uint64) st->st_ino)
+		return NULL;
+
+	/* pages of the file checked by CRC only are still to be checked */
+	if (!entry->blocks_checked && !skip_block_validation)
+		return NULL;
+
+	/*
+	 * Files, validated by the same run, expire at slightly different
+	 * times, so that reading them again is spread over several runs.
+	 */
+	expire_after -= file->path_hash % (revalidate_after / 4 + 1);
+
+	if (arguments->validation_time - entry->validated >= expire_after)
+		return NULL;
+
+	return entry;
+}
+
+/*
+ * Number of sampling partitions of datafile. Every sampled validation
+ * checks one of them, so that the whole file is checked by that many runs.
+ */
+static int
+sample_parts(pgFile *file)
+{
+	if (sample_percent > 0)
+		return (100 + sample_percent - 1) / sample_percent;
+
+	return Max(1, (file->n_headers + sample_pages - 1) / sample_pages);
+}
+
+/*
+ * Add backup file, validated at the given time, to the new ledger.
+ * 'blocks_checked' tells whether the pages were checked, or only CRC.
+ */
+static void
+ledger_add_file(validate_files_arg *arguments, pgFile *file, struct stat *st,
+				time_t validated, bool blocks_checked)
+{
+	ledger_entry *entry = pgut_new(ledger_entry);
+
+	entry->key.rel_path = pgut_strdup(file->rel_path);
+	entry->key.external_dir_num = file->external_dir_num;
+	entry->crc = file->crc;
+	entry->size = st->st_size;
+	entry->mtime = st->st_mtime;
+	entry->inode = (uint64) st->st_ino;
+	entry->validated = validated;
+	entry->blocks_checked = blocks_checked;
+
+	pthread_lock(&ledger_mutex);
+	parray_append(arguments->new_ledger, entry);
+	pthread_mutex_unlock(&ledger_mutex);
+}
+
 /*
  * Validate files in the backup.
  * NOTE: If file is not valid, do not use ERROR log message,
@@ -241,6 +435,7 @@ pgBackupValidateFiles(void *arg)
 		struct stat st;
 		pgFile	   *file = (pgFile *) parray_get(arguments->files, i);
 		char        file_fullpath[MAXPGPATH];
+		ledger_entry *entry;
 
 		if (interrupted || thread_interrupted)
 			elog(ERROR, "Interrupted during validate");
@@ -292,6 +487,50 @@ pgBackupValidateFiles(void *arg)
 		if (file->write_size == 0)
 			continue;
 
+		/* packed file is checked against its range in pack file */
+		if (file->pack_num > 0)
+		{
+			bool		pack_is_stated = false;
+
+			/* identity of packed file is identity of its pack file */
+			if (arguments->new_ledger)
+			{
+				char		pack_name[MAXPGPATH];
+
+				snprintf(pack_name, MAXPGPATH, "%s_%d", PACK_FILE, file->pack_num);
+				join_path_components(file_fullpath, arguments->root_dir, pack_name);
+
+				pack_is_stated = fio_stat(file_fullpath, &st, true, FIO_BACKUP_HOST) == 0;
+
+				if (pack_is_stated &&
+					(entry = ledger_lookup_fresh(arguments, file, &st)) != NULL)
+				{
+					ledger_add_file(arguments, file, &st, entry->validated,
+									entry->blocks_checked);
+					arguments->n_skipped++;
+					continue;
+				}
+			}
+
+			if (!get_packed_file_crc(&(arguments->pack), arguments->root_dir,
+									 file, &crc))
+			{
+				arguments->corrupted = true;
+				break;
+			}
+
+			if (crc != file->crc)
+			{
+				elog(WARNING, "Invalid CRC of packed backup file \"%s\" : %X. Expected %X",
+						file->rel_path, crc, file->crc);
+				arguments->corrupted = true;
+			}
+			else if (pack_is_stated && !arguments->corrupted)
+				ledger_add_file(arguments, file, &st, arguments->validation_time,
+								!skip_block_validation);
+			continue;
+		}
+
 		if (file->external_dir_num)
 		{
 			char temp[MAXPGPATH];
@@ -303,7 +542,7 @@ pgBackupValidateFiles(void *arg)
 			join_path_components(file_fullpath, arguments->base_path, file->rel_path);
 
 		/* TODO: it is redundant to check file existence using stat */
-		if (stat(file_fullpath, &st) == -1)
+		if (fio_stat(file_fullpath, &st, true, FIO_BACKUP_HOST) == -1)
 		{
 			if (errno == ENOENT)
 				elog(WARNING, "Backup file \"%s\" is not found", file_fullpath);
@@ -322,6 +561,15 @@ pgBackupValidateFiles(void *arg)
 			break;
 		}
 
+		if (arguments->new_ledger &&
+			(entry = ledger_lookup_fresh(arguments, file, &st)) != NULL)
+		{
+			ledger_add_file(arguments, file, &st, entry->validated,
+							entry->blocks_checked);
+			arguments->n_skipped++;
+			continue;
+		}
+
 		/*
 		 * If option skip-block-validation is set, compute only file-level CRC for
 		 * datafiles, otherwise check them block by block.
@@ -359,6 +607,41 @@ pgBackupValidateFiles(void *arg)
 				arguments->corrupted = true;
 			}
 		}
+		/*
+		 * In fast mode check only the layout of page records and
+		 * CRC of the file, pages are not decompressed.
+		 */
+		else if (fast_validation)
+		{
+			if (!validate_file_structure(file, file_fullpath,
+										 arguments->backup_version,
+										 arguments->hdr_map))
+				arguments->corrupted = true;
+		}
+		/*
+		 * In sampling mode check only a part of pages, located using
+		 * page header map. Older backups have no map and are checked fully.
+		 */
+		else if ((sample_percent > 0 || sample_pages > 0) &&
+				 arguments->backup_version >= 20400 && file->n_headers > 0)
+		{
+			int			parts = sample_parts(file);
+			int			part = arguments->sample_run % parts;
+			int			n_checked = 0;
+
+			if (!validate_file_pages_sample(file, file_fullpath,
+											arguments->stop_lsn,
+											arguments->checksum_version,
+											arguments->backup_version,
+											arguments->hdr_map,
+											arguments->sample_seed,
+											parts, part, &n_checked))
+				arguments->corrupted = true;
+
+			arguments->n_sampled += n_checked;
+			arguments->n_pages += file->n_headers;
+			arguments->n_covered += (double) file->n_headers * (part + 1) / parts;
+		}
 		else
 		{
 			/*
@@ -372,8 +655,15 @@ pgBackupValidateFiles(void *arg)
 								  arguments->hdr_map))
 				arguments->corrupted = true;
 		}
+
+		/* files validated after corruption was found are read again next time */
+		if (arguments->new_ledger && !arguments->corrupted)
+			ledger_add_file(arguments, file, &st, arguments->validation_time,
+							!skip_block_validation);
 	}
 
+	cleanup_pack_file(&(arguments->pack));
+
 	/* Data files validation is successful */
 	arguments->ret = 0;
 
@@ -396,17 +686,19 @@ do_validate_all(void)
 		char		path[MAXPGPATH];
 		DIR		   *dir;
 		struct dirent *dent;
+		parray	   *instances = parray_new();
+		int			n_workers;
+		int			i;
 
 		/* open directory and list contents */
 		join_path_components(path, backup_path, BACKUPS_DIR);
-		dir = opendir(path);
+		dir = fio_opendir(path, FIO_BACKUP_HOST);
 		if (dir == NULL)
 			elog(ERROR, "cannot open directory \"%s\": %s", path, strerror(errno));
 
 		errno = 0;
-		while ((dent = readdir(dir)))
+		while ((dent = fio_readdir(dir)))
 		{
-			char		conf_path[MAXPGPATH];
 			char		child[MAXPGPATH];
 			struct stat	st;
 
@@ -417,31 +709,43 @@ do_validate_all(void)
 
 			join_path_components(child, path, dent->d_name);
 
-			if (lstat(child, &st) == -1)
+			if (fio_stat(child, &st, false, FIO_BACKUP_HOST) == -1)
 				elog(ERROR, "cannot stat file \"%s\": %s", child, strerror(errno));
 
 			if (!S_ISDIR(st.st_mode))
 				continue;
 
-			/*
-			 * Initialize instance configuration.
-			 */
-			instance_name = dent->d_name;
-			sprintf(backup_instance_path, "%s/%s/%s",
-					backup_path, BACKUPS_DIR, instance_name);
-			sprintf(arclog_path, "%s/%s/%s", backup_path, "wal", instance_name);
-			join_path_components(conf_path, backup_instance_path,
-								 BACKUP_CATALOG_CONF_FILE);
-			if (config_read_opt(conf_path, instance_options, ERROR, false,
-								true) == 0)
+			parray_append(instances, pgut_strdup(dent->d_name));
+		}
+		fio_closedir(dir);
+
+		/*
+		 * Threads are shared between instances first, remaining
+		 * threads are used to validate files of every instance.
+		 */
+		n_workers = Min(num_threads, parray_num(instances));
+
+#ifndef WIN32
+		/*
+		 * Connection to object storage, used to list the catalog, is kept
+		 * alive and would be shared by forked workers, so instances
+		 * in object storage are validated one by one.
+		 */
+		if (n_workers > 1 && !fio_is_storage(FIO_BACKUP_HOST))
+			validate_instances_parallel(instances, n_workers);
+		else
+#endif
+		{
+			for (i = 0; i < parray_num(instances); i++)
 			{
-				elog(WARNING, "Configuration file \"%s\" is empty", conf_path);
-				corrupted_backup_found = true;
-				continue;
+				if (init_instance_validation((char *) parray_get(instances, i)))
+					do_validate_instance();
 			}
-
-			do_validate_instance();
 		}
+
+		parray_walk(instances, pfree);
+		parray_free(instances);
+		instance_name = NULL;
 	}
 	else
 	{
@@ -471,22 +775,487 @@ do_validate_all(void)
 	return 0;
 }
 
+/*
+ * Initialize instance configuration before validation of all its backups.
+ * Returns false if the instance cannot be validated.
+ */
+static bool
+init_instance_validation(const char *name)
+{
+	char		conf_path[MAXPGPATH];
+
+	instance_name = (char *) name;
+	sprintf(backup_instance_path, "%s/%s/%s",
+			backup_path, BACKUPS_DIR, instance_name);
+	sprintf(arclog_path, "%s/%s/%s", backup_path, "wal", instance_name);
+	join_path_components(conf_path, backup_instance_path,
+						 BACKUP_CATALOG_CONF_FILE);
+	if (config_read_opt(conf_path, instance_options, ERROR, false,
+						true) == 0)
+	{
+		elog(WARNING, "Configuration file \"%s\" is empty", conf_path);
+		corrupted_backup_found = true;
+		return false;
+	}
+
+	return true;
+}
+
+#ifndef WIN32
+
+/*
+ * Exit code of the instance validation worker, which validated all
+ * backups of the instance. Any other exit code means that the worker
+ * has failed.
+ */
+#define VALIDATE_WORKER_DONE		16
+#define VALIDATE_WORKER_CORRUPTED	1
+#define VALIDATE_WORKER_SKIPPED		2
+
+typedef struct
+{
+	char	   *name;
+	pid_t		pid;
+	FILE	   *out;			/* captured console output of the worker */
+	int			status;
+	bool		finished;
+} InstanceValidation;
+
+/*
+ * Validate the instance in the child process. Instance configuration is
+ * kept in global variables, so instances cannot share one process.
+ */
+static void
+start_instance_validation(InstanceValidation *task, int threads)
+{
+	task->out = tmpfile();
+	if (task->out == NULL)
+		elog(ERROR, "Cannot create temporary file: %s", strerror(errno));
+
+	/* do not let the child write out buffered data of the parent */
+	fflush(stdout);
+	fflush(stderr);
+
+	task->pid = fork();
+	if (task->pid < 0)
+		elog(ERROR, "Cannot fork validation of instance '%s': %s",
+			 task->name, strerror(errno));
+
+	if (task->pid == 0)
+	{
+		int			status = VALIDATE_WORKER_DONE;
+
+		if (dup2(fileno(task->out), STDERR_FILENO) < 0)
+			elog(ERROR, "Cannot redirect output of validation of instance '%s': %s",
+				 task->name, strerror(errno));
+
+		num_threads = threads;
+
+		if (init_instance_validation(task->name))
+			do_validate_instance();
+
+		if (corrupted_backup_found)
+			status |= VALIDATE_WORKER_CORRUPTED;
+		if (skipped_due_to_lock)
+			status |= VALIDATE_WORKER_SKIPPED;
+
+		exit(status);
+	}
+}
+
+/*
+ * Copy captured output of the worker to console.
+ */
+static void
+replay_instance_validation(InstanceValidation *task)
+{
+	char		buf[STDIO_BUFSIZE];
+	size_t		read_len;
+
+	rewind(task->out);
+	while ((read_len = fread(buf, 1, sizeof(buf), task->out)) > 0)
+		fwrite(buf, 1, read_len, stderr);
+	fflush(stderr);
+
+	fclose(task->out);
+	task->out = NULL;
+}
+
+/*
+ * Validate instances concurrently, at most n_workers at a time.
+ * Output of every instance is printed as a whole and in the order of
+ * instances, as soon as all preceding instances are finished. Result is
+ * the same as if instances were validated one after another: first failed
+ * instance stops validation with an error, once running workers are done.
+ */
+static void
+validate_instances_parallel(parray *instances, int n_workers)
+{
+	int			n_instances = parray_num(instances);
+	InstanceValidation *tasks;
+	int			n_started = 0;
+	int			n_running = 0;
+	int			n_replayed = 0;
+	int			threads = Max(num_threads / n_workers, 1);
+	char	   *failed_instance = NULL;
+	int			i;
+
+	elog(INFO, "Validate %i instances using %i workers with %i threads each",
+		 n_instances, n_workers, threads);
+
+	tasks = pgut_newarray(InstanceValidation, n_instances);
+	for (i = 0; i < n_instances; i++)
+	{
+		tasks[i].name = (char *) parray_get(instances, i);
+		tasks[i].pid = 0;
+		tasks[i].out = NULL;
+		tasks[i].status = 0;
+		tasks[i].finished = false;
+	}
+
+	while (n_replayed < n_instances)
+	{
+		pid_t		pid;
+		int			status;
+
+		/* Fill free worker slots, unless some instance has failed */
+		while (!failed_instance && !interrupted &&
+			   n_running < n_workers && n_started < n_instances)
+		{
+			start_instance_validation(&tasks[n_started], threads);
+			n_started++;
+			n_running++;
+		}
+
+		/* Print results in the order of instances */
+		while (!failed_instance && n_replayed < n_started &&
+			   tasks[n_replayed].finished)
+		{
+			InstanceValidation *task = &tasks[n_replayed];
+
+			replay_instance_validation(task);
+
+			if (WIFEXITED(task->status) &&
+				WEXITSTATUS(task->status) >= VALIDATE_WORKER_DONE)
+			{
+				if (WEXITSTATUS(task->status) & VALIDATE_WORKER_CORRUPTED)
+					corrupted_backup_found = true;
+				if (WEXITSTATUS(task->status) & VALIDATE_WORKER_SKIPPED)
+					skipped_due_to_lock = true;
+			}
+			else
+				failed_instance = task->name;
+
+			n_replayed++;
+		}
+
+		if (n_running == 0)
+			break;
+
+		pid = waitpid(-1, &status, 0);
+		if (pid < 0)
+		{
+			if (errno == EINTR)
+				continue;
+			elog(ERROR, "Cannot wait for validation workers: %s", strerror(errno));
+		}
+
+		for (i = 0; i < n_started; i++)
+		{
+			if (tasks[i].pid == pid && !tasks[i].finished)
+			{
+				tasks[i].status = status;
+				tasks[i].finished = true;
+				n_running--;
+				break;
+			}
+		}
+	}
+
+	/* Output of instances after the failed one is discarded */
+	for (i = n_replayed; i < n_started; i++)
+	{
+		if (tasks[i].out)
+			fclose(tasks[i].out);
+	}
+	pg_free(tasks);
+
+	if (interrupted)
+		elog(ERROR, "Interrupted during validation");
+
+	if (failed_instance)
+		elog(ERROR, "Validation of instance '%s' failed", failed_instance);
+}
+
+#endif
+
+/*
+ * Backup DAG of the instance, built once per validation run.
+ * Backups are in the catalog order of descending start time.
+ */
+typedef struct
+{
+	parray	   *backups;
+	pgBackup  **index;			/* backups, for lookup by start time */
+	parray	  **children;		/* direct descendants of every backup */
+	bool	   *validated;		/* backup is validated by this run */
+	parray	   *wal_ranges;		/* archived WAL validated by this run */
+} ValidationPlan;
+
+/* Range of archived WAL, validated by a backup of this run */
+typedef struct
+{
+	pgBackup   *backup;
+	TimeLineID	tli;
+	XLogRecPtr	start_lsn;
+	XLogRecPtr	stop_lsn;
+} ValidatedWalRange;
+
+static int
+plan_backup_index(ValidationPlan *plan, pgBackup *backup)
+{
+	pgBackup  **res;
+
+	res = (pgBackup **) bsearch(&backup, plan->index, parray_num(plan->backups),
+								sizeof(pgBackup *), pgBackupCompareIdDesc);
+	if (!res)
+		elog(ERROR, "Backup %s is not found in the catalog",
+			 base36enc(backup->start_time));
+
+	return res - plan->index;
+}
+
+static void
+plan_build(ValidationPlan *plan, parray *backups)
+{
+	int			n = parray_num(backups);
+	int			i;
+
+	plan->backups = backups;
+	plan->index = pgut_newarray(pgBackup *, Max(n, 1));
+	plan->children = pgut_newarray(parray *, Max(n, 1));
+	plan->validated = pgut_newarray(bool, Max(n, 1));
+	plan->wal_ranges = parray_new();
+
+	for (i = 0; i < n; i++)
+	{
+		plan->index[i] = (pgBackup *) parray_get(backups, i);
+		plan->children[i] = NULL;
+		plan->validated[i] = false;
+	}
+
+	/* walk from the oldest, so that children are ordered by start time */
+	for (i = n - 1; i >= 0; i--)
+	{
+		pgBackup   *backup = (pgBackup *) parray_get(backups, i);
+		int			parent_idx;
+
+		if (!backup->parent_backup_link)
+			continue;
+
+		parent_idx = plan_backup_index(plan, backup->parent_backup_link);
+
+		if (!plan->children[parent_idx])
+			plan->children[parent_idx] = parray_new();
+		parray_append(plan->children[parent_idx], backup);
+	}
+}
+
+static void
+plan_free(ValidationPlan *plan)
+{
+	int			i;
+
+	for (i = 0; i < parray_num(plan->backups); i++)
+	{
+		if (plan->children[i])
+			parray_free(plan->children[i]);
+	}
+
+	parray_walk(plan->wal_ranges, pfree);
+	parray_free(plan->wal_ranges);
+	pg_free(plan->index);
+	pg_free(plan->children);
+	pg_free(plan->validated);
+}
+
+/*
+ * Validate WAL of the backup. Archived WAL, which was already validated
+ * by another backup of this run, is not read again.
+ */
+static void
+plan_validate_wal(ValidationPlan *plan, pgBackup *backup)
+{
+	ValidatedWalRange *range;
+	int			i;
+
+	if (!backup->stream)
+	{
+		for (i = 0; i < parray_num(plan->wal_ranges); i++)
+		{
+			range = (ValidatedWalRange *) parray_get(plan->wal_ranges, i);
+
+			if (range->tli == backup->tli &&
+				range->start_lsn <= backup->start_lsn &&
+				range->stop_lsn >= backup->stop_lsn)
+			{
+				elog(INFO, "Backup %s WAL segments are valid, they are validated with backup %s",
+					 base36enc(backup->start_time),
+					 base36enc(range->backup->start_time));
+				return;
+			}
+		}
+	}
+
+	validate_wal(backup, arclog_path, 0,
+				 0, 0, backup->tli,
+				 instance_config.xlog_seg_size);
+
+	if (!backup->stream && backup_is_validated(backup))
+	{
+		range = pgut_new(ValidatedWalRange);
+		range->backup = backup;
+		range->tli = backup->tli;
+		range->start_lsn = backup->start_lsn;
+		range->stop_lsn = backup->stop_lsn;
+		parray_append(plan->wal_ranges, range);
+	}
+}
+
+/*
+ * Validate files and WAL of the backup, unless it is already
+ * validated by this run. Backup must be locked by the caller.
+ */
+static void
+plan_validate_backup(ValidationPlan *plan, pgBackup *backup)
+{
+	int			idx = plan_backup_index(plan, backup);
+
+	if (plan->validated[idx])
+		return;
+	plan->validated[idx] = true;
+
+	/* Valiate backup files*/
+	pgBackupValidate(backup, NULL);
+
+	/* Validate corresponding WAL files */
+	if (backup_is_validated(backup))
+		plan_validate_wal(plan, backup);
+}
+
+/*
+ * Mark every OK descendant of invalid backup as orphan.
+ */
+static void
+plan_orphan_descendants(ValidationPlan *plan, pgBackup *backup,
+						pgBackup *invalid_backup, const char *invalid_backup_id)
+{
+	parray	   *children = plan->children[plan_backup_index(plan, backup)];
+	int			i;
+
+	if (!children)
+		return;
+
+	for (i = 0; i < parray_num(children); i++)
+	{
+		pgBackup   *child = (pgBackup *) parray_get(children, i);
+
+		if (child->status == BACKUP_STATUS_OK ||
+			child->status == BACKUP_STATUS_DONE)
+		{
+			write_backup_status(child, BACKUP_STATUS_ORPHAN, instance_name, true);
+
+			elog(WARNING, "Backup %s is orphaned because his parent %s has status: %s",
+				 base36enc(child->start_time),
+				 invalid_backup_id,
+				 status2str(invalid_backup->status));
+		}
+
+		plan_orphan_descendants(plan, child, invalid_backup, invalid_backup_id);
+	}
+}
+
+/*
+ * Try to revalidate ORPHAN descendants of valid backup.
+ * Parents are visited before their children, so revalidated
+ * backup makes its own orphans eligible for revalidation.
+ */
+static void
+plan_revalidate_descendants(ValidationPlan *plan, pgBackup *backup)
+{
+	parray	   *children = plan->children[plan_backup_index(plan, backup)];
+	int			i;
+
+	if (!children)
+		return;
+
+	for (i = 0; i < parray_num(children); i++)
+	{
+		pgBackup   *child = (pgBackup *) parray_get(children, i);
+		pgBackup   *tmp_backup = NULL;
+		int			result;
+
+		//PAGE_b2 ORPHAN
+		//PAGE_b1 ORPHAN          -----
+		//PAGE_a5 ORPHAN 			 |
+		//PAGE_a4 CORRUPT 			 |
+		//PAGE_a3 missing			 |
+		//PAGE_a2 missing			 |
+		//PAGE_a1 ORPHAN 			 |
+		//PAGE    OK <- we are here<-|
+		//FULL OK
+
+		/* Revalidation make sense only if parent chain is whole */
+		result = scan_parent_chain(child, &tmp_backup);
+
+		/* revalidation make sense only if oldest invalid backup is the child */
+		if (result == ChainIsInvalid && tmp_backup->start_time == child->start_time)
+		{
+			if (child->status == BACKUP_STATUS_ORPHAN)
+			{
+				/* Do not interrupt, validate the next backup */
+				if (!lock_backup(child, true))
+				{
+					elog(WARNING, "Cannot lock backup %s directory, skip validation",
+						 base36enc(child->start_time));
+					skipped_due_to_lock = true;
+					continue;
+				}
+				/* Revalidate backup files and WAL */
+				plan_validate_backup(plan, child);
+			}
+
+			if (!backup_is_validated(child))
+			{
+				corrupted_backup_found = true;
+				continue;
+			}
+		}
+
+		plan_revalidate_descendants(plan, child);
+	}
+}
+
 /*
  * Validate all backups in the given instance of the backup catalog.
+ * Backup DAG is built once, so that every backup is validated at most
+ * once per run and statuses are propagated along its descendants.
  */
 static void
 do_validate_instance(void)
 {
 	int			i;
-	int			j;
 	parray	   *backups;
 	pgBackup   *current_backup = NULL;
+	ValidationPlan plan;
 
 	elog(INFO, "Validate backups of the instance '%s'", instance_name);
 
 	/* Get list of all backups sorted in order of descending start time */
 	backups = catalog_get_backup_list(instance_name, INVALID_BACKUP_ID);
 
+	plan_build(&plan, backups);
+
 	/* Examine backups one by one and validate them */
 	for (i = 0; i < parray_num(backups); i++)
 	{
@@ -569,6 +1338,18 @@ do_validate_instance(void)
 		else
 			base_full_backup = current_backup;
 
+		/* Data of backup written to standard output is not in catalog */
+		if (!backup_container_is_available(current_backup))
+		{
+			elog(WARNING, "Backup %s is written to standard output, skip validation",
+				 base36enc(current_backup->start_time));
+			continue;
+		}
+
+		/* Already validated as descendant of revalidated backup */
+		if (plan.validated[i])
+			continue;
+
 		/* Do not interrupt, validate the next backup */
 		if (!lock_backup(current_backup, true))
 		{
@@ -577,19 +1358,13 @@ do_validate_instance(void)
 			skipped_due_to_lock = true;
 			continue;
 		}
-		/* Valiate backup files*/
-		pgBackupValidate(current_backup, NULL);
 
-		/* Validate corresponding WAL files */
-		if (current_backup->status == BACKUP_STATUS_OK)
-			validate_wal(current_backup, arclog_path, 0,
-						 0, 0, current_backup->tli,
-						 instance_config.xlog_seg_size);
+		plan_validate_backup(&plan, current_backup);
 
 		/*
 		 * Mark every descendant of corrupted backup as orphan
 		 */
-		if (current_backup->status != BACKUP_STATUS_OK)
+		if (!backup_is_validated(current_backup))
 		{
 			char	   *current_backup_id;
 			/* This is ridiculous but legal.
@@ -603,100 +1378,18 @@ do_validate_instance(void)
 			corrupted_backup_found = true;
 			current_backup_id = base36enc_dup(current_backup->start_time);
 
-			for (j = i - 1; j >= 0; j--)
-			{
-				pgBackup   *backup = (pgBackup *) parray_get(backups, j);
-
-				if (is_parent(current_backup->start_time, backup, false))
-				{
-					if (backup->status == BACKUP_STATUS_OK ||
-						backup->status == BACKUP_STATUS_DONE)
-					{
-						write_backup_status(backup, BACKUP_STATUS_ORPHAN, instance_name, true);
-
-						elog(WARNING, "Backup %s is orphaned because his parent %s has status: %s",
-							 base36enc(backup->start_time),
-							 current_backup_id,
-							 status2str(current_backup->status));
-					}
-				}
-			}
+			plan_orphan_descendants(&plan, current_backup, current_backup,
+									current_backup_id);
 			free(current_backup_id);
 		}
 
 		/* For every OK backup we try to revalidate all his ORPHAN descendants. */
-		if (current_backup->status == BACKUP_STATUS_OK)
-		{
-			/* revalidate all ORPHAN descendants
-			 * be very careful not to miss a missing backup
-			 * for every backup we must check that he is descendant of current_backup
-			 */
-			for (j = i - 1; j >= 0; j--)
-			{
-				pgBackup   *backup = (pgBackup *) parray_get(backups, j);
-				pgBackup   *tmp_backup = NULL;
-				int result;
-
-				//PAGE_b2 ORPHAN
-				//PAGE_b1 ORPHAN          -----
-				//PAGE_a5 ORPHAN 			 |
-				//PAGE_a4 CORRUPT 			 |
-				//PAGE_a3 missing			 |
-				//PAGE_a2 missing			 |
-				//PAGE_a1 ORPHAN 			 |
-				//PAGE    OK <- we are here<-|
-				//FULL OK
-
-				if (is_parent(current_backup->start_time, backup, false))
-				{
-					/* Revalidation make sense only if parent chain is whole.
-					 * is_parent() do not guarantee that.
-					 */
-					result = scan_parent_chain(backup, &tmp_backup);
-
-					if (result == ChainIsInvalid)
-					{
-						/* revalidation make sense only if oldest invalid backup is current_backup
-						 */
-
-						if (tmp_backup->start_time != backup->start_time)
-							continue;
-
-						if (backup->status == BACKUP_STATUS_ORPHAN)
-						{
-							/* Do not interrupt, validate the next backup */
-							if (!lock_backup(backup, true))
-							{
-								elog(WARNING, "Cannot lock backup %s directory, skip validation",
-									 base36enc(backup->start_time));
-								skipped_due_to_lock = true;
-								continue;
-							}
-							/* Revalidate backup files*/
-							pgBackupValidate(backup, NULL);
-
-							if (backup->status == BACKUP_STATUS_OK)
-							{
-
-								/* Revalidation successful, validate corresponding WAL files */
-								validate_wal(backup, arclog_path, 0,
-											 0, 0, backup->tli,
-											 instance_config.xlog_seg_size);
-							}
-						}
-
-						if (backup->status != BACKUP_STATUS_OK)
-						{
-							corrupted_backup_found = true;
-							continue;
-						}
-					}
-				}
-			}
-		}
+		if (backup_is_validated(current_backup))
+			plan_revalidate_descendants(&plan, current_backup);
 	}
 
 	/* cleanup */
+	plan_free(&plan);
 	parray_walk(backups, pgBackupFree);
 	parray_free(backups);
 }
@@ -3,6 +3,7 @@ import os
 from time import sleep
 from .helpers.ptrack_helpers import ProbackupTest, ProbackupException
 import shutil
+import subprocess
 from distutils.dir_util import copy_tree
 from testgres import ProcessType
 
@@ -2898,3 +2899,518 @@ class BackupTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_resume_interrupted_backup(self):
+        """
+        Check that interrupted backup can be resumed,
+        reusing files copied before interruption
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        # FULL backup, killed in the middle
+        gdb = self.backup_node(
+            backup_dir, 'node', node, gdb=True,
+            options=['--stream', '--compress'])
+
+        gdb.set_breakpoint('backup_data_file')
+        gdb.run_until_break()
+
+        gdb.continue_execution_until_break(20)
+
+        gdb._execute('signal SIGKILL')
+        gdb._execute('detach')
+        sleep(1)
+
+        backup_id = self.show_pb(backup_dir, 'node')[0]['id']
+
+        pgbench = node.pgbench(options=['-t', '1000', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        resumed_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress', '--resume',
+                     '--log-level-file=VERBOSE'])
+
+        self.assertEqual(backup_id, resumed_id)
+        self.assertEqual(
+            'OK', self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+        logfile = os.path.join(backup_dir, 'log', 'pg_probackup.log')
+        with open(logfile, 'r') as f:
+            logfile_content = f.read()
+
+        self.assertIn('is going to be resumed', logfile_content)
+        self.assertIn('is reused from interrupted backup', logfile_content)
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_resume_backup_dropped_table(self):
+        """
+        Check that files deleted from PGDATA after backup was
+        interrupted are removed from resumed backup
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        node.safe_psql(
+            "postgres",
+            "create table t_heap as select i as id "
+            "from generate_series(0,100000) i")
+
+        relpath = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('t_heap')").decode('utf-8').rstrip()
+
+        # FULL backup, killed in the middle
+        gdb = self.backup_node(
+            backup_dir, 'node', node, gdb=True, options=['--stream'])
+
+        gdb.set_breakpoint('backup_data_file')
+        gdb.run_until_break()
+
+        gdb.continue_execution_until_break(20)
+
+        gdb._execute('signal SIGKILL')
+        gdb._execute('detach')
+        sleep(1)
+
+        backup_id = self.show_pb(backup_dir, 'node')[0]['id']
+
+        node.safe_psql("postgres", "drop table t_heap")
+        node.safe_psql("postgres", "checkpoint")
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '--resume'])
+
+        self.assertEqual(
+            'OK', self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+        self.assertFalse(
+            os.path.exists(os.path.join(
+                backup_dir, 'backups', 'node', backup_id,
+                'database', relpath)),
+            'File of dropped table is kept in resumed backup')
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_object_storage(self):
+        """
+        Keep backup catalog in S3-compatible object storage:
+        archive WAL, take FULL and DELTA backups, validate
+        and restore them
+        """
+        if 'PGPROBACKUP_S3_ENDPOINT' not in os.environ or \
+                'PGPROBACKUP_S3_BUCKET' not in os.environ:
+            return unittest.skip(
+                'Skipped because PGPROBACKUP_S3_ENDPOINT and '
+                'PGPROBACKUP_S3_BUCKET are not set')
+
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        log_dir = os.path.join(self.tmp_path, module_name, fname, 'log')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        s3_options = [
+            '--storage=s3',
+            '--s3-endpoint={0}'.format(os.environ['PGPROBACKUP_S3_ENDPOINT']),
+            '--s3-bucket={0}'.format(os.environ['PGPROBACKUP_S3_BUCKET']),
+            '--s3-part-size=5',
+            '--log-directory={0}'.format(log_dir)]
+
+        self.init_pb(backup_dir, options=s3_options)
+        self.add_instance(backup_dir, 'node', node, options=s3_options)
+        self.set_auto_conf(
+            node,
+            {
+                'archive_mode': 'on',
+                'archive_command': '"{0}" archive-push -B {1} --instance=node '
+                '{2} --wal-file-path=%p --wal-file-name=%f'.format(
+                    self.probackup_path, backup_dir, ' '.join(s3_options))
+            })
+        node.slow_start()
+
+        node.pgbench_init(scale=10)
+
+        self.backup_node(
+            backup_dir, 'node', node, options=s3_options + ['--compress'])
+
+        pgbench = node.pgbench(options=['-t', '1000', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        delta_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=s3_options + ['--compress'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.validate_pb(backup_dir, 'node', options=s3_options)
+
+        # objects are not allowed to be streamed into
+        try:
+            self.backup_node(
+                backup_dir, 'node', node, options=s3_options + ['--stream'])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because --stream is not supported "
+                "for object storage.\n Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'ERROR: Option --stream is not supported for backup catalog '
+                'in object storage', e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        node.cleanup()
+        self.restore_node(
+            backup_dir, 'node', node, backup_id=delta_id, options=s3_options)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.run_pb(
+            ['del-instance', '-B', backup_dir, '--instance=node'] + s3_options)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_object_storage_rename(self):
+        """
+        Control file of backup in S3-compatible object storage
+        is rewritten via temporary object, which is renamed
+        by server side copy
+        """
+        if 'PGPROBACKUP_S3_ENDPOINT' not in os.environ or \
+                'PGPROBACKUP_S3_BUCKET' not in os.environ:
+            return unittest.skip(
+                'Skipped because PGPROBACKUP_S3_ENDPOINT and '
+                'PGPROBACKUP_S3_BUCKET are not set')
+
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        log_dir = os.path.join(self.tmp_path, module_name, fname, 'log')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        s3_options = [
+            '--storage=s3',
+            '--s3-endpoint={0}'.format(os.environ['PGPROBACKUP_S3_ENDPOINT']),
+            '--s3-bucket={0}'.format(os.environ['PGPROBACKUP_S3_BUCKET']),
+            '--log-directory={0}'.format(log_dir)]
+
+        self.init_pb(backup_dir, options=s3_options)
+        self.add_instance(backup_dir, 'node', node, options=s3_options)
+        self.set_auto_conf(
+            node,
+            {
+                'archive_mode': 'on',
+                'archive_command': '"{0}" archive-push -B {1} --instance=node '
+                '{2} --wal-file-path=%p --wal-file-name=%f'.format(
+                    self.probackup_path, backup_dir, ' '.join(s3_options))
+            })
+        node.slow_start()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, options=s3_options)
+
+        self.set_backup(
+            backup_dir, 'node', backup_id,
+            options=s3_options + ['--note=renamed'])
+
+        backup_meta = self.show_pb(
+            backup_dir, 'node', backup_id, options=s3_options)
+        self.assertEqual(backup_meta['note'], 'renamed')
+        self.assertEqual(backup_meta['status'], 'OK')
+
+        self.run_pb(
+            ['del-instance', '-B', backup_dir, '--instance=node'] + s3_options)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_output_container(self):
+        """
+        Write backups into single-stream containers, both into
+        a file and to standard output, then restore from them
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        full_container = os.path.join(
+            self.tmp_path, module_name, fname, 'full.pbc')
+        full_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--output={0}'.format(full_container)])
+
+        self.assertTrue(os.path.isfile(full_container))
+        self.assertFalse(
+            os.path.exists(os.path.join(
+                backup_dir, 'backups', 'node', full_id, 'database')))
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2'])
+        pgbench.wait()
+
+        # DELTA backup written to standard output
+        delta_container = os.path.join(
+            self.tmp_path, module_name, fname, 'delta.pbc')
+        with open(delta_container, 'wb') as f:
+            subprocess.check_call(
+                [self.probackup_path, 'backup', '-B', backup_dir,
+                 '--instance=node', '-b', 'delta', '-p', str(node.port),
+                 '-d', 'postgres', '--no-sync', '--output=-'],
+                stdout=f, env=self.test_env)
+
+        delta_id = self.show_pb(backup_dir, 'node')[1]['id']
+        self.assertEqual(
+            'DONE', self.show_pb(backup_dir, 'node', delta_id)['status'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+        node.cleanup()
+
+        try:
+            self.restore_node(backup_dir, 'node', node, backup_id=delta_id)
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because container is not provided.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'its container must be provided with --input option',
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        # restore reading container from standard input
+        with open(delta_container, 'rb') as f:
+            subprocess.check_call(
+                [self.probackup_path, 'restore', '-B', backup_dir,
+                 '--instance=node', '-i', delta_id, '-D', node.data_dir,
+                 '--input=-'],
+                stdin=f, env=self.test_env)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # unpacked files must be removed after restore
+        self.assertFalse(
+            os.path.exists(os.path.join(
+                backup_dir, 'backups', 'node', delta_id, 'database')))
+
+        # restore reading container file in place
+        node.cleanup()
+        self.restore_node(
+            backup_dir, 'node', node, backup_id=delta_id,
+            options=['--input={0}'.format(delta_container)])
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # deleting the backup removes its container
+        self.delete_pb(backup_dir, 'node', backup_id=full_id)
+        self.assertFalse(os.path.exists(full_container))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_pack_small_files(self):
+        """
+        Small non-data files are packed into pack files,
+        restore and validate must read them from there
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        full_id = self.backup_node(
+            backup_dir, 'node', node, options=['--pack-small-files'])
+
+        backup_root = os.path.join(backup_dir, 'backups', 'node', full_id)
+        self.assertTrue(os.path.isfile(os.path.join(backup_root, 'pack_1')))
+        self.assertFalse(
+            os.path.exists(os.path.join(
+                backup_root, 'database', 'postgresql.auto.conf')))
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2'])
+        pgbench.wait()
+
+        page_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='page',
+            options=['--pack-small-files', '-j', '4'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.validate_pb(backup_dir, 'node')
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node, backup_id=page_id)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # corrupt the first packed file
+        with open(os.path.join(backup_root, 'pack_1'), 'r+b') as f:
+            byte = f.read(1)
+            f.seek(0)
+            f.write(bytes([byte[0] ^ 0xFF]))
+            f.flush()
+
+        try:
+            self.validate_pb(backup_dir, 'node', full_id)
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because pack file is corrupted.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Invalid CRC of packed backup file',
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.assertEqual(
+            'CORRUPT', self.show_pb(backup_dir, 'node', full_id)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_backup_parallel_listing(self):
+        """
+        Check that PGDATA and tablespaces listed by several threads
+        are backed up the same way as listed by one thread
+        """
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        self.create_tblspace_in_node(node, 'tblspace')
+
+        for i in range(10):
+            node.safe_psql(
+                "postgres",
+                "create database db{0} tablespace {1}".format(
+                    i, 'tblspace' if i % 2 else 'pg_default'))
+
+        node.pgbench_init(scale=1)
+
+        single_id = self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '-j', '1'])
+
+        parallel_id = self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '-j', '8'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        single_files = self.get_backup_filelist(
+            backup_dir, 'node', single_id)
+        parallel_files = self.get_backup_filelist(
+            backup_dir, 'node', parallel_id)
+
+        # streamed WAL differs between backups
+        self.assertEqual(
+            sorted(f for f in single_files if not f.startswith('pg_wal')),
+            sorted(f for f in parallel_files if not f.startswith('pg_wal')))
+
+        node.stop()
+
+        restored_node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'restored_node'))
+        restored_node.cleanup()
+
+        tblspc_path = self.get_tblspace_path(node, 'tblspace')
+        tblspc_path_new = self.get_tblspace_path(
+            restored_node, 'tblspace_new')
+
+        self.restore_node(
+            backup_dir, 'node', restored_node, backup_id=parallel_id,
+            options=[
+                '-j', '8',
+                '-T', '{0}={1}'.format(tblspc_path, tblspc_path_new)])
+
+        pgdata_restored = self.pgdata_content(restored_node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
@@ -446,6 +446,170 @@ class CheckdbTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         self.del_test_dir(module_name, fname)
 
+    # @unittest.skip("skip")
+    def test_checkdb_incremental_slices(self):
+        """
+        make node, run incremental checkdb twice,
+        check that unchanged data files are skipped
+        and changed data files are checked again
+        """
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.safe_psql(
+            "postgres",
+            "create table t_heap as select 1 as id, md5(i::text) as text "
+            "from generate_series(0,1000) i")
+        node.safe_psql(
+            "postgres",
+            "CHECKPOINT;")
+
+        heap_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('t_heap')").rstrip()
+        heap_full_path = os.path.normpath(os.path.join(node.data_dir, heap_path))
+
+        # files modified in the same second as checkdb are not recorded
+        time.sleep(2)
+
+        # incremental checkdb requires backup catalog
+        try:
+            self.checkdb_node(
+                data_dir=node.data_dir,
+                options=[
+                    '--incremental-slices=1000000',
+                    '-d', 'postgres', '-p', str(node.port)])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because backup catalog is not specified\n"
+                " Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                "ERROR: Option \"--incremental-slices\" requires "
+                "--backup-path and --instance options",
+                e.message,
+                "\n Unexpected Error Message: {0}\n CMD: {1}".format(
+                    repr(e.message), self.cmd))
+
+        output = self.checkdb_node(
+            backup_dir, 'node',
+            options=[
+                '--incremental-slices=1000000',
+                '--log-level-console=verbose',
+                '-d', 'postgres', '-p', str(node.port)])
+
+        self.assertIn("INFO: 0 unchanged data files are skipped", output)
+        self.assertTrue(
+            os.path.isfile(
+                os.path.join(backup_dir, 'backups', 'node', 'checkdb_ledger')))
+
+        output = self.checkdb_node(
+            backup_dir, 'node',
+            options=[
+                '--incremental-slices=1000000',
+                '--log-level-console=verbose',
+                '-d', 'postgres', '-p', str(node.port)])
+
+        self.assertNotIn("INFO: 0 unchanged data files are skipped", output)
+        self.assertIn(
+            'Skip unchanged file "{0}"'.format(heap_full_path), output)
+
+        node.safe_psql(
+            "postgres",
+            "insert into t_heap select 2 as id, md5(i::text) as text "
+            "from generate_series(0,1000) i")
+        node.safe_psql(
+            "postgres",
+            "CHECKPOINT;")
+
+        time.sleep(2)
+
+        output = self.checkdb_node(
+            backup_dir, 'node',
+            options=[
+                '--incremental-slices=1000000',
+                '--log-level-console=verbose',
+                '-d', 'postgres', '-p', str(node.port)])
+
+        self.assertNotIn(
+            'Skip unchanged file "{0}"'.format(heap_full_path), output)
+        self.assertIn(
+            'Checking file:  "{0}"'.format(heap_full_path), output)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_checkdb_amcheck_largest_index_first(self):
+        """
+        make node with indexes in two databases, check that
+        indexes of all databases are amchecked largest first
+        """
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        node.slow_start()
+
+        node.safe_psql("postgres", "create database db1")
+        node.safe_psql("postgres", "create database db2")
+
+        for dbname in ['postgres', 'db1', 'db2']:
+            try:
+                node.safe_psql(
+                    dbname,
+                    "create extension amcheck")
+            except QueryException as e:
+                node.safe_psql(
+                    dbname,
+                    "create extension amcheck_next")
+
+        node.safe_psql(
+            "db1",
+            "create table t_small as select i as id "
+            "from generate_series(0,100) i; "
+            "create index t_small_idx on t_small(id)")
+
+        node.safe_psql(
+            "db2",
+            "create table t_big as select i as id "
+            "from generate_series(0,100000) i; "
+            "create index t_big_idx on t_big(id)")
+
+        output = self.checkdb_node(
+            options=[
+                '--amcheck',
+                '--skip-block-validation',
+                '--progress', '-j', '1',
+                '-d', 'db1', '-p', str(node.port)])
+
+        progress = [
+            line for line in output.splitlines()
+            if 'Amchecking index' in line]
+
+        self.assertIn(
+            "Amchecking index 'public.t_big_idx' in database 'db2'",
+            progress[0])
+
+        self.assertIn("Amcheck succeeded for database 'db1'", output)
+        self.assertIn("Amcheck succeeded for database 'db2'", output)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
     # @unittest.skip("skip")
     def test_checkdb_sigint_handling(self):
         """"""
@@ -561,6 +725,8 @@ class CheckdbTest(ProbackupTest, unittest.TestCase):
                 'GRANT EXECUTE ON FUNCTION pg_catalog.charne("char", "char") TO backup; '
                 'GRANT EXECUTE ON FUNCTION pg_catalog.pg_is_in_recovery() TO backup; '
                 'GRANT EXECUTE ON FUNCTION pg_catalog.pg_control_system() TO backup; '
+                'GRANT EXECUTE ON FUNCTION pg_catalog.pg_relation_size(regclass) TO backup; '
+                'GRANT EXECUTE ON FUNCTION pg_catalog.pg_relation_size(regclass, text) TO backup; '
                 'GRANT EXECUTE ON FUNCTION bt_index_check(regclass) TO backup; '
                 'GRANT EXECUTE ON FUNCTION bt_index_check(regclass, bool) TO backup;'
             )
@@ -587,6 +753,8 @@ class CheckdbTest(ProbackupTest, unittest.TestCase):
                 'GRANT EXECUTE ON FUNCTION pg_catalog.charne("char", "char") TO backup; '
                 'GRANT EXECUTE ON FUNCTION pg_catalog.pg_is_in_recovery() TO backup; '
                 'GRANT EXECUTE ON FUNCTION pg_catalog.pg_control_system() TO backup; '
+                'GRANT EXECUTE ON FUNCTION pg_catalog.pg_relation_size(regclass) TO backup; '
+                'GRANT EXECUTE ON FUNCTION pg_catalog.pg_relation_size(regclass, text) TO backup; '
                 'GRANT EXECUTE ON FUNCTION bt_index_check(regclass) TO backup; '
                 'GRANT EXECUTE ON FUNCTION bt_index_check(regclass, bool) TO backup;'
             )
@@ -613,6 +781,8 @@ class CheckdbTest(ProbackupTest, unittest.TestCase):
                 'GRANT EXECUTE ON FUNCTION pg_catalog.charne("char", "char") TO backup; '
                 'GRANT EXECUTE ON FUNCTION pg_catalog.pg_is_in_recovery() TO backup; '
                 'GRANT EXECUTE ON FUNCTION pg_catalog.pg_control_system() TO backup; '
+                'GRANT EXECUTE ON FUNCTION pg_catalog.pg_relation_size(regclass) TO backup; '
+                'GRANT EXECUTE ON FUNCTION pg_catalog.pg_relation_size(regclass, text) TO backup; '
                 'GRANT EXECUTE ON FUNCTION bt_index_check(regclass) TO backup; '
                 'GRANT EXECUTE ON FUNCTION bt_index_check(regclass, bool) TO backup;'
             )
@@ -520,3 +520,80 @@ class CompressionTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_page_delta_encoding(self):
+        """
+        make node, take full backup, change data and take two
+        delta backups with --page-delta, restore and merge them
+        and check data correctness
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=3)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress', '--page-delta'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress', '--page-delta'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.validate_pb(backup_dir)
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.merge_backup(backup_dir, 'node', backup_id)
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # --page-delta without compression is not allowed
+        try:
+            self.backup_node(
+                backup_dir, 'node', node, backup_type='delta',
+                options=['--stream', '--page-delta'])
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because --page-delta requires compression.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'ERROR: Option --page-delta requires compression to be enabled',
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
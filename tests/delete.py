@@ -1,5 +1,6 @@
 import unittest
 import os
+import socket
 from .helpers.ptrack_helpers import ProbackupTest, ProbackupException
 import subprocess
 from sys import exit
@@ -873,3 +874,53 @@ class DeleteTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_delete_backup_trash(self):
+        """
+        Check that deleted backup is moved to the trash and reaped,
+        and that deletion interrupted by crash is finished by
+        the next deletion
+        """
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        backup_id_1 = self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+        backup_id_2 = self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        # leftover of the process, which crashed during deletion
+        trash_dir = os.path.join(backup_dir, 'backups', 'node', '.trash')
+        leftover = os.path.join(
+            trash_dir, 'QWERTY.{0}.4194303'.format(socket.gethostname()))
+        os.makedirs(os.path.join(leftover, 'database', 'base'))
+        with open(os.path.join(leftover, 'database', 'base', '1'), 'w') as f:
+            f.write('blah')
+
+        # deletion by another host sharing the catalog cannot be checked
+        foreign = 'ASDFGH.another.host.4194303'
+        os.makedirs(os.path.join(trash_dir, foreign))
+
+        self.delete_pb(
+            backup_dir, 'node', backup_id_1, options=['-j', '4'])
+
+        self.assertFalse(
+            os.path.exists(
+                os.path.join(backup_dir, 'backups', 'node', backup_id_1)))
+        self.assertEqual(os.listdir(trash_dir), [foreign])
+
+        show_backups = self.show_pb(backup_dir, 'node')
+        self.assertEqual(len(show_backups), 1)
+        self.assertEqual(show_backups[0]['id'], backup_id_2)
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
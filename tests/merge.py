@@ -1382,6 +1382,145 @@ class MergeTest(ProbackupTest, unittest.TestCase):
 
         self.del_test_dir(module_name, fname)
 
+    def test_merge_copy_compressed_pages(self):
+        """
+        Check that page records of backups with the same compression
+        algorithm are copied during merge without recompression
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=3)
+
+        # FULL backup
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        # DELTA BACKUP
+        self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        # DELTA BACKUP
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress-algorithm=zlib'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        self.merge_backup(
+            backup_dir, "node", backup_id,
+            options=['--log-level-file=VERBOSE'])
+
+        logfile = os.path.join(backup_dir, 'log', 'pg_probackup.log')
+        with open(logfile, 'r') as f:
+            logfile_content = f.read()
+
+        self.assertIn(
+            'are copied without recompression', logfile_content)
+
+        self.validate_pb(backup_dir)
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.del_test_dir(module_name, fname)
+
+    def test_merge_in_place(self):
+        """
+        Check that in-place merge appends changed pages to FULL backup
+        files and failed in-place merge can be continued
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        # FULL backup
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '--compress'])
+
+        pgbench = node.pgbench(options=['-t', '1000', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        # DELTA BACKUP
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress'])
+
+        self.merge_backup(
+            backup_dir, "node", backup_id,
+            options=['--in-place', '--log-level-file=VERBOSE'])
+
+        logfile = os.path.join(backup_dir, 'log', 'pg_probackup.log')
+        with open(logfile, 'r') as f:
+            logfile_content = f.read()
+
+        self.assertIn('is merged in place', logfile_content)
+
+        pgbench = node.pgbench(options=['-t', '1000', '-c', '1', '--no-vacuum'])
+        pgbench.wait()
+
+        # DELTA BACKUP
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--compress'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        # interrupt in-place merge after some files are patched
+        gdb = self.merge_backup(
+            backup_dir, "node", backup_id,
+            options=['--in-place'], gdb=True)
+
+        gdb.set_breakpoint('write_page_headers')
+        gdb.run_until_break()
+
+        gdb.continue_execution_until_break(5)
+
+        gdb._execute('signal SIGKILL')
+        gdb._execute('detach')
+        time.sleep(1)
+
+        # Try to continue failed MERGE
+        self.merge_backup(backup_dir, "node", backup_id)
+
+        self.validate_pb(backup_dir)
+
+        node.cleanup()
+        self.restore_node(backup_dir, 'node', node)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.del_test_dir(module_name, fname)
+
     def test_merge_different_wal_modes(self):
         """
         Check that backups with different wal modes can be merged
@@ -48,3 +48,70 @@ class RemoteTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_remote_window(self):
+        """
+        Data files must be the same after backup and restore
+        with and without pipelined remote requests
+        """
+        if not self.remote:
+            return unittest.skip('Skipped because remote mode is not enabled')
+
+        fname = self.id().split('.')[3]
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        # many small files
+        for i in range(50):
+            node.safe_psql(
+                "postgres",
+                "create table t_small_{0} as select 1 as id".format(i))
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgbench = node.pgbench(options=['-T', '5', '-c', '2'])
+        pgbench.wait()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta',
+            options=['--stream', '--remote-window=64'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+        node.stop()
+
+        # restore with pipelined requests
+        node_restored = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node_restored'))
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored, backup_id=backup_id)
+
+        pgdata_restored = self.pgdata_content(node_restored.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # restore with every request waiting for reply
+        node_restored.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node_restored, backup_id=backup_id,
+            options=['--remote-window=1'])
+
+        pgdata_restored = self.pgdata_content(node_restored.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        self.validate_pb(backup_dir, 'node')
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
@@ -1647,6 +1647,71 @@ class ReplicaTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         self.del_test_dir(module_name, fname)
 
+    # @unittest.skip("skip")
+    def test_catchup_lagging_replica(self):
+        """
+        make node and replica, stop replica, generate changes on master,
+        bring replica in sync via catchup and check that it can be started
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        master = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'master'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'master', master)
+        master.slow_start()
+
+        master.pgbench_init(scale=5)
+
+        self.backup_node(backup_dir, 'master', master, options=['--stream'])
+
+        replica = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'replica'))
+        replica.cleanup()
+
+        self.restore_node(backup_dir, 'master', replica)
+        self.set_replica(master, replica, synchronous=False)
+        self.set_auto_conf(replica, {'port': replica.port})
+        replica.slow_start(replica=True)
+        replica.stop()
+
+        # generate changes while replica is down
+        pgbench = master.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+        master.safe_psql(
+            "postgres",
+            "create table t_heap as select i as id "
+            "from generate_series(0,10000) i")
+        master.safe_psql("postgres", "checkpoint")
+
+        self.run_pb([
+            'catchup',
+            '--source-pgdata={0}'.format(master.data_dir),
+            '--destination-pgdata={0}'.format(replica.data_dir),
+            '-p', str(master.port), '-d', 'postgres',
+            '-j', '2'])
+
+        replica.slow_start(replica=True)
+
+        # wait for replica to catch up with master
+        self.wait_until_replica_catch_with_master(master, replica)
+
+        master_result = master.safe_psql(
+            "postgres", "select * from pgbench_accounts order by aid")
+        replica_result = replica.safe_psql(
+            "postgres", "select * from pgbench_accounts order by aid")
+        self.assertEqual(master_result, replica_result)
+
+        self.assertEqual(
+            master.safe_psql("postgres", "select count(*) from t_heap"),
+            replica.safe_psql("postgres", "select count(*) from t_heap"))
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
 # TODO:
 # null offset STOP LSN and latest record in previous segment is conrecord (manual only)
 # archiving from promoted delayed replica
@@ -3479,3 +3479,248 @@ class RestoreTest(ProbackupTest, unittest.TestCase):
 
         # Clean after yourself
         self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_restore_resume(self):
+        """
+        Check that interrupted restore can be resumed,
+        skipping files restored before interruption
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=5)
+
+        self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.stop()
+        node.cleanup()
+
+        # restore, killed in the middle
+        gdb = self.restore_node(
+            backup_dir, 'node', node, gdb=True)
+
+        gdb.set_breakpoint('restore_data_file')
+        gdb.run_until_break()
+
+        # restored files are journaled in batches
+        gdb.continue_execution_until_break(200)
+
+        gdb._execute('signal SIGKILL')
+        gdb._execute('detach')
+        sleep(1)
+
+        self.assertTrue(
+            os.path.isfile(
+                os.path.join(node.data_dir, 'probackup_restore_journal')))
+
+        # restore into nonempty directory is not allowed without --resume
+        try:
+            self.restore_node(backup_dir, 'node', node)
+            # we should die here because exception is what we expect to happen
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because restore destination is not empty.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'ERROR: Restore destination is not empty',
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=['--resume', '--log-level-file=VERBOSE'])
+
+        logfile = os.path.join(backup_dir, 'log', 'pg_probackup.log')
+        with open(logfile, 'r') as f:
+            logfile_content = f.read()
+
+        self.assertIn(
+            'Skip file restored before interruption', logfile_content)
+
+        self.assertFalse(
+            os.path.isfile(
+                os.path.join(node.data_dir, 'probackup_restore_journal')))
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.slow_start()
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_restore_sync_method_syncfs(self):
+        """
+        Check that backup and restore with syncfs sync method
+        produce the same data as with default fsync method
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=2)
+
+        self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '-j', '4', '--sync-method=syncfs'])
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.stop()
+        node.cleanup()
+
+        self.restore_node(
+            backup_dir, 'node', node,
+            options=['-j', '4', '--sync-method=syncfs'])
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.cleanup()
+
+        self.restore_node(backup_dir, 'node', node, options=['-j', '4'])
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        node.slow_start()
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_restore_inline_validate(self):
+        """
+        Restore with inline validation, then corrupt
+        a file in FULL backup and make sure that restore
+        with inline validation marks the chain as corrupt
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=2)
+
+        file_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('pgbench_accounts')").decode('utf-8').rstrip()
+
+        # FULL
+        full_id = self.backup_node(backup_dir, 'node', node)
+
+        pgbench = node.pgbench(options=['-T', '10', '-c', '2', '--no-vacuum'])
+        pgbench.wait()
+
+        # DELTA
+        delta_id = self.backup_node(
+            backup_dir, 'node', node, backup_type='delta')
+
+        pgdata = self.pgdata_content(node.data_dir)
+
+        node.stop()
+        node.cleanup()
+
+        output = self.restore_node(
+            backup_dir, 'node', node,
+            options=['-j', '4', '--inline-validate'])
+
+        self.assertIn(
+            'INFO: Restored files of backup {0} will be validated '
+            'during restore'.format(delta_id),
+            output)
+        self.assertNotIn(
+            'INFO: Validating backup {0}'.format(full_id), output)
+
+        pgdata_restored = self.pgdata_content(node.data_dir)
+        self.compare_pgdata(pgdata, pgdata_restored)
+
+        # incremental restore does not read all files
+        try:
+            self.restore_node(
+                backup_dir, 'node', node,
+                options=['-j', '4', '--inline-validate', '-I', 'checksum'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of '--inline-validate' and '-I'.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                "ERROR: You cannot specify '--inline-validate' "
+                "and '--incremental-mode' together", e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        node.cleanup()
+
+        # Corrupt data file in FULL backup
+        file = os.path.join(
+            backup_dir, 'backups', 'node',
+            full_id, 'database', file_path)
+        with open(file, "rb+", 0) as f:
+            f.seek(42)
+            f.write(b"blah")
+            f.flush()
+            f.close
+
+        try:
+            self.restore_node(
+                backup_dir, 'node', node,
+                options=['-j', '4', '--inline-validate'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of data file corruption.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'ERROR: Backup {0} is corrupt, validation of file'.format(full_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+            self.assertIn(
+                'WARNING: Backup {0} is orphaned because his parent'.format(delta_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.assertEqual(
+            'CORRUPT',
+            self.show_pb(backup_dir, 'node', full_id)['status'])
+        self.assertEqual(
+            'ORPHAN',
+            self.show_pb(backup_dir, 'node', delta_id)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
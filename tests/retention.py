@@ -2535,3 +2535,128 @@ class RetentionTest(ProbackupTest, unittest.TestCase):
         self.validate_pb(backup_dir, 'node')
 
         self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_wal_purge_parallel(self):
+        """
+        Check that WAL purge removes all segments
+        preceding the oldest backup using several threads
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        B1 = self.backup_node(backup_dir, 'node', node)
+
+        for i in range(20):
+            node.safe_psql('postgres', 'select txid_current()')
+            self.switch_wal_segment(node)
+
+        B2 = self.backup_node(backup_dir, 'node', node)
+
+        output = self.delete_pb(
+            backup_dir, 'node', B1,
+            options=['--delete-wal', '-j', '4', '--progress'])
+
+        self.assertIn('Purge WAL files on timeline 1', output)
+
+        # all segments before START LSN of B2 are removed
+        xlogid, xrecoff = self.show_pb(
+            backup_dir, 'node', B2)['start-lsn'].split('/')
+        oldest_to_keep = '{0:08X}{1:08X}{2:08X}'.format(
+            1, int(xlogid, 16), int(xrecoff, 16) >> 24)
+
+        wals_dir = os.path.join(backup_dir, 'wal', 'node')
+        for wal in os.listdir(wals_dir):
+            if len(wal.split('.')[0]) == 24:
+                self.assertGreaterEqual(wal.split('.')[0], oldest_to_keep)
+
+        self.validate_pb(backup_dir, 'node')
+
+        self.del_test_dir(module_name, fname, [node])
+
+    # @unittest.skip("skip")
+    def test_retention_plan_dry_run(self):
+        """
+        Check that dry run shows the retention plan
+        and the plan is carried out without dry run
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        backup_id_b = self.backup_node(backup_dir, 'node', node)
+        backup_id_a = self.backup_node(backup_dir, 'node', node)
+
+        pgbench = node.pgbench(options=['-t', '10', '-c', '2'])
+        pgbench.wait()
+        page_id_a1 = self.backup_node(
+            backup_dir, 'node', node, backup_type='page')
+
+        pgbench = node.pgbench(options=['-t', '10', '-c', '2'])
+        pgbench.wait()
+        page_id_a2 = self.backup_node(
+            backup_dir, 'node', node, backup_type='page')
+
+        # FULLb and chain of FULLa up to PAGEa1 are expired
+        backups = os.path.join(backup_dir, 'backups', 'node')
+        for backup in [backup_id_b, backup_id_a, page_id_a1]:
+            with open(
+                    os.path.join(
+                        backups, backup, "backup.control"), "a") as conf:
+                conf.write("recovery_time='{:%Y-%m-%d %H:%M:%S}'\n".format(
+                    datetime.now() - timedelta(days=3)))
+
+        output = self.delete_expired(
+            backup_dir, 'node',
+            options=[
+                '--retention-window=1', '--delete-expired',
+                '--merge-expired', '--dry-run'])
+
+        self.assertIn(
+            'INFO: Retention plan: merge 2 backups up to {0} '
+            'into FULL backup {1}'.format(page_id_a2, backup_id_a),
+            output)
+        self.assertIn(
+            'INFO: Retention plan: delete backup {0}'.format(backup_id_b),
+            output)
+        self.assertIn(
+            'INFO: Retention plan: 1 merges, 1 deletions', output)
+
+        self.assertEqual(len(self.show_pb(backup_dir, 'node')), 4)
+
+        output = self.delete_expired(
+            backup_dir, 'node',
+            options=[
+                '--retention-window=1', '--delete-expired',
+                '--merge-expired'])
+
+        self.assertIn(
+            "Merge incremental chain between full backup {0} and backup {1}".format(
+                backup_id_a, page_id_a2),
+            output)
+        self.assertIn("Delete: {0}".format(backup_id_b), output)
+
+        show_backups = self.show_pb(backup_dir, 'node')
+        self.assertEqual(len(show_backups), 1)
+        self.assertEqual(show_backups[0]['id'], page_id_a2)
+        self.assertEqual(show_backups[0]['backup-mode'], 'FULL')
+
+        self.del_test_dir(module_name, fname, [node])
@@ -3965,6 +3965,340 @@ class ValidateTest(ProbackupTest, unittest.TestCase):
         # Clean after yourself
         self.del_test_dir(module_name, fname, [node])
 
+    # @unittest.skip("skip")
+    def test_validate_revalidate_after(self):
+        """
+        Check that validate with --revalidate-after does not read
+        files validated recently, but reads changed files again
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        file_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('pgbench_accounts')").decode('utf-8').rstrip()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, options=['--stream'])
+
+        # first run checks files by CRC only and creates the ledger
+        output = self.validate_pb(
+            backup_dir, 'node',
+            options=['--revalidate-after=1d', '--skip-block-validation'])
+        self.assertNotIn('files are not read', output)
+        self.assertTrue(os.path.isfile(os.path.join(
+            backup_dir, 'backups', 'node', backup_id, 'validation_ledger')))
+
+        # pages of data files checked by CRC only are checked now
+        output = self.validate_pb(
+            backup_dir, 'node', options=['--revalidate-after=1d'])
+        self.assertNotIn('files are not read', output)
+
+        # second run skips all of them
+        output = self.validate_pb(
+            backup_dir, 'node', options=['--revalidate-after=1d', '-j', '4'])
+        self.assertIn(
+            'INFO: Backup {0}: '.format(backup_id), output)
+        self.assertIn('files are not read', output)
+        self.assertIn(
+            'INFO: Backup {0} data files are valid'.format(backup_id), output)
+
+        # changed file is read again
+        file = os.path.join(
+            backup_dir, 'backups', 'node',
+            backup_id, 'database', file_path)
+        with open(file, "rb+", 0) as f:
+            f.seek(42)
+            f.write(b"blah")
+            f.flush()
+            f.close
+
+        try:
+            self.validate_pb(
+                backup_dir, 'node', options=['--revalidate-after=1d'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of data file corruption.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(backup_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.assertEqual(
+            'CORRUPT',
+            self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_validate_fast(self):
+        """
+        Check that validate --fast accepts valid backup
+        and detects corruption of data file payload
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        file_path = node.safe_psql(
+            "postgres",
+            "select pg_relation_filepath('pgbench_accounts')").decode('utf-8').rstrip()
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node,
+            options=['--stream', '--compress'])
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id, options=['--fast', '-j', '4'])
+        self.assertIn(
+            'INFO: Backup {0} data files are valid'.format(backup_id), output)
+
+        # corrupt payload of some page
+        file = os.path.join(
+            backup_dir, 'backups', 'node',
+            backup_id, 'database', file_path)
+        with open(file, "rb+", 0) as f:
+            f.seek(8192)
+            f.write(b"blah")
+            f.flush()
+            f.close
+
+        try:
+            self.validate_pb(
+                backup_dir, 'node', backup_id, options=['--fast'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of data file corruption.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    repr(self.output), self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(backup_id),
+                e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        self.assertEqual(
+            'CORRUPT',
+            self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_validate_sample(self):
+        """
+        Check that sampled validation spreads
+        checking of pages over several runs
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        backup_id = self.backup_node(
+            backup_dir, 'node', node, options=['--stream', '--no-validate'])
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id, options=['--sample=50%', '-j', '4'])
+        self.assertIn(
+            'current sweep has covered 50% of pages', output)
+        self.assertIn(
+            'no corruption is found in sampled pages, '
+            'its status DONE is kept', output)
+
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id, options=['--sample=50%', '-j', '4'])
+        self.assertIn(
+            'current sweep has covered 100% of pages', output)
+
+        # the next run starts a new sweep
+        output = self.validate_pb(
+            backup_dir, 'node', backup_id, options=['--sample=50%'])
+        self.assertIn(
+            'current sweep has covered 50% of pages', output)
+
+        # sampled validation does not prove that backup is valid
+        self.assertEqual(
+            'DONE', self.show_pb(backup_dir, 'node', backup_id)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_validate_instance_revalidated_orphan_once(self):
+        """
+        Check that during validation of instance
+        revalidated ORPHAN backup is validated only once
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        node = self.make_simple_node(
+            base_dir=os.path.join(module_name, fname, 'node'),
+            set_replication=True,
+            initdb_params=['--data-checksums'])
+
+        self.init_pb(backup_dir)
+        self.add_instance(backup_dir, 'node', node)
+        self.set_archiving(backup_dir, 'node', node)
+        node.slow_start()
+
+        node.pgbench_init(scale=1)
+
+        self.backup_node(backup_dir, 'node', node)
+
+        pgbench = node.pgbench(options=['-t', '10', '-c', '2'])
+        pgbench.wait()
+        page_id_1 = self.backup_node(
+            backup_dir, 'node', node, backup_type='page')
+
+        pgbench = node.pgbench(options=['-t', '10', '-c', '2'])
+        pgbench.wait()
+        page_id_2 = self.backup_node(
+            backup_dir, 'node', node, backup_type='page')
+
+        file = os.path.join(
+            backup_dir, 'backups', 'node',
+            page_id_1, 'database', 'postgresql.auto.conf')
+        file_new = os.path.join(backup_dir, 'postgresql.auto.conf')
+        os.rename(file, file_new)
+
+        try:
+            self.validate_pb(backup_dir, 'node')
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of data file dissapearance.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    self.output, self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} is orphaned because '
+                'his parent {1} has status: CORRUPT'.format(
+                    page_id_2, page_id_1), e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+        os.rename(file_new, file)
+
+        output = self.validate_pb(backup_dir, 'node')
+
+        self.assertEqual(
+            1, output.count('INFO: Validating backup {0}'.format(page_id_2)))
+        self.assertEqual(
+            1, output.count(
+                'INFO: Backup {0} data files are valid'.format(page_id_2)))
+
+        self.assertEqual(
+            'OK', self.show_pb(backup_dir, 'node', page_id_1)['status'])
+        self.assertEqual(
+            'OK', self.show_pb(backup_dir, 'node', page_id_2)['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
+    # @unittest.skip("skip")
+    def test_validate_instances_parallel(self):
+        """
+        Check that instances are validated concurrently,
+        output of every instance is printed as a whole
+        and corruption in one instance is reported
+        """
+        fname = self.id().split('.')[3]
+        backup_dir = os.path.join(self.tmp_path, module_name, fname, 'backup')
+        self.init_pb(backup_dir)
+
+        backup_ids = {}
+        for name in ['node1', 'node2', 'node3']:
+            node = self.make_simple_node(
+                base_dir=os.path.join(module_name, fname, name),
+                set_replication=True,
+                initdb_params=['--data-checksums'])
+
+            self.add_instance(backup_dir, name, node)
+            node.slow_start()
+
+            backup_ids[name] = self.backup_node(
+                backup_dir, name, node, options=['--stream'])
+            node.stop()
+
+        file = os.path.join(
+            backup_dir, 'backups', 'node2',
+            backup_ids['node2'], 'database', 'postgresql.auto.conf')
+        os.remove(file)
+
+        try:
+            self.validate_pb(backup_dir, options=['-j', '4'])
+            self.assertEqual(
+                1, 0,
+                "Expecting Error because of data file dissapearance.\n "
+                "Output: {0} \n CMD: {1}".format(
+                    self.output, self.cmd))
+        except ProbackupException as e:
+            self.assertIn(
+                'WARNING: Backup {0} data files are corrupted'.format(
+                    backup_ids['node2']), e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+            self.assertIn(
+                'WARNING: Some backups are not valid', e.message,
+                '\n Unexpected Error Message: {0}\n CMD: {1}'.format(
+                    repr(e.message), self.cmd))
+
+            # messages of every instance follow its header
+            for name in backup_ids:
+                start = e.message.index(
+                    "INFO: Validate backups of the instance '{0}'".format(
+                        name))
+                end = e.message.find(
+                    'INFO: Validate backups of the instance', start + 1)
+                if end == -1:
+                    end = len(e.message)
+                self.assertIn(
+                    'Validating backup {0}'.format(backup_ids[name]),
+                    e.message[start:end])
+
+        self.assertEqual(
+            'OK', self.show_pb(backup_dir, 'node1', backup_ids['node1'])['status'])
+        self.assertEqual(
+            'CORRUPT', self.show_pb(backup_dir, 'node2', backup_ids['node2'])['status'])
+        self.assertEqual(
+            'OK', self.show_pb(backup_dir, 'node3', backup_ids['node3'])['status'])
+
+        # Clean after yourself
+        self.del_test_dir(module_name, fname)
+
 # validate empty backup list
 # page from future during validate
 # page from future during backup